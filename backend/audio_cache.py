@@ -0,0 +1,175 @@
+"""
+Content-addressed on-disk cache for synthesized speech.
+
+The same feedback phrases and page texts are read aloud over and over, and
+each /api/tts call used to go to ElevenLabs. AudioCache stores the audio
+under the SHA-256 of everything that shapes it (text, voice, model and
+voice settings), so a clip is synthesized once and then served by hash
+from GET /api/tts/{hash} as an immutable file that browsers and CDNs can
+keep forever: the same hash always means the same bytes.
+
+Files live in a two-level directory (ab/abcdef....mp3) and are written to a
+temporary name first, then renamed, so a reader never sees half a clip.
+The total size is bounded by max_bytes; the least recently used clips are
+deleted first. Recency is kept in memory and mirrored in each file's
+mtime, so a restarted process rebuilds the index from the directory
+(lazily, on first use) without losing the eviction order.
+
+Methods do blocking file I/O; call them from a thread (sync endpoints run
+in FastAPI's threadpool) or through asyncio.to_thread.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class AudioCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._index: "OrderedDict[str, int]" = OrderedDict()  # hash -> size, least recently used first
+        self._bytes = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.write_errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(text: str, voice_id: str, model_id: str, voice_settings: Dict) -> str:
+        """Content address of a clip: hash of everything sent to the TTS service"""
+        raw = json.dumps({"text": text, "voice_id": voice_id, "model_id": model_id,
+                          "voice_settings": voice_settings}, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    @staticmethod
+    def valid_key(key: str) -> bool:
+        return bool(HASH_RE.match(key))
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.mp3"
+
+    def _load(self):
+        """Index the clips already on disk, oldest mtime first. Hold the lock."""
+        if self._loaded:
+            return
+        self._loaded = True
+        found = []
+        if self.directory.is_dir():
+            for path in self.directory.glob("??/*.mp3"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                if self.valid_key(path.stem):
+                    found.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(found):
+            self._index[key] = size
+            self._bytes += size
+        self._evict()
+
+    def _evict(self):
+        """Delete least recently used clips until the total fits. Hold the lock."""
+        while self._bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                self._path(key).unlink()
+            except OSError:
+                pass
+
+    def path(self, key: str) -> Optional[Path]:
+        """Path of a cached clip, marked as recently used; None if not cached"""
+        if not self.enabled or not self.valid_key(key):
+            return None
+        with self._lock:
+            self._load()
+            if key not in self._index:
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            self.hits += 1
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            # Deleted behind our back (e.g. /tmp cleaned up)
+            with self._lock:
+                size = self._index.pop(key, None)
+                if size is not None:
+                    self._bytes -= size
+                self.hits -= 1
+                self.misses += 1
+            return None
+        return path
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.path(key)
+        if path is None:
+            return None
+        try:
+            return path.read_bytes()
+        except OSError:
+            return None
+
+    def put(self, key: str, audio: bytes) -> bool:
+        """Store a clip; False if it couldn't be written (the caller still has the audio)"""
+        if not self.enabled or not self.valid_key(key) or len(audio) > self.max_bytes:
+            return False
+        path = self._path(key)
+        tmp_path = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            self.write_errors += 1
+            print(f"⚠️ TTS cache write failed: {e}")
+            return False
+        with self._lock:
+            self._load()
+            previous = self._index.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous
+            self._index[key] = len(audio)
+            self._bytes += len(audio)
+            self.writes += 1
+            self._evict()
+        return True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "directory": str(self.directory),
+                "entries": len(self._index),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "write_errors": self.write_errors,
+                "index_loaded": self._loaded,
+            }
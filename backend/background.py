@@ -0,0 +1,124 @@
+"""
+Bounded background work.
+
+WorkerPool runs jobs on a fixed number of asyncio worker tasks fed from a
+bounded queue, so background work can never outgrow the process: when the
+queue is full new jobs are dropped, not buffered. Jobs carry a key (a key
+already queued or running isn't accepted twice) and an optional group, so
+callers can cap how much is in flight per group, e.g. per student.
+
+Workers start on first submit and belong to that event loop; like
+http_clients, a pool used from a new loop (serverless, tests) starts over.
+stats() reports the counters for the metrics endpoints.
+"""
+import asyncio
+from collections import Counter
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+
+class WorkerPool:
+    def __init__(self, name: str, workers: int = 2, max_queue: int = 100):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._loop = None
+        self._keys = set()
+        self._groups: Counter = Counter()
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def _ensure_workers(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Jobs queued on a finished loop can't run any more
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._tasks = []
+            self._keys.clear()
+            self._groups.clear()
+            self.running = 0
+            self._loop = loop
+        self._tasks = [task for task in self._tasks if not task.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(loop.create_task(self._worker()))
+
+    async def _worker(self):
+        while True:
+            key, group, job = await self._queue.get()
+            self.running += 1
+            try:
+                await job()
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"⚠️ Background job {key} in {self.name} failed: {e}")
+            finally:
+                self.running -= 1
+                self._keys.discard(key)
+                if group is not None:
+                    self._groups[group] -= 1
+                    if self._groups[group] <= 0:
+                        del self._groups[group]
+                self._queue.task_done()
+
+    def submit(self, key: Hashable, job: Callable[[], Awaitable], group: Optional[Hashable] = None) -> bool:
+        """Queue job() to run in the background. Must be called from the event loop.
+
+        Returns False, without queueing, when the key is already queued or
+        running or the queue is full.
+        """
+        self._ensure_workers()
+        if key in self._keys:
+            return False
+        try:
+            self._queue.put_nowait((key, group, job))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            print(f"⚠️ {self.name} queue full, dropping {key}")
+            return False
+        self._keys.add(key)
+        if group is not None:
+            self._groups[group] += 1
+        self.submitted += 1
+        return True
+
+    def is_active(self, key: Hashable) -> bool:
+        return key in self._keys
+
+    def active(self, group: Hashable) -> int:
+        """Jobs queued or running for a group"""
+        return self._groups.get(group, 0)
+
+    async def join(self):
+        """Wait until every queued job has finished"""
+        if self._queue is not None and self._loop is asyncio.get_running_loop():
+            await self._queue.join()
+
+    async def close(self):
+        """Cancel the workers; queued jobs are dropped (app shutdown)"""
+        for task in self._tasks:
+            task.cancel()
+        if self._loop is asyncio.get_running_loop():
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._loop = None
+        self._keys.clear()
+        self._groups.clear()
+        self.running = 0
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": self.running,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
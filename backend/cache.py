@@ -0,0 +1,153 @@
+"""
+In-process caches with LRU eviction and a time-to-live.
+
+LRUTTLCache is a bounded mapping: the least recently used key is evicted
+when it is full, and entries older than the TTL are treated as missing.
+VariantCache stores a few alternative values per key (e.g. several
+phrasings of the same LLM feedback) and only serves from a key once it has
+collected them, so cached responses don't all sound the same.
+
+Both keep hit/miss counters; stats() returns them for the metrics endpoints.
+"""
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+
+class LRUTTLCache:
+    def __init__(self, max_entries: int = 1024, ttl_seconds: Optional[float] = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - stored_at > self.ttl_seconds
+
+    def _lookup(self, key: Hashable, now: float):
+        """Entry for key, refreshed as most recently used; None if missing or expired. Hold the lock."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry[0], now):
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key: Hashable, value: Any, stored_at: float):
+        """Insert or replace key, evicting the least recently used entry if full. Hold the lock."""
+        self._entries[key] = (stored_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._lookup(key, time.monotonic())
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._store(key, value, time.monotonic())
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def items(self) -> List[tuple]:
+        """Snapshot of the unexpired (key, value) pairs; doesn't count as a lookup"""
+        with self._lock:
+            now = time.monotonic()
+            return [(key, value) for key, (stored_at, value) in self._entries.items()
+                    if not self._expired(stored_at, now)]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._lookup(key, time.monotonic()) is not None
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class VariantCache(LRUTTLCache):
+    """LRUTTLCache holding up to `variants` alternative values per key.
+
+    get() misses until a key has all its variants (each miss is expected to
+    produce one and add() it), then returns a random variant, avoiding the
+    one it returned last for that key. The TTL runs from the first variant.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: Optional[float] = 3600, variants: int = 3):
+        super().__init__(max_entries, ttl_seconds)
+        self.variants = max(1, variants)
+        self.filling = 0  # misses on keys that have some variants but not all
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._lookup(key, time.monotonic())
+            values: List = entry[1]["values"] if entry else []
+            if len(values) < self.variants:
+                self.misses += 1
+                if values:
+                    self.filling += 1
+                return default
+            self.hits += 1
+            slot = entry[1]
+            choices = [i for i in range(len(values)) if i != slot["last"]] or [0]
+            slot["last"] = random.choice(choices)
+            return values[slot["last"]]
+
+    def add(self, key: Hashable, value: Any):
+        """Record one more variant for key (ignored once the key is full or if it's a duplicate)"""
+        with self._lock:
+            now = time.monotonic()
+            entry = self._lookup(key, now)
+            if entry is None:
+                self._store(key, {"values": [value], "last": None}, now)
+                return
+            values = entry[1]["values"]
+            if len(values) < self.variants and value not in values:
+                values.append(value)
+
+    def set(self, key: Hashable, value: Any):
+        self.add(key, value)
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        stats["variants_per_key"] = self.variants
+        stats["misses_while_filling"] = self.filling
+        stats["complete_keys"] = sum(
+            1 for _, slot in list(self._entries.values()) if len(slot["values"]) >= self.variants
+        )
+        return stats
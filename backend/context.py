@@ -0,0 +1,68 @@
+"""
+Token-budgeted conversation context for the tutors.
+
+build_messages() turns a conversation into the chat messages sent to the
+LLM: the system prompt, the rolling summary of older turns (if any), as
+many of the most recent exchanges as fit in a token budget, and the new
+message. Prompt size, and with it latency and cost, stays bounded however
+long the tutor's past replies were.
+
+Tokens are counted with tiktoken when it is installed, otherwise estimated
+at about four characters per token, which is close enough for budgeting
+English text.
+"""
+from typing import Dict, List, Optional
+
+# Tokens the chat format adds around every message (role, separators)
+MESSAGE_OVERHEAD = 4
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # not installed, or the encoding can't be loaded offline
+    _encoding = None
+
+TOKENIZER = "tiktoken" if _encoding is not None else "estimate"
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def exchange_tokens(exchange: Dict) -> int:
+    """Tokens one stored exchange takes as a user + assistant message pair"""
+    return (count_tokens(exchange["student_message"]) + count_tokens(exchange["ai_response"])
+            + 2 * MESSAGE_OVERHEAD)
+
+
+def fit_history(history: List[Dict], budget: int) -> List[Dict]:
+    """The most recent exchanges whose tokens fit in budget, oldest first.
+
+    Stops at the first exchange that doesn't fit, so the kept turns are
+    always a contiguous tail of the conversation.
+    """
+    kept = []
+    used = 0
+    for exchange in reversed(history):
+        used += exchange_tokens(exchange)
+        if used > budget:
+            break
+        kept.append(exchange)
+    kept.reverse()
+    return kept
+
+
+def build_messages(system_prompt: str, history: List[Dict], message: str,
+                   budget: int, summary: Optional[str] = None) -> List[Dict]:
+    messages = [{"role": "system", "content": system_prompt}]
+    if summary:
+        messages.append({"role": "system", "content": f"Earlier in this conversation: {summary}"})
+    for exchange in fit_history(history, budget):
+        messages.append({"role": "user", "content": exchange["student_message"]})
+        messages.append({"role": "assistant", "content": exchange["ai_response"]})
+    messages.append({"role": "user", "content": message})
+    return messages
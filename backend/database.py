@@ -1,8 +1,17 @@
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, MetaData, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import StaticPool, NullPool, AsyncAdaptedQueuePool
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from contextlib import contextmanager, asynccontextmanager
+from typing import Optional, Union
+import asyncio
 import os
+import threading
+import uuid
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,69 +19,312 @@ load_dotenv()
 # Check if running in serverless environment (Vercel)
 IS_SERVERLESS = os.getenv("VERCEL") == "1" or os.getenv("AWS_LAMBDA_FUNCTION_NAME") is not None
 
+# SQLite tuning for file-based deployments: "production" (default) applies
+# SQLITE_PRAGMAS to every connection and splits reads from writes; "default"
+# keeps SQLite's stock settings.
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "production").lower()
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "8"))
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",          # readers don't block the writer and vice versa
+    "synchronous": "NORMAL",        # fsync at checkpoints only; safe with WAL
+    "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"),  # wait for locks instead of failing
+    "mmap_size": 268435456,         # 256 MB memory-mapped I/O
+    "cache_size": -64000,           # 64 MB page cache (negative = KiB)
+    "temp_store": "MEMORY",
+}
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Connect-event hook that applies ``SQLITE_PRAGMAS`` to a new connection"""
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+def _set_query_only(dbapi_connection, connection_record):
+    """Connect-event hook for read-pool connections: refuse writes outright"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
 # Priority: Vercel Postgres > Local Postgres > SQLite (in-memory for serverless) > SQLite (file-based for local)
 POSTGRES_URL = os.getenv("POSTGRES_URL")  # Vercel Postgres connection string
 DATABASE_URL = os.getenv("DATABASE_URL")  # Generic database URL (can be Postgres or SQLite)
 
-# Determine which database to use
+# Postgres pool mode. "queue" is a regular long-lived pool for servers.
+# Serverless defaults to "reuse": a small pool per instance that survives warm
+# invocations. "null" opens a connection per checkout, for when an external
+# pooler (PgBouncer, Neon/Supabase pooler) does the pooling.
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "reuse" if IS_SERVERLESS else "queue").lower()
+
+def _normalize_postgres_url(url: str) -> str:
+    # Convert postgres:// to postgresql:// if needed (SQLAlchemy prefers postgresql://)
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    # Pin the driver from requirements.txt rather than SQLAlchemy's default
+    if url.startswith("postgresql://"):
+        url = url.replace("postgresql://", "postgresql+psycopg2://", 1)
+    return url
+
+# Determine which database to use. Engines themselves are created lazily by
+# get_engine()/get_async_engine(), so importing this module never connects.
 if POSTGRES_URL:
     # Use Vercel Postgres (production)
-    SQLALCHEMY_DATABASE_URL = POSTGRES_URL
-    # Convert postgres:// to postgresql:// if needed (SQLAlchemy prefers postgresql://)
-    if SQLALCHEMY_DATABASE_URL.startswith("postgres://"):
-        SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("postgres://", "postgresql://", 1)
-    connect_args = {}
-    engine = create_engine(
-        SQLALCHEMY_DATABASE_URL,
-        connect_args=connect_args,
-        echo=False,
-        pool_pre_ping=True,  # Verify connections before using them
-        pool_recycle=300,  # Recycle connections after 5 minutes
-    )
-    print("✅ Using Vercel Postgres database")
+    SQLALCHEMY_DATABASE_URL = _normalize_postgres_url(POSTGRES_URL)
+    DATABASE_LABEL = "✅ Using Vercel Postgres database"
 elif DATABASE_URL and DATABASE_URL.startswith("postgres"):
     # Use local Postgres (if configured)
-    SQLALCHEMY_DATABASE_URL = DATABASE_URL
-    if SQLALCHEMY_DATABASE_URL.startswith("postgres://"):
-        SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("postgres://", "postgresql://", 1)
-    connect_args = {}
-    engine = create_engine(
-        SQLALCHEMY_DATABASE_URL,
-        connect_args=connect_args,
-        echo=False,
-        pool_pre_ping=True,
-    )
-    print("✅ Using PostgreSQL database")
+    SQLALCHEMY_DATABASE_URL = _normalize_postgres_url(DATABASE_URL)
+    DATABASE_LABEL = "✅ Using PostgreSQL database"
 elif IS_SERVERLESS:
-    # Fallback to in-memory SQLite for serverless (not recommended for production)
-    SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
-    # Use StaticPool to ensure all connections share the same in-memory database
-    connect_args = {"check_same_thread": False}
-    engine = create_engine(
-        SQLALCHEMY_DATABASE_URL,
-        connect_args=connect_args,
-        poolclass=StaticPool,  # Critical: ensures all connections share same in-memory DB
-        echo=False
-    )
-    print("⚠️  Using in-memory SQLite (data will not persist - configure Vercel Postgres for production)")
+    # Fallback to in-memory SQLite for serverless (not recommended for production).
+    # A named shared-cache database lets the async engine see the same data.
+    SQLALCHEMY_DATABASE_URL = "sqlite:///file:peregrine?mode=memory&cache=shared&uri=true"
+    DATABASE_LABEL = "⚠️  Using in-memory SQLite (data will not persist - configure Vercel Postgres for production)"
 else:
     # Use file-based SQLite for local development
     SQLALCHEMY_DATABASE_URL = DATABASE_URL or "sqlite:///./peregrine.db"
+    if "sqlite" in SQLALCHEMY_DATABASE_URL and SQLITE_PROFILE == "production":
+        DATABASE_LABEL = "✅ Using SQLite database (production profile: WAL, separate read/write pools)"
+    else:
+        DATABASE_LABEL = "✅ Using SQLite database (local development)"
+
+IS_POSTGRES = make_url(SQLALCHEMY_DATABASE_URL).get_backend_name() == "postgresql"
+IS_MEMORY_SQLITE = IS_SERVERLESS and not IS_POSTGRES
+USE_SQLITE_PROFILE = (not IS_POSTGRES and not IS_MEMORY_SQLITE
+                      and "sqlite" in SQLALCHEMY_DATABASE_URL and SQLITE_PROFILE == "production")
+
+def _postgres_pool_kwargs() -> dict:
+    """Pool settings for the configured DB_POOL_MODE"""
+    if DB_POOL_MODE == "null":
+        return {"poolclass": NullPool}
+    if DB_POOL_MODE == "reuse":
+        # Keep one warm connection per instance. No pre-ping: it costs a round
+        # trip on every checkout; recycling ahead of typical idle timeouts
+        # keeps reused connections fresh instead.
+        return {"pool_size": 1, "max_overflow": 4, "pool_recycle": 240, "pool_use_lifo": True}
+    if POSTGRES_URL:
+        return {
+            "pool_pre_ping": True,  # Verify connections before using them
+            "pool_recycle": 300,  # Recycle connections after 5 minutes
+        }
+    return {"pool_pre_ping": True}
+
+def _create_sync_engine():
+    if IS_POSTGRES:
+        return create_engine(SQLALCHEMY_DATABASE_URL, echo=False, **_postgres_pool_kwargs())
+    if IS_MEMORY_SQLITE:
+        # Use StaticPool to ensure all connections share the same in-memory database
+        return create_engine(
+            SQLALCHEMY_DATABASE_URL,
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,  # Critical: ensures all connections share same in-memory DB
+            echo=False
+        )
     # Only add check_same_thread for SQLite
     connect_args = {}
     if "sqlite" in SQLALCHEMY_DATABASE_URL:
         connect_args = {"check_same_thread": False}
-    engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args)
-    print("✅ Using SQLite database (local development)")
+    sync_engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args)
+    if USE_SQLITE_PROFILE:
+        event.listen(sync_engine, "connect", _apply_sqlite_pragmas)
+    return sync_engine
+
+def _async_database_url(url: str):
+    """Map the sync URL onto its async driver (asyncpg / aiosqlite)"""
+    url = make_url(url)
+    if url.get_backend_name() == "postgresql":
+        url = url.set(drivername="postgresql+asyncpg")
+        # asyncpg takes ``ssl`` rather than libpq's ``sslmode``
+        if "sslmode" in url.query:
+            sslmode = url.query["sslmode"]
+            url = url.difference_update_query(["sslmode"]).update_query_dict({"ssl": sslmode})
+    elif url.get_backend_name() == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    return url
+
+ASYNC_DATABASE_URL = _async_database_url(SQLALCHEMY_DATABASE_URL)
+
+def _create_async_engines():
+    """Build the (write, read) async engine pair; read is the write engine
+    except under the SQLite production profile."""
+    if IS_POSTGRES:
+        connect_args = {}
+        if DB_POOL_MODE in ("reuse", "null"):
+            # Transaction-mode poolers hand each transaction to whichever
+            # server connection is free, so named prepared statements from
+            # asyncpg's caches can't be relied on. Disable both caches and
+            # give each statement a unique name.
+            connect_args = {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+            }
+        write = create_async_engine(ASYNC_DATABASE_URL, connect_args=connect_args, echo=False, **_postgres_pool_kwargs())
+        return write, write
+    if IS_MEMORY_SQLITE:
+        write = create_async_engine(ASYNC_DATABASE_URL, poolclass=StaticPool, echo=False)
+        return write, write
+    if not USE_SQLITE_PROFILE:
+        write = create_async_engine(ASYNC_DATABASE_URL, echo=False)
+        return write, write
+
+    # SQLite allows one writer at a time, so queue writers on a single pooled
+    # connection rather than letting them fight over the file lock; reads get
+    # their own pool and run concurrently under WAL. aiosqlite file URLs
+    # default to NullPool, so ask for a queue pool explicitly.
+    write = create_async_engine(ASYNC_DATABASE_URL, poolclass=AsyncAdaptedQueuePool, pool_size=1, max_overflow=0, pool_timeout=30, echo=False)
+    event.listen(write.sync_engine, "connect", _apply_sqlite_pragmas)
+    read = create_async_engine(ASYNC_DATABASE_URL, poolclass=AsyncAdaptedQueuePool,
+                               pool_size=SQLITE_READ_POOL_SIZE, max_overflow=0, echo=False)
+    event.listen(read.sync_engine, "connect", _apply_sqlite_pragmas)
+    event.listen(read.sync_engine, "connect", _set_query_only)
+    return write, read
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+# Async sessions for the request path, so DB round trips don't block the
+# event loop. The sync engine is still used for table creation, migrations
+# and the sync auth routes.
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+AsyncReadSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+
+_engine = None
+_engine_ready = False  # set once the first-use hooks have run
+_async_engines = None  # (event loop, write engine, read engine)
+_first_use_hooks = []
+_engine_lock = threading.RLock()  # sync routes run in a threadpool
+
+def run_on_first_use(hook):
+    """Register a callable run once, right after the sync engine is created.
+
+    Serverless instances use this to defer schema setup until a request
+    actually needs the database.
+    """
+    _first_use_hooks.append(hook)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def get_engine():
+    """The sync engine, created on first call.
+
+    Other threads wait until the first-use hooks have finished, so nobody
+    sees the engine before its tables exist. The hooks themselves may call
+    get_engine(); the lock is re-entrant and hands them the new engine.
+    """
+    global _engine, _engine_ready
+    if _engine_ready:
+        return _engine
+    with _engine_lock:
+        if _engine is None:
+            engine = _create_sync_engine()
+            SessionLocal.configure(bind=engine)
+            _engine = engine
+            print(DATABASE_LABEL)
+            try:
+                while _first_use_hooks:
+                    _first_use_hooks.pop(0)()
+            finally:
+                _engine_ready = True
+    return _engine
+
+def get_async_engine(readonly: bool = False):
+    """The async write (or read) engine, created on first call.
+
+    asyncpg connections belong to the event loop that opened them. If a
+    serverless runtime starts a new loop for an invocation, the engines are
+    rebuilt for it; otherwise warm invocations keep reusing the same pool.
+    """
+    global _async_engines
+    get_engine()
+    loop = asyncio.get_running_loop() if IS_POSTGRES else None
+    if _async_engines is None or _async_engines[0] is not loop:
+        if _async_engines is not None:
+            # The old loop is gone, so its connections can't be closed cleanly
+            _async_engines[1].sync_engine.dispose(close=False)
+        write, read = _create_async_engines()
+        AsyncSessionLocal.configure(bind=write)
+        AsyncReadSessionLocal.configure(bind=read)
+        _async_engines = (loop, write, read)
+    return _async_engines[2] if readonly else _async_engines[1]
+
+async def dispose_engines():
+    """Close pooled connections, e.g. on application shutdown"""
+    global _async_engines
+    if _async_engines is not None:
+        _, write, read = _async_engines
+        await write.dispose()
+        if read is not write:
+            await read.dispose()
+        _async_engines = None
+    if _engine is not None:
+        _engine.dispose()
 
 Base = declarative_base()
 metadata = MetaData()
 
 def get_db():
+    get_engine()
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_db():
+    get_async_engine()
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_read_db():
+    """Session on the read pool, for routes that never write"""
+    get_async_engine(readonly=True)
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+def dialect_insert(db: Union[Session, AsyncSession], table):
+    """Return an INSERT for ``table`` that supports ``on_conflict_do_*``.
+
+    Postgres and SQLite both speak ON CONFLICT, but SQLAlchemy exposes it
+    through dialect-specific constructs, so pick the one matching the
+    session's engine.
+    """
+    if db.bind.dialect.name == "postgresql":
+        return pg_insert(table)
+    return sqlite_insert(table)
+
+@contextmanager
+def session_scope(db: Optional[Session] = None):
+    """Run a block as one unit of work.
+
+    If a session is passed in, it is reused as-is and the caller stays in
+    charge of committing it. Otherwise a new session is opened, committed on
+    success, rolled back on error and always closed.
+    """
+    if db is not None:
+        yield db
+        return
+    get_engine()
     db = SessionLocal()
     try:
         yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+@asynccontextmanager
+async def async_session_scope(db: Optional[AsyncSession] = None, readonly: bool = False):
+    """Async counterpart of ``session_scope`` backed by ``AsyncSessionLocal``.
+
+    ``readonly=True`` opens the new session on the read pool instead.
+    """
+    if db is not None:
+        yield db
+        return
+    get_async_engine(readonly)
+    async with (AsyncReadSessionLocal if readonly else AsyncSessionLocal)() as db:
+        try:
+            yield db
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
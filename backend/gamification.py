@@ -1,8 +1,9 @@
 from typing import Dict, Any, List
 from fastapi import HTTPException
-from models.auth import UserAuth, UserInDB
-from models.schema import Base
-from sqlalchemy.orm import Session
+from models.auth import UserAuth
+from models.schema import Base, User
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import random
 import uuid
 
@@ -81,9 +82,9 @@ class QuestGenerator:
         
         return quests
 
-async def get_student_rank(student_id: str, db: Session) -> Dict[str, Any]:
+async def get_student_rank(student_id: str, db: AsyncSession) -> Dict[str, Any]:
     """Calculate student's rank based on XP and achievements"""
-    student = db.query(UserInDB).filter(UserInDB.id == student_id).first()
+    student = await db.scalar(select(User).where(User.id == student_id))
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
     
@@ -0,0 +1,173 @@
+"""
+Long-lived outbound HTTP clients.
+
+One pooled httpx.AsyncClient per upstream service, so calls reuse
+keep-alive connections (and HTTP/2 streams where the server supports it)
+instead of paying DNS, TCP and TLS setup on every request. The app
+lifespan creates them at startup; in serverless mode, where the lifespan
+doesn't run, each is created on first use.
+
+Pool sizing comes from the environment:
+
+    HTTP_MAX_CONNECTIONS            connections per upstream (default 20)
+    HTTP_MAX_KEEPALIVE_CONNECTIONS  idle connections kept open (default 10)
+    HTTP_KEEPALIVE_EXPIRY           seconds an idle connection is kept (default 30)
+    HTTP2_ENABLED                   "0" to force HTTP/1.1 (default on when h2 is installed)
+
+Any of the first three can be set per upstream by appending the name,
+e.g. HTTP_MAX_CONNECTIONS_OPENAI=50. pool_stats() reports usage.
+"""
+import asyncio
+import importlib.util
+import os
+from typing import Dict, Optional
+
+import httpx
+
+# httpx needs the h2 package for HTTP/2
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "1") != "0" and HTTP2_AVAILABLE
+
+# name -> (base_url, default request timeout in seconds)
+UPSTREAMS = {
+    "openai": (None, 60.0),  # base URL comes from the OpenAI SDK
+    "elevenlabs": ("https://api.elevenlabs.io", 10.0),
+    "anthropic": (os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com"), 60.0),
+}
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_clients_loop = None
+
+
+def _setting(name: str, upstream: str, default: float) -> float:
+    value = os.getenv(f"{name}_{upstream.upper()}") or os.getenv(name)
+    return float(value) if value else default
+
+
+class PooledTransport(httpx.AsyncHTTPTransport):
+    """AsyncHTTPTransport that keeps request counters for pool_stats()"""
+
+    def __init__(self, limits: httpx.Limits, http2: bool):
+        super().__init__(limits=limits, http2=http2)
+        self.limits = limits
+        self.http2 = http2
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            return await super().handle_async_request(request)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    def _pool_stats(self) -> Dict:
+        """Connection counts read from httpcore's pool.
+
+        These are httpcore internals rather than public API, so any field
+        that can't be read on the installed version is None instead of
+        breaking the metrics endpoint.
+        """
+        stats = dict.fromkeys(("connections", "active_connections", "idle_connections",
+                               "http2_connections", "waiting_for_connection"))
+        pool = getattr(self, "_pool", None)
+        try:
+            connections = list(pool.connections)
+        except (AttributeError, TypeError):
+            return stats
+        stats["connections"] = len(connections)
+        try:
+            idle = sum(1 for conn in connections if conn.is_idle())
+            stats["active_connections"] = len(connections) - idle
+            stats["idle_connections"] = idle
+        except AttributeError:
+            pass
+        try:
+            stats["http2_connections"] = sum(1 for conn in connections if conn.info().startswith("HTTP/2"))
+        except AttributeError:
+            pass
+        try:
+            stats["waiting_for_connection"] = sum(1 for req in pool._requests if req.is_queued())
+        except (AttributeError, TypeError):
+            pass
+        return stats
+
+    def stats(self) -> Dict:
+        return {
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            **self._pool_stats(),
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+def _create_client(upstream: str) -> httpx.AsyncClient:
+    base_url, timeout = UPSTREAMS[upstream]
+    limits = httpx.Limits(
+        max_connections=int(_setting("HTTP_MAX_CONNECTIONS", upstream, 20)),
+        max_keepalive_connections=int(_setting("HTTP_MAX_KEEPALIVE_CONNECTIONS", upstream, 10)),
+        keepalive_expiry=_setting("HTTP_KEEPALIVE_EXPIRY", upstream, 30.0),
+    )
+    transport = PooledTransport(limits=limits, http2=HTTP2_ENABLED)
+    kwargs = {"transport": transport, "timeout": httpx.Timeout(timeout, connect=5.0)}
+    if base_url:
+        kwargs["base_url"] = base_url
+    return httpx.AsyncClient(**kwargs)
+
+
+def get_http_client(upstream: str) -> httpx.AsyncClient:
+    """Return the shared client for an upstream in UPSTREAMS, creating it if needed"""
+    global _clients_loop
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+
+    # Pooled connections belong to the loop that opened them. Serverless
+    # runtimes may use a fresh loop per invocation, so start new pools then.
+    if loop is not None and _clients_loop is not None and loop is not _clients_loop:
+        _clients.clear()
+    if loop is not None:
+        _clients_loop = loop
+
+    client = _clients.get(upstream)
+    if client is None or client.is_closed:
+        client = _clients[upstream] = _create_client(upstream)
+    return client
+
+
+def create_http_clients():
+    """Create every upstream's client up front (app startup)"""
+    for upstream in UPSTREAMS:
+        get_http_client(upstream)
+
+
+async def close_http_clients():
+    """Close all pooled connections (app shutdown)"""
+    global _clients_loop
+    for client in list(_clients.values()):
+        await client.aclose()
+    _clients.clear()
+    _clients_loop = None
+
+
+def pool_stats() -> Dict[str, Optional[Dict]]:
+    """Connection pool usage per upstream; None for clients not created yet"""
+    stats = {}
+    for upstream in UPSTREAMS:
+        client = _clients.get(upstream)
+        transport = client._transport if client is not None else None
+        stats[upstream] = transport.stats() if isinstance(transport, PooledTransport) else None
+    return stats
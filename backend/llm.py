@@ -0,0 +1,103 @@
+"""
+Shared OpenAI client.
+
+Every LLM call goes through one AsyncOpenAI client per process, so calls
+are awaited instead of blocking the event loop. Its connections come from
+the pooled "openai" client in http_clients, which chat, chapter generation,
+feedback and Whisper all share. The app lifespan creates it at startup;
+where the lifespan doesn't run (serverless) it is created on first use.
+
+The API key and endpoint come from OPENAI_API_KEY and OPENAI_BASE_URL.
+
+create_chat_completion(), stream_chat_completion() and create_transcription()
+make the call through the provider's LLMScheduler (see scheduler.py), so
+every call waits for a slot in its priority class. Limits come from
+LLM_MAX_CONCURRENCY, LLM_TOKENS_PER_MINUTE and LLM_RESERVED_INTERACTIVE,
+each overridable per provider with a suffix (LLM_MAX_CONCURRENCY_OPENAI).
+"""
+import os
+from typing import AsyncIterator, Dict, Hashable, List, Optional
+
+from openai import AsyncOpenAI
+
+from context import count_tokens, MESSAGE_OVERHEAD
+from http_clients import get_http_client
+from scheduler import LLMScheduler, Priority
+
+_client: Optional[AsyncOpenAI] = None
+_client_http = None
+
+
+def get_openai_client() -> AsyncOpenAI:
+    """Return the shared client, creating it if needed.
+
+    Raises openai.OpenAIError when no API key is configured, like the
+    OpenAI() constructor the call sites used before.
+    """
+    global _client, _client_http
+    http_client = get_http_client("openai")
+    # http_clients starts a new pool when the event loop changes (serverless);
+    # follow it so the SDK never holds connections from a finished loop
+    if _client is None or _client_http is not http_client:
+        _client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client)
+        _client_http = http_client
+    return _client
+
+
+def close_openai_client():
+    """Drop the shared client; its connections are closed with the http_clients pool"""
+    global _client, _client_http
+    _client = None
+    _client_http = None
+
+
+_schedulers: Dict[str, LLMScheduler] = {}
+
+
+def _setting(name: str, provider: str, default: int) -> int:
+    value = os.getenv(f"{name}_{provider.upper()}") or os.getenv(name)
+    return int(value) if value else default
+
+
+def get_scheduler(provider: str = "openai") -> LLMScheduler:
+    if provider not in _schedulers:
+        _schedulers[provider] = LLMScheduler(
+            provider,
+            max_concurrency=_setting("LLM_MAX_CONCURRENCY", provider, 16),
+            tokens_per_minute=_setting("LLM_TOKENS_PER_MINUTE", provider, 0),
+            reserved=_setting("LLM_RESERVED_INTERACTIVE", provider, 2),
+        )
+    return _schedulers[provider]
+
+
+def scheduler_stats() -> Dict:
+    get_scheduler("openai")  # always listed, even before the first call
+    return {provider: scheduler.stats() for provider, scheduler in _schedulers.items()}
+
+
+def estimate_tokens(messages: List[Dict], max_tokens: Optional[int]) -> int:
+    """Tokens a chat call can use against the budget: the prompt plus the reply limit"""
+    prompt = sum(count_tokens(message["content"]) + MESSAGE_OVERHEAD for message in messages)
+    return prompt + (max_tokens or 0)
+
+
+async def create_chat_completion(priority: Priority, student_id: Optional[Hashable] = None, **kwargs):
+    """client.chat.completions.create(**kwargs), once the scheduler grants a slot"""
+    tokens = estimate_tokens(kwargs["messages"], kwargs.get("max_tokens"))
+    async with get_scheduler().slot(priority, student_id, tokens):
+        return await get_openai_client().chat.completions.create(**kwargs)
+
+
+async def stream_chat_completion(priority: Priority, student_id: Optional[Hashable] = None, **kwargs) -> AsyncIterator:
+    """Streaming create_chat_completion: yields the chunks, holding the slot until the stream ends"""
+    tokens = estimate_tokens(kwargs["messages"], kwargs.get("max_tokens"))
+    async with get_scheduler().slot(priority, student_id, tokens):
+        stream = await get_openai_client().chat.completions.create(stream=True, **kwargs)
+        async for chunk in stream:
+            yield chunk
+
+
+async def create_transcription(priority: Priority, student_id: Optional[Hashable] = None, **kwargs):
+    """client.audio.transcriptions.create(**kwargs) through the scheduler (no token budget)"""
+    async with get_scheduler().slot(priority, student_id):
+        return await get_openai_client().audio.transcriptions.create(**kwargs)
@@ -1,12 +1,15 @@
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Depends, Security, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 import httpx
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, AsyncIterator
 import json
 import uuid
+import hashlib
+import random
+import re
 from datetime import datetime, timedelta
 from enum import Enum
 import os
@@ -14,16 +17,30 @@ import openai
 from pathlib import Path
 import logging
 from contextlib import asynccontextmanager
+from functools import lru_cache
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, delete, func, and_, or_, event
 from dotenv import load_dotenv
 
 # Import our models and database
 from models.auth import UserAuth, UserCreate, UserInDB, Token, TokenData
 from models.reading import Chapter as ChapterPydantic, ReadingSession as ReadingSessionPydantic
-from models.schema import Base, User, Chapter, ReadingSession, StudentStreak, StudentLevelDB, StudentBadgeDB, StudentStatsDB
-from database import engine, get_db
+from models.schema import Base, User, Chapter, ReadingSession, StudentStreak, StudentLevelDB, StudentBadgeDB, StudentStatsDB, StudentQuestDB, QUEST_NO_EXPIRY, ConversationDB, ConversationSummaryDB, ChapterLibraryDB, PendingChapterDB, LeaderboardEntryDB, XPEventDB, XPRollupDB
+from database import get_engine, run_on_first_use, dispose_engines, get_db, get_async_db, get_async_read_db, async_session_scope, dialect_insert
 from utils import format_xp_display, get_difficulty_color, create_achievement_notification
 from gamification import XPCalculator, QuestGenerator, get_student_rank
+from llm import get_openai_client, close_openai_client, create_chat_completion, stream_chat_completion, create_transcription, scheduler_stats
+from providers import hedged_chat_completion, hedged_chat_stream, configured_providers, provider_stats
+import http_clients
+from http_clients import get_http_client, create_http_clients, close_http_clients, pool_stats, HTTP2_ENABLED
+from cache import LRUTTLCache, VariantCache
+from syllables import stuck_word_feedback
+from background import WorkerPool
+from singleflight import SingleFlight
+from audio_cache import AudioCache
+from scheduler import Priority
+from context import build_messages, fit_history, TOKENIZER
 
 # Load environment variables - explicitly look in backend directory
 from pathlib import Path
@@ -31,6 +48,17 @@ backend_dir = Path(__file__).parent
 env_path = backend_dir / '.env'
 load_dotenv(dotenv_path=env_path)
 
+# Offline mode: send every OpenAI, Anthropic and ElevenLabs call to the
+# local stand-in in stub_upstream.py, with placeholder keys, for load tests
+UPSTREAM_STUB_URL = (os.getenv("UPSTREAM_STUB_URL") or "").rstrip("/")
+if UPSTREAM_STUB_URL:
+    os.environ["OPENAI_BASE_URL"] = f"{UPSTREAM_STUB_URL}/v1"
+    os.environ["OPENAI_API_KEY"] = "sk-upstream-stub"
+    os.environ["ELEVENLABS_API_KEY"] = "upstream-stub"
+    for upstream in ("elevenlabs", "anthropic"):
+        http_clients.UPSTREAMS[upstream] = (UPSTREAM_STUB_URL, http_clients.UPSTREAMS[upstream][1])
+    print(f"🧪 Upstream stub mode: LLM, transcription and TTS calls go to {UPSTREAM_STUB_URL}")
+
 # Set up OpenAI API key
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
@@ -49,62 +77,109 @@ logger = logging.getLogger(__name__)
 # Check if running in serverless environment (Vercel)
 IS_SERVERLESS = os.getenv("VERCEL") == "1" or os.getenv("AWS_LAMBDA_FUNCTION_NAME") is not None
 
-# Create database tables
-# For Postgres (Vercel Postgres or local), always create tables
-# For SQLite, create tables (in-memory for serverless, file-based for local)
-try:
-    Base.metadata.create_all(bind=engine)
-    # Check if using Postgres by examining the engine URL
-    db_url = str(engine.url)
-    if "postgresql" in db_url or "postgres" in db_url:
-        print("✅ Database tables created (PostgreSQL)")
-    elif IS_SERVERLESS:
-        print("✅ Database tables created in serverless mode (in-memory SQLite)")
-    else:
-        print("✅ Database tables created (file-based SQLite)")
-except Exception as e:
-    logger.warning(f"Could not create database tables: {e}")
-    # Continue anyway - tables may already exist or will be created lazily
-
-# Lightweight migration: add is_completed column to chapters if missing
-try:
-    from sqlalchemy import text as sa_text, inspect as sa_inspect
-    inspector = sa_inspect(engine)
-    chapter_cols = [c["name"] for c in inspector.get_columns("chapters")]
-    if "is_completed" not in chapter_cols:
-        with engine.connect() as conn:
-            conn.execute(sa_text("ALTER TABLE chapters ADD COLUMN is_completed BOOLEAN DEFAULT FALSE"))
-            conn.commit()
-        print("✅ Added is_completed column to chapters table")
-    else:
-        print("✅ is_completed column already exists")
-except Exception as mig_err:
-    # Column might already exist or table might not exist yet - that's fine
-    print(f"⚠️ Migration check for is_completed: {mig_err}")
-    import traceback
-    traceback.print_exc()
+def init_database():
+    """Create tables and apply the lightweight migrations"""
+    engine = get_engine()
+
+    # Create database tables
+    # For Postgres (Vercel Postgres or local), always create tables
+    # For SQLite, create tables (in-memory for serverless, file-based for local)
+    try:
+        Base.metadata.create_all(bind=engine)
+        # Check if using Postgres by examining the engine URL
+        db_url = str(engine.url)
+        if "postgresql" in db_url or "postgres" in db_url:
+            print("✅ Database tables created (PostgreSQL)")
+        elif IS_SERVERLESS:
+            print("✅ Database tables created in serverless mode (in-memory SQLite)")
+        else:
+            print("✅ Database tables created (file-based SQLite)")
+    except Exception as e:
+        logger.warning(f"Could not create database tables: {e}")
+        # Continue anyway - tables may already exist or will be created lazily
+
+    # Lightweight migration: add is_completed column to chapters if missing
+    try:
+        from sqlalchemy import text as sa_text, inspect as sa_inspect
+        inspector = sa_inspect(engine)
+        chapter_cols = [c["name"] for c in inspector.get_columns("chapters")]
+        if "is_completed" not in chapter_cols:
+            with engine.connect() as conn:
+                conn.execute(sa_text("ALTER TABLE chapters ADD COLUMN is_completed BOOLEAN DEFAULT FALSE"))
+                conn.commit()
+            print("✅ Added is_completed column to chapters table")
+        else:
+            print("✅ is_completed column already exists")
+    except Exception as mig_err:
+        # Column might already exist or table might not exist yet - that's fine
+        print(f"⚠️ Migration check for is_completed: {mig_err}")
+        import traceback
+        traceback.print_exc()
+
+    # Lightweight migration: chapters remember their topic and number (for
+    # pre-generating the next one) and the shared library entry they came from
+    try:
+        from sqlalchemy import text as sa_text, inspect as sa_inspect
+        chapter_cols = [c["name"] for c in sa_inspect(engine).get_columns("chapters")]
+        for column, column_type in (("library_id", "VARCHAR"), ("topic", "VARCHAR"), ("chapter_number", "INTEGER")):
+            if column not in chapter_cols:
+                with engine.begin() as conn:
+                    conn.execute(sa_text(f"ALTER TABLE chapters ADD COLUMN {column} {column_type}"))
+                print(f"✅ Added {column} column to chapters table")
+    except Exception as mig_err:
+        print(f"⚠️ Migration check for chapter library/topic columns: {mig_err}")
+
+    # Lightweight migration: enforce one badge row per student. Older databases
+    # can hold duplicates from the previous check-then-insert award path, so keep
+    # the earliest row of each pair before adding the unique index.
+    try:
+        from sqlalchemy import text as sa_text
+        with engine.begin() as conn:
+            conn.execute(sa_text(
+                "DELETE FROM student_badges WHERE id NOT IN "
+                "(SELECT MIN(id) FROM student_badges GROUP BY student_id, badge_id)"
+            ))
+            conn.execute(sa_text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS uq_student_badges_student_badge "
+                "ON student_badges (student_id, badge_id)"
+            ))
+    except Exception as mig_err:
+        print(f"⚠️ Migration check for student_badges unique index: {mig_err}")
+
+    # Lightweight migration: the all-time leaderboard sorts on total_xp_earned
+    try:
+        from sqlalchemy import text as sa_text
+        with engine.begin() as conn:
+            conn.execute(sa_text(
+                "CREATE INDEX IF NOT EXISTS ix_student_levels_total_xp_earned "
+                "ON student_levels (total_xp_earned)"
+            ))
+    except Exception as mig_err:
+        print(f"⚠️ Migration check for student_levels XP index: {mig_err}")
+
+if IS_SERVERLESS:
+    # Defer engine creation and schema setup to the first request that needs
+    # the database, so a cold start only pays for them when it has to
+    run_on_first_use(init_database)
+else:
+    init_database()
 
 # Define lifespan function (will be used later)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager for FastAPI application startup and shutdown events"""
+    # Startup: open the pooled outbound HTTP clients and the OpenAI client on top
+    create_http_clients()
+    try:
+        get_openai_client()
+        print("✅ OpenAI client ready")
+    except Exception as e:
+        print(f"⚠️ OpenAI client not created: {e}")
+    
     # Startup: Initialize gamification system
     try:
-        # Update gamification engine methods
-        gamification_engine.get_student_stats = GamificationStorage.get_student_stats
-        gamification_engine.student_has_badge = GamificationStorage.student_has_badge
-        gamification_engine.award_badge = GamificationStorage.award_badge
-        gamification_engine.get_student_badges = GamificationStorage.get_student_badges
-        gamification_engine.get_student_level = GamificationStorage.get_student_level
-        gamification_engine.save_student_level = GamificationStorage.save_student_level
-        gamification_engine.get_streak = GamificationStorage.get_streak
-        gamification_engine.save_streak = GamificationStorage.save_streak
-        gamification_engine.get_student_streaks = GamificationStorage.get_student_streaks
-        gamification_engine.get_active_quests = GamificationStorage.get_active_quests
-        gamification_engine.save_quest_progress = GamificationStorage.save_quest_progress
-        gamification_engine.get_recent_achievements = GamificationStorage.get_recent_achievements
-        gamification_engine.get_leaderboard = GamificationStorage.get_leaderboard_data
-        
+        # GamificationEngine delegates to GamificationStorage itself, passing
+        # a shared session through each activity, so nothing to rebind here.
         print("✅ Gamification system initialized successfully!")
     except Exception as e:
         print(f"❌ Error initializing gamification: {e}")
@@ -112,7 +187,11 @@ async def lifespan(app: FastAPI):
     yield  # Server is running
     
     # Shutdown: Clean up resources if needed
-    # Add any cleanup code here
+    await chapter_pregen_pool.close()
+    await conversation_summary_pool.close()
+    close_openai_client()
+    await close_http_clients()
+    await dispose_engines()
 
 # Initialize FastAPI app with optional lifespan
 if IS_SERVERLESS:
@@ -139,12 +218,14 @@ app.add_middleware(
     allow_origins=["*"],  # In production, specify your frontend domain
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=["X-TTS-Hash", "X-TTS-Cache"]
 )
 
 # Add request logging middleware for debugging
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
+from starlette.concurrency import run_in_threadpool
 
 class LoggingMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
@@ -188,13 +269,6 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 @app.post("/api/auth/register")
 def register(user: UserCreate, db: Session = Depends(get_db)):
     """Register a new user. Returns basic confirmation."""
-    # Ensure tables exist (lazy creation for serverless)
-    if IS_SERVERLESS:
-        try:
-            Base.metadata.create_all(bind=engine)
-        except Exception as e:
-            logger.warning(f"Could not create tables on request: {e}")
-    
     # check if email already exists
     existing = db.query(User).filter(User.email == user.email).first()
     if existing:
@@ -218,13 +292,6 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
 @app.post("/api/auth/login", response_model=Token)
 def login(creds: UserAuth, db: Session = Depends(get_db)):
     """Authenticate user and return JWT access token."""
-    # Ensure tables exist (lazy creation for serverless)
-    if IS_SERVERLESS:
-        try:
-            Base.metadata.create_all(bind=engine)
-        except Exception as e:
-            logger.warning(f"Could not create tables on request: {e}")
-    
     user = db.query(User).filter(User.email == creds.email).first()
     if not user:
         raise HTTPException(status_code=400, detail="Incorrect email or password")
@@ -243,6 +310,85 @@ def login(creds: UserAuth, db: Session = Depends(get_db)):
 def test_connection():
     return {"status": "ok", "message": "Backend is running"}
 
+@app.get("/api/system/http-pools")
+def get_http_pool_stats():
+    """Outbound connection pool usage per upstream (OpenAI, ElevenLabs).
+
+    waiting_for_connection > 0 or active_connections at max_connections means
+    the pool is saturated; raise HTTP_MAX_CONNECTIONS for that upstream.
+    """
+    return {"http2_enabled": HTTP2_ENABLED, "pools": pool_stats()}
+
+@app.get("/api/system/feedback-cache")
+def get_feedback_cache_stats():
+    """Reading feedback cache size and hit rate.
+
+    misses_while_filling counts LLM calls made to collect the extra
+    variants for a key before it starts serving from cache.
+    """
+    return feedback_cache.stats()
+
+@app.get("/api/system/tutor-cache")
+def get_tutor_cache_stats():
+    """Cached per-student tutors and how often a request found one"""
+    return {
+        **tutor_cache.stats(),
+        "max_entries": tutor_cache.max_entries,
+        "prompt_templates": SpecializedTutor.prompt_template.cache_info().currsize + AITutor.prompt_template.cache_info().currsize,
+    }
+
+@app.get("/api/system/chapter-pregen")
+def get_chapter_pregen_stats():
+    """Background chapter pre-generation: queue depth, running jobs and outcomes"""
+    return {"enabled": CHAPTER_PREGEN_ENABLED, **chapter_pregen_pool.stats()}
+
+@app.get("/api/system/llm-scheduler")
+def get_llm_scheduler_stats():
+    """LLM admission per provider: slots in use, tokens this minute, queue depth and waits per priority.
+
+    A growing interactive avg/p95 wait means reading feedback is queuing;
+    raise LLM_MAX_CONCURRENCY or LLM_RESERVED_INTERACTIVE.
+    """
+    return scheduler_stats()
+
+@app.get("/api/system/llm-providers")
+def get_llm_provider_stats():
+    """Tutor chat providers: latency percentiles, hedged requests and wins per provider.
+
+    Many hedged_requests with few wins for the second provider means the
+    hedge budget is too tight; raise CHAT_HEDGE_DELAY_MS.
+    """
+    return provider_stats()
+
+@app.get("/api/system/coalescing")
+def get_coalescing_stats():
+    """Identical concurrent outbound calls merged into one, per upstream call.
+
+    coalesced counts callers that waited on another caller's call instead of
+    making their own; executions counts the calls actually made.
+    """
+    return {
+        "tts": tts_flights.stats(),
+        "reading_feedback": feedback_flights.stats(),
+        "chapter_generation": chapter_flights.stats(),
+    }
+
+@app.get("/api/system/tts-cache")
+def get_tts_cache_stats():
+    """Synthesized speech kept on disk: size against the limit, hit rate, evictions"""
+    return tts_cache.stats()
+
+@app.get("/api/system/conversation-context")
+def get_conversation_context_stats():
+    """Tutor context budget and the background summary jobs that keep it small"""
+    return {
+        "tokenizer": TOKENIZER,
+        "history_tokens": CONTEXT_HISTORY_TOKENS,
+        "summary_enabled": CONTEXT_SUMMARY_ENABLED,
+        "summary_every": CONTEXT_SUMMARY_EVERY,
+        **conversation_summary_pool.stats(),
+    }
+
 # Data Models
 class Student(BaseModel):
     id: str
@@ -333,12 +479,14 @@ class Quest(BaseModel):
     difficulty: DifficultyLevel
 
 class StudentQuest(BaseModel):
+    id: Optional[int] = None  # student_quests row id, set once saved
     quest_id: str
     student_id: str
     start_date: datetime
     progress: Dict  # tracks progress toward requirements
     completed: bool = False
     completion_date: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
 
 # Gamification Engine
 class GamificationEngine:
@@ -637,23 +785,37 @@ class GamificationEngine:
         
         return perks
     
-    async def check_and_award_badges(self, student_id: str, activity_data: Dict) -> List[Badge]:
-        """Check if student has earned any new badges and award them"""
+    async def check_and_award_badges(self, student_id: str, activity_data: Dict, db: Optional[AsyncSession] = None,
+                                     student_stats: Optional[Dict] = None) -> List[Badge]:
+        """Check if student has earned any new badges and award them.
+
+        Pass ``student_stats`` when the caller already holds fresh stats to
+        skip re-reading them.
+        """
         awarded_badges = []
-        student_stats = await self.get_student_stats(student_id)
-        
-        for badge_id, badge in self.badges.items():
-            # Skip if student already has this badge
-            if await self.student_has_badge(student_id, badge_id):
-                continue
-                
-            # Check if requirements are met
-            if self._check_badge_requirements(badge, student_stats, activity_data):
-                await self.award_badge(student_id, badge_id)
-                awarded_badges.append(badge)
-                
-                # Award XP for earning the badge
-                await self.add_xp(student_id, badge.xp_reward, f"Earned badge: {badge.name}")
+        async with async_session_scope(db) as db:
+            if student_stats is None:
+                student_stats = await self.get_student_stats(student_id, db)
+            earned = set(await self.get_student_badges(student_id, db))
+            
+            # Evaluate every unearned badge in memory, then write them in one go
+            candidates = [
+                badge for badge_id, badge in self.badges.items()
+                if badge_id not in earned
+                and self._check_badge_requirements(badge, student_stats, activity_data)
+            ]
+            if not candidates:
+                return awarded_badges
+            
+            # Only rows actually inserted count as new, so a concurrent
+            # activity that got there first doesn't double-award XP
+            inserted = set(await GamificationStorage.award_badges(student_id, [b.id for b in candidates], db))
+            for badge in candidates:
+                if badge.id in inserted:
+                    awarded_badges.append(badge)
+                    
+                    # Award XP for earning the badge
+                    await self.add_xp(student_id, badge.xp_reward, f"Earned badge: {badge.name}", db)
         
         return awarded_badges
     
@@ -672,13 +834,17 @@ class GamificationEngine:
         
         return True
     
-    async def update_streaks(self, student_id: str) -> Dict[str, Streak]:
+    async def update_streaks(self, student_id: str, db: Optional[AsyncSession] = None) -> Dict[str, Streak]:
         """Update student streaks based on current activity"""
+        async with async_session_scope(db) as db:
+            return await self._update_streaks(student_id, db)
+
+    async def _update_streaks(self, student_id: str, db: AsyncSession) -> Dict[str, Streak]:
         today = datetime.now().date()
         streaks = {}
         
         # Daily study streak
-        daily_streak = await self.get_streak(student_id, "daily_study")
+        daily_streak = await self.get_streak(student_id, "daily_study", db)
         if not daily_streak:
             daily_streak = Streak(
                 student_id=student_id,
@@ -704,26 +870,29 @@ class GamificationEngine:
                 daily_streak.last_activity_date = datetime.now()
                 daily_streak.is_active = True
         
-        await self.save_streak(daily_streak)
+        await self.save_streak(daily_streak, db)
         streaks["daily_study"] = daily_streak
         
         # Check for streak-based badges
-        await self.check_streak_badges(student_id, daily_streak)
+        await self.check_streak_badges(student_id, daily_streak, db)
         
         return streaks
     
-    async def check_streak_badges(self, student_id: str, streak: Streak):
+    async def check_streak_badges(self, student_id: str, streak: Streak, db: Optional[AsyncSession] = None):
         """Check and award streak-based badges"""
-        if streak.streak_type == "daily_study":
-            if streak.current_count >= 7 and not await self.student_has_badge(student_id, "daily_learner"):
-                await self.award_badge(student_id, "daily_learner")
-            elif streak.current_count >= 30 and not await self.student_has_badge(student_id, "study_warrior"):
-                await self.award_badge(student_id, "study_warrior")
+        async with async_session_scope(db) as db:
+            if streak.streak_type == "daily_study":
+                # award_badge ignores badges the student already holds
+                if streak.current_count >= 7:
+                    await self.award_badge(student_id, "daily_learner", db)
+                if streak.current_count >= 30:
+                    await self.award_badge(student_id, "study_warrior", db)
     
-    async def generate_daily_quests(self, student_id: str) -> List[Quest]:
+    async def generate_daily_quests(self, student_id: str, db: Optional[AsyncSession] = None) -> List[Quest]:
         """Generate personalized daily quests for a student"""
-        student_stats = await self.get_student_stats(student_id)
-        student_level = await self.get_student_level(student_id)
+        async with async_session_scope(db) as db:
+            student_stats = await self.get_student_stats(student_id, db)
+            student_level = await self.get_student_level(student_id, db)
         
         available_quests = []
         
@@ -747,10 +916,15 @@ class GamificationEngine:
         
         return daily_quests
     
-    async def update_quest_progress(self, student_id: str, activity_data: Dict) -> List[Dict]:
+    async def update_quest_progress(self, student_id: str, activity_data: Dict, db: Optional[AsyncSession] = None) -> List[Dict]:
         """Update progress on active quests"""
-        active_quests = await self.get_active_quests(student_id)
+        async with async_session_scope(db) as db:
+            return await self._update_quest_progress(student_id, activity_data, db)
+
+    async def _update_quest_progress(self, student_id: str, activity_data: Dict, db: AsyncSession) -> List[Dict]:
+        active_quests = await self.get_active_quests(student_id, db)
         completed_quests = []
+        changed_quests = []
         
         for quest_progress in active_quests:
             quest = self.quests[quest_progress.quest_id]
@@ -769,10 +943,10 @@ class GamificationEngine:
                 quest_progress.completion_date = datetime.now()
                 
                 # Award XP and badge if applicable
-                await self.add_xp(student_id, quest.xp_reward, f"Completed quest: {quest.name}")
+                await self.add_xp(student_id, quest.xp_reward, f"Completed quest: {quest.name}", db)
                 
                 if quest.badge_reward:
-                    await self.award_badge(student_id, quest.badge_reward)
+                    await self.award_badge(student_id, quest.badge_reward, db)
                 
                 completed_quests.append({
                     "quest": quest,
@@ -780,11 +954,29 @@ class GamificationEngine:
                     "badge_earned": quest.badge_reward
                 })
             
-            if updated:
-                await self.save_quest_progress(quest_progress)
+            if updated or quest_progress.completed:
+                changed_quests.append(quest_progress)
+        
+        if changed_quests:
+            await GamificationStorage.update_quests_progress(changed_quests, db)
         
         return completed_quests
     
+    def _new_quest_progress(self, student_id: str, quest_id: str) -> StudentQuest:
+        """Build progress for a quest starting now, with its expiry fixed up front"""
+        start_date = datetime.now()
+        quest = self.quests.get(quest_id)
+        expires_at = QUEST_NO_EXPIRY
+        if quest and quest.time_limit_hours:
+            expires_at = start_date + timedelta(hours=quest.time_limit_hours)
+        return StudentQuest(
+            quest_id=quest_id,
+            student_id=student_id,
+            start_date=start_date,
+            progress={},
+            expires_at=expires_at
+        )
+    
     def _is_quest_completed(self, quest: Quest, progress: Dict) -> bool:
         """Check if quest requirements are fully met"""
         for req_key, req_value in quest.requirements.items():
@@ -792,16 +984,19 @@ class GamificationEngine:
                 return False
         return True
     
-    async def get_leaderboard(self, timeframe: str = "all_time", limit: int = 10) -> List[Dict]:
+    async def get_leaderboard(self, timeframe: str = "all_time", limit: int = 10, db: Optional[AsyncSession] = None) -> List[Dict]:
         """Get student leaderboard"""
-        return await GamificationStorage.get_leaderboard_data(timeframe, limit)
+        async with async_session_scope(db, readonly=True) as db:
+            return await GamificationStorage.get_leaderboard_data(timeframe, limit, db)
     
-    async def get_student_achievements_summary(self, student_id: str) -> Dict:
+    async def get_student_achievements_summary(self, student_id: str, db: Optional[AsyncSession] = None) -> Dict:
         """Get comprehensive achievement summary for a student"""
-        student_level = await self.get_student_level(student_id)
-        badges = await self.get_student_badges(student_id)
-        streaks = await self.get_student_streaks(student_id)
-        active_quests = await self.get_active_quests(student_id)
+        async with async_session_scope(db, readonly=True) as db:
+            student_level = await self.get_student_level(student_id, db)
+            badges = await self.get_student_badges(student_id, db)
+            streaks = await self.get_student_streaks(student_id, db)
+            active_quests = await self.get_active_quests(student_id, db)
+            recent_achievements = await self.get_recent_achievements(student_id, limit=5, db=db)
         
         # Calculate achievement statistics
         total_badges = len(badges)
@@ -829,37 +1024,44 @@ class GamificationEngine:
             "active_streaks": len([s for s in streaks.values() if s.is_active]),
             "longest_streak": max([s.max_count for s in streaks.values()]) if streaks else 0,
             "active_quests": len(active_quests),
-            "recent_achievements": await self.get_recent_achievements(student_id, limit=5)
+            "recent_achievements": recent_achievements
         }
     
-    # Placeholder methods for database operations
-    # In a real implementation, these would interact with your database
+    # Storage delegates. Each accepts an optional session so a caller can
+    # batch several reads/writes into one unit of work; without one, the
+    # call runs in its own short transaction.
     
-    async def get_student_stats(self, student_id: str) -> Dict:
-        return await GamificationStorage.get_student_stats(student_id)
+    async def get_student_stats(self, student_id: str, db: Optional[AsyncSession] = None) -> Dict:
+        async with async_session_scope(db, readonly=True) as db:
+            return await GamificationStorage.get_student_stats(student_id, db)
 
-    async def student_has_badge(self, student_id: str, badge_id: str) -> bool:
-        return await GamificationStorage.student_has_badge(student_id, badge_id)
+    async def student_has_badge(self, student_id: str, badge_id: str, db: Optional[AsyncSession] = None) -> bool:
+        async with async_session_scope(db, readonly=True) as db:
+            return await GamificationStorage.student_has_badge(student_id, badge_id, db)
 
-    async def award_badge(self, student_id: str, badge_id: str):
-        await GamificationStorage.award_badge(student_id, badge_id)
+    async def award_badge(self, student_id: str, badge_id: str, db: Optional[AsyncSession] = None):
+        async with async_session_scope(db) as db:
+            await GamificationStorage.award_badge(student_id, badge_id, db)
 
-    async def add_xp(self, student_id: str, xp_amount: int, reason: str) -> Dict:
+    async def add_xp(self, student_id: str, xp_amount: int, reason: str, db: Optional[AsyncSession] = None) -> Dict:
         """Add XP to student and check for level up. Returns level-up info."""
-        student_level = await GamificationStorage.get_student_level(student_id)
-        old_level = student_level.current_level
-        student_level.current_xp += xp_amount
-        student_level.total_xp_earned += xp_amount
-
-        while student_level.current_xp >= student_level.xp_to_next_level and student_level.current_level < 20:
-            student_level.current_xp -= student_level.xp_to_next_level
-            student_level.current_level += 1
-            level_data = self.level_thresholds[student_level.current_level]
-            student_level.title = level_data["title"]
-            student_level.xp_to_next_level = level_data["xp_required"]
-            print(f"Level up! Student {student_id} reached level {student_level.current_level}")
-
-        await GamificationStorage.save_student_level(student_level)
+        async with async_session_scope(db) as db:
+            student_level = await GamificationStorage.get_student_level(student_id, db)
+            old_level = student_level.current_level
+            student_level.current_xp += xp_amount
+            student_level.total_xp_earned += xp_amount
+
+            while student_level.current_xp >= student_level.xp_to_next_level and student_level.current_level < 20:
+                student_level.current_xp -= student_level.xp_to_next_level
+                student_level.current_level += 1
+                level_data = self.level_thresholds[student_level.current_level]
+                student_level.title = level_data["title"]
+                student_level.xp_to_next_level = level_data["xp_required"]
+                print(f"Level up! Student {student_id} reached level {student_level.current_level}")
+
+            await GamificationStorage.save_student_level(student_level, db)
+            await GamificationStorage.record_xp_event(student_id, xp_amount, reason, db)
+            await GamificationStorage.record_leaderboard_xp(student_id, xp_amount, db)
 
         leveled_up = student_level.current_level > old_level
         return {
@@ -871,36 +1073,54 @@ class GamificationEngine:
             "total_xp_earned": student_level.total_xp_earned
         }
 
-    async def get_student_level(self, student_id: str) -> StudentLevel:
-        return await GamificationStorage.get_student_level(student_id)
+    async def get_xp_in_range(self, student_ids: List[str], start: datetime, end: datetime, db: Optional[AsyncSession] = None) -> Dict[str, int]:
+        async with async_session_scope(db, readonly=True) as db:
+            return await GamificationStorage.get_xp_in_range(student_ids, start, end, db)
+
+    async def get_student_level(self, student_id: str, db: Optional[AsyncSession] = None) -> StudentLevel:
+        async with async_session_scope(db, readonly=True) as db:
+            return await GamificationStorage.get_student_level(student_id, db)
 
-    async def get_streak(self, student_id: str, streak_type: str) -> Optional[Streak]:
-        return await GamificationStorage.get_streak(student_id, streak_type)
+    async def get_streak(self, student_id: str, streak_type: str, db: Optional[AsyncSession] = None) -> Optional[Streak]:
+        async with async_session_scope(db, readonly=True) as db:
+            return await GamificationStorage.get_streak(student_id, streak_type, db)
 
-    async def save_streak(self, streak: Streak):
-        await GamificationStorage.save_streak(streak)
+    async def save_streak(self, streak: Streak, db: Optional[AsyncSession] = None):
+        async with async_session_scope(db) as db:
+            await GamificationStorage.save_streak(streak, db)
 
-    async def get_active_quests(self, student_id: str) -> List[StudentQuest]:
-        return await GamificationStorage.get_active_quests(student_id)
+    async def get_active_quests(self, student_id: str, db: Optional[AsyncSession] = None) -> List[StudentQuest]:
+        async with async_session_scope(db, readonly=True) as db:
+            return await GamificationStorage.get_active_quests(student_id, db)
 
-    async def save_quest_progress(self, quest_progress: StudentQuest):
-        await GamificationStorage.save_quest_progress(quest_progress)
+    async def save_quest_progress(self, quest_progress: StudentQuest, db: Optional[AsyncSession] = None):
+        async with async_session_scope(db) as db:
+            await GamificationStorage.save_quest_progress(quest_progress, db)
 
-    async def get_student_badges(self, student_id: str) -> List[str]:
-        return await GamificationStorage.get_student_badges(student_id)
+    async def get_student_badges(self, student_id: str, db: Optional[AsyncSession] = None) -> List[str]:
+        async with async_session_scope(db, readonly=True) as db:
+            return await GamificationStorage.get_student_badges(student_id, db)
 
-    async def get_student_streaks(self, student_id: str) -> Dict[str, Streak]:
-        return await GamificationStorage.get_student_streaks(student_id)
+    async def get_student_streaks(self, student_id: str, db: Optional[AsyncSession] = None) -> Dict[str, Streak]:
+        async with async_session_scope(db, readonly=True) as db:
+            return await GamificationStorage.get_student_streaks(student_id, db)
 
-    async def save_student_level(self, student_level: StudentLevel):
-        await GamificationStorage.save_student_level(student_level)
+    async def save_student_level(self, student_level: StudentLevel, db: Optional[AsyncSession] = None):
+        async with async_session_scope(db) as db:
+            await GamificationStorage.save_student_level(student_level, db)
 
-    async def get_recent_achievements(self, student_id: str, limit: int = 5) -> List[Dict]:
-        return await GamificationStorage.get_recent_achievements(student_id, limit)
+    async def get_recent_achievements(self, student_id: str, limit: int = 5, db: Optional[AsyncSession] = None) -> List[Dict]:
+        async with async_session_scope(db, readonly=True) as db:
+            return await GamificationStorage.get_recent_achievements(student_id, limit, db)
     
 
-    async def process_student_activity(self, student_id: str, activity_type: str, activity_data: Dict = None) -> Dict:
-        """Process student activity and update all gamification metrics"""
+    async def process_student_activity(self, student_id: str, activity_type: str, activity_data: Dict = None, db: Optional[AsyncSession] = None) -> Dict:
+        """Process student activity and update all gamification metrics.
+
+        Every read and write for the activity shares one session and is
+        committed as a single transaction, so a failure part-way through
+        leaves the student's gamification state untouched.
+        """
         if activity_data is None:
             activity_data = {}
         
@@ -913,71 +1133,71 @@ class GamificationEngine:
         }
         
         try:
-            # 1. Calculate and award XP
-            xp_result = await XPCalculator.calculate_activity_xp(student_id, activity_type, activity_data)
-            xp_info = await self.add_xp(student_id, xp_result["total_xp"], f"Activity: {activity_type}")
-
-            results["xp_gained"] = xp_result["total_xp"]
-            results["xp_details"] = xp_result
-            results["level_up"] = xp_info.get("level_up", False)
-            results["level_info"] = xp_info
+            async with async_session_scope(db) as db:
+                # 1. Calculate and award XP
+                xp_result = await XPCalculator.calculate_activity_xp(student_id, activity_type, activity_data)
+                xp_info = await self.add_xp(student_id, xp_result["total_xp"], f"Activity: {activity_type}", db)
+
+                results["xp_gained"] = xp_result["total_xp"]
+                results["xp_details"] = xp_result
+                results["level_up"] = xp_info.get("level_up", False)
+                results["level_info"] = xp_info
             
-            # 2. Update student stats
-            stats_update = {
-                activity_type: 1,
-                "total_activities": 1
-            }
+                # 2. Update student stats
+                stats_update = {
+                    activity_type: 1,
+                    "total_activities": 1
+                }
             
-            # Add subject-specific stats
-            if activity_data.get("subject"):
-                stats_update[f"{activity_data['subject']}_interactions"] = 1
+                # Add subject-specific stats
+                if activity_data.get("subject"):
+                    stats_update[f"{activity_data['subject']}_interactions"] = 1
             
-            # Add tutor-specific stats
-            if activity_data.get("tutor_type"):
-                stats_update["different_tutors_used"] = activity_data["tutor_type"]
+                # Add tutor-specific stats
+                if activity_data.get("tutor_type"):
+                    stats_update["different_tutors_used"] = activity_data["tutor_type"]
             
-            # Update time-based stats (use client's local hour if provided, else server time)
-            current_hour = activity_data.get("local_hour")
-            if current_hour is None:
-                current_hour = datetime.now().hour
-            if current_hour >= 22 or current_hour <= 3:  # 10 PM – 3 AM
-                stats_update["late_night_study"] = 1
-            elif 5 <= current_hour <= 6:  # 5 AM – 6 AM
-                stats_update["early_morning_study"] = 1
-
-            await GamificationStorage.update_student_stats(student_id, stats_update)
+                # Update time-based stats (use client's local hour if provided, else server time)
+                current_hour = activity_data.get("local_hour")
+                if current_hour is None:
+                    current_hour = datetime.now().hour
+                if current_hour >= 22 or current_hour <= 3:  # 10 PM – 3 AM
+                    stats_update["late_night_study"] = 1
+                elif 5 <= current_hour <= 6:  # 5 AM – 6 AM
+                    stats_update["early_morning_study"] = 1
+
+                current_stats = await GamificationStorage.update_student_stats(student_id, stats_update, db)
             
-            # 3. Update streaks
-            streak_updates = await self.update_streaks(student_id)
-            results["streak_updates"] = {
-                streak_type: {
-                    "current_count": streak.current_count,
-                    "is_record": streak.current_count >= streak.max_count,
-                    "is_active": streak.is_active
-                } for streak_type, streak in streak_updates.items()
-            }
+                # 3. Update streaks
+                streak_updates = await self.update_streaks(student_id, db)
+                results["streak_updates"] = {
+                    streak_type: {
+                        "current_count": streak.current_count,
+                        "is_record": streak.current_count >= streak.max_count,
+                        "is_active": streak.is_active
+                    } for streak_type, streak in streak_updates.items()
+                }
             
-            # 4. Check for new badges
-            current_stats = await self.get_student_stats(student_id)
-            new_badges = await self.check_and_award_badges(student_id, current_stats)
-            results["new_badges"] = [
-                {
-                    "id": badge.id,
-                    "name": badge.name,
-                    "description": badge.description,
-                    "icon": badge.icon,
-                    "xp_reward": badge.xp_reward,
-                    "difficulty": badge.difficulty.value,
-                    "rarity_score": badge.rarity_score
-                } for badge in new_badges
-            ]
+                # 4. Check for new badges (stats come back from the upsert above)
+                new_badges = await self.check_and_award_badges(student_id, current_stats, db, student_stats=current_stats)
+                results["new_badges"] = [
+                    {
+                        "id": badge.id,
+                        "name": badge.name,
+                        "description": badge.description,
+                        "icon": badge.icon,
+                        "xp_reward": badge.xp_reward,
+                        "difficulty": badge.difficulty.value,
+                        "rarity_score": badge.rarity_score
+                    } for badge in new_badges
+                ]
             
-            # 5. Update quest progress
-            completed_quests = await self.update_quest_progress(student_id, current_stats)
-            results["completed_quests"] = completed_quests
+                # 5. Update quest progress
+                completed_quests = await self.update_quest_progress(student_id, current_stats, db)
+                results["completed_quests"] = completed_quests
             
-            # 6. Check for special achievements
-            await self.check_special_achievements(student_id, activity_type, activity_data)
+                # 6. Check for special achievements
+                await self.check_special_achievements(student_id, activity_type, activity_data, db, student_stats=current_stats)
             
         except Exception as e:
             print(f"Error processing student activity: {e}")
@@ -985,63 +1205,60 @@ class GamificationEngine:
         
         return results
     
-    async def check_special_achievements(self, student_id: str, activity_type: str, activity_data: Dict):
+    async def check_special_achievements(self, student_id: str, activity_type: str, activity_data: Dict, db: Optional[AsyncSession] = None,
+                                         student_stats: Optional[Dict] = None):
         """Check for special time-based and activity-based achievements"""
         # Use client's local hour if provided, else fall back to server time
         current_hour = activity_data.get("local_hour") if activity_data else None
         if current_hour is None:
             current_hour = datetime.now().hour
 
+        earned_now = []
+
         # Night Owl achievement (10 PM – 3 AM local time)
         if current_hour >= 22 or current_hour <= 3:
-            if not await self.student_has_badge(student_id, "night_owl"):
-                await self.award_badge(student_id, "night_owl")
+            earned_now.append("night_owl")
 
         # Early Bird achievement (5 AM – 6 AM local time)
         if 5 <= current_hour <= 6:
-            if not await self.student_has_badge(student_id, "early_bird"):
-                await self.award_badge(student_id, "early_bird")
-        
-        # Voice Explorer achievement
-        if activity_type == "voice_used":
-            stats = await self.get_student_stats(student_id)
-            if stats.get("voice_interactions", 0) >= 10:
-                if not await self.student_has_badge(student_id, "voice_explorer"):
-                    await self.award_badge(student_id, "voice_explorer")
-        
-        # Story Creator achievement
-        if activity_type == "book_generated":
-            stats = await self.get_student_stats(student_id)
-            if stats.get("stories_generated", 0) >= 5:
-                if not await self.student_has_badge(student_id, "story_creator"):
-                    await self.award_badge(student_id, "story_creator")
-        
-        # Tutor Whisperer achievement (all 4 tutors in one day)
-        if activity_data.get("tutor_type"):
-            # This would need daily tracking - simplified version
-            stats = await self.get_student_stats(student_id)
-            tutors_used = stats.get("different_tutors_used", set())
-            if isinstance(tutors_used, set) and len(tutors_used) >= 4:
-                if not await self.student_has_badge(student_id, "tutor_whisperer"):
-                    await self.award_badge(student_id, "tutor_whisperer")
-    
-    async def start_daily_quest(self, student_id: str, quest_id: str) -> bool:
+            earned_now.append("early_bird")
+
+        async with async_session_scope(db) as db:
+            stats = student_stats
+            if stats is None and (activity_type in ("voice_used", "book_generated") or activity_data.get("tutor_type")):
+                stats = await self.get_student_stats(student_id, db)
+
+            # Voice Explorer achievement
+            if activity_type == "voice_used" and stats.get("voice_interactions", 0) >= 10:
+                earned_now.append("voice_explorer")
+
+            # Story Creator achievement
+            if activity_type == "book_generated" and stats.get("stories_generated", 0) >= 5:
+                earned_now.append("story_creator")
+
+            # Tutor Whisperer achievement (all 4 tutors in one day)
+            if activity_data.get("tutor_type"):
+                # This would need daily tracking - simplified version
+                tutors_used = stats.get("different_tutors_used", set())
+                if isinstance(tutors_used, set) and len(tutors_used) >= 4:
+                    earned_now.append("tutor_whisperer")
+
+            if earned_now:
+                await GamificationStorage.award_badges(student_id, earned_now, db)
+    
+    async def start_daily_quest(self, student_id: str, quest_id: str, db: Optional[AsyncSession] = None) -> bool:
         """Start a daily quest for a student"""
         try:
-            # Check if quest already active
-            active_quests = await self.get_active_quests(student_id)
-            if any(q.quest_id == quest_id for q in active_quests):
-                return False  # Already active
-            
-            # Create new quest progress
-            quest_progress = StudentQuest(
-                quest_id=quest_id,
-                student_id=student_id,
-                start_date=datetime.now(),
-                progress={}
-            )
-            
-            await self.save_quest_progress(quest_progress)
+            async with async_session_scope(db) as db:
+                # Check if quest already active
+                active_quests = await self.get_active_quests(student_id, db)
+                if any(q.quest_id == quest_id for q in active_quests):
+                    return False  # Already active
+                
+                # Create new quest progress
+                quest_progress = self._new_quest_progress(student_id, quest_id)
+                
+                await self.save_quest_progress(quest_progress, db)
             print(f"🎯 Daily quest started: {quest_id} for student {student_id}")
             return True
             
@@ -1049,23 +1266,24 @@ class GamificationEngine:
             print(f"Error starting daily quest: {e}")
             return False
     
-    async def get_student_dashboard_data(self, student_id: str) -> Dict:
+    async def get_student_dashboard_data(self, student_id: str, db: Optional[AsyncSession] = None) -> Dict:
         """Get comprehensive dashboard data for a student"""
         try:
-            # Get all the data
-            level_info = await self.get_student_level(student_id)
-            badges = await self.get_student_badges(student_id)
-            streaks = await self.get_student_streaks(student_id)
-            stats = await self.get_student_stats(student_id)
-            recent_achievements = await self.get_recent_achievements(student_id, 5)
-            active_quests = await self.get_active_quests(student_id)
-            
-            # Generate daily quests if none active
-            if not active_quests:
-                daily_quests = await self.generate_daily_quests(student_id)
-                for quest in daily_quests[:3]:  # Start up to 3 daily quests
-                    await self.start_daily_quest(student_id, quest.id)
-                active_quests = await self.get_active_quests(student_id)
+            async with async_session_scope(db) as db:
+                # Get all the data
+                level_info = await self.get_student_level(student_id, db)
+                badges = await self.get_student_badges(student_id, db)
+                streaks = await self.get_student_streaks(student_id, db)
+                stats = await self.get_student_stats(student_id, db)
+                recent_achievements = await self.get_recent_achievements(student_id, 5, db)
+                active_quests = await self.get_active_quests(student_id, db)
+                
+                # Generate daily quests if none active
+                if not active_quests:
+                    daily_quests = await self.generate_daily_quests(student_id, db)
+                    for quest in daily_quests[:3]:  # Start up to 3 daily quests
+                        await self.start_daily_quest(student_id, quest.id, db)
+                    active_quests = await self.get_active_quests(student_id, db)
             
             # Calculate statistics
             total_badges = len(badges)
@@ -1161,360 +1379,515 @@ class GamificationEngine:
         
         return total_progress / len(quest.requirements)
 
+LEADERBOARD_TIMEFRAMES = ("daily", "weekly", "all_time")
+
 class GamificationStorage:
-    """Handles all gamification data storage operations — persisted to database"""
+    """Handles all gamification data storage operations — persisted to database.
+
+    Methods take the caller's async session and never commit; writes are
+    flushed so later reads in the same unit of work see them. Committing is
+    left to the owner of the session (see ``database.async_session_scope``).
+    """
+
+    # Integer counters on StudentStatsDB that activities may increment
+    STAT_COUNTER_COLUMNS = (
+        "messages_sent", "books_read", "voice_interactions",
+        "math_interactions", "science_interactions", "reading_interactions",
+        "general_interactions", "stories_generated", "total_activities",
+        "late_night_study", "early_morning_study", "total_study_time_minutes"
+    )
 
     @staticmethod
-    async def get_student_stats(student_id: str) -> Dict:
-        """Get comprehensive student statistics from database"""
-        from database import SessionLocal
-        db = SessionLocal()
-        try:
-            row = db.query(StudentStatsDB).filter(StudentStatsDB.student_id == student_id).first()
-            if not row:
-                return {
-                    "messages_sent": 0, "math_interactions": 0, "science_interactions": 0,
-                    "reading_interactions": 0, "general_interactions": 0, "books_read": 0,
-                    "voice_interactions": 0, "stories_generated": 0, "unique_questions": 0,
-                    "different_tutors_used": 0, "late_night_study": 0, "early_morning_study": 0,
-                    "total_study_time_minutes": 0, "consecutive_days": 0, "total_activities": 0,
-                    "first_chat_date": None, "last_activity_date": None
-                }
+    def _stats_from_row(row) -> Dict:
+        """Shape a student_stats row (or None) into the stats dict the engine uses"""
+        if not row:
             return {
-                "messages_sent": row.messages_sent or 0,
-                "math_interactions": row.math_interactions or 0,
-                "science_interactions": row.science_interactions or 0,
-                "reading_interactions": row.reading_interactions or 0,
-                "general_interactions": row.general_interactions or 0,
-                "books_read": row.books_read or 0,
-                "voice_interactions": row.voice_interactions or 0,
-                "stories_generated": row.stories_generated or 0,
-                "unique_questions": 0,
-                "different_tutors_used": 0,
-                "late_night_study": row.late_night_study or 0,
-                "early_morning_study": row.early_morning_study or 0,
-                "total_study_time_minutes": row.total_study_time_minutes or 0,
-                "consecutive_days": 0,
-                "total_activities": row.total_activities or 0,
-                "first_chat_date": row.first_activity_date,
-                "last_activity_date": row.last_activity_date
+                "messages_sent": 0, "math_interactions": 0, "science_interactions": 0,
+                "reading_interactions": 0, "general_interactions": 0, "books_read": 0,
+                "voice_interactions": 0, "stories_generated": 0, "unique_questions": 0,
+                "different_tutors_used": 0, "late_night_study": 0, "early_morning_study": 0,
+                "total_study_time_minutes": 0, "consecutive_days": 0, "total_activities": 0,
+                "first_chat_date": None, "last_activity_date": None
             }
-        finally:
-            db.close()
+        return {
+            "messages_sent": row.messages_sent or 0,
+            "math_interactions": row.math_interactions or 0,
+            "science_interactions": row.science_interactions or 0,
+            "reading_interactions": row.reading_interactions or 0,
+            "general_interactions": row.general_interactions or 0,
+            "books_read": row.books_read or 0,
+            "voice_interactions": row.voice_interactions or 0,
+            "stories_generated": row.stories_generated or 0,
+            "unique_questions": 0,
+            "different_tutors_used": 0,
+            "late_night_study": row.late_night_study or 0,
+            "early_morning_study": row.early_morning_study or 0,
+            "total_study_time_minutes": row.total_study_time_minutes or 0,
+            "consecutive_days": 0,
+            "total_activities": row.total_activities or 0,
+            "first_chat_date": row.first_activity_date,
+            "last_activity_date": row.last_activity_date
+        }
 
     @staticmethod
-    async def update_student_stats(student_id: str, activity_data: Dict):
-        """Update student statistics in database"""
-        from database import SessionLocal
-        db = SessionLocal()
-        try:
-            row = db.query(StudentStatsDB).filter(StudentStatsDB.student_id == student_id).first()
-            if not row:
-                row = StudentStatsDB(student_id=student_id, first_activity_date=datetime.now())
-                db.add(row)
-
-            # Map activity_data keys to columns and increment
-            int_cols = {
-                "messages_sent", "books_read", "voice_interactions",
-                "math_interactions", "science_interactions", "reading_interactions",
-                "general_interactions", "stories_generated", "total_activities",
-                "late_night_study", "early_morning_study", "total_study_time_minutes"
-            }
-            for key, value in activity_data.items():
-                if key in int_cols and isinstance(value, (int, float)):
-                    current = getattr(row, key, 0) or 0
-                    setattr(row, key, current + int(value))
+    async def get_student_stats(student_id: str, db: AsyncSession) -> Dict:
+        """Get comprehensive student statistics from database"""
+        row = await db.scalar(select(StudentStatsDB).where(StudentStatsDB.student_id == student_id))
+        return GamificationStorage._stats_from_row(row)
 
-            row.last_activity_date = datetime.now()
-            db.commit()
-        except Exception as e:
-            print(f"Error updating student stats: {e}")
-            db.rollback()
-        finally:
-            db.close()
+    @staticmethod
+    async def update_student_stats(student_id: str, activity_data: Dict, db: AsyncSession) -> Dict:
+        """Increment student statistics in one atomic upsert and return the updated stats.
+
+        The increments are applied by the database (``col = col + n``), so
+        concurrent activities for the same student can't lose updates.
+        """
+        increments = {
+            key: int(value) for key, value in activity_data.items()
+            if key in GamificationStorage.STAT_COUNTER_COLUMNS and isinstance(value, (int, float))
+        }
+        now = datetime.now()
+        stmt = dialect_insert(db, StudentStatsDB).values(
+            student_id=student_id,
+            first_activity_date=now,
+            last_activity_date=now,
+            **{col: increments.get(col, 0) for col in GamificationStorage.STAT_COUNTER_COLUMNS}
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["student_id"],
+            set_={
+                **{
+                    col: func.coalesce(getattr(StudentStatsDB, col), 0) + stmt.excluded[col]
+                    for col in increments
+                },
+                "last_activity_date": stmt.excluded.last_activity_date
+            }
+        ).returning(*StudentStatsDB.__table__.c)
+        row = (await db.execute(stmt)).one()
+        return GamificationStorage._stats_from_row(row)
 
     @staticmethod
-    async def student_has_badge(student_id: str, badge_id: str) -> bool:
+    async def student_has_badge(student_id: str, badge_id: str, db: AsyncSession) -> bool:
         """Check if student has earned a specific badge"""
-        from database import SessionLocal
-        db = SessionLocal()
-        try:
-            row = db.query(StudentBadgeDB).filter(
-                StudentBadgeDB.student_id == student_id,
-                StudentBadgeDB.badge_id == badge_id
-            ).first()
-            return row is not None
-        finally:
-            db.close()
+        row = await db.scalar(select(StudentBadgeDB.id).where(
+            StudentBadgeDB.student_id == student_id,
+            StudentBadgeDB.badge_id == badge_id
+        ))
+        return row is not None
 
     @staticmethod
-    async def award_badge(student_id: str, badge_id: str):
+    async def award_badge(student_id: str, badge_id: str, db: AsyncSession):
         """Award a badge to a student"""
-        if await GamificationStorage.student_has_badge(student_id, badge_id):
-            return
-        from database import SessionLocal
-        db = SessionLocal()
-        try:
-            row = StudentBadgeDB(
-                student_id=student_id,
-                badge_id=badge_id,
-                earned_date=datetime.now()
-            )
-            db.add(row)
-            db.commit()
+        await GamificationStorage.award_badges(student_id, [badge_id], db)
+
+    @staticmethod
+    async def award_badges(student_id: str, badge_ids: List[str], db: AsyncSession) -> List[str]:
+        """Award several badges in one INSERT; returns the IDs that were newly earned.
+
+        Badges the student already holds are skipped by the unique
+        (student_id, badge_id) index rather than a check-then-insert, so
+        concurrent activities can't create duplicate rows.
+        """
+        if not badge_ids:
+            return []
+        now = datetime.now()
+        stmt = dialect_insert(db, StudentBadgeDB).values([
+            {"student_id": student_id, "badge_id": badge_id, "earned_date": now}
+            for badge_id in dict.fromkeys(badge_ids)
+        ]).on_conflict_do_nothing(
+            index_elements=["student_id", "badge_id"]
+        ).returning(StudentBadgeDB.badge_id)
+        inserted = [row.badge_id for row in await db.execute(stmt)]
+        for badge_id in inserted:
             print(f"🏆 Badge awarded: {badge_id} to student {student_id}")
-        except Exception as e:
-            print(f"Error awarding badge: {e}")
-            db.rollback()
-        finally:
-            db.close()
+        return inserted
 
     @staticmethod
-    async def get_student_badges(student_id: str) -> List[str]:
+    async def get_student_badges(student_id: str, db: AsyncSession) -> List[str]:
         """Get list of badge IDs earned by student"""
-        from database import SessionLocal
-        db = SessionLocal()
-        try:
-            rows = db.query(StudentBadgeDB).filter(StudentBadgeDB.student_id == student_id).all()
-            return [row.badge_id for row in rows]
-        finally:
-            db.close()
+        rows = await db.scalars(select(StudentBadgeDB.badge_id).where(StudentBadgeDB.student_id == student_id))
+        return list(rows)
 
     @staticmethod
-    async def get_student_level(student_id: str) -> StudentLevel:
+    async def get_student_level(student_id: str, db: AsyncSession) -> StudentLevel:
         """Get student's current level information from database"""
-        from database import SessionLocal
-        db = SessionLocal()
-        try:
-            row = db.query(StudentLevelDB).filter(StudentLevelDB.student_id == student_id).first()
-            if not row:
-                return StudentLevel(
-                    student_id=student_id,
-                    current_level=1, current_xp=0,
-                    xp_to_next_level=100, total_xp_earned=0,
-                    title="Curious Beginner"
-                )
+        row = await db.scalar(select(StudentLevelDB).where(StudentLevelDB.student_id == student_id))
+        if not row:
             return StudentLevel(
-                student_id=row.student_id,
-                current_level=row.current_level,
-                current_xp=row.current_xp,
-                xp_to_next_level=row.xp_to_next_level,
-                total_xp_earned=row.total_xp_earned,
-                title=row.title
+                student_id=student_id,
+                current_level=1, current_xp=0,
+                xp_to_next_level=100, total_xp_earned=0,
+                title="Curious Beginner"
             )
-        finally:
-            db.close()
+        return StudentLevel(
+            student_id=row.student_id,
+            current_level=row.current_level,
+            current_xp=row.current_xp,
+            xp_to_next_level=row.xp_to_next_level,
+            total_xp_earned=row.total_xp_earned,
+            title=row.title
+        )
 
     @staticmethod
-    async def save_student_level(student_level: StudentLevel):
+    async def save_student_level(student_level: StudentLevel, db: AsyncSession):
         """Save student level to database"""
-        from database import SessionLocal
-        db = SessionLocal()
-        try:
-            row = db.query(StudentLevelDB).filter(
-                StudentLevelDB.student_id == student_level.student_id
-            ).first()
-            if row:
-                row.current_level = student_level.current_level
-                row.current_xp = student_level.current_xp
-                row.xp_to_next_level = student_level.xp_to_next_level
-                row.total_xp_earned = student_level.total_xp_earned
-                row.title = student_level.title
-            else:
-                row = StudentLevelDB(
-                    student_id=student_level.student_id,
-                    current_level=student_level.current_level,
-                    current_xp=student_level.current_xp,
-                    xp_to_next_level=student_level.xp_to_next_level,
-                    total_xp_earned=student_level.total_xp_earned,
-                    title=student_level.title
-                )
-                db.add(row)
-            db.commit()
-            print(f"📊 Level saved for {student_level.student_id}: Level {student_level.current_level} - {student_level.title}")
-        except Exception as e:
-            print(f"Error saving student level: {e}")
-            db.rollback()
-        finally:
-            db.close()
+        row = await db.scalar(select(StudentLevelDB).where(
+            StudentLevelDB.student_id == student_level.student_id
+        ))
+        if row:
+            row.current_level = student_level.current_level
+            row.current_xp = student_level.current_xp
+            row.xp_to_next_level = student_level.xp_to_next_level
+            row.total_xp_earned = student_level.total_xp_earned
+            row.title = student_level.title
+        else:
+            row = StudentLevelDB(
+                student_id=student_level.student_id,
+                current_level=student_level.current_level,
+                current_xp=student_level.current_xp,
+                xp_to_next_level=student_level.xp_to_next_level,
+                total_xp_earned=student_level.total_xp_earned,
+                title=student_level.title
+            )
+            db.add(row)
+        await db.flush()
+        print(f"📊 Level saved for {student_level.student_id}: Level {student_level.current_level} - {student_level.title}")
     
     @staticmethod
-    async def get_streak(student_id: str, streak_type: str) -> Optional[Streak]:
+    async def get_streak(student_id: str, streak_type: str, db: AsyncSession) -> Optional[Streak]:
         """Get a specific streak for a student (from database)"""
-        from database import SessionLocal
-        db = SessionLocal()
-        try:
-            row = db.query(StudentStreak).filter(
-                StudentStreak.student_id == student_id,
-                StudentStreak.streak_type == streak_type
-            ).first()
-            if not row:
-                return None
-            return Streak(
+        row = await db.scalar(select(StudentStreak).where(
+            StudentStreak.student_id == student_id,
+            StudentStreak.streak_type == streak_type
+        ))
+        if not row:
+            return None
+        return Streak(
+            student_id=row.student_id,
+            streak_type=row.streak_type,
+            current_count=row.current_count,
+            max_count=row.max_count,
+            last_activity_date=row.last_activity_date or datetime.now(),
+            is_active=row.is_active
+        )
+
+    @staticmethod
+    async def save_streak(streak: Streak, db: AsyncSession):
+        """Save streak to database"""
+        row = await db.scalar(select(StudentStreak).where(
+            StudentStreak.student_id == streak.student_id,
+            StudentStreak.streak_type == streak.streak_type
+        ))
+        if row:
+            row.current_count = streak.current_count
+            row.max_count = streak.max_count
+            row.last_activity_date = streak.last_activity_date
+            row.is_active = streak.is_active
+        else:
+            row = StudentStreak(
+                student_id=streak.student_id,
+                streak_type=streak.streak_type,
+                current_count=streak.current_count,
+                max_count=streak.max_count,
+                last_activity_date=streak.last_activity_date,
+                is_active=streak.is_active
+            )
+            db.add(row)
+        await db.flush()
+        if streak.is_active:
+            print(f"🔥 Streak updated: {streak.streak_type} - {streak.current_count} days for student {streak.student_id}")
+
+    @staticmethod
+    async def get_student_streaks(student_id: str, db: AsyncSession) -> Dict[str, Streak]:
+        """Get all streaks for a student (from database)"""
+        rows = await db.scalars(select(StudentStreak).where(
+            StudentStreak.student_id == student_id
+        ))
+        return {
+            row.streak_type: Streak(
                 student_id=row.student_id,
                 streak_type=row.streak_type,
                 current_count=row.current_count,
                 max_count=row.max_count,
                 last_activity_date=row.last_activity_date or datetime.now(),
                 is_active=row.is_active
-            )
-        finally:
-            db.close()
-
+            ) for row in rows
+        }
+    
     @staticmethod
-    async def save_streak(streak: Streak):
-        """Save streak to database"""
-        from database import SessionLocal
-        db = SessionLocal()
-        try:
-            row = db.query(StudentStreak).filter(
-                StudentStreak.student_id == streak.student_id,
-                StudentStreak.streak_type == streak.streak_type
-            ).first()
-            if row:
-                row.current_count = streak.current_count
-                row.max_count = streak.max_count
-                row.last_activity_date = streak.last_activity_date
-                row.is_active = streak.is_active
-            else:
-                row = StudentStreak(
-                    student_id=streak.student_id,
-                    streak_type=streak.streak_type,
-                    current_count=streak.current_count,
-                    max_count=streak.max_count,
-                    last_activity_date=streak.last_activity_date,
-                    is_active=streak.is_active
-                )
-                db.add(row)
-            db.commit()
-            if streak.is_active:
-                print(f"🔥 Streak updated: {streak.streak_type} - {streak.current_count} days for student {streak.student_id}")
-        finally:
-            db.close()
-
+    def _quest_from_row(row: StudentQuestDB) -> StudentQuest:
+        return StudentQuest(
+            id=row.id,
+            quest_id=row.quest_id,
+            student_id=row.student_id,
+            start_date=row.start_date,
+            progress=dict(row.progress or {}),
+            completed=row.completed,
+            completion_date=row.completion_date,
+            expires_at=row.expires_at
+        )
+    
     @staticmethod
-    async def get_student_streaks(student_id: str) -> Dict[str, Streak]:
-        """Get all streaks for a student (from database)"""
-        from database import SessionLocal
-        db = SessionLocal()
-        try:
-            rows = db.query(StudentStreak).filter(
-                StudentStreak.student_id == student_id
-            ).all()
-            return {
-                row.streak_type: Streak(
-                    student_id=row.student_id,
-                    streak_type=row.streak_type,
-                    current_count=row.current_count,
-                    max_count=row.max_count,
-                    last_activity_date=row.last_activity_date or datetime.now(),
-                    is_active=row.is_active
-                ) for row in rows
-            }
-        finally:
-            db.close()
+    async def get_active_quests(student_id: str, db: AsyncSession) -> List[StudentQuest]:
+        """Get student's active (not completed, not expired) quests"""
+        rows = await db.scalars(select(StudentQuestDB).where(
+            StudentQuestDB.student_id == student_id,
+            StudentQuestDB.completed.is_(False),
+            StudentQuestDB.expires_at > datetime.now()
+        ).order_by(StudentQuestDB.expires_at))
+        return [GamificationStorage._quest_from_row(row) for row in rows]
     
     @staticmethod
-    async def get_active_quests(student_id: str) -> List[StudentQuest]:
-        """Get student's active quests"""
-        if student_id not in student_quests_db:
-            return []
-        
-        now = datetime.now()
-        active_quests = []
-        
-        for quest in student_quests_db[student_id]:
-            if quest.completed:
-                continue
-            
-            # Check if quest has expired
-            if quest.start_date and hasattr(quest, 'time_limit_hours'):
-                quest_obj = gamification_engine.quests.get(quest.quest_id)
-                if quest_obj and quest_obj.time_limit_hours:
-                    expiry_time = quest.start_date + timedelta(hours=quest_obj.time_limit_hours)
-                    if now > expiry_time:
-                        continue
-            
-            active_quests.append(quest)
+    async def save_quest_progress(quest_progress: StudentQuest, db: AsyncSession):
+        """Save quest progress to the database, inserting it if it's new"""
+        if quest_progress.id is not None:
+            await GamificationStorage.update_quests_progress([quest_progress], db)
+            return
         
-        return active_quests
+        row = StudentQuestDB(
+            student_id=quest_progress.student_id,
+            quest_id=quest_progress.quest_id,
+            progress=quest_progress.progress,
+            start_date=quest_progress.start_date,
+            expires_at=quest_progress.expires_at or QUEST_NO_EXPIRY,
+            completed=quest_progress.completed,
+            completion_date=quest_progress.completion_date
+        )
+        db.add(row)
+        await db.flush()
+        quest_progress.id = row.id
     
     @staticmethod
-    async def save_quest_progress(quest_progress: StudentQuest):
-        """Save quest progress to storage"""
-        if quest_progress.student_id not in student_quests_db:
-            student_quests_db[quest_progress.student_id] = []
-        
-        # Update existing quest or add new one
-        quests = student_quests_db[quest_progress.student_id]
-        for i, existing_quest in enumerate(quests):
-            if existing_quest.quest_id == quest_progress.quest_id:
-                quests[i] = quest_progress
-                return
-        
-        # Add new quest if not found
-        quests.append(quest_progress)
+    async def update_quests_progress(quests: List[StudentQuest], db: AsyncSession):
+        """Write progress for several saved quests as one batched UPDATE by primary key"""
+        if not quests:
+            return
+        await db.execute(update(StudentQuestDB), [
+            {
+                "id": quest.id,
+                "progress": quest.progress,
+                "completed": quest.completed,
+                "completion_date": quest.completion_date
+            } for quest in quests
+        ])
     
     @staticmethod
-    async def start_quest(student_id: str, quest_id: str):
+    async def start_quest(student_id: str, quest_id: str, db: AsyncSession):
         """Start a new quest for a student"""
-        student_quest = StudentQuest(
-            quest_id=quest_id,
-            student_id=student_id,
-            start_date=datetime.now(),
-            progress={}
-        )
+        student_quest = gamification_engine._new_quest_progress(student_id, quest_id)
         
-        await GamificationStorage.save_quest_progress(student_quest)
+        await GamificationStorage.save_quest_progress(student_quest, db)
         print(f"🎯 Quest started: {quest_id} for student {student_id}")
     
     @staticmethod
-    async def get_recent_achievements(student_id: str, limit: int = 5) -> List[Dict]:
+    async def get_recent_achievements(student_id: str, limit: int, db: AsyncSession) -> List[Dict]:
         """Get recent achievements for a student from database"""
-        from database import SessionLocal
-        db = SessionLocal()
-        try:
-            rows = db.query(StudentBadgeDB).filter(
-                StudentBadgeDB.student_id == student_id
-            ).order_by(StudentBadgeDB.earned_date.desc()).limit(limit).all()
-
-            recent = []
-            for row in rows:
-                badge = gamification_engine.badges.get(row.badge_id)
-                if badge:
-                    recent.append({
-                        "id": f"{row.student_id}_{row.badge_id}",
-                        "badge_name": badge.name,
-                        "badge_icon": badge.icon,
-                        "earned_date": row.earned_date.isoformat() if row.earned_date else "",
-                        "xp_reward": badge.xp_reward
-                    })
-            return recent
-        finally:
-            db.close()
+        rows = await db.scalars(select(StudentBadgeDB).where(
+            StudentBadgeDB.student_id == student_id
+        ).order_by(StudentBadgeDB.earned_date.desc()).limit(limit))
+
+        recent = []
+        for row in rows:
+            badge = gamification_engine.badges.get(row.badge_id)
+            if badge:
+                recent.append({
+                    "id": f"{row.student_id}_{row.badge_id}",
+                    "badge_name": badge.name,
+                    "badge_icon": badge.icon,
+                    "earned_date": row.earned_date.isoformat() if row.earned_date else "",
+                    "xp_reward": badge.xp_reward
+                })
+        return recent
     
     @staticmethod
-    async def get_leaderboard_data(timeframe: str = "all_time", limit: int = 10) -> List[Dict]:
-        """Get leaderboard data for all students from database"""
-        from database import SessionLocal
-        db = SessionLocal()
-        try:
-            rows = db.query(StudentLevelDB).order_by(StudentLevelDB.total_xp_earned.desc()).limit(limit).all()
-            leaderboard = []
-            for i, row in enumerate(rows):
-                badges_count = len(await GamificationStorage.get_student_badges(row.student_id))
-                leaderboard.append({
-                    "student_id": row.student_id,
-                    "student_name": f"Student {row.student_id[-4:]}",
-                    "level": row.current_level,
-                    "total_xp": row.total_xp_earned,
-                    "title": row.title,
-                    "badges_earned": badges_count,
-                    "rank": i + 1
-                })
-            return leaderboard
-        finally:
-            db.close()
+    async def record_xp_event(student_id: str, xp_amount: int, reason: str, db: AsyncSession):
+        """Append an XP grant to the ledger and fold it into the hour/day rollups"""
+        now = datetime.now()
+        db.add(XPEventDB(student_id=student_id, amount=xp_amount, reason=reason, created_at=now))
+
+        hour_start = now.replace(minute=0, second=0, microsecond=0)
+        stmt = dialect_insert(db, XPRollupDB).values([
+            {"student_id": student_id, "granularity": "hour", "bucket_start": hour_start, "xp": xp_amount, "event_count": 1},
+            {"student_id": student_id, "granularity": "day", "bucket_start": hour_start.replace(hour=0), "xp": xp_amount, "event_count": 1}
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["student_id", "granularity", "bucket_start"],
+            set_={"xp": XPRollupDB.xp + stmt.excluded.xp, "event_count": XPRollupDB.event_count + 1}
+        )
+        await db.execute(stmt)
+        await db.flush()
+
+    @staticmethod
+    async def get_xp_in_range(student_ids: List[str], start: datetime, end: datetime, db: AsyncSession) -> Dict[str, int]:
+        """Total XP per student earned in [start, end), read from the rollups.
+
+        Whole days inside the range come from daily buckets and the partial
+        days at either edge from hourly buckets, so a week is at most ~7 + 46
+        rows per student. Bounds are truncated to the hour.
+        """
+        if not student_ids:
+            return {}
+        start_hour = start.replace(minute=0, second=0, microsecond=0)
+        end_hour = end.replace(minute=0, second=0, microsecond=0)
+        if end_hour < end:
+            end_hour += timedelta(hours=1)
+
+        first_full_day = start_hour.replace(hour=0)
+        if first_full_day < start_hour:
+            first_full_day += timedelta(days=1)
+        last_full_day = end_hour.replace(hour=0)
+
+        if first_full_day < last_full_day:
+            buckets = or_(
+                and_(XPRollupDB.granularity == "day",
+                     XPRollupDB.bucket_start >= first_full_day, XPRollupDB.bucket_start < last_full_day),
+                and_(XPRollupDB.granularity == "hour",
+                     or_(and_(XPRollupDB.bucket_start >= start_hour, XPRollupDB.bucket_start < first_full_day),
+                         and_(XPRollupDB.bucket_start >= last_full_day, XPRollupDB.bucket_start < end_hour)))
+            )
+        else:
+            buckets = and_(XPRollupDB.granularity == "hour",
+                           XPRollupDB.bucket_start >= start_hour, XPRollupDB.bucket_start < end_hour)
+
+        stmt = (
+            select(XPRollupDB.student_id, func.sum(XPRollupDB.xp))
+            .where(XPRollupDB.student_id.in_(student_ids), buckets)
+            .group_by(XPRollupDB.student_id)
+        )
+        totals = {student_id: 0 for student_id in student_ids}
+        for student_id, xp in await db.execute(stmt):
+            totals[student_id] = int(xp or 0)
+        return totals
+
+    @staticmethod
+    def leaderboard_periods(now: Optional[datetime] = None) -> Dict[str, datetime]:
+        """Start of the current daily and weekly leaderboard periods (weeks start Monday)"""
+        now = now or datetime.now()
+        day_start = datetime.combine(now.date(), datetime.min.time())
+        return {
+            "daily": day_start,
+            "weekly": day_start - timedelta(days=day_start.weekday())
+        }
+
+    @staticmethod
+    async def prune_ended_leaderboard_periods(db: AsyncSession, now: Optional[datetime] = None) -> int:
+        """Delete leaderboard rows for periods that have ended; returns how many went.
+
+        Nothing reads an ended period (ranged XP totals come from the
+        rollups), so only the current day and week are kept.
+        """
+        periods = GamificationStorage.leaderboard_periods(now)
+        result = await db.execute(delete(LeaderboardEntryDB).where(or_(*[
+            and_(LeaderboardEntryDB.timeframe == timeframe, LeaderboardEntryDB.period_start < period_start)
+            for timeframe, period_start in periods.items()
+        ])))
+        return result.rowcount
+
+    # Day whose first leaderboard write has already pruned ended periods (per process)
+    _leaderboard_pruned_for: Optional[datetime] = None
+
+    @staticmethod
+    async def record_leaderboard_xp(student_id: str, xp_amount: int, db: AsyncSession):
+        """Add XP to the student's daily and weekly leaderboard rows in one upsert.
+
+        The first write each day (in each process) also prunes ended periods,
+        in the same transaction.
+        """
+        if not xp_amount:
+            return
+        now = datetime.now()
+        today = GamificationStorage.leaderboard_periods(now)["daily"]
+        if GamificationStorage._leaderboard_pruned_for != today:
+            await GamificationStorage.prune_ended_leaderboard_periods(db, now)
+            GamificationStorage._leaderboard_pruned_for = today
+        stmt = dialect_insert(db, LeaderboardEntryDB).values([
+            {
+                "timeframe": timeframe,
+                "period_start": period_start,
+                "student_id": student_id,
+                "xp": xp_amount,
+                "updated_at": now
+            } for timeframe, period_start in GamificationStorage.leaderboard_periods(now).items()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["timeframe", "period_start", "student_id"],
+            set_={"xp": LeaderboardEntryDB.xp + stmt.excluded.xp, "updated_at": stmt.excluded.updated_at}
+        )
+        await db.execute(stmt)
+    
+    @staticmethod
+    async def count_leaderboard_students(timeframe: str, db: AsyncSession) -> int:
+        """How many students the timeframe's leaderboard ranks"""
+        if timeframe == "all_time":
+            query = select(func.count()).select_from(StudentLevelDB)
+        elif timeframe in ("daily", "weekly"):
+            query = select(func.count()).select_from(LeaderboardEntryDB).where(
+                LeaderboardEntryDB.timeframe == timeframe,
+                LeaderboardEntryDB.period_start == GamificationStorage.leaderboard_periods()[timeframe]
+            )
+        else:
+            raise ValueError(f"Unknown leaderboard timeframe: {timeframe}")
+        return await db.scalar(query) or 0
+
+    @staticmethod
+    async def get_leaderboard_data(timeframe: str, limit: int, db: AsyncSession) -> List[Dict]:
+        """Get leaderboard data for all students from database.
+
+        Runs as one query: the top ``limit`` students for the timeframe are
+        picked first, then badge counts are joined and aggregated for just
+        those rows.
+        """
+        if timeframe == "all_time":
+            top = (
+                select(
+                    StudentLevelDB.student_id,
+                    StudentLevelDB.total_xp_earned.label("xp"),
+                    StudentLevelDB.current_level,
+                    StudentLevelDB.title
+                )
+                .order_by(StudentLevelDB.total_xp_earned.desc())
+                .limit(limit)
+                .subquery()
+            )
+        elif timeframe in ("daily", "weekly"):
+            period_start = GamificationStorage.leaderboard_periods()[timeframe]
+            top = (
+                select(
+                    LeaderboardEntryDB.student_id,
+                    LeaderboardEntryDB.xp,
+                    func.coalesce(StudentLevelDB.current_level, 1).label("current_level"),
+                    func.coalesce(StudentLevelDB.title, "Curious Beginner").label("title")
+                )
+                .outerjoin(StudentLevelDB, StudentLevelDB.student_id == LeaderboardEntryDB.student_id)
+                .where(
+                    LeaderboardEntryDB.timeframe == timeframe,
+                    LeaderboardEntryDB.period_start == period_start
+                )
+                .order_by(LeaderboardEntryDB.xp.desc())
+                .limit(limit)
+                .subquery()
+            )
+        else:
+            raise ValueError(f"Unknown leaderboard timeframe: {timeframe}")
+
+        stmt = (
+            select(top, func.count(StudentBadgeDB.id).label("badges_earned"))
+            .outerjoin(StudentBadgeDB, StudentBadgeDB.student_id == top.c.student_id)
+            .group_by(top.c.student_id, top.c.xp, top.c.current_level, top.c.title)
+            .order_by(top.c.xp.desc())
+        )
+        leaderboard = []
+        for i, row in enumerate(await db.execute(stmt)):
+            leaderboard.append({
+                "student_id": row.student_id,
+                "student_name": f"Student {row.student_id[-4:]}",
+                "level": row.current_level,
+                "total_xp": row.xp,
+                "title": row.title,
+                "badges_earned": row.badges_earned,
+                "rank": i + 1
+            })
+        return leaderboard
     
     @staticmethod
     def export_student_data(student_id: str) -> Dict:
@@ -1556,6 +1929,292 @@ class GamificationStorage:
             "most_popular_badges": sorted(badge_popularity.items(), key=lambda x: x[1], reverse=True)[:10]
         }
 
+class ConversationStorage:
+    """Tutor conversation history, persisted to the conversations table.
+
+    Reads are always bounded: the tutor gets its recent window, the history
+    endpoint pages with a (created_at, id) keyset cursor, and the daily
+    counters read only today's rows. Like GamificationStorage, methods take
+    the caller's session and never commit.
+    """
+
+    @staticmethod
+    def _entry_from_row(row: ConversationDB) -> Dict:
+        return {
+            "id": row.id,
+            "timestamp": row.created_at.isoformat(),
+            "student_message": row.student_message,
+            "ai_response": row.ai_response,
+            "tutor_type": row.tutor_type
+        }
+
+    @staticmethod
+    def encode_cursor(entry: Dict) -> str:
+        return f"{entry['timestamp']}|{entry['id']}"
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> tuple:
+        """Inverse of encode_cursor; raises ValueError for a malformed cursor"""
+        timestamp, entry_id = cursor.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(entry_id)
+
+    @staticmethod
+    async def add_exchange(student_id: str, student_message: str, ai_response: str,
+                           tutor_type: str, db: AsyncSession) -> Dict:
+        row = ConversationDB(
+            student_id=student_id,
+            student_message=student_message,
+            ai_response=ai_response,
+            tutor_type=tutor_type,
+            created_at=datetime.now()
+        )
+        db.add(row)
+        await db.flush()
+        return ConversationStorage._entry_from_row(row)
+
+    @staticmethod
+    async def get_page(student_id: str, limit: int, db: AsyncSession,
+                       before: Optional[tuple] = None, after_id: Optional[int] = None) -> List[Dict]:
+        """Up to `limit` exchanges older than the `before` (created_at, id) key, newest first.
+
+        after_id skips exchanges up to that id (those a summary already covers).
+        """
+        query = select(ConversationDB).where(ConversationDB.student_id == student_id)
+        if after_id is not None:
+            query = query.where(ConversationDB.id > after_id)
+        if before is not None:
+            before_time, before_id = before
+            query = query.where(or_(
+                ConversationDB.created_at < before_time,
+                and_(ConversationDB.created_at == before_time, ConversationDB.id < before_id)
+            ))
+        rows = await db.scalars(query.order_by(
+            ConversationDB.created_at.desc(), ConversationDB.id.desc()
+        ).limit(limit))
+        return [ConversationStorage._entry_from_row(row) for row in rows]
+
+    @staticmethod
+    async def get_recent(student_id: str, limit: int, db: AsyncSession,
+                         after_id: Optional[int] = None) -> List[Dict]:
+        """The last `limit` exchanges, oldest first (the order the tutor replays them)"""
+        entries = await ConversationStorage.get_page(student_id, limit, db, after_id=after_id)
+        entries.reverse()
+        return entries
+
+    @staticmethod
+    async def get_since(student_id: str, since: datetime, db: AsyncSession) -> List[Dict]:
+        rows = await db.scalars(select(ConversationDB).where(
+            ConversationDB.student_id == student_id,
+            ConversationDB.created_at >= since
+        ).order_by(ConversationDB.created_at))
+        return [ConversationStorage._entry_from_row(row) for row in rows]
+
+# Exchanges read as tutor context; CONTEXT_HISTORY_TOKENS decides how many are sent
+CONVERSATION_WINDOW = 20
+
+# Token budget for replayed exchanges, and the rolling summary of those that
+# no longer fit (see refresh_conversation_summary). Summaries run in the
+# background, so they are off by default in serverless.
+CONTEXT_HISTORY_TOKENS = int(os.getenv("CONTEXT_HISTORY_TOKENS", "1200"))
+CONTEXT_SUMMARY_ENABLED = os.getenv("CONTEXT_SUMMARY_ENABLED", "0" if IS_SERVERLESS else "1") != "0"
+CONTEXT_SUMMARY_EVERY = max(1, int(os.getenv("CONTEXT_SUMMARY_EVERY", "6")))
+CONTEXT_SUMMARY_TOKENS = 200  # max_tokens for the summary itself
+conversation_summary_pool = WorkerPool(
+    "conversation summaries",
+    workers=int(os.getenv("CONTEXT_SUMMARY_WORKERS", "2")),
+    max_queue=100,
+)
+
+class ConversationSummaryStorage:
+    """One rolling summary per student, covering exchanges up to through_id.
+
+    Methods take the caller's session and never commit.
+    """
+
+    @staticmethod
+    async def get(student_id: str, db: AsyncSession) -> Optional[ConversationSummaryDB]:
+        return await db.scalar(select(ConversationSummaryDB).where(
+            ConversationSummaryDB.student_id == student_id
+        ))
+
+    @staticmethod
+    async def save(student_id: str, summary: str, through_id: int, db: AsyncSession):
+        stmt = dialect_insert(db, ConversationSummaryDB).values(
+            student_id=student_id,
+            summary=summary,
+            through_id=through_id,
+            updated_at=datetime.utcnow()
+        )
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=["student_id"],
+            set_={
+                "summary": stmt.excluded.summary,
+                "through_id": stmt.excluded.through_id,
+                "updated_at": stmt.excluded.updated_at
+            }
+        ))
+
+# Reuse policy for the shared chapter library (see ChapterLibraryStorage)
+CHAPTER_LIBRARY_ENABLED = os.getenv("CHAPTER_LIBRARY_ENABLED", "1") != "0"
+CHAPTER_LIBRARY_MIN_VARIANTS = int(os.getenv("CHAPTER_LIBRARY_MIN_VARIANTS", "3"))
+CHAPTER_LIBRARY_MAX_AGE_DAYS = float(os.getenv("CHAPTER_LIBRARY_MAX_AGE_DAYS", "30"))
+CHAPTER_LIBRARY_FRESH_RATE = float(os.getenv("CHAPTER_LIBRARY_FRESH_RATE", "0.1"))
+CHAPTER_LIBRARY_CANDIDATES = 50  # newest entries per key considered for reuse
+
+# Identical chapter generations in flight at once (a double-clicked
+# "generate") share one LLM call; see generate_or_reuse_chapter
+chapter_flights = SingleFlight("chapter generation")
+
+class ChapterLibraryStorage:
+    """Generated chapters shared between students who ask for the same thing.
+
+    Chapters are keyed by normalized topic, grade spec and interest set. A
+    request is served from the library once its key holds at least
+    CHAPTER_LIBRARY_MIN_VARIANTS chapters newer than
+    CHAPTER_LIBRARY_MAX_AGE_DAYS, picking the least-served one the student
+    hasn't had yet. Until then, when the student has had them all, and for a
+    CHAPTER_LIBRARY_FRESH_RATE share of requests anyway, a new chapter is
+    generated and added, so every key keeps some variety and stays fresh.
+    Like the other storage classes, methods take the caller's session and
+    never commit.
+    """
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Lowercase, drop punctuation and plural s: "Dinosaurs!" -> "dinosaur"""
+        words = re.sub(r"[^a-z0-9]+", " ", text.lower()).split()
+        return " ".join(w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") else w for w in words)
+
+    @staticmethod
+    def make_key(topic: str, grade_level: int, interests: List[str]) -> tuple:
+        """Return (library_key, normalized topic, grade, normalized interests)"""
+        norm_topic = ChapterLibraryStorage.normalize(topic)
+        grade = max(1, min(grade_level, 6))  # grades share BookGenerator's spec past these bounds
+        norm_interests = sorted({ChapterLibraryStorage.normalize(i) for i in interests} - {""})
+        raw_key = f"{grade}|{norm_topic}|{','.join(norm_interests)}"
+        return hashlib.sha1(raw_key.encode()).hexdigest(), norm_topic, grade, norm_interests
+
+    @staticmethod
+    async def pick_chapter(library_key: str, student_id: str, db: AsyncSession) -> Optional[ChapterLibraryDB]:
+        """A library chapter to reuse for this student, or None to generate a new one"""
+        since = datetime.utcnow() - timedelta(days=CHAPTER_LIBRARY_MAX_AGE_DAYS)
+        entries = list(await db.scalars(select(ChapterLibraryDB).where(
+            ChapterLibraryDB.library_key == library_key,
+            ChapterLibraryDB.created_at >= since
+        ).order_by(ChapterLibraryDB.created_at.desc()).limit(CHAPTER_LIBRARY_CANDIDATES)))
+        if len(entries) < CHAPTER_LIBRARY_MIN_VARIANTS or random.random() < CHAPTER_LIBRARY_FRESH_RATE:
+            return None
+
+        seen = set(await db.scalars(select(Chapter.library_id).where(
+            Chapter.user_id == student_id,
+            Chapter.library_id.in_([entry.id for entry in entries])
+        )))
+        unseen = [entry for entry in entries if entry.id not in seen]
+        if not unseen:
+            return None
+        return min(unseen, key=lambda entry: entry.times_served)
+
+    @staticmethod
+    async def mark_served(entry_id: str, db: AsyncSession):
+        await db.execute(update(ChapterLibraryDB).where(ChapterLibraryDB.id == entry_id).values(
+            times_served=ChapterLibraryDB.times_served + 1
+        ))
+
+    @staticmethod
+    async def add(library_key: str, topic: str, grade_level: int, interests: List[str],
+                  title: Optional[str], content: str, db: AsyncSession) -> str:
+        entry = ChapterLibraryDB(
+            id=str(uuid.uuid4()),
+            library_key=library_key,
+            topic=topic,
+            grade_level=grade_level,
+            interests=interests,
+            title=title,
+            content=content,
+            times_served=1,
+            created_at=datetime.utcnow()
+        )
+        db.add(entry)
+        await db.flush()
+        return entry.id
+
+# Background pre-generation of the next chapter (see schedule_next_chapter).
+# Off by default in serverless, where work after the response may never run.
+CHAPTER_PREGEN_ENABLED = os.getenv("CHAPTER_PREGEN_ENABLED", "0" if IS_SERVERLESS else "1") != "0"
+CHAPTER_PREGEN_PER_STUDENT = int(os.getenv("CHAPTER_PREGEN_PER_STUDENT", "2"))  # pending + in progress
+CHAPTER_PREGEN_TTL_HOURS = float(os.getenv("CHAPTER_PREGEN_TTL_HOURS", "72"))
+chapter_pregen_pool = WorkerPool(
+    "chapter pre-generation",
+    workers=int(os.getenv("CHAPTER_PREGEN_WORKERS", "2")),
+    max_queue=int(os.getenv("CHAPTER_PREGEN_MAX_QUEUE", "50")),
+)
+
+class PendingChapterStorage:
+    """Chapters generated ahead of time, waiting for the student to ask for them.
+
+    A pending chapter is handed out at most once: claim() deletes the row
+    and only the request whose delete succeeds gets it. Rows older than
+    CHAPTER_PREGEN_TTL_HOURS are not handed out and are dropped when found.
+    Methods take the caller's session and never commit.
+    """
+
+    @staticmethod
+    def _fresh_since() -> datetime:
+        return datetime.utcnow() - timedelta(hours=CHAPTER_PREGEN_TTL_HOURS)
+
+    @staticmethod
+    def _chapter_from_row(row: PendingChapterDB) -> Dict:
+        chapter = BookGenerator.build_chapter(row.title, row.content, row.topic, row.chapter_number, chapter_id=row.id)
+        if row.library_id:
+            chapter["library_id"] = row.library_id
+        return chapter
+
+    @staticmethod
+    async def count_for_student(student_id: str, db: AsyncSession) -> int:
+        return await db.scalar(select(func.count()).select_from(PendingChapterDB).where(
+            PendingChapterDB.student_id == student_id,
+            PendingChapterDB.created_at >= PendingChapterStorage._fresh_since()
+        ))
+
+    @staticmethod
+    async def exists(student_id: str, topic_key: str, chapter_number: int, db: AsyncSession) -> bool:
+        row_id = await db.scalar(select(PendingChapterDB.id).where(
+            PendingChapterDB.student_id == student_id,
+            PendingChapterDB.topic_key == topic_key,
+            PendingChapterDB.chapter_number == chapter_number
+        ))
+        return row_id is not None
+
+    @staticmethod
+    async def add(student_id: str, topic_key: str, chapter: Dict, db: AsyncSession):
+        db.add(PendingChapterDB(
+            id=chapter["id"],
+            student_id=student_id,
+            topic_key=topic_key,
+            topic=chapter["topic"],
+            chapter_number=chapter["chapter_number"],
+            title=chapter["title"],
+            content=chapter["content"],
+            library_id=chapter.get("library_id"),
+            created_at=datetime.utcnow()
+        ))
+        await db.flush()
+
+    @staticmethod
+    async def claim(student_id: str, topic_key: str, chapter_number: int, db: AsyncSession) -> Optional[Dict]:
+        """Remove and return the pending chapter for this request, if any"""
+        row = await db.scalar(select(PendingChapterDB).where(
+            PendingChapterDB.student_id == student_id,
+            PendingChapterDB.topic_key == topic_key,
+            PendingChapterDB.chapter_number == chapter_number
+        ))
+        if row is None:
+            return None
+        result = await db.execute(delete(PendingChapterDB).where(PendingChapterDB.id == row.id))
+        if result.rowcount != 1 or row.created_at < PendingChapterStorage._fresh_since():
+            return None  # claimed by a concurrent request, or stale
+        return PendingChapterStorage._chapter_from_row(row)
+
 # Gamification API Models for requests/responses
 class XPGainResponse(BaseModel):
     xp_gained: int
@@ -1580,11 +2239,22 @@ class GamificationActivityRequest(BaseModel):
 # Use the OPENAI_API_KEY loaded at the top of the file
 # (Already loaded from .env file above)
 
-# In-memory storage (we'll upgrade to a database later)
-students_db = {}
-conversations_db = {}
-progress_db = {}
-student_contexts = {}
+# In-memory student profiles and progress counters, bounded like tutor_cache.
+# Profiles are reloaded from the users table on a miss (get_or_create_student);
+# progress entries expire STUDENT_CACHE_TTL after the student's last activity.
+# The User hooks below only invalidate this process's copy, so another worker
+# can serve a changed name or grade for up to STUDENT_CACHE_TTL.
+students_db = LRUTTLCache(
+    max_entries=int(os.getenv("STUDENT_CACHE_MAX_STUDENTS", "10000")),
+    ttl_seconds=float(os.getenv("STUDENT_CACHE_TTL", "3600")),
+)
+progress_db = LRUTTLCache(max_entries=students_db.max_entries, ttl_seconds=students_db.ttl_seconds)
+# One AITutor per student, bounded and rebuilt after TUTOR_CACHE_TTL or a
+# profile change (see get_tutor and the User update hook)
+tutor_cache = LRUTTLCache(
+    max_entries=int(os.getenv("TUTOR_CACHE_MAX_STUDENTS", "1000")),
+    ttl_seconds=float(os.getenv("TUTOR_CACHE_TTL", "3600")),
+)
 student_levels_db = {}
 student_badges_db = {}
 student_streaks_db = {}
@@ -1665,15 +2335,17 @@ class BookGenerator:
         grade = max(1, min(grade, 6))
         return specs[grade]
 
-    async def generate_chapter(self, topic: str, chapter_number: int, difficulty_level: str = "auto") -> Dict:
-        """Generate a custom chapter based on student interests"""
-        try:
-            spec = self._get_grade_spec(self.student.grade_level)
-            interests_str = ", ".join(self.student.interests)
+    def _build_prompts(self, topic: str):
+        """Return (system_prompt, user_prompt, grade spec) for a chapter about `topic`"""
+        spec = self._get_grade_spec(self.student.grade_level)
+        interests_str = ", ".join(self.student.interests)
+        # Chapters from a shared prompt can go to the library, so the name
+        # stays out of it unless the library is off
+        reader = "a" if CHAPTER_LIBRARY_ENABLED else f"{self.student.name}, a"
 
-            system_prompt = f"""You are an expert children's reading content author. You write decodable, grade-appropriate reading passages.
+        system_prompt = f"""You are an expert children's reading content author. You write decodable, grade-appropriate reading passages.
 
-You are writing for {self.student.name}, a grade {self.student.grade_level} student.
+You are writing for {reader} grade {self.student.grade_level} student.
 
 === STRICT READING LEVEL RULES (you MUST follow these) ===
 WORD COUNT: {spec['word_count']}
@@ -1698,73 +2370,148 @@ READABILITY: {spec['flesch_kincaid']} {spec['lexile']}
 
 IMPORTANT: The reading level constraints above are the HIGHEST PRIORITY. A grade 1 passage must read like an early reader decodable book. Do not exceed the grade level."""
 
-            prompt = f"""Write a reading passage about "{topic}" for a grade {self.student.grade_level} student.
+        prompt = f"""Write a reading passage about "{topic}" for a grade {self.student.grade_level} student.
 
 Remember: {spec['word_count']}, sentences of {spec['sentence_length']}, and strictly grade-appropriate vocabulary. The passage must be readable by a typical grade {self.student.grade_level} student reading aloud."""
 
-            from openai import OpenAI
-            client = OpenAI(api_key=OPENAI_API_KEY)
-            
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=spec.get('max_tokens', 600),
-                temperature=0.7
-            )
-            
-            content = response.choices[0].message.content.strip()
-            
-            # Extract title if present
-            lines = content.split('\n')
-            title = f"Chapter {chapter_number}"
-            chapter_text = content
-            
-            # Try to extract title from first line if it looks like a title
-            if lines[0].startswith("Chapter") or lines[0].startswith("Title"):
-                title = lines[0].replace("Title:", "").replace("Chapter", "Chapter").strip()
-                chapter_text = '\n'.join(lines[1:]).strip()
-            
-            # Generate unique ID for the chapter
-            chapter_id = str(uuid.uuid4())
-            
-            return {
-                "id": chapter_id,
-                "title": title,
-                "content": chapter_text,
-                "chapter_number": chapter_number,
-                "topic": topic,
-                "word_count": len(chapter_text.split()),
-                "reading_time_minutes": max(1, len(chapter_text.split()) // 200),
-                "description": chapter_text[:200] + "..." if len(chapter_text) > 200 else chapter_text
-            }
+        return system_prompt, prompt, spec
+
+    @staticmethod
+    def is_title_line(line: str) -> bool:
+        return line.startswith("Chapter") or line.startswith("Title")
+
+    @staticmethod
+    def split_title(content: str, chapter_number: int):
+        """Return (title, chapter_text) for generated content.
+
+        The first line is used as the title when it looks like one ("Chapter..."
+        or "Title: ..."); otherwise the title is "Chapter N" and all of the
+        content is chapter text.
+        """
+        lines = content.split('\n')
+        title = f"Chapter {chapter_number}"
+        chapter_text = content
+        
+        # Try to extract title from first line if it looks like a title
+        if BookGenerator.is_title_line(lines[0]):
+            title = lines[0].replace("Title:", "").replace("Chapter", "Chapter").strip()
+            chapter_text = '\n'.join(lines[1:]).strip()
+        return title, chapter_text
+
+    def chapter_from_content(self, content: str, topic: str, chapter_number: int) -> Dict:
+        """Build the chapter dict for complete generated content"""
+        title, chapter_text = self.split_title(content, chapter_number)
+        return self.build_chapter(title, chapter_text, topic, chapter_number)
+
+    def chapter_from_library(self, entry: ChapterLibraryDB, topic: str, chapter_number: int) -> Dict:
+        """Build the chapter dict for a copy of a shared library chapter"""
+        chapter = self.build_chapter(entry.title or f"Chapter {chapter_number}", entry.content, topic, chapter_number)
+        chapter["library_id"] = entry.id
+        return chapter
+
+    @staticmethod
+    def build_chapter(title: str, chapter_text: str, topic: str, chapter_number: int,
+                      chapter_id: Optional[str] = None) -> Dict:
+        # Generate unique ID for the chapter
+        chapter_id = chapter_id or str(uuid.uuid4())
+        
+        return {
+            "id": chapter_id,
+            "title": title,
+            "content": chapter_text,
+            "chapter_number": chapter_number,
+            "topic": topic,
+            "word_count": len(chapter_text.split()),
+            "reading_time_minutes": max(1, len(chapter_text.split()) // 200),
+            "description": chapter_text[:200] + "..." if len(chapter_text) > 200 else chapter_text
+        }
+
+    def fallback_chapter(self, topic: str, chapter_number: int) -> Dict:
+        """Placeholder chapter used when generation fails"""
+        interests_str = ", ".join(self.student.interests)
+        chapter_id = str(uuid.uuid4())
+        error_content = f"This would be an amazing story about {topic} featuring {interests_str}! The book generator is having trouble right now, but imagine the exciting adventures we could create together!"
+        return {
+            "id": chapter_id,
+            "title": f"Chapter {chapter_number}: Adventure Awaits",
+            "content": error_content,
+            "chapter_number": chapter_number,
+            "topic": topic,
+            "word_count": 50,
+            "reading_time_minutes": 1,
+            "description": error_content[:200] + "..." if len(error_content) > 200 else error_content
+        }
+
+    async def generate_content(self, topic: str, priority: Priority = Priority.CHAPTER) -> str:
+        """Generate the raw chapter text (title line first). Errors propagate."""
+        system_prompt, prompt, spec = self._build_prompts(topic)
+        
+        response = await create_chat_completion(
+            priority,
+            self.student.id,
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=spec.get('max_tokens', 600),
+            temperature=0.7
+        )
+        
+        return response.choices[0].message.content.strip()
+
+    async def generate_chapter(self, topic: str, chapter_number: int, difficulty_level: str = "auto") -> Dict:
+        """Generate a custom chapter based on student interests"""
+        try:
+            content = await self.generate_content(topic)
+            return self.chapter_from_content(content, topic, chapter_number)
             
         except Exception as e:
             print(f"Book generation error: {e}")
-            chapter_id = str(uuid.uuid4())
-            error_content = f"This would be an amazing story about {topic} featuring {interests_str}! The book generator is having trouble right now, but imagine the exciting adventures we could create together!"
-            return {
-                "id": chapter_id,
-                "title": f"Chapter {chapter_number}: Adventure Awaits",
-                "content": error_content,
-                "chapter_number": chapter_number,
-                "topic": topic,
-                "word_count": 50,
-                "reading_time_minutes": 1,
-                "description": error_content[:200] + "..." if len(error_content) > 200 else error_content
-            }
+            return self.fallback_chapter(topic, chapter_number)
+
+    async def stream_chapter_text(self, topic: str, chapter_number: int) -> AsyncIterator[str]:
+        """Yield the raw chapter text as it is generated.
+
+        Errors propagate; the caller decides between the text so far and
+        fallback_chapter().
+        """
+        system_prompt, prompt, spec = self._build_prompts(topic)
+        
+        stream = stream_chat_completion(
+            Priority.CHAPTER,
+            self.student.id,
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=spec.get('max_tokens', 600),
+            temperature=0.7
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
 
 # Specialized AI Tutors
 class SpecializedTutor:
     def __init__(self, tutor_type: str, student: Student):
         self.tutor_type = tutor_type
         self.student = student
-        self.system_prompt = self.create_specialized_prompt()
+    
+    @property
+    def system_prompt(self) -> str:
+        return self.create_specialized_prompt()
         
     def create_specialized_prompt(self) -> str:
-        base_info = f"""Student: {self.student.name}, Grade {self.student.grade_level}, Interests: {', '.join(self.student.interests)}"""
+        template = SpecializedTutor.prompt_template(self.tutor_type, self.student.grade_level)
+        return template.format(name=self.student.name, interests=", ".join(self.student.interests))
+    
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def prompt_template(tutor_type: str, grade_level: int) -> str:
+        """The tutor's system prompt with only {name} and {interests} left to fill in"""
+        base_info = f"""Student: {{name}}, Grade {grade_level}, Interests: {{interests}}"""
         
         prompts = {
             "math": f"""You are Professor Numbers, a brilliant and patient math tutor. You make math fun and relatable.
@@ -1820,48 +2567,68 @@ Always:
 - Make learning feel fun and rewarding"""
         }
         
-        return prompts.get(self.tutor_type, prompts["general"])
+        return prompts.get(tutor_type, prompts["general"])
     
-    async def get_response(self, message: str, conversation_history: List[Dict]) -> str:
+    def _build_messages(self, message: str, conversation_history: List[Dict], summary: Optional[str] = None) -> List[Dict]:
+        return build_messages(self.system_prompt, conversation_history, message, CONTEXT_HISTORY_TOKENS, summary)
+    
+    def _fallback_response(self) -> str:
+        fallback_responses = {
+            "math": "Great math question! Let me help you work through this step by step.",
+            "science": "Wow, what a fascinating science question! Let's explore this together.",
+            "reading": "I love helping with reading and writing! Let's dive into this.",
+            "general": "That's an excellent question! I'm here to help you learn."
+        }
+        return fallback_responses.get(self.tutor_type, "I'm here to help you learn!")
+    
+    async def get_response(self, message: str, conversation_history: List[Dict], summary: Optional[str] = None) -> str:
         """Get specialized tutor response"""
         try:
-            messages = [{"role": "system", "content": self.system_prompt}]
-            
-            # Add conversation history
-            recent_history = conversation_history[-8:] if len(conversation_history) > 8 else conversation_history
-            for exchange in recent_history:
-                messages.append({"role": "user", "content": exchange["student_message"]})
-                messages.append({"role": "assistant", "content": exchange["ai_response"]})
-            
-            messages.append({"role": "user", "content": message})
+            reply = await hedged_chat_completion(
+                Priority.CHAT,
+                self.student.id,
+                self._build_messages(message, conversation_history, summary),
+                max_tokens=500,
+                temperature=0.7
+            )
             
-            from openai import OpenAI
-            client = OpenAI(api_key=OPENAI_API_KEY)
+            return reply.strip()
             
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=messages,
+        except Exception as e:
+            print(f"Specialized tutor error: {e}")
+            return self._fallback_response()
+    
+    async def stream_response(self, message: str, conversation_history: List[Dict], summary: Optional[str] = None) -> AsyncIterator[str]:
+        """Like get_response, but yields the reply in pieces as the model produces them"""
+        sent_any = False
+        try:
+            stream = hedged_chat_stream(
+                Priority.CHAT,
+                self.student.id,
+                self._build_messages(message, conversation_history, summary),
                 max_tokens=500,
                 temperature=0.7
             )
             
-            return response.choices[0].message.content.strip()
-            
+            async for text in stream:
+                # Match get_response's strip() on the reply's leading edge
+                if not sent_any:
+                    text = text.lstrip()
+                    if not text:
+                        continue
+                sent_any = True
+                yield text
+                    
         except Exception as e:
             print(f"Specialized tutor error: {e}")
-            fallback_responses = {
-                "math": "Great math question! Let me help you work through this step by step.",
-                "science": "Wow, what a fascinating science question! Let's explore this together.",
-                "reading": "I love helping with reading and writing! Let's dive into this.",
-                "general": "That's an excellent question! I'm here to help you learn."
-            }
-            return fallback_responses.get(self.tutor_type, "I'm here to help you learn!")
+            # Only substitute the fallback if the student hasn't seen any of the reply yet
+            if not sent_any:
+                yield self._fallback_response()
 
 # Update the AI Tutor class to include specialized tutors
 class AITutor:
     def __init__(self, student: Student):
         self.student = student
-        self.system_prompt = self.create_system_prompt()
         self.book_generator = BookGenerator(student)
         self.specialized_tutors = {
             "math": SpecializedTutor("math", student),
@@ -1870,21 +2637,30 @@ class AITutor:
             "general": SpecializedTutor("general", student)
         }
         
+    @property
+    def system_prompt(self) -> str:
+        return self.create_system_prompt()
+        
     def create_system_prompt(self) -> str:
         """Create a personalized system prompt for this student"""
-        interests_str = ", ".join(self.student.interests)
-        
-        return f"""You are an expert AI tutor for {self.student.name}, a {self.student.grade_level}th grade student.
+        template = AITutor.prompt_template(self.student.grade_level, self.student.learning_style)
+        return template.format(name=self.student.name, interests=", ".join(self.student.interests))
+    
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def prompt_template(grade_level: int, learning_style: str) -> str:
+        """The system prompt with only {name} and {interests} left to fill in"""
+        return f"""You are an expert AI tutor for {{name}}, a {grade_level}th grade student.
 
 STUDENT PROFILE:
-- Name: {self.student.name}
-- Grade Level: {self.student.grade_level}
-- Learning Style: {self.student.learning_style}
-- Interests: {interests_str}
+- Name: {{name}}
+- Grade Level: {grade_level}
+- Learning Style: {learning_style}
+- Interests: {{interests}}
 
 TUTORING GUIDELINES:
-1. Always adapt your explanations to a {self.student.grade_level}th grade level
-2. Use examples from their interests ({interests_str}) whenever possible
+1. Always adapt your explanations to a {grade_level}th grade level
+2. Use examples from their interests ({{interests}}) whenever possible
 3. Be encouraging and patient - celebrate their curiosity and efforts
 4. Break down complex concepts into digestible steps
 5. Ask follow-up questions to check understanding
@@ -1899,55 +2675,93 @@ LEARNING STYLE ADAPTATION:
 
 Remember: You're not just answering questions - you're nurturing a love of learning!"""
 
-    async def get_response(self, message: str, conversation_history: List[Dict], tutor_type: str = "general") -> str:
+    def _api_key_configured(self) -> bool:
+        if not configured_providers():
+            print("ERROR: no LLM API key set properly (OPENAI_API_KEY or ANTHROPIC_API_KEY)!")
+            return False
+        return True
+    
+    def _build_messages(self, message: str, conversation_history: List[Dict], summary: Optional[str] = None) -> List[Dict]:
+        return build_messages(self.system_prompt, conversation_history, message, CONTEXT_HISTORY_TOKENS, summary)
+    
+    def _error_response(self, error: Exception, message: str) -> str:
+        error_message = str(error)
+        print(f"OpenAI API Error: {error_message}")
+        
+        if "invalid_api_key" in error_message.lower():
+            return "There's an issue with the API key. Please check that it's entered correctly."
+        elif "insufficient_quota" in error_message.lower():
+            return "The API quota has been exceeded. Please check your OpenAI account billing."
+        elif "rate_limit" in error_message.lower():
+            return "I'm being asked questions too quickly! Please wait a moment and try again."
+        else:
+            return self.get_fallback_response(message)
+    
+    async def get_response(self, message: str, conversation_history: List[Dict], tutor_type: str = "general",
+                           summary: Optional[str] = None) -> str:
         """Generate AI response using the appropriate specialized tutor"""
         try:
             # Check if API key is properly set
-            if not OPENAI_API_KEY or OPENAI_API_KEY.startswith("your"):
-                print("ERROR: OpenAI API key not set properly!")
+            if not self._api_key_configured():
                 return "I'm sorry, but my AI connection isn't configured yet. Please ask your teacher to set up the OpenAI API key."
             
             # Use specialized tutor if specified
             if tutor_type in self.specialized_tutors:
-                return await self.specialized_tutors[tutor_type].get_response(message, conversation_history)
+                return await self.specialized_tutors[tutor_type].get_response(message, conversation_history, summary)
             
             # Otherwise use general tutor (original logic)
-            messages = [{"role": "system", "content": self.system_prompt}]
-            
-            recent_history = conversation_history[-10:] if len(conversation_history) > 10 else conversation_history
-            
-            for exchange in recent_history:
-                messages.append({"role": "user", "content": exchange["student_message"]})
-                messages.append({"role": "assistant", "content": exchange["ai_response"]})
-            
-            messages.append({"role": "user", "content": message})
-            
-            from openai import OpenAI
-            client = OpenAI(api_key=OPENAI_API_KEY)
-            
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=messages,
+            reply = await hedged_chat_completion(
+                Priority.CHAT,
+                self.student.id,
+                self._build_messages(message, conversation_history, summary),
                 max_tokens=500,
                 temperature=0.7,
                 presence_penalty=0.1,
                 frequency_penalty=0.1
             )
             
-            return response.choices[0].message.content.strip()
+            return reply.strip()
             
         except Exception as e:
-            error_message = str(e)
-            print(f"OpenAI API Error: {error_message}")
+            return self._error_response(e, message)
+    
+    async def stream_response(self, message: str, conversation_history: List[Dict], tutor_type: str = "general",
+                              summary: Optional[str] = None) -> AsyncIterator[str]:
+        """Streaming counterpart of get_response: yields the reply as it is generated"""
+        if not self._api_key_configured():
+            yield "I'm sorry, but my AI connection isn't configured yet. Please ask your teacher to set up the OpenAI API key."
+            return
+        
+        if tutor_type in self.specialized_tutors:
+            async for text in self.specialized_tutors[tutor_type].stream_response(message, conversation_history, summary):
+                yield text
+            return
+        
+        sent_any = False
+        try:
+            stream = hedged_chat_stream(
+                Priority.CHAT,
+                self.student.id,
+                self._build_messages(message, conversation_history, summary),
+                max_tokens=500,
+                temperature=0.7,
+                presence_penalty=0.1,
+                frequency_penalty=0.1
+            )
             
-            if "invalid_api_key" in error_message.lower():
-                return "There's an issue with the API key. Please check that it's entered correctly."
-            elif "insufficient_quota" in error_message.lower():
-                return "The API quota has been exceeded. Please check your OpenAI account billing."
-            elif "rate_limit" in error_message.lower():
-                return "I'm being asked questions too quickly! Please wait a moment and try again."
+            async for text in stream:
+                if not sent_any:
+                    text = text.lstrip()
+                    if not text:
+                        continue
+                sent_any = True
+                yield text
+                    
+        except Exception as e:
+            if sent_any:
+                print(f"OpenAI API Error mid-stream: {e}")
             else:
-                return self.get_fallback_response(message)
+                yield self._error_response(e, message)
     
     def get_fallback_response(self, message: str) -> str:
         """Fallback response when AI API is unavailable"""
@@ -1962,17 +2776,103 @@ Remember: You're not just answering questions - you're nurturing a love of learn
         import random
         return random.choice(responses)
 
+def get_tutor(student: Student) -> AITutor:
+    """The student's cached AITutor, rebuilt when their profile no longer matches it"""
+    tutor = tutor_cache.get(student.id)
+    if tutor is None or tutor.student != student:
+        tutor = AITutor(student)
+        tutor_cache.set(student.id, tutor)
+    return tutor
+
+@event.listens_for(User, "after_update")
+def refresh_student_profile(mapper, connection, user: User):
+    """Carry users row changes into the in-memory profile and drop the stale tutor"""
+    profile = students_db.get(user.id)
+    if profile is not None:
+        profile.update(name=user.name, grade_level=user.grade_level)
+    tutor_cache.pop(user.id)
+
+@event.listens_for(User, "after_delete")
+def forget_student_profile(mapper, connection, user: User):
+    students_db.pop(user.id, None)
+    tutor_cache.pop(user.id)
+
 # Enhanced AI Response Function
-async def generate_ai_response(message: str, student: Student, conversation_history: List[Dict], tutor_type: str = "general") -> str:
+async def generate_ai_response(message: str, student: Student, conversation_history: List[Dict], tutor_type: str = "general",
+                               summary: Optional[str] = None) -> str:
     """
     Generate AI response using the AI Tutor system with specialized tutors
     """
-    # Get or create AI tutor for this student
-    if student.id not in student_contexts:
-        student_contexts[student.id] = AITutor(student)
-    
-    ai_tutor = student_contexts[student.id]
-    return await ai_tutor.get_response(message, conversation_history, tutor_type)
+    ai_tutor = get_tutor(student)
+    return await ai_tutor.get_response(message, conversation_history, tutor_type, summary)
+
+def generate_ai_response_stream(message: str, student: Student, conversation_history: List[Dict], tutor_type: str = "general",
+                                summary: Optional[str] = None) -> AsyncIterator[str]:
+    """Streaming counterpart of generate_ai_response"""
+    return get_tutor(student).stream_response(message, conversation_history, tutor_type, summary)
+
+async def load_conversation_context(student_id: str, db: AsyncSession) -> tuple:
+    """Return (recent exchanges not yet summarized, rolling summary or None)"""
+    summary_row = await ConversationSummaryStorage.get(student_id, db)
+    history = await ConversationStorage.get_recent(
+        student_id, CONVERSATION_WINDOW, db, after_id=summary_row.through_id if summary_row else None
+    )
+    return history, summary_row.summary if summary_row else None
+
+async def summarize_exchanges(student_id: str, previous_summary: Optional[str], exchanges: List[Dict]) -> str:
+    """Fold exchanges into the previous summary with one short LLM call; raises on failure"""
+    transcript = "\n".join(
+        f"Student: {exchange['student_message']}\nTutor: {exchange['ai_response']}" for exchange in exchanges
+    )
+    prompt = f"""Summary so far: {previous_summary or "(none)"}
+
+Newer part of the conversation:
+{transcript}
+
+Write an updated summary in under 120 words: the topics covered, what the student understood or found hard, and anything left open. Plain sentences, no lists."""
+    response = await create_chat_completion(
+        Priority.BACKGROUND,
+        student_id,
+        model="gpt-3.5-turbo",
+        messages=[
+            {"role": "system", "content": "You keep short running notes on a tutoring conversation with a child, for the tutor to read later."},
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=CONTEXT_SUMMARY_TOKENS,
+        temperature=0.3
+    )
+    return response.choices[0].message.content.strip()
+
+async def refresh_conversation_summary(student_id: str):
+    """Background job: fold exchanges that fell out of the context budget into the summary.
+
+    The tutor replays the newest exchanges that fit CONTEXT_HISTORY_TOKENS;
+    once CONTEXT_SUMMARY_EVERY older ones have piled up behind them, they are
+    summarized together with the previous summary, so the summary is
+    regenerated once every K turns rather than on every message. Exchanges
+    older than the rows read here (history from before summaries existed)
+    are skipped.
+    """
+    async with async_session_scope(readonly=True) as db:
+        current = await ConversationSummaryStorage.get(student_id, db)
+        unsummarized = await ConversationStorage.get_recent(
+            student_id, CONVERSATION_WINDOW + CONTEXT_SUMMARY_EVERY, db,
+            after_id=current.through_id if current else None
+        )
+    kept = fit_history(unsummarized[-CONVERSATION_WINDOW:], CONTEXT_HISTORY_TOKENS)
+    older = unsummarized[:len(unsummarized) - len(kept)]
+    if len(older) < CONTEXT_SUMMARY_EVERY:
+        return
+    summary = await summarize_exchanges(student_id, current.summary if current else None, older)
+    async with async_session_scope() as write_db:
+        await ConversationSummaryStorage.save(student_id, summary, older[-1]["id"], write_db)
+    print(f"📝 Summarized {len(older)} older exchanges for {student_id}")
+
+def schedule_summary_refresh(student_id: str) -> bool:
+    """Queue refresh_conversation_summary for the student (one job at a time each)"""
+    if not CONTEXT_SUMMARY_ENABLED:
+        return False
+    return conversation_summary_pool.submit(student_id, lambda: refresh_conversation_summary(student_id))
 
 
 
@@ -1980,22 +2880,33 @@ async def generate_ai_response(message: str, student: Student, conversation_hist
 @app.post("/api/students")
 async def create_student(student: Student):
     """Create a new student profile"""
-    students_db[student.id] = student.dict()
-    conversations_db[student.id] = []
-    progress_db[student.id] = {
-        "total_messages": 0,
-        "topics_covered": [],
-        "last_active": datetime.now().isoformat()
-    }
+    students_db.set(student.id, student.dict())
+    progress_db.pop(student.id)
+    student_progress(student.id)
     return {"message": "Student created successfully", "student_id": student.id}
 
-def get_or_create_student(student_id: str, db: Session):
+def student_progress(student_id: str) -> Dict:
+    """The student's progress_db entry, created if missing; each call restarts its TTL"""
+    progress = progress_db.get(student_id)
+    if progress is None:
+        progress = {
+            "total_messages": 0,
+            "topics_covered": [],
+            "last_active": datetime.now().isoformat(),
+            "generated_books": []
+        }
+    progress.setdefault("generated_books", [])
+    progress_db.set(student_id, progress)
+    return progress
+
+async def get_or_create_student(student_id: str, db: AsyncSession):
     """Get or create student in students_db from User database"""
-    if student_id in students_db:
-        return students_db[student_id]
+    student_data = students_db.get(student_id)
+    if student_data is not None:
+        return student_data
     
     # Try to get from User database
-    user = db.query(User).filter(User.id == student_id).first()
+    user = await db.scalar(select(User).where(User.id == student_id))
     if user:
         # Create student record from User
         student_data = {
@@ -2005,51 +2916,35 @@ def get_or_create_student(student_id: str, db: Session):
             "interests": [],  # Default empty, can be updated later
             "learning_style": "general"  # Default learning style
         }
-        students_db[student_id] = student_data
-        if student_id not in conversations_db:
-            conversations_db[student_id] = []
-        if student_id not in progress_db:
-            progress_db[student_id] = {
-                "total_messages": 0,
-                "topics_covered": [],
-                "last_active": datetime.now().isoformat(),
-                "generated_books": []
-            }
+        students_db.set(student_id, student_data)
+        student_progress(student_id)
         return student_data
     
     return None
 
 @app.get("/api/students/{student_id}")
-async def get_student(student_id: str, db: Session = Depends(get_db)):
+async def get_student(student_id: str, db: AsyncSession = Depends(get_async_read_db)):
     """Get student profile"""
-    student = get_or_create_student(student_id, db)
+    student = await get_or_create_student(student_id, db)
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
     return student
 
-@app.post("/api/chat")
-async def chat_with_tutor(message: ChatMessage, db: Session = Depends(get_db)):  # Note: ChatMessage instead of Message
-    """Enhanced chat endpoint with gamification tracking"""
-    student_data = get_or_create_student(message.student_id, db)
-    if not student_data:
-        raise HTTPException(status_code=404, detail="Student not found")
-    
-    student = Student(**student_data)
-    
-    # Get conversation history for context
-    conversation_history = conversations_db.get(message.student_id, [])
-    
-    # Generate AI response with specialized tutor
-    ai_response = await generate_ai_response(message.content, student, conversation_history, message.tutor_type)
-    
+async def complete_chat_exchange(message: ChatMessage, ai_response: str) -> Dict:
+    """Persist a finished exchange, record it for gamification and progress.
+
+    Shared by /api/chat and /api/chat/stream; returns the final response body.
+    """
     # Store conversation
-    conversation_entry = {
-        "timestamp": datetime.now().isoformat(),
-        "student_message": message.content,
-        "ai_response": ai_response,
-        "tutor_type": message.tutor_type
-    }
-    conversations_db[message.student_id].append(conversation_entry)
+    try:
+        async with async_session_scope() as write_db:
+            conversation_entry = await ConversationStorage.add_exchange(
+                message.student_id, message.content, ai_response, message.tutor_type, write_db
+            )
+        schedule_summary_refresh(message.student_id)
+    except Exception as e:
+        print(f"⚠️ Could not save conversation for {message.student_id}: {e}")
+        conversation_entry = {"timestamp": datetime.now().isoformat()}
     
     # 🎮 GAMIFICATION: Record activity
     activity_data = GamificationActivityRequest(
@@ -2068,14 +2963,15 @@ async def chat_with_tutor(message: ChatMessage, db: Session = Depends(get_db)):
         gamification_response = {"activity_processed": False}
     
     # Update progress tracking
-    progress_db[message.student_id]["total_messages"] += 1
-    progress_db[message.student_id]["last_active"] = datetime.now().isoformat()
+    progress = student_progress(message.student_id)
+    progress["total_messages"] += 1
+    progress["last_active"] = datetime.now().isoformat()
     
     # Extract topics for progress tracking
     topics = extract_topics(message.content.lower())
     for topic in topics:
-        if topic not in progress_db[message.student_id]["topics_covered"]:
-            progress_db[message.student_id]["topics_covered"].append(topic)
+        if topic not in progress["topics_covered"]:
+            progress["topics_covered"].append(topic)
     
     return {
         "response": ai_response,
@@ -2084,108 +2980,386 @@ async def chat_with_tutor(message: ChatMessage, db: Session = Depends(get_db)):
         "gamification": gamification_response  # 🎮 Include gamification data
     }
 
-@app.post("/api/generate-chapter")
-async def generate_chapter(request: BookRequest, db: Session = Depends(get_db)):
-    """Generate a custom chapter for the student with gamification"""
-    try:
-        student_data = get_or_create_student(request.student_id, db)
+@app.post("/api/chat")
+async def chat_with_tutor(message: ChatMessage):  # Note: ChatMessage instead of Message
+    """Enhanced chat endpoint with gamification tracking"""
+    # Look everything up first so no pooled connection is held during the LLM call
+    async with async_session_scope(readonly=True) as db:
+        student_data = await get_or_create_student(message.student_id, db)
         if not student_data:
             raise HTTPException(status_code=404, detail="Student not found")
-        
-        student = Student(**student_data)
-        
-        # Ensure progress_db entry exists (for backward compatibility)
-        if request.student_id not in progress_db:
-            progress_db[request.student_id] = {
-                "total_messages": 0,
-                "topics_covered": [],
-                "last_active": datetime.now().isoformat(),
-                "generated_books": []
-            }
-        elif "generated_books" not in progress_db[request.student_id]:
-            progress_db[request.student_id]["generated_books"] = []
-        
-        if request.student_id not in student_contexts:
-            student_contexts[request.student_id] = AITutor(student)
-        
-        ai_tutor = student_contexts[request.student_id]
-        
-        print(f"Generating chapter for student {request.student_id}, topic: {request.topic}")
-        chapter = await ai_tutor.book_generator.generate_chapter(
-            request.topic, 
-            request.chapter_number
-        )
-        
-        print(f"Chapter generated: {chapter.get('id', 'NO ID')}, title: {chapter.get('title', 'NO TITLE')}")
-        
-        # Save chapter to database
-        chapter_id = chapter.get('id', str(uuid.uuid4()))
-        try:
-            db_chapter = Chapter(
-                id=chapter_id,
-                user_id=request.student_id,  # student_id is the same as user_id
-                title=chapter.get('title', 'Untitled Chapter'),
-                content=chapter.get('content', ''),
-                created_at=datetime.utcnow(),  # Explicitly set created_at
-                reading_progress=0.0
+        # Get recent conversation history and the summary of older turns for context
+        conversation_history, summary = await load_conversation_context(message.student_id, db)
+    
+    student = Student(**student_data)
+    
+    # Generate AI response with specialized tutor
+    ai_response = await generate_ai_response(message.content, student, conversation_history, message.tutor_type, summary)
+    
+    return await complete_chat_exchange(message, ai_response)
+
+def sse_event(event: str, data: Dict) -> str:
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/api/chat/stream")
+async def chat_with_tutor_stream(message: ChatMessage):
+    """Streaming variant of /api/chat (Server-Sent Events).
+
+    Sends `token` events ({"text": ...}) as the tutor's reply is generated,
+    then one `done` event with the same body /api/chat returns, including
+    the gamification result. The exchange is saved once the reply is complete.
+    """
+    # Look everything up before streaming so no session is held open meanwhile
+    async with async_session_scope(readonly=True) as db:
+        student_data = await get_or_create_student(message.student_id, db)
+        if not student_data:
+            raise HTTPException(status_code=404, detail="Student not found")
+        conversation_history, summary = await load_conversation_context(message.student_id, db)
+    
+    student = Student(**student_data)
+    
+    async def events():
+        parts = []
+        async for text in generate_ai_response_stream(message.content, student, conversation_history, message.tutor_type, summary):
+            parts.append(text)
+            yield sse_event("token", {"text": text})
+        
+        ai_response = "".join(parts).strip()
+        yield sse_event("done", await complete_chat_exchange(message, ai_response))
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def prepare_chapter_generation(request: BookRequest, db: AsyncSession) -> AITutor:
+    """Look up the student and return their tutor, whose book_generator writes the chapter"""
+    student_data = await get_or_create_student(request.student_id, db)
+    if not student_data:
+        raise HTTPException(status_code=404, detail="Student not found")
+    
+    student = Student(**student_data)
+    
+    # Ensure progress_db entry exists (for backward compatibility)
+    student_progress(request.student_id)
+    
+    return get_tutor(student)
+
+async def reuse_library_chapter(request: BookRequest, book_generator: BookGenerator) -> Optional[Dict]:
+    """A copy of a shared library chapter for this request, or None to generate one"""
+    if not CHAPTER_LIBRARY_ENABLED:
+        return None
+    student = book_generator.student
+    library_key = ChapterLibraryStorage.make_key(request.topic, student.grade_level, student.interests)[0]
+    try:
+        async with async_session_scope(readonly=True) as db:
+            entry = await ChapterLibraryStorage.pick_chapter(library_key, request.student_id, db)
+        if entry is None:
+            return None
+        async with async_session_scope() as write_db:
+            await ChapterLibraryStorage.mark_served(entry.id, write_db)
+    except Exception as e:
+        print(f"⚠️ Chapter library lookup failed: {e}")
+        return None
+    print(f"📚 Reusing library chapter {entry.id} for topic: {request.topic}")
+    return book_generator.chapter_from_library(entry, request.topic, request.chapter_number)
+
+async def share_generated_chapter(request: BookRequest, book_generator: BookGenerator, chapter: Dict):
+    """Add a freshly generated chapter to the shared library and link it via chapter["library_id"]"""
+    if not CHAPTER_LIBRARY_ENABLED:
+        return
+    student = book_generator.student
+    library_key, topic, grade, interests = ChapterLibraryStorage.make_key(
+        request.topic, student.grade_level, student.interests
+    )
+    # split_title's "Chapter N" placeholder depends on the request, so it isn't stored
+    title = None if chapter["title"] == f"Chapter {request.chapter_number}" else chapter["title"]
+    try:
+        async with async_session_scope() as write_db:
+            chapter["library_id"] = await ChapterLibraryStorage.add(
+                library_key, topic, grade, interests, title, chapter["content"], write_db
             )
-            db.add(db_chapter)
-            db.commit()
-            db.refresh(db_chapter)
-            print(f"Chapter saved to database: {chapter_id} for user {request.student_id}")
-        except Exception as db_error:
-            print(f"Error saving chapter to database: {db_error}")
-            import traceback
-            traceback.print_exc()
-            db.rollback()
-            # Continue anyway - chapter is still in progress_db
-        
-        # Also store in progress_db for backward compatibility
-        progress_db[request.student_id]["generated_books"].append(chapter)
-        print(f"Chapter stored. Total books for student: {len(progress_db[request.student_id]['generated_books'])}")
-        
-        # 🎮 Record gamification activity
-        activity_data = GamificationActivityRequest(
-            student_id=request.student_id,
-            activity_type="book_generated",
-            activity_data={"topic": request.topic}
+    except Exception as e:
+        print(f"⚠️ Could not add chapter to library: {e}")
+
+async def generate_or_reuse_chapter(request: BookRequest, book_generator: BookGenerator,
+                                    fallback: bool = True, priority: Priority = Priority.CHAPTER) -> Optional[Dict]:
+    """The chapter for a request: a library copy when the reuse policy allows, else a new one.
+
+    When generation fails this returns the fallback chapter, or None if
+    `fallback` is False.
+    """
+    chapter = await reuse_library_chapter(request, book_generator)
+    if chapter is not None:
+        return chapter
+    
+    async def generate():
+        content = await book_generator.generate_content(request.topic, priority)
+        generated = book_generator.chapter_from_content(content, request.topic, request.chapter_number)
+        await share_generated_chapter(request, book_generator, generated)
+        return generated
+    
+    # Concurrent requests from one student that would send the same prompt
+    # share one generation; other students get theirs from the library
+    flight_key = SingleFlight.key("chapter", request.student_id, book_generator._build_prompts(request.topic),
+                                  request.chapter_number)
+    try:
+        chapter = await chapter_flights.do(flight_key, generate)
+    except Exception as e:
+        print(f"Book generation error: {e}")
+        return book_generator.fallback_chapter(request.topic, request.chapter_number) if fallback else None
+    # Each caller saves its own Chapter row
+    return {**chapter, "id": str(uuid.uuid4())}
+
+async def claim_pending_chapter(request: BookRequest) -> Optional[Dict]:
+    """The chapter pre-generated for this request, if there is one (it is handed out once)"""
+    topic_key = ChapterLibraryStorage.normalize(request.topic)
+    try:
+        async with async_session_scope() as write_db:
+            chapter = await PendingChapterStorage.claim(request.student_id, topic_key, request.chapter_number, write_db)
+    except Exception as e:
+        print(f"⚠️ Pending chapter lookup failed: {e}")
+        return None
+    if chapter is not None:
+        print(f"⏩ Serving pre-generated chapter {request.chapter_number} of '{request.topic}' for {request.student_id}")
+    return chapter
+
+async def pregenerate_chapter(request: BookRequest, topic_key: str):
+    """Background job: generate a chapter and keep it pending for the student"""
+    async with async_session_scope(readonly=True) as db:
+        ai_tutor = await prepare_chapter_generation(request, db)
+    chapter = await generate_or_reuse_chapter(request, ai_tutor.book_generator, fallback=False,
+                                              priority=Priority.BACKGROUND)
+    if chapter is None:
+        return  # the student will get a normal generation when they ask
+    async with async_session_scope() as write_db:
+        await PendingChapterStorage.add(request.student_id, topic_key, chapter, write_db)
+    print(f"⏩ Chapter {request.chapter_number} of '{request.topic}' ready for {request.student_id}")
+
+async def schedule_next_chapter(student_id: str, chapter: Chapter) -> bool:
+    """Start generating the chapter after `chapter` in the background.
+
+    Called when a student finishes a chapter. Skipped when pre-generation is
+    off, the chapter has no recorded topic, the next chapter already exists
+    or is pending, or the student already has CHAPTER_PREGEN_PER_STUDENT
+    chapters pending or in progress. Returns whether a job was queued.
+    """
+    if not CHAPTER_PREGEN_ENABLED or not chapter.topic or chapter.chapter_number is None:
+        return False
+    topic = chapter.topic
+    next_number = chapter.chapter_number + 1
+    topic_key = ChapterLibraryStorage.normalize(topic)
+    job_key = (student_id, topic_key, next_number)
+    if chapter_pregen_pool.is_active(job_key):
+        return False
+    try:
+        async with async_session_scope(readonly=True) as db:
+            pending = await PendingChapterStorage.count_for_student(student_id, db)
+            if await PendingChapterStorage.exists(student_id, topic_key, next_number, db):
+                return False
+            next_topics = await db.scalars(select(Chapter.topic).where(
+                Chapter.user_id == student_id,
+                Chapter.chapter_number == next_number
+            ))
+            if any(ChapterLibraryStorage.normalize(t or "") == topic_key for t in next_topics):
+                return False
+    except Exception as e:
+        print(f"⚠️ Could not check pending chapters: {e}")
+        return False
+    if pending + chapter_pregen_pool.active(student_id) >= CHAPTER_PREGEN_PER_STUDENT:
+        return False
+
+    request = BookRequest(student_id=student_id, topic=topic, chapter_number=next_number)
+    queued = chapter_pregen_pool.submit(job_key, lambda: pregenerate_chapter(request, topic_key), group=student_id)
+    if queued:
+        print(f"⏩ Pre-generating chapter {next_number} of '{topic}' for {student_id}")
+    return queued
+
+async def complete_chapter_generation(request: BookRequest, chapter: Dict) -> Dict:
+    """Save a finished chapter and record it for gamification.
+
+    Shared by /api/generate-chapter and /api/generate-chapter/stream; returns
+    the chapter with the gamification result.
+    """
+    print(f"Chapter generated: {chapter.get('id', 'NO ID')}, title: {chapter.get('title', 'NO TITLE')}")
+    
+    # Save chapter to database. The write gets its own short session so the
+    # write pool isn't held while the chapter is being generated.
+    chapter_id = chapter.get('id', str(uuid.uuid4()))
+    try:
+        db_chapter = Chapter(
+            id=chapter_id,
+            user_id=request.student_id,  # student_id is the same as user_id
+            title=chapter.get('title', 'Untitled Chapter'),
+            content=chapter.get('content', ''),
+            created_at=datetime.utcnow(),  # Explicitly set created_at
+            reading_progress=0.0,
+            library_id=chapter.get('library_id'),
+            topic=request.topic,
+            chapter_number=request.chapter_number
         )
+        async with async_session_scope() as write_db:
+            write_db.add(db_chapter)
+        print(f"Chapter saved to database: {chapter_id} for user {request.student_id}")
+    except Exception as db_error:
+        print(f"Error saving chapter to database: {db_error}")
+        import traceback
+        traceback.print_exc()
+        # Continue anyway - chapter is still in progress_db
+    
+    # Also store in progress_db for backward compatibility
+    generated_books = student_progress(request.student_id)["generated_books"]
+    generated_books.append(chapter)
+    print(f"Chapter stored. Total books for student: {len(generated_books)}")
+    
+    # 🎮 Record gamification activity
+    activity_data = GamificationActivityRequest(
+        student_id=request.student_id,
+        activity_type="book_generated",
+        activity_data={"topic": request.topic}
+    )
+    
+    try:
+        gamification_response = await record_activity(activity_data)
+    except Exception as e:
+        print(f"Gamification error: {e}")
+        gamification_response = {"activity_processed": False}
+    
+    return {
+        **chapter,
+        "gamification": gamification_response
+    }
+
+@app.post("/api/generate-chapter")
+async def generate_chapter(request: BookRequest):
+    """Generate a custom chapter for the student with gamification"""
+    try:
+        # Look everything up first so no pooled connection is held during the LLM call
+        async with async_session_scope(readonly=True) as db:
+            ai_tutor = await prepare_chapter_generation(request, db)
         
-        try:
-            gamification_response = await record_activity(activity_data)
-        except Exception as e:
-            print(f"Gamification error: {e}")
-            gamification_response = {"activity_processed": False}
+        print(f"Generating chapter for student {request.student_id}, topic: {request.topic}")
+        chapter = await claim_pending_chapter(request)
+        if chapter is None:
+            chapter = await generate_or_reuse_chapter(request, ai_tutor.book_generator)
         
-        return {
-            **chapter,
-            "gamification": gamification_response
-        }
+        return await complete_chapter_generation(request, chapter)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error generating chapter: {e}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to generate chapter: {str(e)}")
 
+@app.post("/api/generate-chapter/stream")
+async def generate_chapter_stream(request: BookRequest):
+    """Streaming variant of /api/generate-chapter (Server-Sent Events).
+
+    Events, in order:
+    - `title`: {"id", "title", "chapter_number", "topic"} as soon as the first
+      line of the story is known
+    - `page`: {"index", "text"} for each page once it can no longer change,
+      paginated exactly as /api/reading/content/{id} will serve it
+    - `done`: the same body /api/generate-chapter returns, plus the full
+      `pages` list; the Chapter row is saved just before this event
+    """
+    # Look everything up before streaming so no session is held open meanwhile
+    async with async_session_scope(readonly=True) as db:
+        ai_tutor = await prepare_chapter_generation(request, db)
+    book_generator = ai_tutor.book_generator
+    
+    async def events():
+        chapter = await claim_pending_chapter(request) or await reuse_library_chapter(request, book_generator)
+        chapter_id = chapter["id"] if chapter else str(uuid.uuid4())
+        raw = ""
+        title = None
+        pages = ChapterPageStream()
+        page_index = 0
+        
+        def title_event(title_text: str) -> str:
+            return sse_event("title", {
+                "id": chapter_id,
+                "title": title_text,
+                "chapter_number": request.chapter_number,
+                "topic": request.topic
+            })
+        
+        if chapter is not None:
+            # A pre-generated chapter or library copy is complete already:
+            # title now, then every page
+            yield title_event(chapter["title"])
+        else:
+            print(f"Streaming chapter for student {request.student_id}, topic: {request.topic}")
+            failed = False
+            try:
+                async for text in book_generator.stream_chapter_text(request.topic, request.chapter_number):
+                    raw += text
+                    if title is None:
+                        # The title is decided by the first line, so wait for it
+                        content = raw.lstrip()
+                        if "\n" not in content:
+                            continue
+                        first_line, rest = content.split("\n", 1)
+                        title, _ = BookGenerator.split_title(content, request.chapter_number)
+                        yield title_event(title)
+                        # Same split as split_title, minus its strip(): a partial
+                        # "\n\n" at the end is a paragraph break still arriving
+                        text = rest if BookGenerator.is_title_line(first_line) else content
+                    for page in pages.feed(text):
+                        yield sse_event("page", {"index": page_index, **page})
+                        page_index += 1
+            except Exception as e:
+                print(f"Book generation error: {e}")
+                failed = True
+            
+            if raw.strip():
+                chapter = book_generator.chapter_from_content(raw.strip(), request.topic, request.chapter_number)
+                chapter["id"] = chapter_id
+                # A stream cut short is kept for this student but not shared
+                if not failed:
+                    await share_generated_chapter(request, book_generator, chapter)
+            else:
+                chapter = book_generator.fallback_chapter(request.topic, request.chapter_number)
+                chapter["id"] = chapter_id
+            if title is None:
+                yield title_event(chapter["title"])
+        
+        for page in pages.finish(chapter["content"]):
+            yield sse_event("page", {"index": page_index, **page})
+            page_index += 1
+        
+        result = await complete_chapter_generation(request, chapter)
+        all_pages = paginate_content(chapter["content"])
+        yield sse_event("done", {**result, "pages": all_pages, "total_pages": len(all_pages)})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/students/{student_id}/books")
-async def get_student_books(student_id: str, db: Session = Depends(get_db)):
+async def get_student_books(student_id: str, db: AsyncSession = Depends(get_async_read_db)):
     """Get all books/chapters generated for a student"""
     print(f"📖 get_student_books endpoint called with student_id: {student_id}")
     try:
         # Verify user exists in database
-        user = db.query(User).filter(User.id == student_id).first()
+        user = await db.scalar(select(User).where(User.id == student_id))
         if not user:
             print(f"⚠️ User not found for student_id: {student_id}")
             # Fallback: check in-memory progress_db
-            if student_id in progress_db and "generated_books" in progress_db[student_id]:
-                books = progress_db[student_id]["generated_books"]
-                print(f"Returning {len(books)} books from in-memory storage for student {student_id}")
-                return books
-            return []
+            books = progress_db.get(student_id, {}).get("generated_books", [])
+            print(f"Returning {len(books)} books from in-memory storage for student {student_id}")
+            return books
         
         # Get chapters from database
         print(f"🔍 Querying chapters for user_id: {student_id}")
-        db_chapters = db.query(Chapter).filter(Chapter.user_id == student_id).order_by(Chapter.created_at.desc()).all()
+        db_chapters = (await db.scalars(
+            select(Chapter).where(Chapter.user_id == student_id).order_by(Chapter.created_at.desc())
+        )).all()
         print(f"✅ Found {len(db_chapters)} chapters in database for user {student_id}")
         
         # Convert database chapters to the expected format
@@ -2202,9 +3376,10 @@ async def get_student_books(student_id: str, db: Session = Depends(get_db)):
             })
         
         # If no books in database, check in-memory storage as fallback
-        if len(books) == 0 and student_id in progress_db and "generated_books" in progress_db[student_id]:
+        progress = progress_db.get(student_id) if len(books) == 0 else None
+        if progress and "generated_books" in progress:
             print(f"⚠️ No books in database, checking in-memory storage for student {student_id}")
-            books = progress_db[student_id]["generated_books"]
+            books = progress["generated_books"]
             print(f"Returning {len(books)} books from in-memory storage")
         
         print(f"📚 Returning {len(books)} books for student {student_id}")
@@ -2214,14 +3389,15 @@ async def get_student_books(student_id: str, db: Session = Depends(get_db)):
         import traceback
         traceback.print_exc()
         # Fallback to in-memory storage
-        if student_id in progress_db and "generated_books" in progress_db[student_id]:
+        books = progress_db.get(student_id, {}).get("generated_books")
+        if books is not None:
             print(f"🔄 Falling back to in-memory storage for student {student_id}")
-            return progress_db[student_id]["generated_books"]
+            return books
         # Return empty list instead of raising error to prevent frontend issues
         return []
 
 @app.post("/api/students/{student_id}/books/{book_id}/complete")
-async def mark_book_completed(student_id: str, book_id: str, request: Request = None, db: Session = Depends(get_db)):
+async def mark_book_completed(student_id: str, book_id: str, request: Request = None, db: AsyncSession = Depends(get_async_db)):
     """Mark a book as completed and move it to the completed section"""
     try:
         # Parse optional body for local_hour
@@ -2232,17 +3408,18 @@ async def mark_book_completed(student_id: str, book_id: str, request: Request =
         except Exception:
             pass
 
-        chapter = db.query(Chapter).filter(
+        chapter = await db.scalar(select(Chapter).where(
             Chapter.id == book_id,
             Chapter.user_id == student_id
-        ).first()
+        ))
         if not chapter:
             raise HTTPException(status_code=404, detail="Book not found")
 
         chapter.is_completed = True
         chapter.reading_progress = 100.0
-        db.commit()
+        await db.commit()
         print(f"✅ Book {book_id} marked as completed for student {student_id}")
+        await schedule_next_chapter(student_id, chapter)
 
         # Award XP for completing a book
         try:
@@ -2259,38 +3436,37 @@ async def mark_book_completed(student_id: str, book_id: str, request: Request =
         raise
     except Exception as e:
         print(f"Error marking book as completed: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/api/students/{student_id}/books/{book_id}")
-async def delete_book(student_id: str, book_id: str, db: Session = Depends(get_db)):
+async def delete_book(student_id: str, book_id: str, db: AsyncSession = Depends(get_async_db)):
     """Delete a book/chapter for a student"""
     try:
-        chapter = db.query(Chapter).filter(
+        chapter = await db.scalar(select(Chapter).where(
             Chapter.id == book_id,
             Chapter.user_id == student_id
-        ).first()
+        ))
         if not chapter:
             raise HTTPException(status_code=404, detail="Book not found")
 
         # Delete associated reading sessions first
-        db.query(ReadingSession).filter(ReadingSession.chapter_id == book_id).delete()
-        db.delete(chapter)
-        db.commit()
+        await db.execute(delete(ReadingSession).where(ReadingSession.chapter_id == book_id))
+        await db.delete(chapter)
+        await db.commit()
         print(f"🗑️ Book {book_id} deleted for student {student_id}")
 
         # Also remove from in-memory storage if present
-        if student_id in progress_db and "generated_books" in progress_db[student_id]:
-            progress_db[student_id]["generated_books"] = [
-                b for b in progress_db[student_id]["generated_books"] if b.get("id") != book_id
-            ]
+        progress = progress_db.get(student_id)
+        if progress and "generated_books" in progress:
+            progress["generated_books"] = [b for b in progress["generated_books"] if b.get("id") != book_id]
 
         return {"message": "Book deleted", "book_id": book_id}
     except HTTPException:
         raise
     except Exception as e:
         print(f"Error deleting book: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 # Reading Agent endpoints
@@ -2304,42 +3480,119 @@ class ReadingFeedbackRequest(BaseModel):
 class ReadingContentRequest(BaseModel):
     book_id: str
 
+# Feedback for a stuck word, a long pause or plain encouragement depends only
+# on the grade, the branch and (at most) one word, so the LLM's replies are
+# cached under those, and their prompts leave the passage out. Each key keeps
+# a few variants so repeats don't sound canned. FEEDBACK_CACHE_MAX_KEYS=0
+# turns the cache off.
+feedback_cache = VariantCache(
+    max_entries=int(os.getenv("FEEDBACK_CACHE_MAX_KEYS", "2048")),
+    ttl_seconds=float(os.getenv("FEEDBACK_CACHE_TTL", "86400")),
+    variants=int(os.getenv("FEEDBACK_CACHE_VARIANTS", "3")),
+)
+# Identical feedback prompts in flight at once share one LLM call
+feedback_flights = SingleFlight("reading feedback")
+
+def normalize_feedback_word(word: str) -> str:
+    """Lowercase a word and strip punctuation so "Butterfly," and "butterfly" share a cache key"""
+    return ''.join(c for c in word.lower() if c.isalnum() or c == "'").strip("'")
+
+PAGE_CHARS = 500  # ~500 chars per page
+
+def _paginate_sentences(sentences: List[str]):
+    """Group a paragraph's sentences into pages.
+
+    Returns (closed pages, the page still being filled).
+    """
+    pages = []
+    current_page = ""
+    for sentence in sentences:
+        if len(current_page) + len(sentence) < PAGE_CHARS:
+            current_page += sentence + ". "
+        else:
+            if current_page:
+                pages.append(current_page.strip())
+            current_page = sentence + ". "
+    return pages, current_page
+
+def paginate_content(content: str) -> List[Dict]:
+    """Split chapter content into reader pages.
+
+    Pages never span paragraphs; a long paragraph is split between sentences.
+    """
+    pages = []
+    # Split by double newlines first (paragraphs)
+    paragraphs = [p.strip() for p in content.split("\n\n") if p.strip()]
+    for para in paragraphs:
+        # If paragraph is long, split by sentences
+        closed, current_page = _paginate_sentences(para.split('. '))
+        pages.extend(closed)
+        if current_page:
+            pages.append(current_page.strip())
+    
+    # If no pages created, create one page with all content
+    if not pages:
+        return [{"text": content}] if content else [{"text": "No content available"}]
+    return [{"text": page} for page in pages]
+
+class ChapterPageStream:
+    """Pages chapter text as it streams in, using paginate_content's rules.
+
+    feed() returns only pages that more text can no longer change: those of
+    finished paragraphs, and pages in the current paragraph that a later,
+    complete sentence has already closed. finish() returns the rest, taken
+    from paginate_content() on the final text so the result always matches
+    what get_reading_content serves for the saved chapter.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.sent = 0
+
+    def _settled_pages(self) -> List[str]:
+        paragraphs = self.text.split("\n\n")
+        pages = []
+        for para in paragraphs[:-1]:
+            para = para.strip()
+            if para:
+                closed, current_page = _paginate_sentences(para.split('. '))
+                pages.extend(closed)
+                if current_page:
+                    pages.append(current_page.strip())
+        # In the unfinished paragraph only complete sentences count, and the
+        # page they are still filling stays open
+        tail = paragraphs[-1].lstrip()
+        closed, _ = _paginate_sentences(tail.split('. ')[:-1])
+        pages.extend(closed)
+        return pages
+
+    def feed(self, text: str) -> List[Dict]:
+        self.text += text
+        if "." not in text and "\n" not in text:
+            return []
+        pages = self._settled_pages()
+        new_pages = pages[self.sent:]
+        self.sent = len(pages)
+        return [{"text": page} for page in new_pages]
+
+    def finish(self, final_content: str) -> List[Dict]:
+        pages = paginate_content(final_content)
+        remaining = pages[self.sent:]
+        self.sent = len(pages)
+        return remaining
+
 @app.get("/api/reading/content/{book_id}")
-async def get_reading_content(book_id: str, db: Session = Depends(get_db)):
+async def get_reading_content(book_id: str, db: AsyncSession = Depends(get_async_read_db)):
     """Get reading content for a book/chapter"""
     print(f"📖 get_reading_content called for book_id: {book_id}")
     
     # First, try to get from database
     try:
-        db_chapter = db.query(Chapter).filter(Chapter.id == book_id).first()
+        db_chapter = await db.scalar(select(Chapter).where(Chapter.id == book_id))
         if db_chapter:
             print(f"✅ Found chapter in database: {book_id}")
             content = db_chapter.content or ""
-            # Split content into pages (by paragraphs or sentences)
-            pages = []
-            if content:
-                # Split by double newlines first (paragraphs)
-                paragraphs = [p.strip() for p in content.split("\n\n") if p.strip()]
-                for para in paragraphs:
-                    # If paragraph is long, split by sentences
-                    sentences = para.split('. ')
-                    current_page = ""
-                    for sentence in sentences:
-                        if len(current_page) + len(sentence) < 500:  # ~500 chars per page
-                            current_page += sentence + ". "
-                        else:
-                            if current_page:
-                                pages.append(current_page.strip())
-                            current_page = sentence + ". "
-                    if current_page:
-                        pages.append(current_page.strip())
-            
-            # If no pages created, create one page with all content
-            if not pages:
-                pages = [{"text": content}] if content else [{"text": "No content available"}]
-            else:
-                # Convert string pages to dict format
-                pages = [{"text": page} if isinstance(page, str) else page for page in pages]
+            pages = paginate_content(content)
             
             return {
                 "id": db_chapter.id,
@@ -2361,27 +3614,8 @@ async def get_reading_content(book_id: str, db: Session = Depends(get_db)):
         for book in books:
             if book.get("id") == book_id:
                 print(f"✅ Found chapter in in-memory storage: {book_id}")
-                # Split content into pages (by paragraphs or sentences)
                 content = book.get("content", "")
-                pages = []
-                if content:
-                    # Split by double newlines first (paragraphs)
-                    paragraphs = [p.strip() for p in content.split("\n\n") if p.strip()]
-                    for para in paragraphs:
-                        # If paragraph is long, split by sentences
-                        sentences = para.split('. ')
-                        current_page = ""
-                        for sentence in sentences:
-                            if len(current_page) + len(sentence) < 500:  # ~500 chars per page
-                                current_page += sentence + ". "
-                            else:
-                                if current_page:
-                                    pages.append({"text": current_page.strip()})
-                                current_page = sentence + ". "
-                        if current_page:
-                            pages.append({"text": current_page.strip()})
-                else:
-                    pages = [{"text": "No content available"}]
+                pages = paginate_content(content)
                 
                 return {
                     "id": book_id,
@@ -2397,11 +3631,12 @@ async def get_reading_content(book_id: str, db: Session = Depends(get_db)):
     raise HTTPException(status_code=404, detail=f"Book with id {book_id} not found")
 
 @app.post("/api/reading/feedback")
-async def get_reading_feedback(request: ReadingFeedbackRequest, db: Session = Depends(get_db)):
+async def get_reading_feedback(request: ReadingFeedbackRequest):
     """Get AI-powered reading feedback like a teacher would give"""
     try:
-        # Get student info
-        student_data = get_or_create_student(request.student_id, db)
+        # Get student info; the session closes before the LLM is asked
+        async with async_session_scope(readonly=True) as db:
+            student_data = await get_or_create_student(request.student_id, db)
         if not student_data:
             raise HTTPException(status_code=404, detail="Student not found")
         
@@ -2445,16 +3680,19 @@ async def get_reading_feedback(request: ReadingFeedbackRequest, db: Session = De
         is_long_pause = request.struggle_indicators.get("long_pause", False) if request.struggle_indicators else False
         is_stuck_on_word = request.struggle_indicators.get("stuck_word", False) if request.struggle_indicators else False
 
-        # Build a concise, spoken-aloud-friendly prompt
+        # Build a concise, spoken-aloud-friendly prompt. Cached branches leave
+        # the passage out, since their replies are shared across stories.
         prompt = f"""You are a warm, patient reading teacher helping a grade {student.grade_level} student read aloud.
 Your response will be SPOKEN ALOUD to the student through text-to-speech, so keep it very short and conversational.
-
-The student is reading: "{request.expected_text}"
-
-They have read up to word {request.current_word_index} of {len(expected_words)}.
 """
 
+        # Misread feedback depends on what was said, so it isn't cached
+        cache_key = None
+        feedback = None
         if is_stuck_on_word and stuck_word:
+            # Most words are split into syllables locally; the LLM only gets the hard ones
+            feedback = stuck_word_feedback(stuck_word)
+            cache_key = ("stuck_word", student.grade_level, normalize_feedback_word(stuck_word))
             prompt += f"""
 The student is STUCK on the word: "{stuck_word}"
 Help them by breaking the word into real syllables. Say each syllable slowly with commas between them.
@@ -2465,16 +3703,25 @@ Good example for "together": "Let's try this one, tuh, geh, ther, together!"
 Bad example (NEVER do this): "b-u-t, buh-uh-tuh" — TTS cannot say this properly.
 """
         elif is_long_pause:
+            next_word = expected_words[request.current_word_index] if 0 <= request.current_word_index < len(expected_words) else ""
+            cache_key = ("long_pause", student.grade_level, normalize_feedback_word(next_word))
             prompt += """
-The student has paused for a while. Gently encourage them to keep going. If they're near a word, help them with it.
-"""
+The student has paused for a while. Gently encourage them to keep going."""
+            if cache_key[2]:
+                prompt += f""" The next word is "{cache_key[2]}"; help them with it."""
+            prompt += "\n"
         elif incorrect_words:
             prompt += f"""
+The student is reading: "{request.expected_text}"
+
+They have read up to word {request.current_word_index} of {len(expected_words)}.
+
 The student misread some words: {str(incorrect_words[:2])}
 Gently correct ONLY the most recent mistake. If helping them sound it out, break the word into real syllables separated by commas.
 IMPORTANT: Do NOT use dashes, slashes, or made-up phonetic spellings like "buh" or "kuh" — the TTS engine cannot say these. Use real syllable chunks instead.
 """
         else:
+            cache_key = ("encouragement", student.grade_level)
             prompt += """
 The student seems to need a little encouragement. Give brief praise and encourage them to continue.
 """
@@ -2488,26 +3735,35 @@ RULES:
 - NEVER use letter-by-letter spelling or made-up sounds like "buh" "cuh" "puh" — TTS cannot read these
 - Never say "great job" if they are struggling — instead be helpful and gentle"""
 
-        # Use OpenAI to generate feedback
-        try:
-            from openai import OpenAI
-            client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        if feedback is None and cache_key:
+            feedback = feedback_cache.get(cache_key)
 
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
+        # Use OpenAI to generate feedback
+        if feedback is None:
+            try:
+                messages = [
                     {"role": "system", "content": "You are a kind reading teacher. Your responses are spoken aloud to children, so be brief, warm, and clear. 1-2 sentences max."},
                     {"role": "user", "content": prompt}
-                ],
-                max_tokens=100,
-                temperature=0.7
-            )
-            
-            feedback = response.choices[0].message.content
-        except Exception as api_err:
-            logger.error(f"OpenAI API error in reading feedback: {api_err}")
-            # Fallback feedback
-            feedback = "Keep reading! You're doing great. Take your time with each word and sound it out if you need help."
+                ]
+
+                async def ask_llm():
+                    response = await create_chat_completion(
+                        Priority.INTERACTIVE,
+                        request.student_id,
+                        model="gpt-3.5-turbo",
+                        messages=messages,
+                        max_tokens=100,
+                        temperature=0.7
+                    )
+                    return response.choices[0].message.content
+
+                feedback = await feedback_flights.do(SingleFlight.key("feedback", messages), ask_llm)
+                if cache_key and feedback:
+                    feedback_cache.add(cache_key, feedback)
+            except Exception as api_err:
+                logger.error(f"OpenAI API error in reading feedback: {api_err}")
+                # Fallback feedback (not cached, so the next request retries the API)
+                feedback = "Keep reading! You're doing great. Take your time with each word and sound it out if you need help."
         
         # Calculate accuracy
         correct = sum(1 for _, match in word_matches if match)
@@ -2534,11 +3790,11 @@ RULES:
         }
 
 @app.post("/api/reading/finish/{book_id}")
-async def finish_reading_session(book_id: str, data: dict, db: Session = Depends(get_db)):
+async def finish_reading_session(book_id: str, data: dict, db: AsyncSession = Depends(get_async_db)):
     """Save reading session results to database"""
     try:
         # Get chapter first to verify it exists
-        chapter = db.query(Chapter).filter(Chapter.id == book_id).first()
+        chapter = await db.scalar(select(Chapter).where(Chapter.id == book_id))
         if not chapter:
             raise HTTPException(status_code=404, detail="Chapter not found")
         
@@ -2568,10 +3824,10 @@ async def finish_reading_session(book_id: str, data: dict, db: Session = Depends
             words_read = data.get('words_read', 0)
             chapter.reading_progress = min(100.0, (words_read / total_words) * 100.0)
         
-        db.commit()
-        db.refresh(reading_session)
+        await db.commit()
 
         print(f"Reading session saved to database: {session_id} for chapter {book_id}")
+        await schedule_next_chapter(student_id, chapter)
 
         # Update gamification: increment books_read and update streaks
         gamification_results = {}
@@ -2602,7 +3858,7 @@ async def finish_reading_session(book_id: str, data: dict, db: Session = Depends
         print(f"Error saving reading session: {e}")
         import traceback
         traceback.print_exc()
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to save reading session: {str(e)}")
 
 # ─── ElevenLabs Text-to-Speech Endpoint ─────────────────────────────
@@ -2633,15 +3889,13 @@ async def transcribe_audio(audio: UploadFile = File(...)):
             ext = ".ogg"
 
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=OPENAI_API_KEY)
-
         with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as f:
             f.write(audio_bytes)
             temp_path = f.name
 
         with open(temp_path, "rb") as audio_file:
-            transcription = client.audio.transcriptions.create(
+            transcription = await create_transcription(
+                Priority.INTERACTIVE,
                 model="whisper-1",
                 file=audio_file,
                 language="en",
@@ -2663,6 +3917,18 @@ async def transcribe_audio(audio: UploadFile = File(...)):
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
 ELEVENLABS_VOICE_ID = os.getenv("ELEVENLABS_VOICE_ID", "XB0fDUnXU5powFXDhCwa")  # "Charlotte" - warm, clear, friendly teacher
 
+# A class pressing "listen" on the same text at once makes one ElevenLabs call
+tts_flights = SingleFlight("tts")
+
+# Synthesized clips on disk, by content hash; see audio_cache.py. Serverless
+# instances only have /tmp, and less of it.
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR") or (
+    os.path.join(tempfile.gettempdir(), "peregrine-tts-cache") if IS_SERVERLESS else str(backend_dir / "tts_cache")
+)
+TTS_CACHE_MAX_MB = float(os.getenv("TTS_CACHE_MAX_MB", "100" if IS_SERVERLESS else "500"))
+tts_cache = AudioCache(TTS_CACHE_DIR, int(TTS_CACHE_MAX_MB * 1024 * 1024))
+TTS_IMMUTABLE = "public, max-age=31536000, immutable"
+
 class TTSRequest(BaseModel):
     text: str
     voice_id: Optional[str] = None
@@ -2671,9 +3937,6 @@ class TTSRequest(BaseModel):
 async def text_to_speech(request: TTSRequest):
     """Convert text to speech using ElevenLabs API. Returns audio/mpeg stream."""
 
-    if not ELEVENLABS_API_KEY or ELEVENLABS_API_KEY == "your_elevenlabs_api_key_here":
-        raise HTTPException(status_code=503, detail="TTS service not configured")
-
     text = request.text.strip()
     if not text:
         raise HTTPException(status_code=400, detail="Text is required")
@@ -2684,10 +3947,9 @@ async def text_to_speech(request: TTSRequest):
 
     voice_id = request.voice_id or ELEVENLABS_VOICE_ID
 
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+    url = f"/v1/text-to-speech/{voice_id}"
 
     headers = {
-        "xi-api-key": ELEVENLABS_API_KEY,
         "Content-Type": "application/json",
         "Accept": "audio/mpeg"
     }
@@ -2703,19 +3965,37 @@ async def text_to_speech(request: TTSRequest):
         }
     }
 
-    try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.post(url, json=payload, headers=headers)
+    # Keyed on what is sent, not the API key; repeat playback is served from disk.
+    # The same clip can then be fetched (and cached by the browser) at /api/tts/{hash}.
+    audio_hash = AudioCache.key(text, voice_id, payload["model_id"], payload["voice_settings"])
+    response_headers = {"Content-Disposition": "inline", "Cache-Control": "no-cache"}
+    if tts_cache.enabled:
+        response_headers["X-TTS-Hash"] = audio_hash
+        response_headers["Content-Location"] = f"/api/tts/{audio_hash}"
 
-            if response.status_code != 200:
-                logger.error(f"ElevenLabs API error: {response.status_code} {response.text[:200]}")
-                raise HTTPException(status_code=502, detail="TTS service error")
+    audio = await run_in_threadpool(tts_cache.get, audio_hash)
+    if audio is not None:
+        return Response(audio, media_type="audio/mpeg", headers={**response_headers, "X-TTS-Cache": "hit"})
 
-            return StreamingResponse(
-                iter([response.content]),
-                media_type="audio/mpeg",
-                headers={"Content-Disposition": "inline", "Cache-Control": "no-cache"}
-            )
+    if not ELEVENLABS_API_KEY or ELEVENLABS_API_KEY == "your_elevenlabs_api_key_here":
+        raise HTTPException(status_code=503, detail="TTS service not configured")
+
+    headers["xi-api-key"] = ELEVENLABS_API_KEY
+
+    async def call_elevenlabs():
+        response = await get_http_client("elevenlabs").post(url, json=payload, headers=headers)
+        if response.status_code != 200:
+            logger.error(f"ElevenLabs API error: {response.status_code} {response.text[:200]}")
+            return None
+        await run_in_threadpool(tts_cache.put, audio_hash, response.content)
+        return response.content
+
+    try:
+        audio = await tts_flights.do(audio_hash, call_elevenlabs)
+        if audio is None:
+            raise HTTPException(status_code=502, detail="TTS service error")
+
+        return Response(audio, media_type="audio/mpeg", headers={**response_headers, "X-TTS-Cache": "miss"})
     except httpx.TimeoutException:
         logger.error("ElevenLabs API timeout")
         raise HTTPException(status_code=504, detail="TTS service timeout")
@@ -2725,6 +4005,67 @@ async def text_to_speech(request: TTSRequest):
         logger.error(f"TTS error: {e}")
         raise HTTPException(status_code=500, detail="TTS service unavailable")
 
+def parse_byte_range(range_header: str, size: int):
+    """(start, end) of a single "bytes=" range, inclusive; None to send the whole file.
+
+    Raises ValueError when the range can't be satisfied.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None  # other units and multipart ranges: a full 200 is allowed
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        elif last:
+            start, end = max(0, size - int(last)), size - 1  # suffix: the last N bytes
+        else:
+            return None
+    except ValueError:
+        return None
+    if start >= size or start > end or start < 0:
+        raise ValueError(f"unsatisfiable range {range_header}")
+    return start, min(end, size - 1)
+
+@app.api_route("/api/tts/{audio_hash}", methods=["GET", "HEAD"])
+def get_tts_audio(audio_hash: str, request: Request):
+    """A clip made by POST /api/tts, by the hash it returned in X-TTS-Hash.
+
+    The same hash always means the same audio, so responses are immutable
+    and can be cached by browsers and CDNs. Supports Range requests (audio
+    elements seek with them) and If-None-Match. 404 once evicted: POST the
+    text again.
+    """
+    path = tts_cache.path(audio_hash)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Audio not cached")
+    etag = f'"{audio_hash}"'
+    headers = {"ETag": etag, "Cache-Control": TTS_IMMUTABLE, "Accept-Ranges": "bytes"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        audio = path.read_bytes()
+    except OSError:
+        raise HTTPException(status_code=404, detail="Audio not cached")
+    size = len(audio)
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", etag) == etag:
+        try:
+            byte_range = parse_byte_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if byte_range is None:
+        return Response(audio, media_type="audio/mpeg", headers=headers)
+    start, end = byte_range
+    return Response(audio[start:end + 1], status_code=206, media_type="audio/mpeg",
+                    headers={**headers, "Content-Range": f"bytes {start}-{end}/{size}"})
+
 def extract_topics(message: str) -> List[str]:
     """Simple topic extraction from student messages"""
     topic_keywords = {
@@ -2745,29 +4086,46 @@ def extract_topics(message: str) -> List[str]:
     return found_topics
 
 @app.get("/api/students/{student_id}/conversations")
-async def get_conversations(student_id: str):
-    """Get conversation history"""
-    if student_id not in students_db:
+async def get_conversations(student_id: str, limit: int = 20, before: Optional[str] = None,
+                            db: AsyncSession = Depends(get_async_read_db)):
+    """Get conversation history, newest first.
+
+    Pass the returned next_cursor as `before` to fetch the next (older) page.
+    """
+    if not await get_or_create_student(student_id, db):
         raise HTTPException(status_code=404, detail="Student not found")
-    return conversations_db.get(student_id, [])
+    limit = max(1, min(limit, 100))
+    try:
+        before_key = ConversationStorage.decode_cursor(before) if before else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    conversations = await ConversationStorage.get_page(student_id, limit, db, before=before_key)
+    next_cursor = ConversationStorage.encode_cursor(conversations[-1]) if len(conversations) == limit else None
+    return {
+        "student_id": student_id,
+        "conversations": conversations,
+        "next_cursor": next_cursor
+    }
 
 @app.get("/api/students/{student_id}/progress")
-async def get_progress(student_id: str):
+async def get_progress(student_id: str, db: AsyncSession = Depends(get_async_read_db)):
     """Get student progress data"""
-    if student_id not in students_db:
+    if not await get_or_create_student(student_id, db):
         raise HTTPException(status_code=404, detail="Student not found")
-    return progress_db.get(student_id, {})
+    return student_progress(student_id)
 
 @app.get("/api/parent/dashboard/{student_id}")
-async def parent_dashboard(student_id: str):
+async def parent_dashboard(student_id: str, db: AsyncSession = Depends(get_async_read_db)):
     """Get data for parent dashboard"""
-    if student_id not in students_db:
+    student = await get_or_create_student(student_id, db)
+    if not student:
         raise HTTPException(status_code=404, detail="Student not found")
     
     return {
-        "student": students_db[student_id],
-        "progress": progress_db[student_id],
-        "recent_conversations": conversations_db[student_id][-5:],  # Last 5 conversations
+        "student": student,
+        "progress": student_progress(student_id),
+        "recent_conversations": await ConversationStorage.get_recent(student_id, 5, db),  # Last 5 conversations
         "summary": {
             "active_days_this_week": 3,  # Mock data
             "concepts_learned": 8,
@@ -2856,12 +4214,8 @@ async def get_student_dashboard(student_id: str):
 
         # Add student rank (non-fatal)
         try:
-            from database import SessionLocal
-            rank_db = SessionLocal()
-            try:
+            async with async_session_scope(readonly=True) as rank_db:
                 rank_info = await get_student_rank(student_id, rank_db)
-            finally:
-                rank_db.close()
             dashboard["rank"] = rank_info
         except Exception as rank_err:
             print(f"⚠️ Student rank failed (non-fatal): {rank_err}")
@@ -2965,12 +4319,8 @@ async def get_student_level_info(student_id: str):
         
         # Get rank information
         try:
-            from database import SessionLocal
-            rank_db = SessionLocal()
-            try:
+            async with async_session_scope(readonly=True) as rank_db:
                 rank_info = await get_student_rank(student_id, rank_db)
-            finally:
-                rank_db.close()
         except Exception:
             rank_info = {"name": "Novice Reader", "min_xp": 0}
 
@@ -3135,9 +4485,13 @@ async def start_quest(student_id: str, quest_data: Dict):
 @app.get("/api/gamification/leaderboard")
 async def get_leaderboard(timeframe: str = "all_time", limit: int = 10):
     """Get student leaderboard - FULLY FUNCTIONAL"""
+    if timeframe not in LEADERBOARD_TIMEFRAMES:
+        raise HTTPException(status_code=400, detail=f"timeframe must be one of {', '.join(LEADERBOARD_TIMEFRAMES)}")
     try:
         # Get real leaderboard data
-        leaderboard_data = await gamification_engine.get_leaderboard(timeframe, limit)
+        async with async_session_scope(readonly=True) as db:
+            leaderboard_data = await gamification_engine.get_leaderboard(timeframe, limit, db)
+            total_students = await GamificationStorage.count_leaderboard_students(timeframe, db)
         
         # Format leaderboard with additional stats
         formatted_leaderboard = []
@@ -3172,7 +4526,7 @@ async def get_leaderboard(timeframe: str = "all_time", limit: int = 10):
         return {
             "timeframe": timeframe,
             "leaderboard": formatted_leaderboard,
-            "total_students": len(student_levels_db),
+            "total_students": total_students,
             "last_updated": datetime.now().isoformat()
         }
         
@@ -3180,6 +4534,35 @@ async def get_leaderboard(timeframe: str = "all_time", limit: int = 10):
         print(f"Leaderboard error: {e}")
         return {"leaderboard": [], "error": str(e)}
 
+@app.get("/api/gamification/xp")
+async def get_xp_summary(student_ids: str, timeframe: str = "weekly", start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """XP earned by one or more students (comma-separated IDs, e.g. a class) in a time window.
+
+    Uses the current daily/weekly period by default; pass ``start``/``end``
+    (ISO timestamps) for a custom window.
+    """
+    try:
+        ids = [sid.strip() for sid in student_ids.split(",") if sid.strip()]
+        end = end or datetime.now()
+        if start is None:
+            periods = GamificationStorage.leaderboard_periods(end)
+            if timeframe not in periods:
+                raise HTTPException(status_code=400, detail="timeframe must be 'daily' or 'weekly' when start is not given")
+            start = periods[timeframe]
+
+        totals = await gamification_engine.get_xp_in_range(ids, start, end)
+        return {
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "students": totals,
+            "total_xp": sum(totals.values())
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"XP summary error: {e}")
+        return {"students": {}, "total_xp": 0, "error": str(e)}
+
 
 @app.get("/api/gamification/badges/catalog")
 async def get_badge_catalog():
@@ -3392,7 +4775,9 @@ async def get_todays_quest_progress(student_id: str, quest_id: str) -> Dict:
         
         # Get student's real stats
         student_stats = await gamification_engine.get_student_stats(student_id)
-        conversations = conversations_db.get(student_id, [])
+        today_start = datetime.combine(today, datetime.min.time())
+        async with async_session_scope(readonly=True) as conv_db:
+            conversations = await ConversationStorage.get_since(student_id, today_start, conv_db)
         
         # Calculate today's activities
         todays_progress = {}
@@ -3432,8 +4817,8 @@ async def get_todays_quest_progress(student_id: str, quest_id: str) -> Dict:
             "different_tutors_today": len(different_tutors_today),
             "topics_covered_today": len(topics_covered_today),
             "stories_generated_today": count_stories_generated_today(student_id),
-            "books_read_today": count_books_read_today(student_id),
-            "new_topics_today": count_new_topics_today(student_id),
+            "books_read_today": await count_books_read_today(student_id),
+            "new_topics_today": count_new_topics_today(conversations, student_id),
             "explanations_given_today": count_explanations_today(conversations),
             "math_problems_today": count_subject_interactions_today(conversations, "math"),
             "science_topics_today": count_subject_interactions_today(conversations, "science"),
@@ -3605,28 +4990,24 @@ def count_stories_generated_today(student_id: str) -> int:
     except Exception:
         return 0
 
-def count_books_read_today(student_id: str, db: Session = None) -> int:
+async def count_books_read_today(student_id: str, db: Optional[AsyncSession] = None) -> int:
     """Count books/chapters read today by querying ReadingSession table"""
     try:
-        if db is None:
-            # Get a DB session if one wasn't provided
-            from database import get_db
-            db = next(get_db())
         today_start = datetime.combine(datetime.now().date(), datetime.min.time())
-        count = db.query(ReadingSession).filter(
-            ReadingSession.user_id == student_id,
-            ReadingSession.end_time >= today_start
-        ).count()
+        async with async_session_scope(db, readonly=True) as db:
+            count = await db.scalar(select(func.count(ReadingSession.id)).where(
+                ReadingSession.user_id == student_id,
+                ReadingSession.end_time >= today_start
+            ))
         return count
 
     except Exception:
         return 0
 
-def count_new_topics_today(student_id: str) -> int:
+def count_new_topics_today(conversations: List[Dict], student_id: str) -> int:
     """Count new topics explored today"""
     try:
         today = datetime.now().date()
-        conversations = conversations_db.get(student_id, [])
         existing_topics = set(progress_db.get(student_id, {}).get("topics_covered", []))
         
         todays_new_topics = set()
@@ -3777,21 +5158,8 @@ async def lifespan(app: FastAPI):
     """Lifespan context manager for FastAPI application startup and shutdown events"""
     # Startup: Initialize gamification system
     try:
-        # Update gamification engine methods
-        gamification_engine.get_student_stats = GamificationStorage.get_student_stats
-        gamification_engine.student_has_badge = GamificationStorage.student_has_badge
-        gamification_engine.award_badge = GamificationStorage.award_badge
-        gamification_engine.get_student_badges = GamificationStorage.get_student_badges
-        gamification_engine.get_student_level = GamificationStorage.get_student_level
-        gamification_engine.save_student_level = GamificationStorage.save_student_level
-        gamification_engine.get_streak = GamificationStorage.get_streak
-        gamification_engine.save_streak = GamificationStorage.save_streak
-        gamification_engine.get_student_streaks = GamificationStorage.get_student_streaks
-        gamification_engine.get_active_quests = GamificationStorage.get_active_quests
-        gamification_engine.save_quest_progress = GamificationStorage.save_quest_progress
-        gamification_engine.get_recent_achievements = GamificationStorage.get_recent_achievements
-        gamification_engine.get_leaderboard = GamificationStorage.get_leaderboard_data
-        
+        # GamificationEngine delegates to GamificationStorage itself, passing
+        # a shared session through each activity, so nothing to rebind here.
         print("✅ Gamification system initialized successfully!")
     except Exception as e:
         print(f"❌ Error initializing gamification: {e}")
@@ -3812,34 +5180,5 @@ if __name__ == "__main__":
 # 4. Run: python backend_server.py
 # 5. Visit: http://localhost:8000/docs for API documentation
 
-# Alternative: Use Anthropic Claude instead of OpenAI
-# Uncomment below and install anthropic: pip install anthropic
-"""
-import anthropic
-
-ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "your-anthropic-key-here")
-anthropic_client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-
-# In the AITutor class, replace the get_response method with:
-async def get_response_anthropic(self, message: str, conversation_history: List[Dict]) -> str:
-    try:
-        # Build conversation context for Claude
-        conversation_text = ""
-        for exchange in conversation_history[-5:]:  # Last 5 exchanges
-            conversation_text += f"Human: {exchange['student_message']}\n"
-            conversation_text += f"Assistant: {exchange['ai_response']}\n"
-        
-        full_prompt = f"{self.system_prompt}\n\nConversation so far:\n{conversation_text}\nHuman: {message}\n\nAssistant:"
-        
-        response = anthropic_client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=500,
-            messages=[{"role": "user", "content": full_prompt}]
-        )
-        
-        return response.content[0].text
-        
-    except Exception as e:
-        print(f"Anthropic API Error: {e}")
-        return self.get_fallback_response(message)
-"""
\ No newline at end of file
+# Anthropic Claude: set ANTHROPIC_API_KEY as well (or instead) and tutor
+# chat uses it as a hedge/failover provider, see backend/providers.py
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime, Float, ForeignKey, Table, Boolean, Text
+from sqlalchemy import Column, String, Integer, DateTime, Float, ForeignKey, Table, Boolean, Text, Index, JSON
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -27,6 +27,9 @@ class Chapter(Base):
     last_read_at = Column(DateTime, nullable=True)
     reading_progress = Column(Float, default=0)
     is_completed = Column(Boolean, default=False)
+    library_id = Column(String, nullable=True)  # chapter_library entry this was copied from/into
+    topic = Column(String, nullable=True)
+    chapter_number = Column(Integer, nullable=True)
 
     user = relationship("User", back_populates="chapters")
     reading_sessions = relationship("ReadingSession", back_populates="chapter")
@@ -66,17 +69,166 @@ class StudentLevelDB(Base):
     current_level = Column(Integer, default=1)
     current_xp = Column(Integer, default=0)
     xp_to_next_level = Column(Integer, default=100)
-    total_xp_earned = Column(Integer, default=0)
+    total_xp_earned = Column(Integer, default=0, index=True)
     title = Column(String, default="Curious Beginner")
 
 class StudentBadgeDB(Base):
     __tablename__ = "student_badges"
+    __table_args__ = (
+        # One row per (student, badge); award_badges() relies on this for ON CONFLICT DO NOTHING
+        Index("uq_student_badges_student_badge", "student_id", "badge_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     student_id = Column(String, ForeignKey("users.id"), index=True)
     badge_id = Column(String, index=True)
     earned_date = Column(DateTime, default=datetime.utcnow)
 
+class ConversationDB(Base):
+    """One tutor exchange: the student's message and the tutor's reply"""
+    __tablename__ = "conversations"
+    __table_args__ = (
+        Index("ix_conversations_student_created", "student_id", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    student_id = Column(String, ForeignKey("users.id"), nullable=False)
+    student_message = Column(Text, nullable=False)
+    ai_response = Column(Text, nullable=False)
+    tutor_type = Column(String, default="general")
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+
+class ConversationSummaryDB(Base):
+    """Rolling summary of a student's older tutor exchanges.
+
+    Covers every exchange up to and including through_id; the tutor gets it
+    in place of those turns once they no longer fit its context budget.
+    """
+    __tablename__ = "conversation_summaries"
+
+    student_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    summary = Column(Text, nullable=False)
+    through_id = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+class ChapterLibraryDB(Base):
+    """A generated chapter kept for reuse by students asking for the same thing.
+
+    library_key hashes the normalized topic, grade and interest set; students
+    with the same key get a copy of one of its chapters instead of a new
+    generation.
+    """
+    __tablename__ = "chapter_library"
+    __table_args__ = (
+        Index("ix_chapter_library_key_created", "library_key", "created_at"),
+    )
+
+    id = Column(String, primary_key=True)
+    library_key = Column(String, nullable=False)
+    topic = Column(String, nullable=False)
+    grade_level = Column(Integer, nullable=False)
+    interests = Column(JSON, default=list)
+    title = Column(String, nullable=True)  # None when the generated text had no title line
+    content = Column(Text, nullable=False)
+    times_served = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+class PendingChapterDB(Base):
+    """A chapter generated ahead of time, waiting for the student to ask for it.
+
+    Written by the background pre-generation of chapter N+1 and removed when
+    /api/generate-chapter hands it out as a regular Chapter.
+    """
+    __tablename__ = "pending_chapters"
+    __table_args__ = (
+        Index("uq_pending_chapters_student_topic_number", "student_id", "topic_key", "chapter_number", unique=True),
+    )
+
+    id = Column(String, primary_key=True)  # becomes the Chapter id
+    student_id = Column(String, ForeignKey("users.id"), nullable=False)
+    topic_key = Column(String, nullable=False)  # normalized topic
+    topic = Column(String, nullable=False)
+    chapter_number = Column(Integer, nullable=False)
+    title = Column(String, nullable=False)
+    content = Column(Text, nullable=False)
+    library_id = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+# expires_at for quests without a time limit; keeps the active-quest lookup a plain range
+QUEST_NO_EXPIRY = datetime(9999, 12, 31)
+
+class StudentQuestDB(Base):
+    """A quest a student has started, with progress toward its requirements.
+
+    expires_at is fixed when the quest starts (start + time limit, or
+    QUEST_NO_EXPIRY for quests without one), so the active quests for a
+    student are one range scan on the composite index.
+    """
+    __tablename__ = "student_quests"
+    __table_args__ = (
+        Index("ix_student_quests_active", "student_id", "completed", "expires_at"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    student_id = Column(String, ForeignKey("users.id"), nullable=False)
+    quest_id = Column(String, nullable=False)
+    progress = Column(JSON, default=dict)
+    start_date = Column(DateTime, default=datetime.now, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    completed = Column(Boolean, default=False, nullable=False)
+    completion_date = Column(DateTime, nullable=True)
+
+class LeaderboardEntryDB(Base):
+    """XP earned per student within a leaderboard period (daily / weekly).
+
+    Maintained incrementally on every XP change, so ranking a period is a
+    single indexed read instead of an aggregate over activity history.
+    All-time rankings read StudentLevelDB.total_xp_earned directly.
+    """
+    __tablename__ = "leaderboard_entries"
+    __table_args__ = (
+        Index("uq_leaderboard_period_student", "timeframe", "period_start", "student_id", unique=True),
+        Index("ix_leaderboard_period_xp", "timeframe", "period_start", "xp"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    timeframe = Column(String, nullable=False)  # "daily" or "weekly"
+    period_start = Column(DateTime, nullable=False)
+    student_id = Column(String, ForeignKey("users.id"), nullable=False)
+    xp = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class XPEventDB(Base):
+    """Append-only ledger of every XP grant"""
+    __tablename__ = "xp_events"
+    __table_args__ = (
+        Index("ix_xp_events_student_created", "student_id", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    student_id = Column(String, ForeignKey("users.id"), nullable=False)
+    amount = Column(Integer, nullable=False)
+    reason = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+
+class XPRollupDB(Base):
+    """XP per student per hour/day bucket, kept in step with xp_events.
+
+    Time-windowed totals ("XP this week") read a handful of these rows
+    instead of aggregating the raw ledger.
+    """
+    __tablename__ = "xp_rollups"
+    __table_args__ = (
+        Index("uq_xp_rollups_student_bucket", "student_id", "granularity", "bucket_start", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    student_id = Column(String, ForeignKey("users.id"), nullable=False)
+    granularity = Column(String, nullable=False)  # "hour" or "day"
+    bucket_start = Column(DateTime, nullable=False)
+    xp = Column(Integer, default=0)
+    event_count = Column(Integer, default=0)
+
 class StudentStatsDB(Base):
     __tablename__ = "student_stats"
 
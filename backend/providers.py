@@ -0,0 +1,389 @@
+"""
+Chat providers with hedged requests for tutor replies.
+
+A tutor reply used to be one OpenAI call, so a slow or stalled OpenAI
+response was the student's wait. ChatProvider puts OpenAI and Anthropic
+behind the same two calls, complete() and stream(), and the hedged_*
+functions race them:
+
+1. The first configured provider in LLM_PROVIDERS gets the request.
+2. If it hasn't answered (complete) or produced its first token (stream)
+   within its p95 latency for that kind of call, the same request goes to
+   the next provider, and whichever answers first wins. The loser is
+   cancelled, which closes its connection and frees its scheduler slot.
+3. A provider that fails before answering hands over to the next one at
+   once, so an outage costs one error instead of the fallback reply.
+
+Each provider keeps its recent latencies per kind of call; until it has
+HEDGE_MIN_SAMPLES answered calls the budget is CHAT_HEDGE_DELAY_MS. A
+call cancelled because another provider won (or time ran out) is kept
+as a censored sample: it would have taken at least that long, so
+dropping it would make a slow provider look fast and hedge too early.
+Calls that failed aren't sampled. Nobody waits more than
+CHAT_FIRST_TOKEN_TIMEOUT seconds for a first streamed token, or
+CHAT_COMPLETE_TIMEOUT seconds for a whole reply, across all providers
+(TimeoutError, so callers fall back as they do for any other error).
+
+Anthropic is called on its Messages API through the pooled "anthropic"
+client in http_clients, so it needs no SDK, only ANTHROPIC_API_KEY (and
+optionally ANTHROPIC_MODEL / ANTHROPIC_BASE_URL). With one provider
+configured nothing is hedged and calls behave as before, apart from the
+timeout. Each provider's calls go through its own LLMScheduler.
+"""
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from http_clients import get_http_client
+from llm import create_chat_completion, estimate_tokens, get_scheduler, stream_chat_completion
+from scheduler import Priority
+
+LATENCY_SAMPLES = 200      # recent latencies kept per provider and kind of call
+HEDGE_MIN_SAMPLES = 20     # below this the default budget is used instead of the p95
+HEDGE_PERCENTILE = 0.95
+MIN_HEDGE_DELAY = 0.05     # seconds; never hedge sooner than this
+ANTHROPIC_VERSION = "2023-06-01"
+KINDS = ("complete", "first_token")
+
+
+def _float_env(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def hedging_enabled() -> bool:
+    return os.getenv("CHAT_HEDGE_ENABLED", "1") != "0"
+
+
+class ProviderError(Exception):
+    pass
+
+
+class LatencyTracker:
+    """Recent latencies (seconds) with percentiles.
+
+    A censored sample is a lower bound: the call was cancelled after that
+    long without answering. Percentiles use the Kaplan-Meier estimate, so
+    censored samples count as "still waiting" up to their time.
+    """
+
+    def __init__(self, samples: int = LATENCY_SAMPLES):
+        self._samples: Deque[Tuple[float, bool]] = deque(maxlen=samples)
+
+    def record(self, seconds: float, censored: bool = False):
+        self._samples.append((seconds, censored))
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    @property
+    def answered(self) -> int:
+        return sum(1 for _, censored in self._samples if not censored)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        # Answers sort before cancellations at the same time
+        ordered = sorted(self._samples)
+        at_risk = len(ordered)
+        survival = 1.0
+        for seconds, censored in ordered:
+            if not censored:
+                survival *= 1 - 1 / at_risk
+                if 1 - survival > fraction + 1e-9:
+                    return seconds
+            at_risk -= 1
+        # Not enough answers to reach the percentile: the longest wait is a lower bound
+        return ordered[-1][0]
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait for this provider before asking the next one"""
+        if self.answered < HEDGE_MIN_SAMPLES:
+            delay = _float_env("CHAT_HEDGE_DELAY_MS", 2000) / 1000
+        else:
+            delay = self.percentile(HEDGE_PERCENTILE)
+        return max(delay, MIN_HEDGE_DELAY)
+
+    def stats(self) -> Dict:
+        def ms(value):
+            return round(value * 1000, 1) if value is not None else None
+
+        return {
+            "samples": len(self._samples),
+            "censored": len(self._samples) - self.answered,
+            "p50_ms": ms(self.percentile(0.5)),
+            "p95_ms": ms(self.percentile(0.95)),
+            "p99_ms": ms(self.percentile(0.99)),
+            "hedge_after_ms": ms(self.hedge_delay()),
+        }
+
+
+class ChatProvider:
+    """One LLM vendor: complete() returns the reply, stream() yields its text pieces"""
+
+    name = ""
+
+    def __init__(self):
+        self.latency = {kind: LatencyTracker() for kind in KINDS}
+        self.requests = 0
+        self.hedged = 0    # requests sent because an earlier provider was slow
+        self.wins = 0
+        self.errors = 0
+        self.cancelled = 0  # lost the race
+
+    def configured(self) -> bool:
+        raise NotImplementedError
+
+    async def complete(self, priority: Priority, student_id: Optional[Hashable], messages: List[Dict],
+                       max_tokens: int, temperature: float, **options) -> str:
+        raise NotImplementedError
+
+    def stream(self, priority: Priority, student_id: Optional[Hashable], messages: List[Dict],
+               max_tokens: int, temperature: float, **options) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+    def stats(self) -> Dict:
+        return {
+            "configured": self.configured(),
+            "requests": self.requests,
+            "hedged_requests": self.hedged,
+            "wins": self.wins,
+            "errors": self.errors,
+            "cancelled": self.cancelled,
+            "latency": {kind: tracker.stats() for kind, tracker in self.latency.items()},
+        }
+
+
+class OpenAIProvider(ChatProvider):
+    name = "openai"
+
+    @property
+    def model(self) -> str:
+        return os.getenv("OPENAI_CHAT_MODEL", "gpt-3.5-turbo")
+
+    def configured(self) -> bool:
+        key = os.getenv("OPENAI_API_KEY")
+        return bool(key) and not key.startswith("your")
+
+    async def complete(self, priority, student_id, messages, max_tokens, temperature, **options) -> str:
+        response = await create_chat_completion(
+            priority, student_id, model=self.model, messages=messages, max_tokens=max_tokens,
+            temperature=temperature, timeout=_float_env("CHAT_REQUEST_TIMEOUT", 60), **options
+        )
+        return response.choices[0].message.content or ""
+
+    async def stream(self, priority, student_id, messages, max_tokens, temperature, **options) -> AsyncIterator[str]:
+        chunks = stream_chat_completion(
+            priority, student_id, model=self.model, messages=messages, max_tokens=max_tokens,
+            temperature=temperature, timeout=_float_env("CHAT_REQUEST_TIMEOUT", 60), **options
+        )
+        try:
+            async for chunk in chunks:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await chunks.aclose()
+
+
+class AnthropicProvider(ChatProvider):
+    name = "anthropic"
+
+    @property
+    def model(self) -> str:
+        return os.getenv("ANTHROPIC_MODEL", "claude-3-5-haiku-latest")
+
+    def configured(self) -> bool:
+        key = os.getenv("ANTHROPIC_API_KEY")
+        return bool(key) and not key.startswith("your")
+
+    def _payload(self, messages: List[Dict], max_tokens: int, temperature: float) -> Dict:
+        """OpenAI-style messages to a Messages API body: system text apart, roles alternating"""
+        system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+        turns: List[Dict] = []
+        for message in messages:
+            if message["role"] == "system":
+                continue
+            if turns and turns[-1]["role"] == message["role"]:
+                turns[-1]["content"] += "\n\n" + message["content"]
+            else:
+                turns.append({"role": message["role"], "content": message["content"]})
+        if turns and turns[0]["role"] != "user":
+            turns.insert(0, {"role": "user", "content": "(conversation continues)"})
+        payload = {"model": self.model, "max_tokens": max_tokens, "temperature": temperature, "messages": turns}
+        if system:
+            payload["system"] = system
+        return payload
+
+    def _headers(self) -> Dict:
+        return {"x-api-key": os.getenv("ANTHROPIC_API_KEY", ""), "anthropic-version": ANTHROPIC_VERSION}
+
+    async def complete(self, priority, student_id, messages, max_tokens, temperature, **options) -> str:
+        # OpenAI-only options (presence_penalty, ...) have no Messages API equivalent
+        async with get_scheduler(self.name).slot(priority, student_id, estimate_tokens(messages, max_tokens)):
+            response = await get_http_client("anthropic").post(
+                "/v1/messages", json=self._payload(messages, max_tokens, temperature), headers=self._headers()
+            )
+        if response.status_code != 200:
+            raise ProviderError(f"Anthropic API error {response.status_code}: {response.text[:200]}")
+        return "".join(block.get("text", "") for block in response.json().get("content", []))
+
+    async def stream(self, priority, student_id, messages, max_tokens, temperature, **options) -> AsyncIterator[str]:
+        payload = {**self._payload(messages, max_tokens, temperature), "stream": True}
+        async with get_scheduler(self.name).slot(priority, student_id, estimate_tokens(messages, max_tokens)):
+            async with get_http_client("anthropic").stream(
+                "POST", "/v1/messages", json=payload, headers=self._headers()
+            ) as response:
+                if response.status_code != 200:
+                    body = await response.aread()
+                    raise ProviderError(f"Anthropic API error {response.status_code}: {body[:200].decode(errors='replace')}")
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    event = json.loads(line[5:])
+                    if event.get("type") == "content_block_delta":
+                        text = event.get("delta", {}).get("text")
+                        if text:
+                            yield text
+                    elif event.get("type") == "error":
+                        raise ProviderError(f"Anthropic stream error: {event.get('error')}")
+                    elif event.get("type") == "message_stop":
+                        return
+
+
+PROVIDERS: Dict[str, ChatProvider] = {provider.name: provider for provider in (OpenAIProvider(), AnthropicProvider())}
+
+
+def race_timeout(kind: str) -> float:
+    """Seconds the whole race may take: to the first token, or to the full reply"""
+    if kind == "first_token":
+        return _float_env("CHAT_FIRST_TOKEN_TIMEOUT", 20)
+    return _float_env("CHAT_COMPLETE_TIMEOUT", 45)
+
+
+def configured_providers() -> List[ChatProvider]:
+    """Providers with an API key, in LLM_PROVIDERS order"""
+    order = [name.strip() for name in os.getenv("LLM_PROVIDERS", "openai,anthropic").split(",") if name.strip()]
+    return [PROVIDERS[name] for name in order if name in PROVIDERS and PROVIDERS[name].configured()]
+
+
+async def _race(kind: str, attempt: Callable[[ChatProvider], Awaitable[Any]],
+                discard: Callable[[Any], Awaitable[None]]) -> Tuple[ChatProvider, Any]:
+    """Run attempt() on the first provider, hedging and failing over to the rest; return the first answer"""
+    queue = configured_providers()
+    if not queue:
+        raise ProviderError("No LLM provider API key is configured")
+    loop = asyncio.get_running_loop()
+    timeout = race_timeout(kind)
+    deadline = loop.time() + timeout
+    hedge = hedging_enabled()
+    tasks: Dict[asyncio.Task, ChatProvider] = {}
+    hedge_at = None
+    winner = None
+    errors: List[Exception] = []
+
+    def launch(hedged: bool):
+        nonlocal hedge_at
+        provider = queue.pop(0)
+        provider.requests += 1
+        provider.hedged += hedged
+
+        async def timed():
+            started = time.monotonic()
+            try:
+                result = await attempt(provider)
+            except asyncio.CancelledError:
+                provider.latency[kind].record(time.monotonic() - started, censored=True)
+                raise
+            provider.latency[kind].record(time.monotonic() - started)
+            return result
+
+        tasks[loop.create_task(timed())] = provider
+        hedge_at = loop.time() + provider.latency[kind].hedge_delay()
+
+    launch(hedged=False)
+    try:
+        while winner is None:
+            if not tasks:
+                if not queue:
+                    raise errors[-1]
+                launch(hedged=False)  # fail over
+                continue
+            now = loop.time()
+            if now >= deadline:
+                raise asyncio.TimeoutError(f"No LLM reply within {timeout} s")
+            wake = min(deadline, hedge_at) if hedge and queue else deadline
+            done, _ = await asyncio.wait(list(tasks), timeout=max(0.0, wake - now), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                provider = tasks.pop(task)
+                if task.exception() is not None:
+                    provider.errors += 1
+                    errors.append(task.exception())
+                    print(f"⚠️ {provider.name} chat call failed: {task.exception()}")
+                elif winner is None:
+                    winner = (provider, task.result())
+                else:
+                    await discard(task.result())
+            if winner is None and not done and hedge and queue and loop.time() >= hedge_at:
+                launch(hedged=True)
+    finally:
+        for task, provider in tasks.items():
+            task.cancel()
+            provider.cancelled += 1
+        for outcome in await asyncio.gather(*tasks, return_exceptions=True):
+            if not isinstance(outcome, BaseException):
+                await discard(outcome)
+    winner[0].wins += 1
+    return winner
+
+
+async def hedged_chat_completion(priority: Priority, student_id: Optional[Hashable], messages: List[Dict],
+                                 max_tokens: int, temperature: float, **options) -> str:
+    """The reply from whichever configured provider answers first (see module docstring)"""
+    async def attempt(provider: ChatProvider) -> str:
+        return await provider.complete(priority, student_id, messages, max_tokens, temperature, **options)
+
+    async def discard(result):
+        pass
+
+    _, reply = await _race("complete", attempt, discard)
+    return reply
+
+
+async def hedged_chat_stream(priority: Priority, student_id: Optional[Hashable], messages: List[Dict],
+                             max_tokens: int, temperature: float, **options) -> AsyncIterator[str]:
+    """Streaming hedged_chat_completion: the race is to the first token, then one provider streams the rest"""
+    async def attempt(provider: ChatProvider):
+        pieces = provider.stream(priority, student_id, messages, max_tokens, temperature, **options)
+        try:
+            first = await pieces.__anext__()
+        except StopAsyncIteration:
+            first = ""
+        except BaseException:
+            await pieces.aclose()
+            raise
+        return pieces, first
+
+    async def discard(result):
+        await result[0].aclose()
+
+    _, (pieces, first) = await _race("first_token", attempt, discard)
+    try:
+        if first:
+            yield first
+        async for text in pieces:
+            yield text
+    finally:
+        await pieces.aclose()
+
+
+def provider_stats() -> Dict:
+    return {
+        "order": [provider.name for provider in configured_providers()],
+        "hedging": hedging_enabled(),
+        "first_token_timeout_s": race_timeout("first_token"),
+        "complete_timeout_s": race_timeout("complete"),
+        "providers": {name: provider.stats() for name, provider in PROVIDERS.items()},
+    }
@@ -0,0 +1,176 @@
+"""
+Priority-aware admission for LLM calls.
+
+Every call to a provider first takes a slot from that provider's
+LLMScheduler. The scheduler bounds how many calls run at once and how many
+tokens are sent per minute, and hands out free slots in priority order:
+a child stuck on a word (INTERACTIVE) goes ahead of tutor chat, which goes
+ahead of chapter generation and background work. Within one priority,
+waiting students are served round-robin, so one student's burst can't hold
+up the rest of the class.
+
+The last `reserved` slots, and the last INTERACTIVE_TOKEN_SHARE of the
+token budget, are kept for INTERACTIVE calls, so stuck-word help never
+waits for an 800-token story to finish even when every other slot is busy
+writing chapters. Token budgets use the caller's estimate (prompt +
+max_tokens) over a sliding one-minute window; 0 turns the budget off.
+
+Like WorkerPool, queues belong to the event loop they were created on and
+start over on a new loop. stats() reports queue depth and wait times per
+priority for the metrics endpoint.
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import Deque, Dict, Hashable, Optional
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # reading feedback, transcription
+    CHAT = 1
+    CHAPTER = 2
+    BACKGROUND = 3   # pre-generation, conversation summaries
+
+
+WAIT_SAMPLES = 500  # recent waits kept per priority for the percentiles
+INTERACTIVE_TOKEN_SHARE = 0.2  # of tokens_per_minute, usable only by INTERACTIVE calls
+
+
+class LLMScheduler:
+    def __init__(self, name: str, max_concurrency: int = 16, tokens_per_minute: int = 0, reserved: int = 2):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.tokens_per_minute = tokens_per_minute
+        self.reserved = min(max(0, reserved), self.max_concurrency - 1)
+        self._loop = None
+        self._reset()
+        self.granted = {p: 0 for p in Priority}
+        self._waits: Dict[Priority, Deque[float]] = {p: deque(maxlen=WAIT_SAMPLES) for p in Priority}
+
+    def _reset(self):
+        # priority -> student -> waiting (future, tokens, enqueued_at), FIFO per student
+        self._queues: Dict[Priority, OrderedDict] = {p: OrderedDict() for p in Priority}
+        self._window: Deque[tuple] = deque()  # (granted_at, tokens) in the last minute
+        self._window_tokens = 0
+        self._timer = None
+        self.in_flight = 0
+
+    def _check_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._reset()
+            self._loop = loop
+
+    def _limit_for(self, priority: Priority) -> int:
+        if priority == Priority.INTERACTIVE:
+            return self.max_concurrency
+        return self.max_concurrency - self.reserved
+
+    def _expire_window(self, now: float):
+        while self._window and now - self._window[0][0] >= 60:
+            self._window_tokens -= self._window.popleft()[1]
+
+    def _tokens_fit(self, priority: Priority, tokens: int, now: float) -> bool:
+        if not self.tokens_per_minute or not tokens:
+            return True
+        self._expire_window(now)
+        budget = self.tokens_per_minute
+        if priority != Priority.INTERACTIVE:
+            budget *= 1 - INTERACTIVE_TOKEN_SHARE
+        # A call bigger than the whole budget still runs once the window is empty
+        return self._window_tokens + tokens <= budget or not self._window
+
+    def _dispatch(self):
+        """Grant queued requests while slots and token budget allow, highest priority first"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        for priority in Priority:
+            students = self._queues[priority]
+            while students:
+                if self.in_flight >= self._limit_for(priority):
+                    break  # lower priorities have tighter limits, they can't run either
+                student, waiters = next(iter(students.items()))
+                future, tokens, enqueued_at = waiters[0]
+                if not self._tokens_fit(priority, tokens, now):
+                    # Wait for the budget; nothing lower may jump ahead of this request
+                    wake_in = 60 - (now - self._window[0][0])
+                    self._timer = self._loop.call_later(max(wake_in, 0.01), self._dispatch)
+                    return
+                waiters.popleft()
+                if waiters:
+                    students.move_to_end(student)  # round-robin between students
+                else:
+                    del students[student]
+                self._grant(priority, tokens, now - enqueued_at, now)
+                future.set_result(None)
+
+    def _grant(self, priority: Priority, tokens: int, waited: float, now: float):
+        self.in_flight += 1
+        if self.tokens_per_minute and tokens:
+            self._window.append((now, tokens))
+            self._window_tokens += tokens
+        self.granted[priority] += 1
+        self._waits[priority].append(waited)
+
+    def _release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority, student_id: Optional[Hashable] = None, tokens: int = 0):
+        """Hold one of the provider's slots for the duration of the block"""
+        self._check_loop()
+        future = self._loop.create_future()
+        entry = (future, tokens, time.monotonic())
+        students = self._queues[priority]
+        students.setdefault(student_id, deque()).append(entry)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()  # granted just as the caller went away
+            else:
+                waiters = students.get(student_id)
+                if waiters is not None and entry in waiters:
+                    waiters.remove(entry)
+                    if not waiters:
+                        del students[student_id]
+                    self._dispatch()  # the request behind it may fit now
+            raise
+        try:
+            yield
+        finally:
+            if self._loop is asyncio.get_running_loop():
+                self._release()
+
+    def queued(self, priority: Optional[Priority] = None) -> int:
+        priorities = [priority] if priority is not None else list(Priority)
+        return sum(len(waiters) for p in priorities for waiters in self._queues[p].values())
+
+    def stats(self) -> Dict:
+        self._expire_window(time.monotonic())
+        priorities = {}
+        for priority in Priority:
+            waits = sorted(self._waits[priority])
+            priorities[priority.name.lower()] = {
+                "queued": self.queued(priority),
+                "waiting_students": len(self._queues[priority]),
+                "granted": self.granted[priority],
+                "avg_wait_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+                "p95_wait_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+                "max_wait_ms": round(waits[-1] * 1000, 1) if waits else 0.0,
+            }
+        return {
+            "max_concurrency": self.max_concurrency,
+            "reserved_interactive": self.reserved,
+            "tokens_per_minute": self.tokens_per_minute,
+            "in_flight": self.in_flight,
+            "tokens_last_minute": self._window_tokens,
+            "queued": self.queued(),
+            "priorities": priorities,
+        }
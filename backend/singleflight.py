@@ -0,0 +1,68 @@
+"""
+Coalescing of identical concurrent outbound calls ("single flight").
+
+When a class listens to the same projected chapter, 25 students press
+"listen" at once and /api/tts would make 25 identical ElevenLabs calls.
+SingleFlight.do(key, fn) runs fn() only if no call with the same key is in
+flight; otherwise it waits for that call, and its result (or exception) is
+handed to every waiter. Nothing is kept once the call finishes, so this is
+not a cache: the next request after it completes makes a new call.
+
+Keys are hashes of the outbound request (SingleFlight.key), so only calls
+that would send exactly the same thing are merged. The shared call runs in
+a task of its own, so a waiter that goes away (client disconnect) doesn't
+cancel it for the others. Like WorkerPool, in-flight calls belong to the
+event loop they started on; a new loop starts over.
+"""
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._loop = None
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        """Hash of the parts of an outbound request (JSON-serializable values)"""
+        raw = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]) -> Any:
+        """Return fn()'s result, sharing one call among concurrent callers with the same key"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._calls = {}
+            self._loop = loop
+        self.calls += 1
+        task = self._calls.get(key)
+        if task is None:
+            self.executions += 1
+            task = loop.create_task(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Every waiter may have been cancelled; mark the exception retrieved either way
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls),
+        }
@@ -0,0 +1,317 @@
+"""
+Offline stand-in for the OpenAI, Anthropic and ElevenLabs APIs.
+
+Speaks the wire formats the backend uses, so /api/chat, /api/chat/stream,
+/api/generate-chapter, /api/reading/feedback, /api/reading/transcribe and
+/api/tts can be load-tested without keys or network:
+
+    POST /v1/chat/completions               OpenAI chat (JSON or SSE stream)
+    POST /v1/audio/transcriptions           OpenAI Whisper (multipart)
+    POST /v1/messages                       Anthropic Messages (JSON or SSE)
+    POST /v1/text-to-speech/{voice_id}      ElevenLabs TTS (audio/mpeg)
+    GET  /stub/stats                        requests, injected errors, concurrency
+    GET  /stub/config, PUT /stub/config     read or change the settings below
+
+Run it and point the backend at it with UPSTREAM_STUB_URL (see main.py):
+
+    python backend/stub_upstream.py --port 8100
+    UPSTREAM_STUB_URL=http://127.0.0.1:8100 uvicorn main:app
+
+Behaviour is set per kind of call ("chat", "stt", "tts") from the
+environment, with a suffix for one kind (STUB_LATENCY_MS_TTS=150):
+
+    STUB_LATENCY_MS          median time to first byte/token (chat 400, stt 500, tts 300)
+    STUB_LATENCY_DIST        lognormal (default), uniform or fixed
+    STUB_LATENCY_SPREAD      lognormal sigma, or +/- fraction for uniform (0.5)
+    STUB_TOKENS_PER_SECOND   chat generation rate after the first token (60)
+    STUB_REPLY_TOKENS        longest chat reply, in words (150; max_tokens caps it too)
+    STUB_ERROR_RATE          share of calls answered with an error (0)
+    STUB_ERROR_STATUS        status of those errors (500; 429 for rate limits)
+    STUB_SEED                random seed, for repeatable runs
+
+Chat replies start with a "Title:" line so chapter parsing works on them.
+TTS returns silent MP3 frames, about as many bytes as real speech of that
+text. Latencies are asyncio sleeps, so one process keeps thousands of
+calls in flight.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+
+KINDS = ("chat", "stt", "tts")
+DEFAULTS = {
+    "latency_ms": {"chat": 400.0, "stt": 500.0, "tts": 300.0},
+    "latency_dist": "lognormal",
+    "latency_spread": 0.5,
+    "tokens_per_second": 60.0,
+    "reply_tokens": 150,
+    "error_rate": 0.0,
+    "error_status": 500,
+}
+ENV_NAMES = {
+    "latency_ms": "STUB_LATENCY_MS",
+    "latency_dist": "STUB_LATENCY_DIST",
+    "latency_spread": "STUB_LATENCY_SPREAD",
+    "tokens_per_second": "STUB_TOKENS_PER_SECOND",
+    "reply_tokens": "STUB_REPLY_TOKENS",
+    "error_rate": "STUB_ERROR_RATE",
+    "error_status": "STUB_ERROR_STATUS",
+}
+
+SENTENCES = [
+    "The little fox ran to the big red barn.",
+    "She saw a bird sitting on the old fence.",
+    "They counted the stars until the moon came up.",
+    "A brave frog jumped over the muddy pond.",
+    "We can learn something new every single day.",
+]
+TRANSCRIPT = "the little fox ran to the big red barn"
+
+# One silent MPEG-1 Layer III frame (128 kbps, 44.1 kHz): 417 bytes, 26 ms
+MP3_FRAME = b"\xff\xfb\x90\x64" + bytes(413)
+MP3_FRAMES_PER_SECOND = 38.28
+CHARACTERS_PER_SECOND = 15  # of read-aloud speech
+
+
+def settings_from_env() -> Dict[str, Dict]:
+    """Settings per kind of call: defaults, then STUB_*, then STUB_*_<KIND>"""
+    settings = {}
+    for kind in KINDS:
+        values = {}
+        for key, env_name in ENV_NAMES.items():
+            default = DEFAULTS[key][kind] if isinstance(DEFAULTS[key], dict) else DEFAULTS[key]
+            raw = os.getenv(f"{env_name}_{kind.upper()}") or os.getenv(env_name)
+            values[key] = type(default)(raw) if raw else default
+        settings[kind] = values
+    return settings
+
+
+class StubState:
+    def __init__(self, settings: Dict[str, Dict], seed: Optional[int] = None):
+        self.settings = settings
+        self.random = random.Random(seed)
+        self.requests = {kind: 0 for kind in KINDS}
+        self.errors = {kind: 0 for kind in KINDS}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def latency(self, kind: str) -> float:
+        """Seconds to wait before the first byte, drawn from the kind's distribution"""
+        config = self.settings[kind]
+        median = config["latency_ms"] / 1000
+        spread = config["latency_spread"]
+        if config["latency_dist"] == "fixed" or spread <= 0:
+            return median
+        if config["latency_dist"] == "uniform":
+            return max(0.0, self.random.uniform(median * (1 - spread), median * (1 + spread)))
+        return median * self.random.lognormvariate(0, spread)
+
+    def should_fail(self, kind: str) -> bool:
+        if self.random.random() < self.settings[kind]["error_rate"]:
+            self.errors[kind] += 1
+            return True
+        return False
+
+    def reply_words(self, max_tokens: Optional[int]) -> list:
+        limit = self.settings["chat"]["reply_tokens"]
+        if max_tokens:
+            limit = min(limit, max_tokens)
+        words = ["Title:", "A", "Stub", "Story\n\n"]
+        start = self.random.randrange(len(SENTENCES))
+        i = 0
+        while len(words) < limit:
+            words.extend(SENTENCES[(start + i) % len(SENTENCES)].split())
+            i += 1
+        return words[:max(limit, 1)]
+
+    def stats(self) -> Dict:
+        return {
+            "requests": dict(self.requests),
+            "errors_injected": dict(self.errors),
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+        }
+
+
+def _pieces(words: list) -> list:
+    """One streamed piece per word, with the space that follows it"""
+    return [word if word.endswith("\n") else word + " " for word in words]
+
+
+def _join(words: list) -> str:
+    return "".join(_pieces(words)).rstrip()
+
+
+class CountInFlight:
+    """ASGI middleware: requests being handled, until the last byte of the response"""
+
+    def __init__(self, app, state: "StubState"):
+        self.app = app
+        self.state = state
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith("/stub/"):
+            return await self.app(scope, receive, send)
+        self.state.in_flight += 1
+        self.state.peak_in_flight = max(self.state.peak_in_flight, self.state.in_flight)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.state.in_flight -= 1
+
+
+def create_app(settings: Optional[Dict[str, Dict]] = None, seed: Optional[int] = None) -> FastAPI:
+    if seed is None and os.getenv("STUB_SEED"):
+        seed = int(os.getenv("STUB_SEED"))
+    state = StubState(settings or settings_from_env(), seed)
+    app = FastAPI(title="Peregrine upstream stub")
+    app.state.stub = state
+    app.add_middleware(CountInFlight, state=state)
+
+    async def begin(kind: str) -> bool:
+        """Count the call and wait out its latency; True if it should fail"""
+        state.requests[kind] += 1
+        fail = state.should_fail(kind)
+        await asyncio.sleep(state.latency(kind))
+        return fail
+
+    def openai_error(kind: str) -> JSONResponse:
+        status = state.settings[kind]["error_status"]
+        error_type = "rate_limit_exceeded" if status == 429 else "server_error"
+        return JSONResponse({"error": {"message": f"stub {error_type}", "type": error_type, "code": error_type}},
+                            status_code=status)
+
+    def token_delay() -> float:
+        return 1 / state.settings["chat"]["tokens_per_second"]
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        fail = await begin("chat")
+        if fail:
+            return openai_error("chat")
+        words = state.reply_words(body.get("max_tokens"))
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages", []))
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "created": int(time.time()), "model": body.get("model", "stub")}
+
+        if not body.get("stream"):
+            await asyncio.sleep(len(words) * token_delay())
+            return {**base, "object": "chat.completion", "choices": [{
+                "index": 0, "message": {"role": "assistant", "content": _join(words)}, "finish_reason": "stop"
+            }], "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                          "total_tokens": prompt_tokens + len(words)}}
+
+        async def events():
+            for i, piece in enumerate(_pieces(words)):
+                if i:
+                    await asyncio.sleep(token_delay())
+                chunk = {**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            done = {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            yield f"data: {json.dumps(done)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/messages")
+    async def anthropic_messages(request: Request):
+        body = await request.json()
+        fail = await begin("chat")
+        if fail:
+            status = state.settings["chat"]["error_status"]
+            error_type = "rate_limit_error" if status == 429 else "api_error"
+            return JSONResponse({"type": "error", "error": {"type": error_type, "message": f"stub {error_type}"}},
+                                status_code=status)
+        words = state.reply_words(body.get("max_tokens"))
+        message_id = f"msg_{uuid.uuid4().hex[:12]}"
+
+        if not body.get("stream"):
+            await asyncio.sleep(len(words) * token_delay())
+            return {"id": message_id, "type": "message", "role": "assistant", "model": body.get("model", "stub"),
+                    "content": [{"type": "text", "text": _join(words)}], "stop_reason": "end_turn",
+                    "usage": {"input_tokens": 0, "output_tokens": len(words)}}
+
+        async def events():
+            start = {"type": "message_start", "message": {"id": message_id, "type": "message", "role": "assistant",
+                                                           "model": body.get("model", "stub"), "content": []}}
+            yield f"event: message_start\ndata: {json.dumps(start)}\n\n"
+            for i, piece in enumerate(_pieces(words)):
+                if i:
+                    await asyncio.sleep(token_delay())
+                delta = {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": piece}}
+                yield f"event: content_block_delta\ndata: {json.dumps(delta)}\n\n"
+            yield 'event: message_stop\ndata: {"type": "message_stop"}\n\n'
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/audio/transcriptions")
+    async def transcriptions(request: Request):
+        form = await request.form()
+        fail = await begin("stt")
+        if fail:
+            return openai_error("stt")
+        if form.get("response_format") == "text":
+            return PlainTextResponse(TRANSCRIPT + "\n")
+        return {"text": TRANSCRIPT}
+
+    @app.post("/v1/text-to-speech/{voice_id}")
+    async def text_to_speech(voice_id: str, request: Request):
+        body = await request.json()
+        fail = await begin("tts")
+        if fail:
+            status = state.settings["tts"]["error_status"]
+            return JSONResponse({"detail": {"status": "stub_error", "message": "stub error"}}, status_code=status)
+        seconds = max(len(body.get("text", "")), 1) / CHARACTERS_PER_SECOND
+        return Response(MP3_FRAME * max(1, round(seconds * MP3_FRAMES_PER_SECOND)), media_type="audio/mpeg")
+
+    @app.get("/stub/stats")
+    async def stub_stats():
+        return state.stats()
+
+    @app.get("/stub/config")
+    async def get_config():
+        return state.settings
+
+    @app.put("/stub/config")
+    async def put_config(request: Request):
+        """Change settings while running, e.g. {"chat": {"error_rate": 0.1}}"""
+        for kind, values in (await request.json()).items():
+            for key, value in values.items():
+                state.settings[kind][key] = type(state.settings[kind][key])(value)
+        return state.settings
+
+    return app
+
+
+def run_in_thread(host: str = "127.0.0.1", port: int = 0, **kwargs):
+    """Start the stub on a background thread; returns (uvicorn server, base URL)"""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(create_app(**kwargs), host=host, port=port,
+                                           log_level="warning", lifespan="off"))
+    threading.Thread(target=lambda: asyncio.run(server.serve()), daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    bound_port = server.servers[0].sockets[0].getsockname()[1]
+    return server, f"http://{host}:{bound_port}"
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Offline OpenAI/Anthropic/ElevenLabs stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+    print(f"🧪 Upstream stub on http://{args.host}:{args.port} - settings: {json.dumps(settings_from_env())}")
+    uvicorn.run(create_app(), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,240 @@
+"""
+Local syllable splitting for stuck-word help.
+
+When a child is stuck on a word, the reading feedback breaks it into
+syllables ("but, ter, fly, butterfly!"). split_syllables() does that with
+English spelling rules plus a small table of irregular words, and
+stuck_word_feedback() wraps the result in a short spoken phrase, so the
+common case never waits on the LLM.
+
+Both return None when the split isn't trustworthy: unusual characters,
+vowel pairs that may or may not be two syllables ("lion" vs "coin"), long
+words, consonant clusters with no split that keeps digraphs whole, a silent
+"e" inside a compound ("spaceship"), or a chunk a TTS engine would read as a
+letter name ("a, bout").
+The caller then asks the LLM instead.
+"""
+import random
+import re
+from typing import List, Optional
+
+VOWELS = set("aeiou")
+
+# Vowel pairs that are one sound in some words and two in others
+AMBIGUOUS_VOWELS = ("ia", "io", "iu", "eo", "ua", "uo", "ui", "oe", "ue")
+
+# Consonant pairs that start a syllable together ("mon, ster", "hun, dred")
+ONSET_BLENDS = {
+    "bl", "br", "ch", "cl", "cr", "dr", "fl", "fr", "gl", "gr", "ph", "pl", "pr", "sc", "sh",
+    "sk", "sl", "sm", "sn", "sp", "st", "sw", "th", "tr", "tw", "wh", "wr",
+}
+# Consonant pairs that make one sound and stay with the syllable before ("fish, ing")
+DIGRAPHS = {"ch", "ck", "gh", "ng", "ph", "sh", "th", "wh"}
+THREE_LETTER_ONSETS = {"scr", "shr", "spl", "spr", "squ", "str", "thr"}
+
+# Words the rules get wrong, or that are too common to risk
+IRREGULAR = {
+    "people": ["peo", "ple"],
+    "because": ["be", "cause"],
+    "beautiful": ["beau", "ti", "ful"],
+    "different": ["dif", "fer", "ent"],
+    "every": ["ev", "ery"],
+    "everyone": ["ev", "ery", "one"],
+    "everything": ["ev", "ery", "thing"],
+    "orange": ["or", "ange"],
+    "lion": ["li", "on"],
+    "giant": ["gi", "ant"],
+    "quiet": ["qui", "et"],
+    "science": ["sci", "ence"],
+    "create": ["cre", "ate"],
+    "does": ["does"],
+    "shoes": ["shoes"],
+    "blue": ["blue"],
+    "clue": ["clue"],
+    "glue": ["glue"],
+    "true": ["true"],
+    "fruit": ["fruit"],
+    "juice": ["juice"],
+    "build": ["build"],
+    "guess": ["guess"],
+    "guitar": ["gui", "tar"],
+}
+
+# Endings that are always one syllable ("sta, tion", "de, li, cious")
+SUFFIXES = ("tion", "sion", "cian", "cious", "tious")
+
+MAX_WORD_LENGTH = 14
+MAX_SYLLABLES = 4
+
+MULTI_SYLLABLE_TEMPLATES = [
+    "The next word is {word}. Let's try it together, {parts}, {word}!",
+    "Let's sound it out slowly, {parts}, {word}!",
+    "This one is {word}. Say each part with me, {parts}, {word}!",
+]
+ONE_SYLLABLE_TEMPLATES = [
+    "This word is {word}. Say it with me, {word}!",
+    "The next word is {word}. Let's say it together, {word}!",
+    "You've got this, the word is {word}. Try it, {word}!",
+]
+
+
+def _vowel_positions(word: str) -> List[bool]:
+    """Which letters act as vowels; y is a vowel unless it starts a syllable"""
+    flags = []
+    for i, c in enumerate(word):
+        if c in VOWELS:
+            # u after q is part of the "kw" sound
+            flags.append(not (c == "u" and i > 0 and word[i - 1] == "q"))
+        elif c == "y":
+            flags.append(i > 0 and not (i + 1 < len(word) and word[i + 1] in VOWELS))
+        else:
+            flags.append(False)
+    return flags
+
+
+def _consonant_units(cluster: str) -> List[str]:
+    """Break a consonant cluster into sounds, keeping digraphs, "ght" and "qu" whole"""
+    units = []
+    i = 0
+    while i < len(cluster):
+        if cluster[i:i + 3] == "ght":  # "light, house", not "ligh, thouse"
+            units.append("ght")
+            i += 3
+        elif cluster[i:i + 2] in DIGRAPHS or cluster[i:i + 2] == "qu":
+            units.append(cluster[i:i + 2])
+            i += 2
+        else:
+            units.append(cluster[i])
+            i += 1
+    return units
+
+
+def _is_onset(consonants: str) -> bool:
+    """Whether a syllable can start with these consonants"""
+    if len(consonants) == 1:
+        return consonants != "x"  # ta, xi reads badly; tax, i is handled as a coda
+    return consonants in ONSET_BLENDS or consonants in THREE_LETTER_ONSETS or consonants == "qu"
+
+
+def _split_cluster(cluster: str) -> Optional[int]:
+    """How many consonants of a cluster between two vowels stay with the syllable before.
+
+    Digraphs are never broken, and the syllable after gets the longest
+    consonant run that can start a syllable ("mon, ster", "birth, day").
+    None when no such split exists.
+    """
+    if len(cluster) == 0:
+        return 0
+    if len(cluster) == 1:
+        return 1 if cluster == "x" else 0  # ti, ger; but tax, i
+    units = _consonant_units(cluster)
+    if len(units) == 1:
+        # "qu" starts the next syllable; other digraphs end this one ("fish, ing")
+        if cluster == "qu":
+            return 0
+        return 2 if cluster == "ght" else len(cluster)  # daugh, ter
+    for k in range(1, len(units)):
+        onset = "".join(units[k:])
+        if _is_onset(onset):
+            return len(cluster) - len(onset)
+    return None
+
+
+def _rule_syllables(word: str) -> Optional[List[str]]:
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) > len(suffix):
+            stem = _rule_syllables(word[:-len(suffix)])
+            return stem + [suffix] if stem else None
+
+    is_vowel = _vowel_positions(word)
+
+    # Vowel groups as (start, end) letter ranges
+    groups = []
+    i = 0
+    while i < len(word):
+        if is_vowel[i]:
+            start = i
+            while i < len(word) and is_vowel[i]:
+                i += 1
+            groups.append((start, i))
+        else:
+            i += 1
+    if not groups:
+        return None
+
+    for start, end in groups:
+        if any(pair in word[start:end] for pair in AMBIGUOUS_VOWELS):
+            # A final "ue" ("blue", "rescue") is one sound
+            if not (end == len(word) and word[start:end] == "ue"):
+                return None
+
+    # Silent endings: final e, "-ed" not after t/d ("jumped" but "hun, dred"),
+    # "-es" not after a hissing sound
+    if len(groups) > 1:
+        last_start, last_end = groups[-1]
+        tail = word[last_start:]
+        before = word[:last_start]
+        if tail == "e" and not re.search(r"[^aeiouy]le$", word):
+            groups.pop()
+        elif tail == "ed" and not before.endswith(("t", "d")) and not re.search(r"[^aeiouy]r$", before):
+            groups.pop()
+        elif tail == "es" and not before.endswith(("s", "x", "z", "ch", "sh", "c", "g")):
+            groups.pop()
+
+    # A lone "e" between single consonants mid-word is usually silent, as in
+    # compounds like "space, ship" or "some, thing"; the rules would give
+    # "spa, cesh, ip". "-er" ("ca, ter, pil, lar") is the common exception.
+    for (_, prev_end), (start, end), (next_start, _) in zip(groups, groups[1:], groups[2:]):
+        if word[start:end] != "e":
+            continue
+        before, after = word[prev_end:start], word[end:next_start]
+        if (len(_consonant_units(before)) == 1 and len(_consonant_units(after)) == 1
+                and after != "r"):
+            return None
+
+    # Cut between each pair of neighbouring vowel groups
+    cuts = []
+    for (_, prev_end), (next_start, _) in zip(groups, groups[1:]):
+        cluster = word[prev_end:next_start]
+        # Consonant + le at the end starts its own syllable ("ta, ble")
+        if next_start == len(word) - 1 and word.endswith("le") and cluster:
+            cuts.append(next_start - 2)
+            continue
+        keep = _split_cluster(cluster)
+        if keep is None:
+            return None
+        cuts.append(prev_end + keep)
+
+    parts = []
+    last = 0
+    for cut in cuts:
+        parts.append(word[last:cut])
+        last = cut
+    parts.append(word[last:])
+    return parts
+
+
+def split_syllables(word: str) -> Optional[List[str]]:
+    """Split a word into syllables, or None if the split isn't reliable"""
+    word = word.strip().lower().strip(".,!?;:\"'()")
+    if not word or len(word) > MAX_WORD_LENGTH or not word.isalpha() or not word.isascii():
+        return None
+
+    parts = IRREGULAR.get(word) or _rule_syllables(word)
+    if not parts or len(parts) > MAX_SYLLABLES or "".join(parts) != word:
+        return None
+    # A lone letter is read as its name ("a" -> "ay"), which doesn't help
+    if len(parts) > 1 and any(len(part) < 2 for part in parts):
+        return None
+    return parts
+
+
+def stuck_word_feedback(word: str) -> Optional[str]:
+    """Short spoken help for a stuck word, or None to ask the LLM instead"""
+    parts = split_syllables(word)
+    if parts is None:
+        return None
+    clean = "".join(parts)
+    if len(parts) == 1:
+        return random.choice(ONE_SYLLABLE_TEMPLATES).format(word=clean)
+    return random.choice(MULTI_SYLLABLE_TEMPLATES).format(word=clean, parts=", ".join(parts))
@@ -0,0 +1,114 @@
+"""
+Cold-start benchmark for the Postgres engine modes in backend/database.py.
+
+Each run starts a fresh Python process, like a cold serverless instance, and
+measures:
+
+- import:    importing the FastAPI app (main.py)
+- first:     first request that doesn't touch the database (/api/test)
+- first db:  first request that does (/api/gamification/leaderboard)
+- warm db:   median of further DB requests in the same process
+
+for these configurations:
+
+- eager:     previous behaviour - engine, connect and schema setup at import,
+             QueuePool with pre-ping (DB_POOL_MODE=queue, not serverless)
+- reuse:     serverless mode, lazy engine, one pooled connection kept warm
+- null:      serverless mode, lazy engine, NullPool (for an external pooler)
+
+Needs a local Postgres, e.g.
+    docker run --rm -e POSTGRES_PASSWORD=pw -p 5432:5432 postgres:16
+
+Run with:  python bench-cold-start.py --url postgresql://postgres:pw@localhost/postgres [--runs 5] [--warm 20]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+CONFIGS = {
+    "eager": {"DB_POOL_MODE": "queue"},
+    "reuse": {"VERCEL": "1", "DB_POOL_MODE": "reuse"},
+    "null": {"VERCEL": "1", "DB_POOL_MODE": "null"},
+}
+
+
+async def cold_start(warm: int) -> dict:
+    sys.path.insert(0, BACKEND_DIR)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        import main
+    timings = {"import": time.perf_counter() - start}
+
+    import httpx
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            (await client.get("/api/test")).raise_for_status()
+            timings["first"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            (await client.get("/api/gamification/leaderboard", params={"timeframe": "weekly"})).raise_for_status()
+            timings["first db"] = time.perf_counter() - start
+
+            warm_times = []
+            for _ in range(warm):
+                start = time.perf_counter()
+                (await client.get("/api/gamification/leaderboard", params={"timeframe": "weekly"})).raise_for_status()
+                warm_times.append(time.perf_counter() - start)
+            timings["warm db"] = statistics.median(warm_times) if warm_times else 0.0
+    return timings
+
+
+def run_config(name: str, url: str, args) -> dict:
+    env = dict(os.environ)
+    for key in ("VERCEL", "AWS_LAMBDA_FUNCTION_NAME", "DATABASE_URL", "DB_POOL_MODE"):
+        env.pop(key, None)
+    env["POSTGRES_URL"] = url
+    env.update(CONFIGS[name])
+
+    runs = []
+    for _ in range(args.runs):
+        out = subprocess.run(
+            [sys.executable, __file__, "--worker", "--warm", str(args.warm)],
+            env=env, capture_output=True, text=True, cwd=BACKEND_DIR
+        )
+        lines = [line for line in out.stdout.splitlines() if line.startswith("RESULT ")]
+        if not lines:
+            raise RuntimeError(f"{name} run failed:\n{out.stdout[-2000:]}\n{out.stderr[-2000:]}")
+        runs.append(json.loads(lines[-1][len("RESULT "):]))
+    return {key: statistics.median(r[key] for r in runs) for key in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default=os.getenv("POSTGRES_URL"), help="Postgres URL (default: $POSTGRES_URL)")
+    parser.add_argument("--runs", type=int, default=5, help="cold starts per configuration")
+    parser.add_argument("--warm", type=int, default=20, help="warm requests per cold start")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print("RESULT " + json.dumps(asyncio.run(cold_start(args.warm))))
+        return
+    if not args.url:
+        parser.error("pass --url or set POSTGRES_URL")
+
+    print(f"median of {args.runs} cold starts, times in ms\n")
+    print(f"{'config':<8}{'import':>10}{'first':>10}{'first db':>10}{'warm db':>10}")
+    for name in CONFIGS:
+        r = run_config(name, args.url, args)
+        print(f"{name:<8}" + "".join(f"{r[key] * 1000:>10.1f}" for key in ("import", "first", "first db", "warm db")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Write-throughput benchmark for the SQLite profiles in backend/database.py.
+
+Runs the same workload against a fresh database file once with
+SQLITE_PROFILE=default (stock SQLite settings, one shared pool) and once with
+SQLITE_PROFILE=production (WAL + tuned pragmas, single-connection write pool,
+separate read pool):
+
+- P server processes (like uvicorn/gunicorn workers) share the file
+- in each, N students record M gamification activities each, all
+  concurrently, through GamificationEngine.process_student_activity
+- optionally, a few readers per process poll the leaderboard every 50 ms
+
+and reports activities/second, failed activities (e.g. "database is locked")
+and leaderboard reads completed for each profile.
+
+Run with:  python bench-sqlite-writes.py [--processes 4] [--students 10] [--activities 10] [--readers 2]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+
+async def run_workload(worker: int, students: int, activities: int, readers: int) -> dict:
+    sys.path.insert(0, BACKEND_DIR)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import main
+
+    engine = main.gamification_engine
+    failures = []
+    reads = 0
+    writers_done = asyncio.Event()
+
+    async def student(i: int):
+        for n in range(activities):
+            result = await engine.process_student_activity(
+                f"bench-{worker}-{i}", "messages_sent", {"subject": "math", "local_hour": 12}
+            )
+            if result.get("error"):
+                failures.append(result["error"])
+
+    async def reader():
+        nonlocal reads
+        while not writers_done.is_set():
+            try:
+                await engine.get_leaderboard("weekly", 10)
+                reads += 1
+            except Exception as e:
+                failures.append(f"read: {e}")
+            await asyncio.sleep(0.05)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        reader_tasks = [asyncio.create_task(reader()) for _ in range(readers)]
+        start = time.time()
+        await asyncio.gather(*(student(i) for i in range(students)))
+        end = time.time()
+        writers_done.set()
+        await asyncio.gather(*reader_tasks)
+
+    return {
+        "activities": students * activities,
+        "failed": len(failures),
+        "start": start,
+        "end": end,
+        "leaderboard_reads": reads,
+        "sample_error": failures[0] if failures else None,
+    }
+
+
+def run_profile(profile: str, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.pop("POSTGRES_URL", None)
+        env.pop("VERCEL", None)
+        env["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        env["SQLITE_PROFILE"] = profile
+
+        # Create the schema once so the workers don't race on CREATE TABLE
+        subprocess.run([sys.executable, "-c", "import main"], env=env, capture_output=True, cwd=BACKEND_DIR)
+
+        procs = [
+            subprocess.Popen(
+                [sys.executable, __file__, "--worker", str(w),
+                 "--students", str(args.students), "--activities", str(args.activities), "--readers", str(args.readers)],
+                env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, cwd=BACKEND_DIR
+            ) for w in range(args.processes)
+        ]
+        results = []
+        for proc in procs:
+            stdout, stderr = proc.communicate()
+            lines = [line for line in stdout.splitlines() if line.startswith("RESULT ")]
+            if not lines:
+                raise RuntimeError(f"{profile} worker failed:\n{stdout[-2000:]}\n{stderr[-2000:]}")
+            results.append(json.loads(lines[-1][len("RESULT "):]))
+
+    total = sum(r["activities"] for r in results)
+    failed = sum(r["failed"] for r in results)
+    elapsed = max(r["end"] for r in results) - min(r["start"] for r in results)
+    errors = [r["sample_error"] for r in results if r["sample_error"]]
+    return {
+        "activities_per_sec": round((total - failed) / elapsed, 1),
+        "failed": failed,
+        "seconds": round(elapsed, 2),
+        "leaderboard_reads": sum(r["leaderboard_reads"] for r in results),
+        "sample_error": errors[0] if errors else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--students", type=int, default=10, help="concurrent students per process")
+    parser.add_argument("--activities", type=int, default=10, help="activities per student")
+    parser.add_argument("--readers", type=int, default=2, help="leaderboard readers per process")
+    parser.add_argument("--worker", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        result = asyncio.run(run_workload(args.worker, args.students, args.activities, args.readers))
+        print("RESULT " + json.dumps(result))
+        return
+
+    print(f"{args.processes} processes x {args.students} students x {args.activities} activities, "
+          f"{args.readers} leaderboard readers per process\n")
+    print(f"{'profile':<12}{'activities/s':>14}{'failed':>8}{'seconds':>9}{'reads':>8}")
+    for profile in ("default", "production"):
+        r = run_profile(profile, args)
+        print(f"{profile:<12}{r['activities_per_sec']:>14}{r['failed']:>8}{r['seconds']:>9}{r['leaderboard_reads']:>8}")
+        if r["sample_error"]:
+            print(f"  e.g. {r['sample_error'][:100]}")
+
+
+if __name__ == "__main__":
+    main()
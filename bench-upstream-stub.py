@@ -0,0 +1,164 @@
+"""
+Throughput benchmark for the upstream-backed endpoints, with no API keys.
+
+Starts backend/stub_upstream.py and the app (uvicorn, UPSTREAM_STUB_URL
+pointing at the stub) as separate processes, then runs C concurrent
+clients for D seconds. Each client picks one of
+
+- chat:       POST /api/chat
+- stream:     POST /api/chat/stream (time to first byte and to the end)
+- chapter:    POST /api/generate-chapter (chapter library off)
+- feedback:   POST /api/reading/feedback (a different misreading each time)
+- transcribe: POST /api/reading/transcribe
+- tts:        POST /api/tts (different text each time)
+
+and reports requests/second, errors and p50/p95/p99 latency per endpoint.
+Stub behaviour comes from the STUB_* variables (see stub_upstream.py), e.g.
+
+    STUB_LATENCY_MS=600 STUB_ERROR_RATE=0.02 python bench-upstream-stub.py --clients 50
+
+Run with:  python bench-upstream-stub.py [--clients 20] [--duration 20] [--endpoints chat,tts]
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+ENDPOINTS = ("chat", "stream", "chapter", "feedback", "transcribe", "tts")
+STUDENTS = 20
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start(args, env, url) -> subprocess.Popen:
+    process = subprocess.Popen(args, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(300):
+        try:
+            httpx.get(url, timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{args[1:3]} didn't start")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+async def call(client: httpx.AsyncClient, endpoint: str, n: int) -> bool:
+    student = f"bench-{n % STUDENTS}"
+    if endpoint == "chat":
+        response = await client.post("/api/chat", json={"student_id": student, "content": f"Question {n}?", "tutor_type": "science"})
+    elif endpoint == "stream":
+        async with client.stream("POST", "/api/chat/stream", json={
+            "student_id": student, "content": f"Question {n}?", "tutor_type": "science"
+        }) as response:
+            async for _ in response.aiter_bytes():
+                pass
+    elif endpoint == "chapter":
+        response = await client.post("/api/generate-chapter", json={"student_id": student, "topic": "Foxes"})
+    elif endpoint == "feedback":
+        response = await client.post("/api/reading/feedback", json={
+            "student_id": student, "expected_text": "The fox ran to the barn.",
+            "spoken_text": f"The fox ran to the barn{n}", "current_word_index": 5,
+        })
+    elif endpoint == "transcribe":
+        response = await client.post("/api/reading/transcribe", files={"audio": ("a.webm", b"\x1a\x45\xdf\xa3" * 256, "audio/webm")})
+    else:
+        response = await client.post("/api/tts", json={"text": f"Page {n}: the fox ran to the big red barn."})
+    return response.status_code == 200
+
+
+async def run(app_url: str, endpoints, clients: int, duration: float) -> dict:
+    timings = {endpoint: [] for endpoint in endpoints}
+    errors = {endpoint: 0 for endpoint in endpoints}
+    counter = 0
+    async with httpx.AsyncClient(base_url=app_url, timeout=120, limits=httpx.Limits(max_connections=clients)) as client:
+        for i in range(STUDENTS):
+            await client.post("/api/students", json={
+                "id": f"bench-{i}", "name": f"Bench{i}", "grade_level": 3, "interests": ["foxes"], "learning_style": "visual"
+            })
+        deadline = time.perf_counter() + duration
+
+        async def worker(seed):
+            nonlocal counter
+            rng = random.Random(seed)
+            while time.perf_counter() < deadline:
+                endpoint = rng.choice(endpoints)
+                counter += 1
+                start = time.perf_counter()
+                try:
+                    ok = await call(client, endpoint, counter)
+                except httpx.HTTPError:
+                    ok = False
+                timings[endpoint].append(time.perf_counter() - start)
+                errors[endpoint] += not ok
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker(i) for i in range(clients)])
+        elapsed = time.perf_counter() - started
+    return {"timings": timings, "errors": errors, "elapsed": elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=20, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=20, help="seconds")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    args = parser.parse_args()
+    endpoints = [endpoint for endpoint in args.endpoints.split(",") if endpoint in ENDPOINTS]
+
+    stub_port, app_port = free_port(), free_port()
+    stub_url, app_url = f"http://127.0.0.1:{stub_port}", f"http://127.0.0.1:{app_port}"
+    env = {**os.environ, "UPSTREAM_STUB_URL": stub_url, "CHAPTER_LIBRARY_ENABLED": "0",
+           "DATABASE_URL": f"sqlite:///{os.path.join(BACKEND_DIR, f'bench-upstream-{app_port}.db')}",
+           "TTS_CACHE_DIR": tempfile.mkdtemp()}
+    for name in ("POSTGRES_URL", "VERCEL"):
+        env.pop(name, None)
+
+    stub = start([sys.executable, "stub_upstream.py", "--port", str(stub_port)], env, f"{stub_url}/stub/stats")
+    app = None
+    try:
+        app = start([sys.executable, "-m", "uvicorn", "main:app", "--port", str(app_port), "--log-level", "warning"],
+                    env, f"{app_url}/api/test")
+        print(f"{args.clients} clients for {args.duration:.0f} s against the upstream stub\n")
+        result = asyncio.run(run(app_url, endpoints, args.clients, args.duration))
+        stub_stats = httpx.get(f"{stub_url}/stub/stats").json()
+    finally:
+        for process in (app, stub):
+            if process is not None:
+                process.terminate()
+                process.wait()
+        db_path = env["DATABASE_URL"].replace("sqlite:///", "")
+        if os.path.exists(db_path):
+            os.unlink(db_path)
+        shutil.rmtree(env["TTS_CACHE_DIR"], ignore_errors=True)
+
+    print(f"{'endpoint':<12}{'requests':>10}{'req/s':>8}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for endpoint in endpoints:
+        timings = result["timings"][endpoint]
+        print(f"{endpoint:<12}{len(timings):>10}{len(timings) / result['elapsed']:>8.1f}{result['errors'][endpoint]:>8}"
+              f"{percentile(timings, 0.5) * 1000:>9.0f}{percentile(timings, 0.95) * 1000:>9.0f}{percentile(timings, 0.99) * 1000:>9.0f}")
+    total = sum(len(timings) for timings in result["timings"].values())
+    print(f"\n{total / result['elapsed']:.1f} requests/s overall; stub saw {stub_stats['requests']} "
+          f"(peak {stub_stats['peak_in_flight']} in flight, {stub_stats['errors_injected']} errors injected)")
+
+
+if __name__ == "__main__":
+    main()
@@ -38,6 +38,7 @@ class ReadingSession {
         this.ttsVoiceReady = false; // Whether we've resolved the best voice
         this.isSpeaking = false; // Track if TTS is currently speaking
         this._ttsAudio = null; // Current ElevenLabs audio element
+        this._ttsUrls = new Map(); // text -> cacheable /api/tts/{hash} URL from an earlier playback
         this._pendingInterim = ''; // Last interim transcript (promoted to lastSpokenText on session end)
 
         // Whisper fallback properties (for mobile browsers without SpeechRecognition)
@@ -917,25 +918,34 @@ class ReadingSession {
                              window.location.hostname === '127.0.0.1')
                 ? 'http://127.0.0.1:8000/api' : '/api';
 
-            const response = await fetch(`${apiBase}/tts`, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'Authorization': `Bearer ${token}`
-                },
-                body: JSON.stringify({ text })
-            });
-
-            if (!response.ok) throw new Error(`TTS API returned ${response.status}`);
-
-            const audioBlob = await response.blob();
-            const audioUrl = URL.createObjectURL(audioBlob);
+            // Repeat phrases play straight from the immutable per-clip URL,
+            // which the browser caches; the first playback POSTs the text
+            let audioUrl = this._ttsUrls.get(text);
+            let blobUrl = null;
+            if (!audioUrl) {
+                const response = await fetch(`${apiBase}/tts`, {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                        'Authorization': `Bearer ${token}`
+                    },
+                    body: JSON.stringify({ text })
+                });
+
+                if (!response.ok) throw new Error(`TTS API returned ${response.status}`);
+
+                const audioHash = response.headers.get('X-TTS-Hash');
+                if (audioHash) this._ttsUrls.set(text, `${apiBase}/tts/${audioHash}`);
+                const audioBlob = await response.blob();
+                blobUrl = URL.createObjectURL(audioBlob);
+                audioUrl = blobUrl;
+            }
             const audio = new Audio(audioUrl);
             this._ttsAudio = audio;
 
             audio.onended = () => {
                 this.isSpeaking = false;
-                URL.revokeObjectURL(audioUrl);
+                if (blobUrl) URL.revokeObjectURL(blobUrl);
                 this._ttsAudio = null;
                 if (this.isListening && this.recognition) {
                     try { this.recognition.start(); } catch (e) {}
@@ -944,7 +954,8 @@ class ReadingSession {
 
             audio.onerror = () => {
                 this.isSpeaking = false;
-                URL.revokeObjectURL(audioUrl);
+                if (blobUrl) URL.revokeObjectURL(blobUrl);
+                this._ttsUrls.delete(text); // evicted on the server; POST again next time
                 this._ttsAudio = null;
                 if (this.isListening && this.recognition) {
                     try { this.recognition.start(); } catch (e) {}
@@ -0,0 +1,225 @@
+"""
+Tests that LLM calls don't block the event loop.
+
+Starts a stub OpenAI-compatible server whose chat completions take
+STUB_DELAY seconds, points the backend at it with OPENAI_BASE_URL, and
+checks:
+1. No call site builds its own synchronous OpenAI() client
+2. Two concurrent /api/chat requests overlap at the stub server
+3. A chat and a chapter generation running together take about one
+   completion's time, not two
+4. The event loop keeps ticking while completions are in flight
+5. Those calls reuse pooled keep-alive connections, and pool stats
+   survive httpcore internals they can't read
+
+Run with:  python test-async-openai.py
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_DELAY = 0.5
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+# ─── Stub OpenAI server ───────────────────────────────────────────────
+
+in_flight = 0
+max_in_flight = 0
+requests_served = 0
+counter_lock = threading.Lock()
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+    def do_POST(self):
+        global in_flight, max_in_flight, requests_served
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with counter_lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        time.sleep(STUB_DELAY)
+        with counter_lock:
+            in_flight -= 1
+            requests_served += 1
+
+        payload = json.dumps({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "Stub Title\n\nA stub reply."},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), StubOpenAIHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+tmp_dir = tempfile.mkdtemp()
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+os.environ["OPENAI_API_KEY"] = "sk-test-stub"
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'test.db')}"
+os.environ.pop("POSTGRES_URL", None)
+os.environ.pop("VERCEL", None)
+
+sys.path.insert(0, BACKEND_DIR)
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+import httpx
+
+# ─── TESTS ─────────────────────────────────────────────────────────────
+
+passed = 0
+failed = 0
+
+
+def check(condition, label):
+    global passed, failed
+    if condition:
+        passed += 1
+        print(f"  \033[32m✓\033[0m {label}")
+    else:
+        failed += 1
+        print(f"  \033[31m✗\033[0m {label}")
+
+
+def reset_counters():
+    global max_in_flight, requests_served
+    with counter_lock:
+        max_in_flight = 0
+        requests_served = 0
+
+
+print("\n1. No blocking client construction")
+main_code = open(os.path.join(BACKEND_DIR, "main.py")).read()
+check(re.search(r"\bOpenAI\(", main_code) is None, "main.py never constructs a sync OpenAI() client")
+llm_code = open(os.path.join(BACKEND_DIR, "llm.py")).read()
+providers_code = open(os.path.join(BACKEND_DIR, "providers.py")).read()
+check("chat.completions.create" not in main_code + providers_code
+      and len(re.findall(r"await (create_chat_completion|hedged_chat_completion)\(", main_code)) >= 4
+      and "await create_chat_completion(" in providers_code
+      and len(re.findall(r"await get_openai_client\(\)\.chat\.completions\.create", llm_code)) == 2,
+      "all chat completion call sites are awaited (through llm.py's scheduler)")
+
+
+async def run_requests():
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+        with contextlib.redirect_stdout(io.StringIO()):
+            await client.post("/api/students", json={
+                "id": "async-stu", "name": "Async", "grade_level": 3,
+                "interests": ["space"], "learning_style": "visual"
+            })
+
+            results = {}
+
+            # The app lifespan (not run by ASGITransport) opens the clients at startup
+            main.create_http_clients()
+            main.get_openai_client()
+
+            # 2. Two chats at once
+            reset_counters()
+            start = time.perf_counter()
+            chats = await asyncio.gather(*(
+                client.post("/api/chat", json={"student_id": "async-stu", "content": f"Question {i}", "tutor_type": "math"})
+                for i in range(2)
+            ))
+            results["chat_elapsed"] = time.perf_counter() - start
+            results["chat_overlap"] = max_in_flight
+            results["chat_status"] = [r.status_code for r in chats]
+            results["chat_replies"] = [r.json().get("response") for r in chats]
+
+            # 3 + 4. A chat and a chapter together, with a ticker watching the loop
+            reset_counters()
+            ticks = []
+
+            async def ticker():
+                while True:
+                    ticks.append(time.perf_counter())
+                    await asyncio.sleep(0.02)
+
+            ticker_task = asyncio.create_task(ticker())
+            start = time.perf_counter()
+            mixed = await asyncio.gather(
+                client.post("/api/chat", json={"student_id": "async-stu", "content": "Another question", "tutor_type": "general"}),
+                client.post("/api/generate-chapter", json={"student_id": "async-stu", "topic": "planets", "chapter_number": 1}),
+            )
+            results["mixed_elapsed"] = time.perf_counter() - start
+            ticker_task.cancel()
+            results["mixed_overlap"] = max_in_flight
+            results["mixed_served"] = requests_served
+            results["mixed_status"] = [r.status_code for r in mixed]
+            gaps = [b - a for a, b in zip(ticks, ticks[1:])]
+            results["max_tick_gap"] = max(gaps) if gaps else float("inf")
+
+            results["pools"] = (await client.get("/api/system/http-pools")).json()["pools"]
+    return results
+
+
+results = asyncio.run(run_requests())
+
+print("\n2. Concurrent chats overlap")
+check(results["chat_status"] == [200, 200], "both chats succeed")
+check(all(reply == "Stub Title\n\nA stub reply." for reply in results["chat_replies"]),
+      "replies come from the stub server")
+check(results["chat_overlap"] == 2, f"stub saw 2 requests in flight at once (saw {results['chat_overlap']})")
+check(results["chat_elapsed"] < STUB_DELAY * 1.9,
+      f"two chats took ~one completion ({results['chat_elapsed']:.2f}s < {STUB_DELAY * 1.9:.2f}s)")
+
+print("\n3. Chapter generation doesn't hold up chat")
+check(results["mixed_status"] == [200, 200], "chat and chapter generation succeed")
+check(results["mixed_served"] == 2 and results["mixed_overlap"] == 2,
+      f"chat and chapter completions in flight together (saw {results['mixed_overlap']})")
+check(results["mixed_elapsed"] < STUB_DELAY * 1.9,
+      f"both finished in ~one completion ({results['mixed_elapsed']:.2f}s)")
+
+print("\n4. Event loop stays responsive")
+check(results["max_tick_gap"] < STUB_DELAY / 2,
+      f"loop ticked every {results['max_tick_gap'] * 1000:.0f} ms at worst while waiting")
+
+print("\n5. Pooled connections")
+openai_pool = results["pools"]["openai"] or {}
+check(openai_pool.get("requests") == 4, f"pool stats count 4 OpenAI requests (saw {openai_pool.get('requests')})")
+check(0 < openai_pool.get("connections", 0) <= 2,
+      f"4 requests reused at most 2 connections (saw {openai_pool.get('connections')})")
+check(openai_pool.get("peak_in_flight") == 2 and openai_pool.get("in_flight") == 0,
+      "peak of 2 in flight, none left over")
+from http_clients import PooledTransport
+bare = PooledTransport(limits=httpx.Limits(max_connections=5), http2=False)
+bare._pool = object()  # stands in for a pool whose internals changed
+bare_stats = bare.stats()
+check(bare_stats["connections"] is None and bare_stats["waiting_for_connection"] is None
+      and bare_stats["requests"] == 0 and bare_stats["max_connections"] == 5,
+      "unreadable pool internals report None; own counters still reported")
+
+server.shutdown()
+
+total = passed + failed
+print()
+if failed == 0:
+    print(f"\033[32mAll {total} checks passed!\033[0m")
+else:
+    print(f"\033[31m{passed}/{total} checks passed, {failed} FAILED\033[0m")
+
+sys.exit(0 if failed == 0 else 1)
@@ -0,0 +1,229 @@
+"""
+Tests for the shared chapter library.
+
+Starts a stub OpenAI-compatible server that writes a numbered chapter per
+completion, runs with CHAPTER_LIBRARY_MIN_VARIANTS=2 and no random fresh
+generations, and checks:
+1. The first requests for a key generate; later ones get a library copy
+   without calling the LLM, spread across the stored variants
+2. A student is never given the same library chapter twice
+3. Keys normalize the topic and interests and separate grades
+4. Stale entries and fallbacks aren't reused, and chapter prompts leave
+   the student's name out so every generated chapter can be shared
+5. The streaming endpoint sends a library copy without generating
+
+Run with:  python test-chapter-library.py
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+# ─── Stub OpenAI server ───────────────────────────────────────────────
+
+llm_calls = 0
+named_prompts = 0
+fail_requests = False
+counter_lock = threading.Lock()
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        global llm_calls, named_prompts
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with counter_lock:
+            llm_calls += 1
+            n = llm_calls
+            named_prompts += any("Zed" in m["content"] for m in body["messages"])
+        if fail_requests:
+            payload = json.dumps({"error": {"message": "stub outage", "type": "server_error"}}).encode()
+            self.send_response(400)
+        else:
+            story = f"Title: Story {n}\n\nThis is story number {n}. It is about big animals."
+            payload = json.dumps({
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": story},
+                             "finish_reason": "stop"}],
+            }).encode()
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), StubOpenAIHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+tmp_dir = tempfile.mkdtemp()
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+os.environ["OPENAI_API_KEY"] = "sk-test-stub"
+os.environ["CHAPTER_LIBRARY_MIN_VARIANTS"] = "2"
+os.environ["CHAPTER_LIBRARY_FRESH_RATE"] = "0"
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'test.db')}"
+os.environ.pop("POSTGRES_URL", None)
+os.environ.pop("VERCEL", None)
+
+sys.path.insert(0, BACKEND_DIR)
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+from sqlalchemy import select, func, update
+from models.schema import ChapterLibraryDB, Chapter
+import httpx
+
+# ─── TESTS ─────────────────────────────────────────────────────────────
+
+passed = 0
+failed = 0
+
+
+def check(condition, label):
+    global passed, failed
+    if condition:
+        passed += 1
+        print(f"  \033[32m✓\033[0m {label}")
+    else:
+        failed += 1
+        print(f"  \033[31m✗\033[0m {label}")
+
+
+async def library_size() -> int:
+    async with main.async_session_scope(readonly=True) as db:
+        return await db.scalar(select(func.count()).select_from(ChapterLibraryDB))
+
+
+async def run_requests():
+    global fail_requests
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+        with contextlib.redirect_stdout(io.StringIO()):
+            students = {
+                "lib-a": (2, ["space", "dinosaurs"]),
+                "lib-b": (2, ["Dinosaurs", "space"]),
+                "lib-c": (2, ["space", "dinosaur"]),
+                "lib-d": (2, ["space", "dinosaurs"]),
+                "lib-g3": (3, ["space", "dinosaurs"]),
+                "lib-art": (2, ["art"]),
+                "lib-zed": (4, ["cars"]),
+                "lib-zoe": (4, ["cars"]),
+                "lib-s": (2, ["space", "dinosaurs"]),
+            }
+            for sid, (grade, interests) in students.items():
+                await client.post("/api/students", json={
+                    "id": sid, "name": "Zed" if sid == "lib-zed" else "Kid", "grade_level": grade,
+                    "interests": interests, "learning_style": "visual"
+                })
+
+            async def chapter(sid, topic="Dinosaurs"):
+                before = llm_calls
+                response = await client.post("/api/generate-chapter", json={"student_id": sid, "topic": topic})
+                return response.json(), llm_calls - before
+
+            # 1 + 2
+            results["a"] = await chapter("lib-a")
+            results["b"] = await chapter("lib-b", "dinosaurs!")
+            results["c1"] = await chapter("lib-c", "  DINOSAUR ")
+            results["d"] = await chapter("lib-d")
+            results["c2"] = await chapter("lib-c")
+            results["c3"] = await chapter("lib-c")
+            results["size_after_c"] = await library_size()
+
+            # 3
+            results["g3"] = await chapter("lib-g3")
+            results["art"] = await chapter("lib-art")
+
+            # 4
+            async with main.async_session_scope() as db:
+                await db.execute(update(ChapterLibraryDB).values(created_at=datetime.utcnow() - timedelta(days=60)))
+            results["stale"] = await chapter("lib-d")
+            results["zed"] = await chapter("lib-zed", "cars")
+            results["zoe"] = await chapter("lib-zoe", "cars")
+            size = await library_size()
+            fail_requests = True
+            results["fallback"] = await chapter("lib-zoe", "boats")
+            fail_requests = False
+            results["fallback_added"] = await library_size() - size
+
+            # 5: lib-s hasn't read any of the 2 fresh chapters for this key yet
+            await chapter("lib-a")
+            before = llm_calls
+            raw = ""
+            async with client.stream("POST", "/api/generate-chapter/stream",
+                                     json={"student_id": "lib-s", "topic": "dinosaurs"}) as response:
+                async for piece in response.aiter_text():
+                    raw += piece
+            results["stream_calls"] = llm_calls - before
+            results["stream_raw"] = raw
+
+            content = await client.get(f"/api/reading/content/{results['c1'][0]['id']}")
+            results["copy_content"] = content.json()
+            async with main.async_session_scope(readonly=True) as db:
+                results["c_links"] = list(await db.scalars(
+                    select(Chapter.library_id).where(Chapter.user_id == "lib-c")
+                ))
+    return results
+
+
+results = asyncio.run(run_requests())
+
+print("\n1. Reuse")
+check(results["a"][1] == 1 and results["b"][1] == 1, "first two requests for the key generate")
+check(results["a"][0].get("library_id") and results["b"][0].get("library_id"), "generated chapters join the library")
+check(results["c1"][1] == 0 and results["d"][1] == 0, "once the key has 2 variants, requests make no LLM call")
+check(results["c1"][0]["library_id"] != results["d"][0]["library_id"], "reuse spreads across the variants")
+check(results["c1"][0]["id"] != results["c1"][0]["library_id"]
+      and results["c1"][0]["content"].startswith("This is story number"), "the student gets their own copy")
+check(results["copy_content"].get("title", "").startswith("Story")
+      and results["copy_content"].get("total_pages", 0) >= 1, "the copy is readable like any chapter")
+
+print("\n2. No repeats")
+check(results["c2"][1] == 0 and results["c2"][0]["library_id"] != results["c1"][0]["library_id"],
+      "second request gets the other variant")
+check(results["c3"][1] == 1 and results["size_after_c"] == 3, "third request (seen both) generates a new one")
+check(len(set(results["c_links"])) == 3, "each of the student's copies links a different library chapter")
+
+print("\n3. Keys")
+check(results["g3"][1] == 1, "another grade doesn't share")
+check(results["art"][1] == 1, "different interests don't share")
+
+print("\n4. Not reused")
+check(results["stale"][1] == 1, "chapters older than CHAPTER_LIBRARY_MAX_AGE_DAYS aren't reused")
+check(results["zed"][1] == 1 and named_prompts == 0, "the chapter prompt doesn't name the student")
+check(results["zed"][0].get("library_id") and results["zoe"][0].get("library_id"), "...so every generated chapter is shared")
+check(results["fallback"][1] == 1 and results["fallback_added"] == 0, "fallback chapters aren't shared")
+
+print("\n5. Streaming")
+stream_events = [block for block in results["stream_raw"].split("\n\n") if block.strip()]
+check(results["stream_calls"] == 0, "library hit streams without an LLM call")
+check(stream_events[0].startswith("event: title") and stream_events[-1].startswith("event: done"),
+      "title first, done last")
+done = json.loads(stream_events[-1].split("data: ", 1)[1])
+check(done.get("library_id") and done.get("total_pages") == len([e for e in stream_events if e.startswith("event: page")]),
+      "done carries the library link and every page was sent")
+
+server.shutdown()
+
+total = passed + failed
+print()
+if failed == 0:
+    print(f"\033[32mAll {total} checks passed!\033[0m")
+else:
+    print(f"\033[31m{passed}/{total} checks passed, {failed} FAILED\033[0m")
+
+sys.exit(0 if failed == 0 else 1)
@@ -0,0 +1,249 @@
+"""
+Tests for background pre-generation of the next chapter.
+
+Starts a stub OpenAI-compatible server whose completions take STUB_DELAY
+seconds and checks:
+1. Completing chapter N pre-generates chapter N+1, which
+   /api/generate-chapter then returns without calling the LLM
+2. finish_reading_session triggers it too, once per chapter
+3. The worker pool bounds concurrency and the per-student cap holds
+4. Failed or stale pre-generations fall back to normal generation
+5. The streaming endpoint serves a pending chapter too
+
+Run with:  python test-chapter-pregen.py
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_DELAY = 0.3
+WORKERS = 2
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+# ─── Stub OpenAI server ───────────────────────────────────────────────
+
+llm_calls = 0
+in_flight = 0
+max_in_flight = 0
+fail_requests = False
+counter_lock = threading.Lock()
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        global llm_calls, in_flight, max_in_flight
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with counter_lock:
+            llm_calls += 1
+            n = llm_calls
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        time.sleep(STUB_DELAY)
+        with counter_lock:
+            in_flight -= 1
+        if fail_requests:
+            payload = json.dumps({"error": {"message": "stub outage", "type": "server_error"}}).encode()
+            self.send_response(400)
+        else:
+            payload = json.dumps({
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {
+                    "role": "assistant", "content": f"Title: Part {n}\n\nThis is part {n}. Lava is hot."
+                }}],
+            }).encode()
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), StubOpenAIHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+tmp_dir = tempfile.mkdtemp()
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+os.environ["OPENAI_API_KEY"] = "sk-test-stub"
+os.environ["CHAPTER_LIBRARY_ENABLED"] = "0"
+os.environ["CHAPTER_PREGEN_ENABLED"] = "1"
+os.environ["CHAPTER_PREGEN_WORKERS"] = str(WORKERS)
+os.environ["CHAPTER_PREGEN_PER_STUDENT"] = "2"
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'test.db')}"
+os.environ.pop("POSTGRES_URL", None)
+os.environ.pop("VERCEL", None)
+
+sys.path.insert(0, BACKEND_DIR)
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+from sqlalchemy import select, func, update
+from models.schema import PendingChapterDB
+import httpx
+
+# ─── TESTS ─────────────────────────────────────────────────────────────
+
+passed = 0
+failed = 0
+
+
+def check(condition, label):
+    global passed, failed
+    if condition:
+        passed += 1
+        print(f"  \033[32m✓\033[0m {label}")
+    else:
+        failed += 1
+        print(f"  \033[31m✗\033[0m {label}")
+
+
+async def pending_count() -> int:
+    async with main.async_session_scope(readonly=True) as db:
+        return await db.scalar(select(func.count()).select_from(PendingChapterDB))
+
+
+async def run_requests():
+    global fail_requests, max_in_flight
+    results = {}
+    pool = main.chapter_pregen_pool
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for sid in ("pre-a", "pre-b", "pre-c", "pre-d", "pre-e", "pre-s"):
+                await client.post("/api/students", json={
+                    "id": sid, "name": "Pre", "grade_level": 3, "interests": ["rocks"], "learning_style": "visual"
+                })
+
+            async def chapter(sid, topic, number):
+                before = llm_calls
+                start = time.perf_counter()
+                response = await client.post("/api/generate-chapter", json={
+                    "student_id": sid, "topic": topic, "chapter_number": number
+                })
+                return response.json(), llm_calls - before, time.perf_counter() - start
+
+            # 1. complete -> N+1 is ready
+            ch1, _, results["gen_elapsed"] = await chapter("pre-a", "Volcanoes", 1)
+            before = llm_calls
+            await client.post(f"/api/students/pre-a/books/{ch1['id']}/complete", json={})
+            await pool.join()
+            results["pregen_calls"] = llm_calls - before
+            results["pending_after_complete"] = await pending_count()
+            results["ch2"] = await chapter("pre-a", "volcanoes", 2)
+            results["pending_after_claim"] = await pending_count()
+            results["ch2_again"] = await chapter("pre-a", "volcanoes", 2)
+
+            # 2. finish_reading_session triggers, once
+            before = llm_calls
+            for _ in range(3):
+                await client.post(f"/api/reading/finish/{results['ch2'][0]['id']}",
+                                  json={"student_id": "pre-a", "words_read": 5})
+            await pool.join()
+            results["finish_calls"] = llm_calls - before
+            # chapter 2 exists already, so completing chapter 1 again queues nothing
+            before_submitted = pool.submitted
+            await client.post(f"/api/students/pre-a/books/{ch1['id']}/complete", json={})
+            results["resubmitted"] = pool.submitted - before_submitted
+
+            # 3. concurrency and per-student cap
+            firsts = {}
+            for sid in ("pre-b", "pre-c", "pre-d"):
+                firsts[sid] = (await chapter(sid, "Rivers", 1))[0]
+            caps = [(await chapter("pre-e", topic, 1))[0] for topic in ("Moon", "Sun", "Stars")]
+            max_in_flight = 0
+            for sid, ch in firsts.items():
+                await client.post(f"/api/students/{sid}/books/{ch['id']}/complete", json={})
+            results["queued_at_once"] = pool.stats()["queued"] + pool.stats()["running"]
+            for ch in caps:
+                await client.post(f"/api/students/pre-e/books/{ch['id']}/complete", json={})
+            await pool.join()
+            results["max_in_flight"] = max_in_flight
+            async with main.async_session_scope(readonly=True) as db:
+                results["pending_e"] = await db.scalar(select(func.count()).select_from(PendingChapterDB)
+                                                       .where(PendingChapterDB.student_id == "pre-e"))
+
+            # 4. failures and staleness
+            results["pending_before_failure"] = await pending_count()
+            fail_requests = True
+            failing = (await chapter("pre-s", "Caves", 1))[0]
+            await client.post(f"/api/students/pre-s/books/{failing['id']}/complete", json={})
+            await pool.join()
+            fail_requests = False
+            results["pending_after_failure"] = await pending_count()
+            results["after_failure"] = await chapter("pre-s", "caves", 2)
+            async with main.async_session_scope() as db:
+                await db.execute(update(PendingChapterDB).where(PendingChapterDB.student_id == "pre-b")
+                                 .values(created_at=datetime.utcnow() - timedelta(days=30)))
+            results["stale"] = await chapter("pre-b", "rivers", 2)
+
+            # 5. streaming
+            before = llm_calls
+            raw = ""
+            async with client.stream("POST", "/api/generate-chapter/stream",
+                                     json={"student_id": "pre-c", "topic": "Rivers", "chapter_number": 2}) as response:
+                async for piece in response.aiter_text():
+                    raw += piece
+            results["stream_calls"] = llm_calls - before
+            results["stream_raw"] = raw
+            results["stats"] = (await client.get("/api/system/chapter-pregen")).json()
+    return results
+
+
+results = asyncio.run(run_requests())
+
+print("\n1. Completing a chapter pre-generates the next")
+check(results["pregen_calls"] == 1 and results["pending_after_complete"] == 1, "chapter 2 generated in the background")
+ch2, ch2_calls, ch2_elapsed = results["ch2"]
+check(ch2_calls == 0 and ch2.get("chapter_number") == 2 and ch2.get("title", "").startswith("Part"),
+      "/api/generate-chapter returns it without an LLM call")
+check(ch2_elapsed < results["gen_elapsed"] / 3,
+      f"served in {ch2_elapsed * 1000:.0f} ms vs {results['gen_elapsed'] * 1000:.0f} ms to generate")
+check(results["pending_after_claim"] == 0, "the pending chapter is handed out once")
+check(results["ch2_again"][1] == 1, "asking again generates normally")
+
+print("\n2. finish_reading_session")
+check(results["finish_calls"] == 1, f"three finishes of chapter 2 pre-generate chapter 3 once (saw {results['finish_calls']})")
+check(results["resubmitted"] == 0, "nothing queued when the next chapter already exists")
+
+print("\n3. Bounds")
+check(results["max_in_flight"] <= WORKERS, f"at most {WORKERS} pre-generations at once (saw {results['max_in_flight']})")
+check(results["queued_at_once"] == 3, "jobs beyond the worker count wait in the queue")
+check(results["pending_e"] == 2, "per-student cap: 2 of 3 completed topics pre-generated")
+
+print("\n4. Failure and staleness")
+check(results["pending_after_failure"] == results["pending_before_failure"],
+      "a failed pre-generation leaves nothing pending")
+check(results["after_failure"][1] == 1 and results["after_failure"][0]["title"].startswith("Part"),
+      "the student still gets a generated chapter")
+check(results["stale"][1] == 1, "stale pending chapters are regenerated")
+
+print("\n5. Streaming and metrics")
+events = [block for block in results["stream_raw"].split("\n\n") if block.strip()]
+check(results["stream_calls"] == 0 and events[0].startswith("event: title") and events[-1].startswith("event: done"),
+      "stream serves the pending chapter without an LLM call")
+stats = results["stats"]
+check(stats["enabled"] and stats["failed"] == 0 and stats["completed"] == stats["submitted"],
+      f"stats: {stats['submitted']} submitted, {stats['completed']} completed")
+
+server.shutdown()
+
+total = passed + failed
+print()
+if failed == 0:
+    print(f"\033[32mAll {total} checks passed!\033[0m")
+else:
+    print(f"\033[31m{passed}/{total} checks passed, {failed} FAILED\033[0m")
+
+sys.exit(0 if failed == 0 else 1)
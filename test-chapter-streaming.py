@@ -0,0 +1,202 @@
+"""
+Tests for streamed chapter generation (/api/generate-chapter/stream).
+
+Starts a stub OpenAI-compatible server that streams a three-paragraph story
+one word every STUB_TOKEN_DELAY seconds, and checks:
+1. The title arrives first, long before the story is finished
+2. Pages arrive while the rest is still being written
+3. Streamed pages match what /api/reading/content/{id} serves afterwards
+4. The Chapter row is saved only when the stream completes
+
+Run with:  python test-chapter-streaming.py
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_TOKEN_DELAY = 0.02
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+STORY = (
+    "Title: The Red Planet\n\n"
+    "Mia looked up at the night sky. She saw a small red dot. Her dad said it was Mars.\n\n"
+    + " ".join(f"Mars has tall mountains and deep canyons number {i}." for i in range(12)) + "\n\n"
+    "Mia wanted to visit Mars one day. She would build a rocket. The end."
+)
+REPLY_TOKENS = [word + " " for word in STORY.split(" ")]
+REPLY_TOKENS[-1] = REPLY_TOKENS[-1].rstrip()
+GENERATION_TIME = len(REPLY_TOKENS) * STUB_TOKEN_DELAY
+
+# ─── Stub OpenAI server ───────────────────────────────────────────────
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        base = {"id": "chatcmpl-stub", "created": int(time.time()), "model": body.get("model", "stub")}
+
+        if not body.get("stream"):
+            payload = json.dumps({**base, "object": "chat.completion", "choices": [{
+                "index": 0, "message": {"role": "assistant", "content": STORY}, "finish_reason": "stop"
+            }]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in REPLY_TOKENS:
+            time.sleep(STUB_TOKEN_DELAY)
+            chunk = {**base, "object": "chat.completion.chunk", "choices": [{
+                "index": 0, "delta": {"content": token}, "finish_reason": None
+            }]}
+            self._chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+
+    def log_message(self, *args):
+        pass
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), StubOpenAIHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+tmp_dir = tempfile.mkdtemp()
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+os.environ["OPENAI_API_KEY"] = "sk-test-stub"
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'test.db')}"
+os.environ.pop("POSTGRES_URL", None)
+os.environ.pop("VERCEL", None)
+
+sys.path.insert(0, BACKEND_DIR)
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+    from database import async_session_scope
+    from models.schema import User
+import httpx
+import uvicorn
+
+# A real server: httpx's in-process ASGI transport buffers whole responses
+app_server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=0, log_level="warning", lifespan="off"))
+threading.Thread(target=lambda: asyncio.run(app_server.serve()), daemon=True).start()
+while not app_server.started:
+    time.sleep(0.01)
+APP_URL = "http://127.0.0.1:{}".format(app_server.servers[0].sockets[0].getsockname()[1])
+
+# ─── TESTS ─────────────────────────────────────────────────────────────
+
+passed = 0
+failed = 0
+
+
+def check(condition, label):
+    global passed, failed
+    if condition:
+        passed += 1
+        print(f"  \033[32m✓\033[0m {label}")
+    else:
+        failed += 1
+        print(f"  \033[31m✗\033[0m {label}")
+
+
+async def create_user():
+    async with async_session_scope() as db:
+        db.add(User(id="chapter-stu", email="chapter-stu@example.com", name="Mia", grade_level=2))
+
+
+async def run_requests():
+    results = {"arrivals": []}
+    async with httpx.AsyncClient(base_url=APP_URL, timeout=30) as client:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            buffer = ""
+            chapter_id = None
+            async with client.stream("POST", "/api/generate-chapter/stream", json={
+                "student_id": "chapter-stu", "topic": "Mars", "chapter_number": 1
+            }) as response:
+                results["content_type"] = response.headers.get("content-type", "")
+                async for piece in response.aiter_text():
+                    buffer += piece
+                    while "\n\n" in buffer:
+                        block, buffer = buffer.split("\n\n", 1)
+                        fields = dict(line.split(": ", 1) for line in block.splitlines())
+                        event, data = fields["event"], json.loads(fields["data"])
+                        results["arrivals"].append((event, data, time.perf_counter() - start))
+                        if event == "title":
+                            chapter_id = data["id"]
+                        if event == "page" and data["index"] == 0:
+                            saved = await client.get(f"/api/reading/content/{chapter_id}")
+                            results["saved_during_stream"] = saved.status_code
+            results["total"] = time.perf_counter() - start
+            results["reading"] = (await client.get(f"/api/reading/content/{chapter_id}")).json()
+            results["books"] = (await client.get("/api/students/chapter-stu/books")).json()
+            results["plain"] = (await client.post("/api/generate-chapter", json={
+                "student_id": "chapter-stu", "topic": "Mars", "chapter_number": 2
+            })).json()
+    return results
+
+
+asyncio.run(create_user())
+results = asyncio.run(run_requests())
+arrivals = results["arrivals"]
+events = [event for event, _, _ in arrivals]
+pages = [data for event, data, _ in arrivals if event == "page"]
+page_times = [at for event, _, at in arrivals if event == "page"]
+title_at = next((at for event, _, at in arrivals if event == "title"), None)
+done = next((data for event, data, _ in arrivals if event == "done"), {})
+
+print("\n1. Title first")
+check(results["content_type"].startswith("text/event-stream"), "response is text/event-stream")
+check(events and events[0] == "title", "first event is the title")
+check(arrivals and arrivals[0][1].get("title") == "The Red Planet", "title parsed from the first line")
+check(title_at is not None and title_at < GENERATION_TIME / 4,
+      f"title after {title_at * 1000:.0f} ms (story takes {GENERATION_TIME * 1000:.0f} ms)")
+
+print("\n2. Pages stream while the story is written")
+check(len(pages) >= 3, f"several pages streamed (saw {len(pages)})")
+check([p["index"] for p in pages] == list(range(len(pages))), "page indexes are 0..n-1 in order")
+check(page_times and page_times[0] < GENERATION_TIME / 2,
+      f"page 1 after {page_times[0] * 1000:.0f} ms, before half the story is written")
+check(events[-1] == "done", "done event is last")
+
+print("\n3. Same pagination as get_reading_content")
+served = results["reading"].get("pages", [])
+check([p["text"] for p in pages] == [p["text"] for p in served], "streamed pages == /api/reading/content pages")
+check(done.get("pages") == served and done.get("total_pages") == len(served), "done event carries the same pages")
+check(done.get("title") == results["reading"].get("title") == "The Red Planet", "saved title matches")
+check(done.get("content") == results["plain"].get("content"), "content matches the non-streaming endpoint")
+check(done.get("gamification", {}).get("activity_processed") is True, "done event carries the gamification result")
+
+print("\n4. Chapter row saved at the end")
+check(results.get("saved_during_stream") == 404, "no Chapter row while pages are still streaming")
+check(any(book["id"] == done.get("id") for book in results["books"]), "chapter listed in the student's books afterwards")
+
+app_server.should_exit = True
+server.shutdown()
+
+total = passed + failed
+print()
+if failed == 0:
+    print(f"\033[32mAll {total} checks passed!\033[0m")
+else:
+    print(f"\033[31m{passed}/{total} checks passed, {failed} FAILED\033[0m")
+
+sys.exit(0 if failed == 0 else 1)
@@ -0,0 +1,223 @@
+"""
+Tests for the streaming chat endpoint (/api/chat/stream).
+
+Starts a stub OpenAI-compatible server that streams a reply of STUB_TOKENS
+tokens, one every STUB_TOKEN_DELAY seconds, and checks:
+1. Tokens reach the client as they are generated: time to first token is a
+   small fraction of the full generation time
+2. The stream ends with a `done` event carrying the full reply and the
+   gamification result
+3. The exchange is saved once the stream completes
+4. /api/chat still returns the whole reply as JSON
+5. /api/chat holds no read connection while the model generates, so more
+   concurrent chats than SQLITE_READ_POOL_SIZE run side by side
+
+Run with:  python test-chat-streaming.py
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_TOKENS = 20
+STUB_TOKEN_DELAY = 0.05
+READ_POOL_SIZE = 2
+CONCURRENT_CHATS = 2 * READ_POOL_SIZE + 1
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+REPLY_TOKENS = [f"word{i} " for i in range(STUB_TOKENS)]
+FULL_REPLY = "".join(REPLY_TOKENS).strip()
+
+# ─── Stub OpenAI server ───────────────────────────────────────────────
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        base = {"id": "chatcmpl-stub", "created": int(time.time()), "model": body.get("model", "stub")}
+
+        if not body.get("stream"):
+            time.sleep(STUB_TOKENS * STUB_TOKEN_DELAY)
+            payload = json.dumps({**base, "object": "chat.completion", "choices": [{
+                "index": 0, "message": {"role": "assistant", "content": FULL_REPLY}, "finish_reason": "stop"
+            }]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in REPLY_TOKENS:
+            time.sleep(STUB_TOKEN_DELAY)
+            chunk = {**base, "object": "chat.completion.chunk", "choices": [{
+                "index": 0, "delta": {"content": token}, "finish_reason": None
+            }]}
+            self._chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+
+    def log_message(self, *args):
+        pass
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), StubOpenAIHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+tmp_dir = tempfile.mkdtemp()
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+os.environ["OPENAI_API_KEY"] = "sk-test-stub"
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'test.db')}"
+os.environ["SQLITE_READ_POOL_SIZE"] = str(READ_POOL_SIZE)
+os.environ.pop("POSTGRES_URL", None)
+os.environ.pop("VERCEL", None)
+
+sys.path.insert(0, BACKEND_DIR)
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+import httpx
+import uvicorn
+
+# A real server: httpx's in-process ASGI transport buffers whole responses
+app_server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=0, log_level="warning", lifespan="off"))
+threading.Thread(target=lambda: asyncio.run(app_server.serve()), daemon=True).start()
+while not app_server.started:
+    time.sleep(0.01)
+APP_URL = "http://127.0.0.1:{}".format(app_server.servers[0].sockets[0].getsockname()[1])
+
+# ─── TESTS ─────────────────────────────────────────────────────────────
+
+passed = 0
+failed = 0
+
+
+def check(condition, label):
+    global passed, failed
+    if condition:
+        passed += 1
+        print(f"  \033[32m✓\033[0m {label}")
+    else:
+        failed += 1
+        print(f"  \033[31m✗\033[0m {label}")
+
+
+def parse_sse(raw: str):
+    """Split an SSE body into (event, data) pairs"""
+    events = []
+    for block in raw.split("\n\n"):
+        if not block.strip():
+            continue
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields.get("event"), json.loads(fields["data"])))
+    return events
+
+
+async def run_requests():
+    results = {}
+    async with httpx.AsyncClient(base_url=APP_URL, timeout=30) as client:
+        with contextlib.redirect_stdout(io.StringIO()):
+            await client.post("/api/students", json={
+                "id": "stream-stu", "name": "Stream", "grade_level": 3,
+                "interests": ["space"], "learning_style": "visual"
+            })
+
+            start = time.perf_counter()
+            first_token_at = None
+            saved_before_done = None
+            raw = ""
+            async with client.stream("POST", "/api/chat/stream", json={
+                "student_id": "stream-stu", "content": "Why is the sky blue?", "tutor_type": "science"
+            }) as response:
+                results["content_type"] = response.headers.get("content-type", "")
+                async for piece in response.aiter_text():
+                    if first_token_at is None and "event: token" in piece:
+                        first_token_at = time.perf_counter() - start
+                    if saved_before_done is None and "event: token" in piece:
+                        history = await client.get("/api/students/stream-stu/conversations")
+                        saved_before_done = len(history.json()["conversations"])
+                    raw += piece
+            results["total"] = time.perf_counter() - start
+            results["ttft"] = first_token_at
+            results["events"] = parse_sse(raw)
+            results["saved_before_done"] = saved_before_done
+            results["history"] = (await client.get("/api/students/stream-stu/conversations")).json()["conversations"]
+
+            start = time.perf_counter()
+            plain = await client.post("/api/chat", json={
+                "student_id": "stream-stu", "content": "Tell me more", "tutor_type": "science"
+            })
+            results["plain_elapsed"] = time.perf_counter() - start
+            results["plain"] = plain.json()
+
+            start = time.perf_counter()
+            concurrent = await asyncio.gather(*(client.post("/api/chat", json={
+                "student_id": "stream-stu", "content": f"Question {i}", "tutor_type": "science"
+            }) for i in range(CONCURRENT_CHATS)))
+            results["concurrent_elapsed"] = time.perf_counter() - start
+            results["concurrent_ok"] = sum(r.status_code == 200 for r in concurrent)
+    return results
+
+
+results = asyncio.run(run_requests())
+events = results["events"]
+tokens = [data["text"] for event, data in events if event == "token"]
+done = [data for event, data in events if event == "done"]
+generation_time = STUB_TOKENS * STUB_TOKEN_DELAY
+
+print("\n1. Tokens stream as they are generated")
+check(results["content_type"].startswith("text/event-stream"), "response is text/event-stream")
+check(len(tokens) == STUB_TOKENS, f"{STUB_TOKENS} token events (saw {len(tokens)})")
+check(results["ttft"] is not None and results["ttft"] < generation_time / 3,
+      f"first token after {results['ttft'] * 1000:.0f} ms (generation takes {generation_time * 1000:.0f} ms)")
+check(results["total"] >= generation_time, "stream stays open until generation finishes")
+
+print("\n2. Final event")
+check(len(done) == 1 and events[-1][0] == "done", "exactly one done event, sent last")
+final = done[0] if done else {}
+check(final.get("response") == FULL_REPLY, "done event carries the full reply")
+check("".join(tokens).strip() == FULL_REPLY, "tokens join up to the full reply")
+check(final.get("gamification", {}).get("activity_processed") is True, "done event carries the gamification result")
+check(final.get("gamification", {}).get("xp_gained", 0) > 0, "XP awarded for the streamed message")
+
+print("\n3. Persistence")
+check(results["saved_before_done"] == 0, "nothing saved while the reply is still streaming")
+check(len(results["history"]) == 1 and results["history"][0]["ai_response"] == FULL_REPLY,
+      "exchange saved with the full reply once the stream completed")
+
+print("\n4. Non-streaming endpoint unchanged")
+check(results["plain"].get("response") == FULL_REPLY, "/api/chat returns the whole reply")
+check(results["plain_elapsed"] >= generation_time, "/api/chat waits for the full generation")
+check("gamification" in results["plain"], "/api/chat includes gamification")
+
+print("\n5. Read pool is free during generation")
+check(results["concurrent_ok"] == CONCURRENT_CHATS, f"{CONCURRENT_CHATS} concurrent chats on a read pool of {READ_POOL_SIZE} all succeed")
+check(results["concurrent_elapsed"] < 2 * generation_time,
+      f"they overlap instead of queueing for a connection ({results['concurrent_elapsed'] * 1000:.0f} ms)")
+
+app_server.should_exit = True
+server.shutdown()
+
+total = passed + failed
+print()
+if failed == 0:
+    print(f"\033[32mAll {total} checks passed!\033[0m")
+else:
+    print(f"\033[31m{passed}/{total} checks passed, {failed} FAILED\033[0m")
+
+sys.exit(0 if failed == 0 else 1)
@@ -0,0 +1,248 @@
+"""
+Tests for coalescing identical concurrent outbound calls (backend/singleflight.py).
+
+Starts one stub server standing in for both OpenAI and ElevenLabs, whose
+responses take STUB_DELAY seconds, and checks:
+1. SingleFlight shares one call among concurrent callers, fans out results
+   and errors, survives a cancelled waiter and keeps nothing afterwards
+2. 25 students pressing "listen" at once make one ElevenLabs call
+3. Identical concurrent reading-feedback requests make one LLM call
+4. Duplicate concurrent chapter requests make one LLM call but each get
+   their own chapter, and the library gets it once
+
+Run with:  python test-coalescing.py
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_DELAY = 0.3
+STUDENTS = 25
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+# ─── Stub OpenAI + ElevenLabs server ──────────────────────────────────
+
+calls = {"tts": 0, "llm": 0}
+fail_tts = False
+counter_lock = threading.Lock()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        kind = "tts" if self.path.startswith("/v1/text-to-speech/") else "llm"
+        with counter_lock:
+            calls[kind] += 1
+            n = calls[kind]
+        time.sleep(STUB_DELAY)
+        if kind == "tts":
+            if fail_tts:
+                payload, status, content_type = b'{"detail": "stub outage"}', 500, "application/json"
+            else:
+                payload, status, content_type = f"MP3:{body['text']}:{n}".encode(), 200, "audio/mpeg"
+        else:
+            payload = json.dumps({
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {
+                    "role": "assistant", "content": f"Title: Tale {n}\n\nThis is tale {n}. Owls fly at night."
+                }}],
+            }).encode()
+            status, content_type = 200, "application/json"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+stub_url = f"http://127.0.0.1:{server.server_port}"
+
+tmp_dir = tempfile.mkdtemp()
+os.environ["OPENAI_BASE_URL"] = f"{stub_url}/v1"
+os.environ["OPENAI_API_KEY"] = "sk-test-stub"
+os.environ["ELEVENLABS_API_KEY"] = "el-test-stub"
+os.environ["CHAPTER_LIBRARY_FRESH_RATE"] = "0"
+os.environ["TTS_CACHE_MAX_MB"] = "0"  # repeat listens must reach the stub here
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'test.db')}"
+os.environ.pop("POSTGRES_URL", None)
+os.environ.pop("VERCEL", None)
+
+sys.path.insert(0, BACKEND_DIR)
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+import http_clients
+from singleflight import SingleFlight
+from sqlalchemy import select, func
+from models.schema import ChapterLibraryDB
+import httpx
+
+http_clients.UPSTREAMS["elevenlabs"] = (stub_url, 10.0)
+
+# ─── TESTS ─────────────────────────────────────────────────────────────
+
+passed = 0
+failed = 0
+
+
+def check(condition, label):
+    global passed, failed
+    if condition:
+        passed += 1
+        print(f"  \033[32m✓\033[0m {label}")
+    else:
+        failed += 1
+        print(f"  \033[31m✗\033[0m {label}")
+
+
+async def unit_checks():
+    results = {}
+    flights = SingleFlight("test")
+    runs = 0
+
+    async def work(value):
+        nonlocal runs
+        runs += 1
+        await asyncio.sleep(0.05)
+        return value
+
+    results["shared"] = await asyncio.gather(*[flights.do("a", lambda: work("A")) for _ in range(10)])
+    results["shared_runs"] = runs
+    results["after"] = await flights.do("a", lambda: work("A2"))
+    results["distinct"] = await asyncio.gather(flights.do("x", lambda: work("X")), flights.do("y", lambda: work("Y")))
+
+    async def boom():
+        await asyncio.sleep(0.05)
+        raise ValueError("upstream down")
+
+    errors = await asyncio.gather(*[flights.do("e", boom) for _ in range(3)], return_exceptions=True)
+    results["errors"] = errors
+
+    # The first caller goes away; the others still get the result
+    first = asyncio.ensure_future(flights.do("c", lambda: work("C")))
+    others = [asyncio.ensure_future(flights.do("c", lambda: work("C"))) for _ in range(2)]
+    await asyncio.sleep(0.01)
+    first.cancel()
+    results["after_cancel"] = await asyncio.gather(*others)
+    results["stats"] = flights.stats()
+    results["key_stable"] = SingleFlight.key("t", {"a": 1, "b": 2}) == SingleFlight.key("t", {"b": 2, "a": 1})
+    return results
+
+
+units = asyncio.run(unit_checks())
+
+print("\n1. SingleFlight")
+check(units["shared"] == ["A"] * 10 and units["shared_runs"] == 1, "10 concurrent callers, 1 call, all get the result")
+check(units["after"] == "A2", "a call after the flight lands runs again (not a cache)")
+check(units["distinct"] == ["X", "Y"], "different keys don't share")
+check(all(isinstance(e, ValueError) for e in units["errors"]), "errors fan out to every waiter")
+check(units["after_cancel"] == ["C", "C"], "a cancelled waiter doesn't cancel the call for the others")
+check(units["stats"]["in_flight"] == 0 and units["stats"]["coalesced"] == 9 + 2 + 2,
+      f"stats: {units['stats']}")
+check(units["key_stable"], "keys don't depend on dict order")
+
+
+async def run_requests():
+    global fail_tts
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+        with contextlib.redirect_stdout(io.StringIO()):
+            await client.post("/api/students", json={
+                "id": "sf-stu", "name": "Sef", "grade_level": 2, "interests": ["owls"], "learning_style": "visual"
+            })
+
+            # 2. TTS
+            text = "Once upon a time, an owl woke up."
+            start = time.perf_counter()
+            responses = await asyncio.gather(*[client.post("/api/tts", json={"text": text}) for _ in range(STUDENTS)])
+            results["tts_elapsed"] = time.perf_counter() - start
+            results["tts_calls"] = calls["tts"]
+            results["tts_bodies"] = {(r.status_code, r.content) for r in responses}
+            await asyncio.gather(client.post("/api/tts", json={"text": "Page two."}),
+                                 client.post("/api/tts", json={"text": "Page three."}))
+            results["tts_distinct_calls"] = calls["tts"] - results["tts_calls"]
+            before = calls["tts"]
+            await client.post("/api/tts", json={"text": text})
+            results["tts_again_calls"] = calls["tts"] - before
+            fail_tts = True
+            before = calls["tts"]
+            failures = await asyncio.gather(*[client.post("/api/tts", json={"text": "Broken."}) for _ in range(5)])
+            fail_tts = False
+            results["tts_fail_calls"] = calls["tts"] - before
+            results["tts_fail_codes"] = {r.status_code for r in failures}
+
+            # 3. Reading feedback (a misread isn't cached, so only coalescing helps)
+            before = calls["llm"]
+            feedback = await asyncio.gather(*[client.post("/api/reading/feedback", json={
+                "student_id": "sf-stu", "expected_text": "The owl can see.", "spoken_text": "The owl can sea",
+                "current_word_index": 4,
+            }) for _ in range(10)])
+            results["feedback_calls"] = calls["llm"] - before
+            results["feedback_texts"] = {r.json()["feedback"] for r in feedback}
+
+            # 4. Chapters
+            before = calls["llm"]
+            chapters = await asyncio.gather(*[client.post("/api/generate-chapter", json={
+                "student_id": "sf-stu", "topic": "Owls"
+            }) for _ in range(4)])
+            results["chapter_calls"] = calls["llm"] - before
+            results["chapters"] = [r.json() for r in chapters]
+            async with main.async_session_scope(readonly=True) as db:
+                results["library_size"] = await db.scalar(select(func.count()).select_from(ChapterLibraryDB))
+            results["stats"] = (await client.get("/api/system/coalescing")).json()
+    return results
+
+
+results = asyncio.run(run_requests())
+
+print("\n2. TTS")
+check(results["tts_calls"] == 1, f"{STUDENTS} concurrent listens, {results['tts_calls']} ElevenLabs call")
+check(len(results["tts_bodies"]) == 1 and next(iter(results["tts_bodies"]))[0] == 200,
+      "every student gets the same audio")
+check(results["tts_elapsed"] < STUB_DELAY * 3, f"all answered in {results['tts_elapsed'] * 1000:.0f} ms")
+check(results["tts_distinct_calls"] == 2, "different text isn't merged")
+check(results["tts_again_calls"] == 1, "a later listen calls again")
+check(results["tts_fail_calls"] == 1 and results["tts_fail_codes"] == {502}, "an upstream error reaches every waiter as 502")
+
+print("\n3. Reading feedback")
+check(results["feedback_calls"] == 1, f"10 identical requests, {results['feedback_calls']} LLM call")
+check(len(results["feedback_texts"]) == 1 and next(iter(results["feedback_texts"])).startswith("Title: Tale"),
+      "all get the same reply")
+
+print("\n4. Chapters")
+chapters = results["chapters"]
+check(results["chapter_calls"] == 1, f"4 duplicate chapter requests, {results['chapter_calls']} LLM call")
+check(len({c["id"] for c in chapters}) == 4 and len({c["content"] for c in chapters}) == 1,
+      "each request gets its own chapter row with the shared story")
+check(results["library_size"] == 1 and len({c.get("library_id") for c in chapters}) == 1,
+      "the story joins the library once")
+
+stats = results["stats"]
+check(stats["tts"]["coalesced"] == STUDENTS - 1 + 4 and stats["reading_feedback"]["coalesced"] == 9
+      and stats["chapter_generation"]["coalesced"] == 3, "metrics count the merged calls")
+
+server.shutdown()
+
+total = passed + failed
+print()
+if failed == 0:
+    print(f"\033[32mAll {total} checks passed!\033[0m")
+else:
+    print(f"\033[31m{passed}/{total} checks passed, {failed} FAILED\033[0m")
+
+sys.exit(0 if failed == 0 else 1)
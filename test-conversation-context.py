@@ -0,0 +1,204 @@
+"""
+Tests for the token-budgeted tutor context and rolling summaries.
+
+Starts a stub OpenAI-compatible server that gives long tutor replies and
+records every prompt, runs with a small CONTEXT_HISTORY_TOKENS budget and
+CONTEXT_SUMMARY_EVERY=3, and checks:
+1. fit_history() keeps the newest exchanges that fit the budget
+2. Chat prompts stay within the budget however many turns there are
+3. Turns that fall out of the budget are folded into a summary once every
+   3 turns, and the tutor gets the summary instead of those turns
+4. The streaming endpoint uses the same context
+
+Run with:  python test-conversation-context.py
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BUDGET = 300
+EVERY = 3
+TURNS = 11
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+# ─── Stub OpenAI server ───────────────────────────────────────────────
+
+chat_prompts = []
+summary_prompts = []
+counter_lock = threading.Lock()
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        messages = body["messages"]
+        with counter_lock:
+            if "running notes" in messages[0]["content"]:
+                summary_prompts.append(messages)
+                text = f"Summary {len(summary_prompts)}: we talked about volcanoes."
+            else:
+                chat_prompts.append(messages)
+                text = f"Reply {len(chat_prompts)}. " + "Lava is very hot rock. " * 18
+        if body.get("stream"):
+            chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": "stub", "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]}
+            payload = f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode()
+            content_type = "text/event-stream"
+        else:
+            payload = json.dumps({
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": text}}],
+            }).encode()
+            content_type = "application/json"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), StubOpenAIHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+tmp_dir = tempfile.mkdtemp()
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+os.environ["OPENAI_API_KEY"] = "sk-test-stub"
+os.environ["CONTEXT_HISTORY_TOKENS"] = str(BUDGET)
+os.environ["CONTEXT_SUMMARY_EVERY"] = str(EVERY)
+os.environ["CONTEXT_SUMMARY_ENABLED"] = "1"
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'test.db')}"
+os.environ.pop("POSTGRES_URL", None)
+os.environ.pop("VERCEL", None)
+
+sys.path.insert(0, BACKEND_DIR)
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+from context import count_tokens, exchange_tokens, fit_history
+import httpx
+
+# ─── TESTS ─────────────────────────────────────────────────────────────
+
+passed = 0
+failed = 0
+
+
+def check(condition, label):
+    global passed, failed
+    if condition:
+        passed += 1
+        print(f"  \033[32m✓\033[0m {label}")
+    else:
+        failed += 1
+        print(f"  \033[31m✗\033[0m {label}")
+
+
+def history_tokens(messages):
+    """Tokens of the replayed user/assistant turns, excluding the new message"""
+    turns = [m for m in messages[:-1] if m["role"] != "system"]
+    return sum(count_tokens(m["content"]) + 4 for m in turns)
+
+
+print("\n1. fit_history")
+short = {"student_message": "hi", "ai_response": "hello"}
+long = {"student_message": "tell me more", "ai_response": "x" * 2000}
+history = [dict(short, id=1), dict(long, id=2), dict(short, id=3), dict(short, id=4)]
+kept = fit_history(history, 100)
+check([e["id"] for e in kept] == [3, 4], "keeps the newest turns, stopping at one that doesn't fit")
+check(sum(exchange_tokens(e) for e in kept) <= 100, "kept turns fit the budget")
+check(fit_history(history, 0) == [] and fit_history([], 100) == [], "empty budget or history keeps nothing")
+
+
+async def run_requests():
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+        with contextlib.redirect_stdout(io.StringIO()):
+            await client.post("/api/students", json={
+                "id": "ctx-stu", "name": "Ctx", "grade_level": 3, "interests": ["volcanoes"], "learning_style": "visual"
+            })
+            results["summaries_after"] = []
+            for turn in range(1, TURNS + 1):
+                await client.post("/api/chat", json={
+                    "student_id": "ctx-stu", "content": f"Question {turn} about lava?", "tutor_type": "science"
+                })
+                await main.conversation_summary_pool.join()
+                results["summaries_after"].append(len(summary_prompts))
+            await client.post("/api/chat", json={
+                "student_id": "ctx-stu", "content": "And one more?", "tutor_type": "general"
+            })
+            raw = ""
+            async with client.stream("POST", "/api/chat/stream", json={
+                "student_id": "ctx-stu", "content": "Streaming question?", "tutor_type": "science"
+            }) as response:
+                async for piece in response.aiter_text():
+                    raw += piece
+            results["stream_raw"] = raw
+            await main.conversation_summary_pool.join()
+            results["stats"] = (await client.get("/api/system/conversation-context")).json()
+    return results
+
+
+results = asyncio.run(run_requests())
+
+print("\n2. Budget")
+check(len(chat_prompts) == TURNS + 2, f"{len(chat_prompts)} chat prompts sent")
+largest = max(history_tokens(p) for p in chat_prompts)
+check(largest <= BUDGET, f"replayed history never over {BUDGET} tokens (max {largest})")
+late = chat_prompts[TURNS - 1]
+replayed = [m for m in late if m["role"] == "assistant"]
+check(0 < len(replayed) < TURNS - 1, f"turn {TURNS} replays the {len(replayed)} newest exchanges, not all {TURNS - 1}")
+check(replayed[-1]["content"].startswith(f"Reply {TURNS - 1}."), "the previous exchange is replayed")
+
+print("\n3. Rolling summary")
+# 2 exchanges fit the budget; every 3 more that fall out trigger a summary
+expected = [max(0, (turn - 2) // EVERY) for turn in range(1, TURNS + 1)]
+check(results["summaries_after"] == expected,
+      f"summaries regenerated every {EVERY} turns: {results['summaries_after']}")
+check(len(summary_prompts) == 3 and "Summary 1:" in summary_prompts[1][1]["content"],
+      "each summary folds in the previous one")
+check("Question 4 about lava?" in summary_prompts[1][1]["content"]
+      and "Question 3 about lava?" not in summary_prompts[1][1]["content"],
+      "each summary only adds the turns since the last one")
+summary_messages = [m["content"] for m in late if m["role"] == "system"][1:]
+check(summary_messages == ["Earlier in this conversation: Summary 2: we talked about volcanoes."],
+      "the tutor gets the latest summary as context (the third is written after this turn)")
+all_user = " ".join(m["content"] for m in chat_prompts[TURNS] if m["role"] == "user")
+check("Question 1 about lava?" not in all_user and "Question 9 about lava?" not in all_user,
+      "summarized turns aren't replayed")
+general = chat_prompts[TURNS]
+check(general[0]["content"] != late[0]["content"] and "Summary 3" in general[1]["content"],
+      "other tutor types share the summary")
+
+print("\n4. Streaming and metrics")
+streamed = chat_prompts[TURNS + 1]
+check("Summary" in streamed[1]["content"] and history_tokens(streamed) <= BUDGET,
+      "streaming chat gets the summary and the budgeted history")
+check('"response"' in results["stream_raw"].split("event: done", 1)[-1], "stream finishes with done")
+stats = results["stats"]
+check(stats["history_tokens"] == BUDGET and stats["summary_every"] == EVERY and stats["failed"] == 0
+      and stats["tokenizer"] in ("tiktoken", "estimate"), f"stats: {stats['completed']} summary jobs, tokenizer {stats['tokenizer']}")
+
+server.shutdown()
+
+total = passed + failed
+print()
+if failed == 0:
+    print(f"\033[32mAll {total} checks passed!\033[0m")
+else:
+    print(f"\033[31m{passed}/{total} checks passed, {failed} FAILED\033[0m")
+
+sys.exit(0 if failed == 0 else 1)
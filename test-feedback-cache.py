@@ -0,0 +1,243 @@
+"""
+Tests for the reading feedback cache.
+
+Starts a stub OpenAI-compatible server that answers each completion with a
+numbered reply after STUB_DELAY seconds, and checks:
+1. Stuck-word feedback for words the local syllabifier can't split calls
+   the LLM until the key has its variants, then is served from cache
+2. Keys are normalized (case, punctuation) and split by grade and branch
+2b. Cached branches share replies across passages, so their prompts must
+    not mention the passage
+3. Misread feedback and API-error fallbacks are never cached
+4. /api/system/feedback-cache reports the hit rate
+5. LRUTTLCache / VariantCache evict by recency and expire by TTL
+
+Run with:  python test-feedback-cache.py
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_DELAY = 0.2
+VARIANTS = 3
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+# ─── Stub OpenAI server ───────────────────────────────────────────────
+
+llm_calls = 0
+llm_prompts = []
+fail_requests = False
+counter_lock = threading.Lock()
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        global llm_calls
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with counter_lock:
+            llm_calls += 1
+            n = llm_calls
+            llm_prompts.append(body["messages"][-1]["content"])
+        time.sleep(STUB_DELAY)
+        if fail_requests:
+            payload = json.dumps({"error": {"message": "stub outage", "type": "server_error"}}).encode()
+            self.send_response(400)
+        else:
+            payload = json.dumps({
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": f"Feedback number {n}."},
+                             "finish_reason": "stop"}],
+            }).encode()
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), StubOpenAIHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+tmp_dir = tempfile.mkdtemp()
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+os.environ["OPENAI_API_KEY"] = "sk-test-stub"
+os.environ["FEEDBACK_CACHE_VARIANTS"] = str(VARIANTS)
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'test.db')}"
+os.environ.pop("POSTGRES_URL", None)
+os.environ.pop("VERCEL", None)
+
+sys.path.insert(0, BACKEND_DIR)
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+from cache import LRUTTLCache, VariantCache
+import httpx
+
+# ─── TESTS ─────────────────────────────────────────────────────────────
+
+passed = 0
+failed = 0
+
+
+def check(condition, label):
+    global passed, failed
+    if condition:
+        passed += 1
+        print(f"  \033[32m✓\033[0m {label}")
+    else:
+        failed += 1
+        print(f"  \033[31m✗\033[0m {label}")
+
+
+def stuck(student_id, word):
+    return {
+        "student_id": student_id, "expected_text": f"The {word} flew away.", "spoken_text": "The",
+        "current_word_index": 1, "struggle_indicators": {"stuck_word": True, "stuck_on": word},
+    }
+
+
+async def run_requests():
+    global fail_requests
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for sid, grade in (("fc-g2", 2), ("fc-g4", 4)):
+                await client.post("/api/students", json={
+                    "id": sid, "name": "Cache", "grade_level": grade,
+                    "interests": ["bugs"], "learning_style": "visual"
+                })
+
+            async def feedback(payload):
+                before = llm_calls
+                start = time.perf_counter()
+                response = await client.post("/api/reading/feedback", json=payload)
+                return response.json()["feedback"], llm_calls - before, time.perf_counter() - start
+
+            # 1. Fill, then serve
+            results["fill"] = [await feedback(stuck("fc-g2", "violin")) for _ in range(VARIANTS)]
+            results["served"] = [await feedback(stuck("fc-g2", "violin")) for _ in range(20)]
+
+            # 2. Normalized keys, grade and branch split
+            results["normalized"] = await feedback(stuck("fc-g2", "Violin,"))
+            results["other_grade"] = await feedback(stuck("fc-g4", "violin"))
+            results["other_word"] = await feedback(stuck("fc-g2", "piano"))
+
+            # 3. Not cached: misreads and API failures
+            misread = {"student_id": "fc-g2", "expected_text": "The butterfly flew", "spoken_text": "The buttery flew"}
+            results["misread"] = [await feedback(misread) for _ in range(VARIANTS + 1)]
+            fail_requests = True
+            results["failed"] = await feedback(stuck("fc-g2", "radio"))
+            fail_requests = False
+            results["after_failure"] = await feedback(stuck("fc-g2", "radio"))
+
+            # 4. Metrics
+            results["stats"] = (await client.get("/api/system/feedback-cache")).json()
+
+            # 2b. Same grade and branch, two different stories (after the metrics snapshot)
+            def story(text, **indicators):
+                return {"student_id": "fc-g4", "expected_text": text, "spoken_text": "",
+                        "current_word_index": 0, "struggle_indicators": indicators or None}
+            for name, text in (("dragon", "The dragon slept in a cave of gold."),
+                               ("picnic", "Mia packed apples for the picnic.")):
+                before = len(llm_prompts)
+                results[f"encourage_{name}"] = await feedback(story(text))
+                results[f"pause_{name}"] = await feedback(story(text, long_pause=True))
+                results[f"prompts_{name}"] = llm_prompts[before:]
+    return results
+
+
+main.feedback_cache.clear()
+results = asyncio.run(run_requests())
+
+print("\n1. Stuck-word feedback is served from cache once its variants are collected")
+check([calls for _, calls, _ in results["fill"]] == [1] * VARIANTS,
+      f"first {VARIANTS} requests each call the LLM")
+fill_texts = {text for text, _, _ in results["fill"]}
+check(len(fill_texts) == VARIANTS, f"{VARIANTS} distinct variants stored")
+check(all(calls == 0 for _, calls, _ in results["served"]), "next 20 requests make no LLM calls")
+served_texts = [text for text, _, _ in results["served"]]
+check(set(served_texts) <= fill_texts and len(set(served_texts)) > 1, "cached replies rotate among the stored variants")
+check(all(a != b for a, b in zip(served_texts, served_texts[1:])), "the same variant is never served twice in a row")
+fill_time = min(elapsed for _, _, elapsed in results["fill"])
+served_time = sorted(elapsed for _, _, elapsed in results["served"])[len(results["served"]) // 2]
+check(served_time < STUB_DELAY / 10,
+      f"cached request took {served_time * 1000:.1f} ms (median) vs {fill_time * 1000:.0f} ms with the LLM")
+key = ("stuck_word", 2, "violin")
+start = time.perf_counter()
+for _ in range(1000):
+    main.feedback_cache.get(key)
+lookup_ms = (time.perf_counter() - start) * 1000 / 1000
+check(lookup_ms < 1.0, f"cache lookup costs {lookup_ms:.4f} ms")
+
+print("\n2. Cache keys")
+check(results["normalized"][1] == 0, '"Violin," shares the "violin" entry')
+check(results["other_grade"][1] == 1, "another grade gets its own entry")
+check(results["other_word"][1] == 1, "another word gets its own entry")
+
+print("\n2b. Cached prompts don't depend on the passage")
+check(results["encourage_dragon"][1] == 1 and results["pause_dragon"][1] == 1, "first story fills both keys")
+dragon_prompts = results["prompts_dragon"]
+check(len(dragon_prompts) == 2 and not any("dragon" in p or "cave" in p for p in dragon_prompts),
+      "encouragement and long-pause prompts leave the passage out")
+check(all("picnic" not in p and "apples" not in p for p in results["prompts_picnic"]),
+      "second story's passage isn't sent either")
+check('"the"' in dragon_prompts[1], "long-pause prompt names the cached next word")
+check(len(results["prompts_picnic"]) == 2 and results["prompts_picnic"][0] == dragon_prompts[0],
+      "both stories send the same encouragement prompt for the shared key")
+check(results["pause_picnic"][1] == 1 and '"mia"' in results["prompts_picnic"][1],
+      "a different next word gets its own long-pause entry")
+
+print("\n3. Not cached")
+check([calls for _, calls, _ in results["misread"]] == [1] * (VARIANTS + 1), "misread feedback always calls the LLM")
+check(results["failed"][1] == 1 and results["failed"][0].startswith("Keep reading!"), "API error falls back")
+check(results["after_failure"][1] == 1 and not results["after_failure"][0].startswith("Keep reading!"),
+      "fallback text wasn't cached")
+
+print("\n4. Metrics")
+stats = results["stats"]
+check(stats["hits"] == 21, f"21 hits (saw {stats['hits']})")
+check(stats["misses_while_filling"] == VARIANTS - 1, f"{VARIANTS - 1} misses while filling the first key")
+check(0 < stats["hit_rate"] < 1 and stats["hit_rate"] == round(stats["hits"] / (stats["hits"] + stats["misses"]), 4),
+      f"hit_rate {stats['hit_rate']} reported")
+check(stats["complete_keys"] == 1 and stats["entries"] == 4, "1 complete key out of 4")
+
+print("\n5. LRU and TTL")
+lru = LRUTTLCache(max_entries=2, ttl_seconds=None)
+lru.set("a", 1)
+lru.set("b", 2)
+lru.get("a")
+lru.set("c", 3)
+check("b" not in lru and lru.get("a") == 1 and lru.get("c") == 3, "least recently used key evicted")
+check(lru.stats()["evictions"] == 1, "eviction counted")
+ttl = VariantCache(max_entries=10, ttl_seconds=0.05, variants=1)
+ttl.add("k", "v")
+check(ttl.get("k") == "v", "entry served before the TTL")
+time.sleep(0.08)
+check(ttl.get("k") is None and ttl.stats()["expirations"] == 1, "entry expires after the TTL")
+off = VariantCache(max_entries=0, variants=1)
+off.add("k", "v")
+check(off.get("k") is None, "max_entries=0 disables caching")
+
+server.shutdown()
+
+total = passed + failed
+print()
+if failed == 0:
+    print(f"\033[32mAll {total} checks passed!\033[0m")
+else:
+    print(f"\033[31m{passed}/{total} checks passed, {failed} FAILED\033[0m")
+
+sys.exit(0 if failed == 0 else 1)
@@ -0,0 +1,446 @@
+"""
+Tests for the gamification and conversation storage layer (backend/main.py).
+
+Runs against a fresh SQLite file with the default production profile (WAL,
+one-connection write pool, query-only read pool) and checks:
+1. An activity is one transaction: a failure part-way leaves nothing behind
+2. Badges are awarded once: repeats, stale reads and concurrent awards
+   insert no duplicate rows and grant the badge XP once
+3. Leaderboards: daily and weekly only count the current period, all-time
+   ranks by total XP, badge counts and limits are right; the route reports
+   how many students are ranked and rejects unknown timeframes; ended
+   periods are pruned
+4. XP ledger and rollups: hour/day buckets match the ledger, and
+   get_xp_in_range() matches a sum over hourly buckets for any window
+5. Stat counters: concurrent updates from this process and from other
+   processes sharing the file lose no increments
+6. The async gamification routes read back what activities wrote, and
+   run reads concurrently with writes
+7. Quests: expiry is fixed at start (far-future sentinel when untimed),
+   expired and completed quests drop out, progress and completion are saved
+8. Conversation history: keyset pages cover every exchange exactly once,
+   newest first, including exchanges with the same timestamp
+
+Run with:  python test-gamification-storage.py
+(--stats-worker is internal: section 5 starts copies of this script with it)
+"""
+import asyncio
+import contextlib
+import io
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+# No test here needs the LLM; any call fails fast against a closed port
+with socket.socket() as probe:
+    probe.bind(("127.0.0.1", 0))
+    closed_port = probe.getsockname()[1]
+
+STATS_WORKER = sys.argv[1:2] == ["--stats-worker"]
+STATS_UPDATES = 20
+db_path = os.environ["STORAGE_TEST_DB"] if STATS_WORKER else os.path.join(tempfile.mkdtemp(), "test.db")
+os.environ["STORAGE_TEST_DB"] = db_path
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{closed_port}/v1"
+os.environ["OPENAI_API_KEY"] = "sk-test-stub"
+os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+os.environ.pop("POSTGRES_URL", None)
+os.environ.pop("VERCEL", None)
+os.environ.pop("SQLITE_PROFILE", None)
+
+sys.path.insert(0, BACKEND_DIR)
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+from main import ConversationStorage, GamificationStorage, async_session_scope, gamification_engine
+from models.schema import QUEST_NO_EXPIRY, ConversationDB, User, LeaderboardEntryDB, StudentQuestDB, StudentBadgeDB, StudentLevelDB, StudentStatsDB, XPEventDB, XPRollupDB
+from sqlalchemy import func, select, update
+import httpx
+
+
+async def bump_stats(student_id):
+    async with async_session_scope() as db:
+        return await GamificationStorage.update_student_stats(
+            student_id, {"messages_sent": 1, "total_activities": 1, "not_a_counter": 5}, db)
+
+
+if STATS_WORKER:
+    async def stats_worker():
+        with contextlib.redirect_stdout(io.StringIO()):
+            await asyncio.gather(*[bump_stats("stats-stu") for _ in range(STATS_UPDATES)])
+            await main.dispose_engines()
+
+    asyncio.run(stats_worker())
+    sys.exit(0)
+
+# ─── TESTS ─────────────────────────────────────────────────────────────
+
+passed = 0
+failed = 0
+OUT = sys.stdout  # the backend prints progress; checks go to the real stdout
+
+
+def check(condition, label):
+    global passed, failed
+    if condition:
+        passed += 1
+        print(f"  \033[32m✓\033[0m {label}", file=OUT)
+    else:
+        failed += 1
+        print(f"  \033[31m✗\033[0m {label}", file=OUT)
+
+
+async def count(model, student_id):
+    async with async_session_scope(readonly=True) as db:
+        return await db.scalar(select(func.count()).select_from(model).where(model.student_id == student_id))
+
+
+SECTIONS = []
+
+
+def section(fn):
+    SECTIONS.append(fn)
+    return fn
+
+
+@section
+async def activity_transaction():
+    print("\n1. One transaction per activity", file=OUT)
+
+    async def broken_quests(*args, **kwargs):
+        raise RuntimeError("quest table unavailable")
+
+    gamification_engine.update_quest_progress = broken_quests
+    try:
+        result = await gamification_engine.process_student_activity(
+            "tx-stu", "messages_sent", {"subject": "math", "local_hour": 12})
+    finally:
+        del gamification_engine.update_quest_progress
+    check("quest table unavailable" in result.get("error", ""), "a failing step is reported")
+    check(await count(StudentLevelDB, "tx-stu") == 0 and await count(XPEventDB, "tx-stu") == 0,
+          "XP granted before the failure was rolled back")
+    check(await count(StudentStatsDB, "tx-stu") == 0, "stats updated before the failure were rolled back")
+
+    result = await gamification_engine.process_student_activity(
+        "tx-stu", "messages_sent", {"subject": "math", "local_hour": 12})
+    level = await gamification_engine.get_student_level("tx-stu")
+    stats = await gamification_engine.get_student_stats("tx-stu")
+    badge_xp = sum(badge["xp_reward"] for badge in result["new_badges"])
+    check("error" not in result and level.total_xp_earned == result["xp_gained"] + badge_xp > 0,
+          f"a clean activity commits its XP ({result['xp_gained']} + {badge_xp} from badges)")
+    check(stats["messages_sent"] == 1 and stats["math_interactions"] == 1, "and its stats")
+
+
+@section
+async def badge_awards():
+    print("\n2. Badge awards", file=OUT)
+    async with async_session_scope() as db:
+        first = await GamificationStorage.award_badges("badge-stu", ["first_chat", "night_owl", "first_chat"], db)
+    async with async_session_scope() as db:
+        again = await GamificationStorage.award_badges("badge-stu", ["night_owl", "first_chat"], db)
+    check(sorted(first) == ["first_chat", "night_owl"] and again == [], "a second award inserts nothing")
+    check(await count(StudentBadgeDB, "badge-stu") == 2, "one row per badge")
+
+    # A stale read of the earned set (another activity committed in between)
+    # must not grant the badge XP again
+    async def stale_badges(*args, **kwargs):
+        return []
+
+    gamification_engine.get_student_badges = stale_badges
+    try:
+        awarded = await gamification_engine.check_and_award_badges(
+            "badge-stu", {}, student_stats={"messages_sent": 1, "late_night_study": 1})
+    finally:
+        del gamification_engine.get_student_badges
+    level = await gamification_engine.get_student_level("badge-stu")
+    check(awarded == [] and level.total_xp_earned == 0, "held badges aren't re-awarded after a stale read")
+
+    stats = {"messages_sent": 1}
+    results = await asyncio.gather(*[
+        gamification_engine.check_and_award_badges("race-stu", {}, student_stats=stats) for _ in range(8)
+    ])
+    awarded = [badge.id for badges in results for badge in badges]
+    level = await gamification_engine.get_student_level("race-stu")
+    check(awarded == ["first_chat"], f"8 concurrent checks award first_chat once ({awarded})")
+    check(await count(StudentBadgeDB, "race-stu") == 1 and level.total_xp_earned == 50,
+          f"one row and its 50 XP ({level.total_xp_earned})")
+
+
+@section
+async def leaderboard_windows():
+    print("\n3. Leaderboard windows", file=OUT)
+    for student_id, xp in (("lb-a", 900), ("lb-b", 700), ("lb-c", 500)):
+        await gamification_engine.add_xp(student_id, xp, "test")
+    await gamification_engine.award_badge("lb-b", "first_chat")
+    periods = GamificationStorage.leaderboard_periods()
+    async with async_session_scope() as db:
+        db.add_all([
+            # Earlier periods, and a weekly row with no daily one
+            LeaderboardEntryDB(timeframe="daily", period_start=periods["daily"] - timedelta(days=1), student_id="lb-old", xp=5000),
+            LeaderboardEntryDB(timeframe="weekly", period_start=periods["weekly"] - timedelta(days=7), student_id="lb-old", xp=5000),
+            LeaderboardEntryDB(timeframe="weekly", period_start=periods["weekly"], student_id="lb-week", xp=800),
+        ])
+
+    daily = await gamification_engine.get_leaderboard("daily", 3)
+    weekly = await gamification_engine.get_leaderboard("weekly", 4)
+    all_time = await gamification_engine.get_leaderboard("all_time", 3)
+    check([e["student_id"] for e in daily] == ["lb-a", "lb-b", "lb-c"], "daily: today's XP only")
+    check([e["student_id"] for e in weekly] == ["lb-a", "lb-week", "lb-b", "lb-c"], "weekly: this week's XP only")
+    check([e["student_id"] for e in all_time] == ["lb-a", "lb-b", "lb-c"]
+          and [e["total_xp"] for e in all_time] == [900, 700, 500], "all-time: ranked by total XP")
+    by_id = {e["student_id"]: e for e in weekly}
+    check(by_id["lb-b"]["badges_earned"] == 1 and by_id["lb-a"]["badges_earned"] == 0, "badge counts joined per student")
+    check(by_id["lb-week"]["level"] == 1 and by_id["lb-week"]["title"] == "Curious Beginner",
+          "a student with no level row gets the default level")
+    check([e["rank"] for e in weekly] == [1, 2, 3, 4] and len(await gamification_engine.get_leaderboard("daily", 2)) == 2,
+          "ranks and limit")
+    try:
+        await gamification_engine.get_leaderboard("monthly", 3)
+        check(False, "unknown timeframe rejected")
+    except ValueError:
+        check(True, "unknown timeframe rejected")
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+        routes = {timeframe: (await client.get("/api/gamification/leaderboard", params={"timeframe": timeframe})).json()
+                  for timeframe in ("daily", "weekly", "all_time")}
+        unknown = await client.get("/api/gamification/leaderboard", params={"timeframe": "monthly"})
+    async with async_session_scope(readonly=True) as db:
+        ranked_today = await db.scalar(select(func.count()).select_from(LeaderboardEntryDB).where(
+            LeaderboardEntryDB.timeframe == "daily", LeaderboardEntryDB.period_start == periods["daily"]))
+        with_levels = await db.scalar(select(func.count()).select_from(StudentLevelDB))
+    check(routes["daily"]["total_students"] == ranked_today > 0
+          and routes["weekly"]["total_students"] == ranked_today + 1
+          and routes["all_time"]["total_students"] == with_levels,
+          f"total_students counts the ranked rows ({[r['total_students'] for r in routes.values()]})")
+    check(unknown.status_code == 400, f"the route answers an unknown timeframe with 400 ({unknown.status_code})")
+
+    async with async_session_scope() as db:
+        pruned = await GamificationStorage.prune_ended_leaderboard_periods(db)
+    async with async_session_scope(readonly=True) as db:
+        old_rows = await db.scalar(select(func.count()).select_from(LeaderboardEntryDB).where(
+            LeaderboardEntryDB.student_id == "lb-old"))
+    check(pruned == 2 and old_rows == 0, f"ended periods pruned ({pruned} rows)")
+    check([e["student_id"] for e in await gamification_engine.get_leaderboard("weekly", 4)]
+          == ["lb-a", "lb-week", "lb-b", "lb-c"], "current periods kept")
+    async with async_session_scope() as db:
+        db.add(LeaderboardEntryDB(timeframe="daily", period_start=periods["daily"] - timedelta(days=3),
+                                  student_id="lb-old", xp=1))
+    GamificationStorage._leaderboard_pruned_for = None  # as if the day just rolled over
+    await gamification_engine.add_xp("lb-c", 1, "test")
+    check(await count(LeaderboardEntryDB, "lb-old") == 0, "the first XP write of a new day prunes ended periods")
+
+
+@section
+async def xp_rollups():
+    print("\n4. XP ledger and rollups", file=OUT)
+    for amount in (10, 20, 30, 40, 50):
+        async with async_session_scope() as db:
+            await GamificationStorage.record_xp_event("xp-stu", amount, "test", db)
+    async with async_session_scope(readonly=True) as db:
+        ledger = list(await db.scalars(select(XPEventDB.amount).where(XPEventDB.student_id == "xp-stu")))
+        rollups = {}
+        for granularity, xp, events in await db.execute(
+                select(XPRollupDB.granularity, XPRollupDB.xp, XPRollupDB.event_count)
+                .where(XPRollupDB.student_id == "xp-stu")):
+            totals = rollups.setdefault(granularity, [0, 0])
+            totals[0] += xp
+            totals[1] += events
+    check(sorted(ledger) == [10, 20, 30, 40, 50], "every grant is in the ledger")
+    check(rollups == {"hour": [150, 5], "day": [150, 5]}, f"hour and day rollups add up ({rollups})")
+    now = datetime.now()
+    totals = await gamification_engine.get_xp_in_range(["xp-stu", "xp-nobody"], now.replace(hour=0, minute=0), now)
+    check(totals == {"xp-stu": 150, "xp-nobody": 0}, "today's total, and 0 for a student with none")
+
+    # Hourly buckets over four days, with day buckets as their sums
+    base = datetime(2024, 3, 4)
+    hourly = {base + timedelta(hours=h): (h * 7) % 13 + 1 for h in range(0, 96, 5)}
+    daily = {}
+    for start, xp in hourly.items():
+        day = start.replace(hour=0)
+        daily[day] = daily.get(day, 0) + xp
+    async with async_session_scope() as db:
+        db.add_all([XPRollupDB(student_id="xp-seed", granularity="hour", bucket_start=start, xp=xp, event_count=1)
+                    for start, xp in hourly.items()])
+        db.add_all([XPRollupDB(student_id="xp-seed", granularity="day", bucket_start=start, xp=xp, event_count=1)
+                    for start, xp in daily.items()])
+
+    windows = [
+        (base, base + timedelta(days=4)),                                   # whole days
+        (base + timedelta(hours=3), base + timedelta(days=2, hours=17)),    # partial days at both edges
+        (base + timedelta(hours=26), base + timedelta(hours=40)),           # inside one day
+        (base + timedelta(hours=5, minutes=30), base + timedelta(days=3, hours=1, minutes=10)),  # mid-hour bounds
+        (base + timedelta(days=1), base + timedelta(days=2)),               # exactly one day
+    ]
+    mismatches = []
+    for start, end in windows:
+        start_hour = start.replace(minute=0)
+        end_hour = end if end.minute == 0 else end.replace(minute=0) + timedelta(hours=1)
+        expected = sum(xp for bucket, xp in hourly.items() if start_hour <= bucket < end_hour)
+        got = (await gamification_engine.get_xp_in_range(["xp-seed"], start, end))["xp-seed"]
+        if got != expected:
+            mismatches.append((start, end, got, expected))
+    check(not mismatches, f"{len(windows)} windows match the hourly sums {mismatches or ''}")
+
+
+@section
+async def concurrent_stats():
+    print("\n5. Concurrent stat updates", file=OUT)
+    workers = [subprocess.Popen([sys.executable, __file__, "--stats-worker"], stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE) for _ in range(3)]
+    returned = await asyncio.gather(*[bump_stats("stats-stu") for _ in range(STATS_UPDATES)])
+    errors = [worker.communicate()[1].decode()[-300:] for worker in workers if worker.wait() != 0]
+    check(not errors, f"3 worker processes finished {errors or ''}")
+    expected = STATS_UPDATES * (1 + len(workers))
+    stats = await gamification_engine.get_student_stats("stats-stu")
+    check(stats["messages_sent"] == expected and stats["total_activities"] == expected,
+          f"{expected} increments, none lost ({stats['messages_sent']} messages, {stats['total_activities']} activities)")
+    counts = [row["messages_sent"] for row in returned]
+    check(len(set(counts)) == STATS_UPDATES and max(counts) <= expected,
+          "each update returns the row as it left it")
+    check(await count(StudentStatsDB, "stats-stu") == 1, "one stats row per student")
+
+
+@section
+async def async_routes():
+    print("\n6. Async gamification routes", file=OUT)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+        activity = {"student_id": "route-stu", "activity_type": "messages_sent",
+                    "activity_data": {"subject": "science", "local_hour": 23}}
+        first = (await client.post("/api/gamification/activity", json=activity)).json()
+        # Reads for the dashboard keep going while more activities are written
+        responses = await asyncio.gather(
+            *[client.post("/api/gamification/activity", json=activity) for _ in range(4)],
+            *[client.get("/api/gamification/student/route-stu/level") for _ in range(4)],
+        )
+        level = (await client.get("/api/gamification/student/route-stu/level")).json()
+        badges = (await client.get("/api/gamification/student/route-stu/badges")).json()
+        xp = (await client.get("/api/gamification/xp", params={"student_ids": "route-stu", "timeframe": "daily"})).json()
+
+    check(first["activity_processed"] and {b["id"] for b in first["new_badges"]} >= {"first_chat", "night_owl"},
+          "an activity is processed and awards its badges")
+    check(all(r.status_code == 200 and "error" not in r.json() for r in responses),
+          "concurrent activity writes and level reads all succeed")
+    stats = await gamification_engine.get_student_stats("route-stu")
+    check(stats["messages_sent"] == 5 and stats["science_interactions"] == 5 and stats["late_night_study"] == 5,
+          "stats from all five activities")
+    check(sorted(b["id"] for b in badges["badges"]) == sorted(await gamification_engine.get_student_badges("route-stu")),
+          f"badges route matches storage ({badges['total_badges']} badges)")
+    ledger_total = (await gamification_engine.get_xp_in_range(
+        ["route-stu"], datetime.now().replace(hour=0, minute=0), datetime.now()))["route-stu"]
+    check(level["total_xp_earned"] == ledger_total == xp["students"]["route-stu"],
+          f"level, XP summary and ledger agree ({level['total_xp_earned']} XP)")
+
+
+@section
+async def quest_expiry():
+    print("\n7. Quests", file=OUT)
+    engine = gamification_engine
+    engine.quests["free_play"] = engine.quests["daily_explorer"].model_copy(
+        update={"id": "free_play", "time_limit_hours": None})
+    try:
+        started = datetime.now()
+        check(await engine.start_daily_quest("quest-stu", "daily_explorer"), "a quest starts")
+        check(not await engine.start_daily_quest("quest-stu", "daily_explorer"), "an active quest isn't started twice")
+        await engine.start_daily_quest("quest-stu", "free_play")
+        async with async_session_scope() as db:
+            db.add(StudentQuestDB(student_id="quest-stu", quest_id="story_time", progress={},
+                                  start_date=started - timedelta(days=2), expires_at=started - timedelta(days=1)))
+
+        active = {q.quest_id: q for q in await engine.get_active_quests("quest-stu")}
+        check(set(active) == {"daily_explorer", "free_play"}, f"expired quest left out ({sorted(active)})")
+        explorer_expiry = active["daily_explorer"].expires_at - active["daily_explorer"].start_date
+        check(explorer_expiry == timedelta(hours=24), "a timed quest expires time_limit_hours after it starts")
+        check(active["free_play"].expires_at == QUEST_NO_EXPIRY, "an untimed quest gets the no-expiry sentinel")
+
+        await engine.update_quest_progress("quest-stu", {"messages_today": 3})
+        active = {q.quest_id: q for q in await engine.get_active_quests("quest-stu")}
+        check(all(q.progress == {"messages_today": 3} for q in active.values()), "progress saved for every matching quest")
+
+        completed = await engine.update_quest_progress("quest-stu", {"messages_today": 2})
+        level = await engine.get_student_level("quest-stu")
+        check(sorted(c["quest"].id for c in completed) == ["daily_explorer", "free_play"] and level.total_xp_earned == 200,
+              f"both quests complete and pay out once ({level.total_xp_earned} XP)")
+        check(await engine.get_active_quests("quest-stu") == [], "completed quests drop out")
+        async with async_session_scope(readonly=True) as db:
+            done = await db.scalar(select(func.count()).select_from(StudentQuestDB).where(
+                StudentQuestDB.student_id == "quest-stu", StudentQuestDB.completed.is_(True),
+                StudentQuestDB.completion_date.is_not(None)))
+        check(done == 2, "completion stored with its date")
+    finally:
+        del engine.quests["free_play"]
+
+
+@section
+async def conversation_paging():
+    print("\n8. Conversation keyset paging", file=OUT)
+    async with async_session_scope() as db:
+        ids = [(await ConversationStorage.add_exchange("conv-stu", f"question {i}", f"answer {i}", "math", db))["id"]
+               for i in range(25)]
+        # Ten exchanges share one timestamp, so only the id can order them
+        tie = datetime.now().replace(microsecond=0) - timedelta(minutes=5)
+        await db.execute(update(ConversationDB).where(ConversationDB.id.in_(ids[5:15])).values(created_at=tie))
+    async with async_session_scope(readonly=True) as db:
+        expected = [row.id for row in await db.execute(
+            select(ConversationDB.id).where(ConversationDB.student_id == "conv-stu")
+            .order_by(ConversationDB.created_at.desc(), ConversationDB.id.desc()))]
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+        await client.post("/api/students", json={
+            "id": "conv-stu", "name": "Paige", "grade_level": 3, "interests": ["maps"], "learning_style": "visual"})
+        pages = []
+        cursor = None
+        while len(pages) < 10:
+            params = {"limit": 7, **({"before": cursor} if cursor else {})}
+            body = (await client.get("/api/students/conv-stu/conversations", params=params)).json()
+            pages.append([entry["id"] for entry in body["conversations"]])
+            cursor = body["next_cursor"]
+            if cursor is None:
+                break
+        bad_cursor = await client.get("/api/students/conv-stu/conversations", params={"before": "not-a-cursor"})
+        # After a restart (or on another worker) the student is only in the DB
+        main.students_db.pop("conv-stu", None)
+        async with async_session_scope() as db:
+            db.add(User(id="conv-stu", name="Paige", grade_level=3))
+        restarted = await client.get("/api/students/conv-stu/conversations", params={"limit": 3})
+        dashboard = await client.get("/api/parent/dashboard/conv-stu")
+        unknown = await client.get("/api/students/nobody/conversations")
+
+    paged = [entry_id for page in pages for entry_id in page]
+    check([len(page) for page in pages] == [7, 7, 7, 4], f"pages of 7, the last one short ({[len(p) for p in pages]})")
+    check(paged == expected and len(set(paged)) == 25, "every exchange once, newest first, ties broken by id")
+    check(bad_cursor.status_code == 400, "a malformed cursor is a 400")
+    check(restarted.status_code == 200 and len(restarted.json()["conversations"]) == 3,
+          "history is served for a student known only to the DB")
+    check(dashboard.status_code == 200 and dashboard.json()["student"]["name"] == "Paige",
+          "parent dashboard resolves the student from the DB")
+    check(unknown.status_code == 404, "an unknown student is a 404")
+    async with async_session_scope(readonly=True) as db:
+        recent = await ConversationStorage.get_recent("conv-stu", 5, db)
+        after = await ConversationStorage.get_page("conv-stu", 100, db, after_id=ids[19])
+    check([e["id"] for e in recent] == list(reversed(expected[:5])), "get_recent returns the last 5, oldest first")
+    check(sorted(e["id"] for e in after) == ids[20:], "after_id skips exchanges a summary already covers")
+
+
+async def run_all():
+    with contextlib.redirect_stdout(io.StringIO()):
+        for fn in SECTIONS:
+            await fn()
+        await main.dispose_engines()
+
+
+asyncio.run(run_all())
+
+total = passed + failed
+print()
+if failed == 0:
+    print(f"\033[32mAll {total} checks passed!\033[0m")
+else:
+    print(f"\033[31m{passed}/{total} checks passed, {failed} FAILED\033[0m")
+
+sys.exit(0 if failed == 0 else 1)
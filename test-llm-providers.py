@@ -0,0 +1,322 @@
+"""
+Tests for hedged tutor chat across providers (backend/providers.py).
+
+Starts one stub server standing in for both the OpenAI chat API and the
+Anthropic Messages API, with per-provider delays set by each test, and
+checks:
+1. Latency percentiles and the hedge budget (default, then the p95)
+2. A fast first provider answers alone; nothing is hedged
+3. A slow first provider is hedged after the budget and the second
+   provider's reply wins; the slow call is cancelled
+4. Once the first provider has enough samples, the hedge fires after its
+   p95 instead of the default budget
+5. An error from the first provider fails over at once
+6. Streaming races to the first token, then streams the winner's reply
+7. Nothing answering within CHAT_COMPLETE_TIMEOUT falls back; a reply
+   slower than CHAT_FIRST_TOKEN_TIMEOUT is still waited for
+8. The metrics endpoint reports latencies (cancelled calls as censored
+   samples), hedges and wins
+
+Run with:  python test-llm-providers.py
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HEDGE_DELAY_MS = 300
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+# ─── Stub OpenAI + Anthropic server ───────────────────────────────────
+
+delays = {"openai": 0.0, "anthropic": 0.0}
+fail = {"openai": 0}
+calls = {"openai": 0, "anthropic": 0}
+anthropic_bodies = []
+counter_lock = threading.Lock()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send(self, status, payload: bytes, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        provider = "anthropic" if self.path == "/v1/messages" else "openai"
+        with counter_lock:
+            calls[provider] += 1
+            if provider == "anthropic":
+                anthropic_bodies.append(body)
+        reply = f"Hello from {provider}!"
+        try:
+            time.sleep(delays[provider])
+            if provider == "openai" and fail["openai"]:
+                self._send(400, json.dumps({"error": {"message": "stub bad request", "type": "invalid_request_error"}}).encode())
+            elif not body.get("stream"):
+                if provider == "openai":
+                    payload = {"id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+                               "model": body["model"], "choices": [{"index": 0, "finish_reason": "stop",
+                                                                    "message": {"role": "assistant", "content": reply}}]}
+                else:
+                    payload = {"id": "msg-stub", "type": "message", "role": "assistant", "model": body["model"],
+                               "content": [{"type": "text", "text": reply}], "stop_reason": "end_turn"}
+                self._send(200, json.dumps(payload).encode())
+            else:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for word in reply.split(" "):
+                    if provider == "openai":
+                        event = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                                 "model": body["model"], "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}
+                        self._chunk(f"data: {json.dumps(event)}\n\n".encode())
+                    else:
+                        event = {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": word + " "}}
+                        self._chunk(f"event: content_block_delta\ndata: {json.dumps(event)}\n\n".encode())
+                    time.sleep(0.02)
+                if provider == "openai":
+                    self._chunk(b"data: [DONE]\n\n")
+                else:
+                    self._chunk(b'event: message_stop\ndata: {"type": "message_stop"}\n\n')
+                self._chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # a hedged call that lost the race
+
+    def log_message(self, *args):
+        pass
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+stub_url = f"http://127.0.0.1:{server.server_port}"
+
+tmp_dir = tempfile.mkdtemp()
+os.environ["OPENAI_BASE_URL"] = f"{stub_url}/v1"
+os.environ["OPENAI_API_KEY"] = "sk-test-stub"
+os.environ["ANTHROPIC_API_KEY"] = "ak-test-stub"
+os.environ["ANTHROPIC_BASE_URL"] = stub_url
+os.environ["CHAT_HEDGE_DELAY_MS"] = str(HEDGE_DELAY_MS)
+os.environ["CONTEXT_SUMMARY_ENABLED"] = "0"
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'test.db')}"
+os.environ.pop("POSTGRES_URL", None)
+os.environ.pop("VERCEL", None)
+
+sys.path.insert(0, BACKEND_DIR)
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+from providers import LatencyTracker, PROVIDERS, hedged_chat_stream, HEDGE_MIN_SAMPLES
+from scheduler import Priority
+import httpx
+
+# ─── TESTS ─────────────────────────────────────────────────────────────
+
+passed = 0
+failed = 0
+
+
+def check(condition, label):
+    global passed, failed
+    if condition:
+        passed += 1
+        print(f"  \033[32m✓\033[0m {label}")
+    else:
+        failed += 1
+        print(f"  \033[31m✗\033[0m {label}")
+
+
+print("\n1. Latency tracking")
+tracker = LatencyTracker()
+check(tracker.percentile(0.95) is None and tracker.hedge_delay() == HEDGE_DELAY_MS / 1000,
+      "no samples: the default budget")
+for i in range(100):
+    tracker.record((i + 1) / 1000)
+check(tracker.percentile(0.5) == 0.051 and tracker.percentile(0.95) == 0.096 and tracker.percentile(0.99) == 0.1,
+      "p50/p95/p99 of 1..100 ms")
+check(tracker.hedge_delay() == 0.096, "with enough samples the budget is the p95")
+censored = LatencyTracker()
+for i in range(HEDGE_MIN_SAMPLES):
+    censored.record(0.05)
+    censored.record(1.0, censored=True)
+check(censored.answered == HEDGE_MIN_SAMPLES and censored.percentile(0.95) == 1.0,
+      "calls cancelled at 1 s keep the p95 at least 1 s, not the 50 ms answers")
+mixed = LatencyTracker()
+for i in range(100):
+    mixed.record((i + 1) / 1000, censored=i % 2 == 1)
+check(mixed.percentile(0.5) > 0.051, f"censored samples push the median up ({mixed.percentile(0.5) * 1000:.0f} ms)")
+
+
+async def run_requests():
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+        with contextlib.redirect_stdout(io.StringIO()):
+            await client.post("/api/students", json={
+                "id": "hedge-stu", "name": "Hedy", "grade_level": 3, "interests": ["rockets"], "learning_style": "visual"
+            })
+
+            async def chat(tutor_type="math"):
+                start = time.perf_counter()
+                response = await client.post("/api/chat", json={
+                    "student_id": "hedge-stu", "content": "Why is the sky blue?", "tutor_type": tutor_type
+                })
+                return response.json()["response"], time.perf_counter() - start
+
+            async def settle():
+                await asyncio.sleep(0.05)
+
+            # Warm up connections so the timings below are the stub's
+            await chat()
+
+            # 2. fast first provider
+            delays.update(openai=0.02, anthropic=0.02)
+            before = dict(calls)
+            results["fast"] = await chat()
+            results["fast_calls"] = {k: calls[k] - before[k] for k in calls}
+
+            # 3. slow first provider, cold budget
+            delays.update(openai=1.0, anthropic=0.05)
+            before = dict(calls)
+            cancelled = PROVIDERS["openai"].cancelled
+            results["slow"] = await chat("homework")
+            await settle()
+            results["slow_calls"] = {k: calls[k] - before[k] for k in calls}
+            results["openai_cancelled"] = PROVIDERS["openai"].cancelled - cancelled
+            results["anthropic_body"] = anthropic_bodies[-1]
+
+            # 4. p95 budget once there are enough samples
+            # (twice the minimum, so the censored sample from step 3 and the
+            # warm-up call don't decide the p95 on their own)
+            delays.update(openai=0.02)
+            for _ in range(2 * HEDGE_MIN_SAMPLES):
+                await chat()
+            results["learned_budget"] = PROVIDERS["openai"].latency["complete"].hedge_delay()
+            delays.update(openai=1.0)
+            results["slow_learned"] = await chat()
+            await settle()
+
+            # 5. failover
+            delays.update(openai=0.0)
+            fail["openai"] = 1
+            results["failover"] = await chat()
+            fail["openai"] = 0
+
+            # 6. streaming: first token
+            delays.update(openai=1.0, anthropic=0.05)
+            start = time.perf_counter()
+            pieces = []
+            first_at = None
+            async for text in hedged_chat_stream(Priority.CHAT, "hedge-stu", [
+                {"role": "system", "content": "Be brief."}, {"role": "user", "content": "Hi"}
+            ], max_tokens=50, temperature=0.7):
+                first_at = first_at or time.perf_counter() - start
+                pieces.append(text)
+            results["stream"] = ("".join(pieces), first_at)
+            delays.update(openai=0.02)
+            pieces = [text async for text in hedged_chat_stream(Priority.CHAT, "hedge-stu", [
+                {"role": "user", "content": "Hi"}
+            ], max_tokens=50, temperature=0.7)]
+            results["stream_fast"] = "".join(pieces)
+            await settle()
+
+            # 7. timeouts
+            delays.update(openai=1.5, anthropic=1.5)
+            os.environ["CHAT_COMPLETE_TIMEOUT"] = "0.4"
+            results["timeout"] = await chat()
+            del os.environ["CHAT_COMPLETE_TIMEOUT"]
+            await settle()
+            delays.update(openai=0.6, anthropic=0.6)
+            os.environ["CHAT_FIRST_TOKEN_TIMEOUT"] = "0.3"
+            results["slow_complete"] = await chat()
+            del os.environ["CHAT_FIRST_TOKEN_TIMEOUT"]
+            delays.update(openai=0.0, anthropic=0.0)
+            await settle()
+
+            results["stats"] = (await client.get("/api/system/llm-providers")).json()
+            results["schedulers"] = (await client.get("/api/system/llm-scheduler")).json()
+    return results
+
+
+results = asyncio.run(run_requests())
+
+print("\n2. Fast first provider")
+reply, elapsed = results["fast"]
+check(reply == "Hello from openai!" and results["fast_calls"] == {"openai": 1, "anthropic": 0},
+      f"answered by openai alone in {elapsed * 1000:.0f} ms")
+
+print("\n3. Hedging a slow provider")
+reply, elapsed = results["slow"]
+check(reply == "Hello from anthropic!", "the second provider's reply wins")
+check(HEDGE_DELAY_MS / 1000 <= elapsed < HEDGE_DELAY_MS / 1000 + 0.4,
+      f"answered in {elapsed * 1000:.0f} ms (hedged after {HEDGE_DELAY_MS} ms, slow call takes 1000 ms)")
+check(results["slow_calls"] == {"openai": 1, "anthropic": 1} and results["openai_cancelled"] == 1,
+      "one call each; the slow one is cancelled")
+body = results["anthropic_body"]
+check(body["system"].startswith("You are an expert AI tutor for Hedy") and body["messages"][-1] == {
+    "role": "user", "content": "Why is the sky blue?"} and all(m["role"] != "system" for m in body["messages"]),
+      "the system prompt goes in Anthropic's system field")
+
+print("\n4. p95 budget")
+reply, elapsed = results["slow_learned"]
+check(results["learned_budget"] < 0.15, f"budget after {2 * HEDGE_MIN_SAMPLES} fast replies: {results['learned_budget'] * 1000:.0f} ms")
+check(reply == "Hello from anthropic!" and elapsed < HEDGE_DELAY_MS / 1000,
+      f"hedged on the p95: answered in {elapsed * 1000:.0f} ms")
+
+print("\n5. Failover")
+reply, elapsed = results["failover"]
+check(reply == "Hello from anthropic!" and elapsed < HEDGE_DELAY_MS / 1000,
+      f"an OpenAI error goes to anthropic at once ({elapsed * 1000:.0f} ms)")
+
+print("\n6. Streaming")
+text, first_at = results["stream"]
+check(text == "Hello from anthropic! ", "the stream comes from the first provider to produce a token")
+check(first_at < HEDGE_DELAY_MS / 1000 + 0.3, f"first token after {first_at * 1000:.0f} ms")
+check(results["stream_fast"] == "Hello from openai! ", "a fast first provider streams alone")
+
+print("\n7. Timeouts")
+reply, elapsed = results["timeout"]
+check("Hello" not in reply and elapsed < 0.8, f"no answer within the timeout: fallback reply in {elapsed * 1000:.0f} ms")
+reply, elapsed = results["slow_complete"]
+check(reply.startswith("Hello from") and elapsed >= 0.6,
+      f"a whole reply isn't cut off by the first-token timeout ({elapsed * 1000:.0f} ms)")
+
+print("\n8. Metrics")
+stats = results["stats"]
+openai_stats, anthropic_stats = stats["providers"]["openai"], stats["providers"]["anthropic"]
+check(stats["order"] == ["openai", "anthropic"] and stats["hedging"], "both providers configured, openai first")
+check(openai_stats["latency"]["complete"]["samples"] >= HEDGE_MIN_SAMPLES and openai_stats["latency"]["complete"]["p95_ms"] >= 300,
+      f"openai p95 {openai_stats['latency']['complete']['p95_ms']} ms counts the slow and cancelled calls")
+check(openai_stats["latency"]["complete"]["censored"] >= 2,
+      f"cancelled openai calls kept as censored samples ({openai_stats['latency']['complete']['censored']})")
+check(stats["complete_timeout_s"] == 45 and stats["first_token_timeout_s"] == 20, "both timeouts reported")
+check(anthropic_stats["hedged_requests"] >= 4 and anthropic_stats["wins"] >= 4 and openai_stats["errors"] >= 1,
+      f"anthropic: {anthropic_stats['hedged_requests']} hedged, {anthropic_stats['wins']} wins; openai errors {openai_stats['errors']}")
+check(results["schedulers"]["anthropic"]["in_flight"] == 0 and results["schedulers"]["openai"]["in_flight"] == 0,
+      "cancelled calls give their scheduler slots back")
+
+server.shutdown()
+
+total = passed + failed
+print()
+if failed == 0:
+    print(f"\033[32mAll {total} checks passed!\033[0m")
+else:
+    print(f"\033[31m{passed}/{total} checks passed, {failed} FAILED\033[0m")
+
+sys.exit(0 if failed == 0 else 1)
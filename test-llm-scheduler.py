@@ -0,0 +1,257 @@
+"""
+Tests for the priority-aware LLM scheduler (backend/scheduler.py).
+
+Checks:
+1. Concurrency stays within max_concurrency
+2. Free slots go to the highest priority waiting, and reserved slots only
+   to INTERACTIVE calls
+3. Students waiting at the same priority are served round-robin
+4. The tokens-per-minute budget holds back non-interactive calls while
+   interactive ones still fit; cancelled waiters leave the queue
+5. Against a stub OpenAI server with 3 slots busy writing chapters,
+   stuck-word feedback is answered in about one completion time, and the
+   metrics endpoint reports queue depth and waits
+
+Run with:  python test-llm-scheduler.py
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_DELAY = 0.4
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+# ─── Stub OpenAI server ───────────────────────────────────────────────
+
+in_flight = 0
+max_in_flight = 0
+counter_lock = threading.Lock()
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        global in_flight, max_in_flight
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with counter_lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        time.sleep(STUB_DELAY)
+        with counter_lock:
+            in_flight -= 1
+        payload = json.dumps({
+            "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {
+                "role": "assistant", "content": "Title: Frogs\n\nThe frog can hop. It hops far."
+            }}],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), StubOpenAIHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+tmp_dir = tempfile.mkdtemp()
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+os.environ["OPENAI_API_KEY"] = "sk-test-stub"
+os.environ["LLM_MAX_CONCURRENCY"] = "4"
+os.environ["LLM_RESERVED_INTERACTIVE"] = "1"
+os.environ["CHAPTER_LIBRARY_ENABLED"] = "0"
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'test.db')}"
+os.environ.pop("POSTGRES_URL", None)
+os.environ.pop("VERCEL", None)
+
+sys.path.insert(0, BACKEND_DIR)
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+from scheduler import LLMScheduler, Priority
+import httpx
+
+# ─── TESTS ─────────────────────────────────────────────────────────────
+
+passed = 0
+failed = 0
+
+
+def check(condition, label):
+    global passed, failed
+    if condition:
+        passed += 1
+        print(f"  \033[32m✓\033[0m {label}")
+    else:
+        failed += 1
+        print(f"  \033[31m✗\033[0m {label}")
+
+
+async def unit_checks():
+    results = {}
+
+    # 1. concurrency
+    scheduler = LLMScheduler("test", max_concurrency=3, reserved=0)
+    running = peak = 0
+
+    async def job(priority=Priority.CHAT, student=None, tokens=0, hold=0.02, log=None, name=None):
+        nonlocal running, peak
+        async with scheduler.slot(priority, student, tokens):
+            running += 1
+            peak = max(peak, running)
+            if log is not None:
+                log.append(name)
+            await asyncio.sleep(hold)
+            running -= 1
+
+    await asyncio.gather(*[job() for _ in range(10)])
+    results["peak"] = peak
+    results["in_flight_after"] = scheduler.in_flight
+
+    # 2. priorities: one slot held, then waiters queue lowest first
+    scheduler = LLMScheduler("test", max_concurrency=1, reserved=0)
+    order = []
+    holder = asyncio.ensure_future(job(hold=0.05))
+    await asyncio.sleep(0)
+    waiters = [asyncio.ensure_future(job(priority, log=order, name=priority.name))
+               for priority in (Priority.BACKGROUND, Priority.CHAPTER, Priority.CHAT, Priority.INTERACTIVE)]
+    await asyncio.gather(holder, *waiters)
+    results["priority_order"] = order
+
+    # reserved: 2 slots, 1 kept for INTERACTIVE
+    scheduler = LLMScheduler("test", max_concurrency=2, reserved=1)
+    running = peak = 0
+    stories = [asyncio.ensure_future(job(Priority.CHAPTER, hold=0.1)) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    results["chapter_peak"] = peak
+    start = time.perf_counter()
+    await job(Priority.INTERACTIVE, hold=0)
+    results["interactive_wait"] = time.perf_counter() - start
+    await asyncio.gather(*stories)
+
+    # 3. fairness
+    scheduler = LLMScheduler("test", max_concurrency=1, reserved=0)
+    order = []
+    holder = asyncio.ensure_future(job(hold=0.03))
+    await asyncio.sleep(0)
+    queued = [asyncio.ensure_future(job(Priority.CHAT, "amy", log=order, name="amy", hold=0)) for _ in range(4)]
+    queued += [asyncio.ensure_future(job(Priority.CHAT, student, log=order, name=student, hold=0)) for student in ("ben", "cal")]
+    await asyncio.sleep(0)
+    results["fair_stats"] = scheduler.stats()["priorities"]["chat"]
+    await asyncio.gather(holder, *queued)
+    results["fair_order"] = order
+
+    # 4. token budget
+    scheduler = LLMScheduler("test", max_concurrency=10, tokens_per_minute=100, reserved=0)
+    async with scheduler.slot(Priority.CHAPTER, "a", 50):
+        pass
+    async with scheduler.slot(Priority.CHAPTER, "b", 30):
+        pass
+    blocked = asyncio.ensure_future(job(Priority.CHAPTER, "c", tokens=30))
+    await asyncio.sleep(0.05)
+    results["blocked_waiting"] = not blocked.done() and scheduler.queued() == 1
+    start = time.perf_counter()
+    await asyncio.wait_for(job(Priority.INTERACTIVE, "d", tokens=20, hold=0), 1)
+    results["interactive_in_reserve"] = time.perf_counter() - start
+    blocked.cancel()
+    await asyncio.sleep(0)
+    stats = scheduler.stats()
+    results["after_cancel"] = (stats["queued"], stats["in_flight"], stats["tokens_last_minute"])
+    return results
+
+
+units = asyncio.run(unit_checks())
+
+print("\n1. Concurrency")
+check(units["peak"] == 3 and units["in_flight_after"] == 0, f"10 calls, at most 3 at once (saw {units['peak']})")
+
+print("\n2. Priorities")
+check(units["priority_order"] == ["INTERACTIVE", "CHAT", "CHAPTER", "BACKGROUND"],
+      f"freed slots go highest priority first: {units['priority_order']}")
+check(units["chapter_peak"] == 1, "chapters can't take the reserved slot")
+check(units["interactive_wait"] < 0.05, f"interactive call got the reserved slot in {units['interactive_wait'] * 1000:.1f} ms")
+
+print("\n3. Fairness")
+check(units["fair_order"] == ["amy", "ben", "cal", "amy", "amy", "amy"],
+      f"round-robin between students: {units['fair_order']}")
+check(units["fair_stats"]["queued"] == 6 and units["fair_stats"]["waiting_students"] == 3,
+      "stats count queued calls and waiting students")
+
+print("\n4. Token budget")
+check(units["blocked_waiting"], "a chapter call past the non-interactive budget waits")
+check(units["interactive_in_reserve"] < 0.05, "an interactive call still fits the reserved share")
+check(units["after_cancel"] == (0, 0, 100), f"cancelled waiter leaves the queue: {units['after_cancel']}")
+
+
+async def run_requests():
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(6):
+                await client.post("/api/students", json={
+                    "id": f"sch-{i}", "name": f"Sch{i}", "grade_level": 2, "interests": ["frogs"], "learning_style": "visual"
+                })
+            main.create_http_clients()
+            main.get_openai_client()
+
+            chapters = [asyncio.ensure_future(client.post("/api/generate-chapter", json={
+                "student_id": f"sch-{i}", "topic": "Frogs"
+            })) for i in range(5)]
+            # Wait until every chapter has reached the scheduler
+            for _ in range(40):
+                await asyncio.sleep(0.02)
+                results["queued_stats"] = (await client.get("/api/system/llm-scheduler")).json()["openai"]
+                if results["queued_stats"]["in_flight"] + results["queued_stats"]["queued"] == 5:
+                    break
+            start = time.perf_counter()
+            response = await client.post("/api/reading/feedback", json={
+                "student_id": "sch-5", "expected_text": "The axolotl swims.", "spoken_text": "The",
+                "current_word_index": 1, "struggle_indicators": {"stuck_word": True, "stuck_on": "axolotl"},
+            })
+            results["feedback_elapsed"] = time.perf_counter() - start
+            results["feedback"] = response.json()["feedback"]
+            chapter_responses = await asyncio.gather(*chapters)
+            results["chapters_ok"] = all(r.status_code == 200 for r in chapter_responses)
+            results["stats"] = (await client.get("/api/system/llm-scheduler")).json()["openai"]
+    return results
+
+
+results = asyncio.run(run_requests())
+
+print("\n5. Endpoints")
+queued = results["queued_stats"]
+check(queued["in_flight"] == 3 and queued["priorities"]["chapter"]["queued"] == 2,
+      f"5 chapters: {queued['in_flight']} running, {queued['priorities']['chapter']['queued']} queued (1 slot reserved)")
+check(results["feedback_elapsed"] < STUB_DELAY * 1.8,
+      f"stuck-word feedback answered in {results['feedback_elapsed'] * 1000:.0f} ms with every chapter slot busy")
+check(results["feedback"].startswith("Title: Frogs") and results["chapters_ok"], "every call completes")
+check(max_in_flight <= 4, f"stub never saw more than 4 calls at once (saw {max_in_flight})")
+stats = results["stats"]
+check(stats["priorities"]["chapter"]["granted"] == 5 and stats["priorities"]["chapter"]["max_wait_ms"] >= STUB_DELAY * 1000 * 0.8
+      and stats["priorities"]["interactive"]["granted"] == 1 and stats["queued"] == 0,
+      f"metrics: chapter waits up to {stats['priorities']['chapter']['max_wait_ms']:.0f} ms, "
+      f"interactive {stats['priorities']['interactive']['max_wait_ms']:.0f} ms")
+
+server.shutdown()
+
+total = passed + failed
+print()
+if failed == 0:
+    print(f"\033[32mAll {total} checks passed!\033[0m")
+else:
+    print(f"\033[31m{passed}/{total} checks passed, {failed} FAILED\033[0m")
+
+sys.exit(0 if failed == 0 else 1)
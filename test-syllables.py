@@ -0,0 +1,149 @@
+"""
+Tests for local stuck-word help (backend/syllables.py).
+
+Checks:
+1. Common words are split into real syllables, keeping digraphs whole
+2. Words the rules can't split reliably return None (the LLM handles them)
+3. stuck_word_feedback() phrasing is TTS-friendly and fast
+4. /api/reading/feedback answers stuck words locally, without the LLM
+
+Run with:  python test-syllables.py
+"""
+import asyncio
+import contextlib
+import io
+import os
+import socket
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+# Any LLM call fails fast against a closed port and returns the fallback text
+with socket.socket() as probe:
+    probe.bind(("127.0.0.1", 0))
+    closed_port = probe.getsockname()[1]
+
+tmp_dir = tempfile.mkdtemp()
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{closed_port}/v1"
+os.environ["OPENAI_API_KEY"] = "sk-test-stub"
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'test.db')}"
+os.environ.pop("POSTGRES_URL", None)
+os.environ.pop("VERCEL", None)
+
+sys.path.insert(0, BACKEND_DIR)
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+from syllables import split_syllables, stuck_word_feedback
+import httpx
+
+# ─── TESTS ─────────────────────────────────────────────────────────────
+
+passed = 0
+failed = 0
+
+
+def check(condition, label):
+    global passed, failed
+    if condition:
+        passed += 1
+        print(f"  \033[32m✓\033[0m {label}")
+    else:
+        failed += 1
+        print(f"  \033[31m✗\033[0m {label}")
+
+
+print("\n1. Syllable splits")
+EXPECTED = {
+    "butterfly": ["but", "ter", "fly"],
+    "caterpillar": ["ca", "ter", "pil", "lar"],
+    "dinosaur": ["di", "no", "saur"],
+    "happy": ["hap", "py"],
+    "table": ["ta", "ble"],
+    "monster": ["mon", "ster"],
+    "hundred": ["hun", "dred"],
+    "station": ["sta", "tion"],
+    "wanted": ["wan", "ted"],
+    "jumped": ["jumped"],
+    "make": ["make"],
+    "cat": ["cat"],
+    "people": ["peo", "ple"],
+    "Butterfly,": ["but", "ter", "fly"],
+}
+for word, parts in EXPECTED.items():
+    got = split_syllables(word)
+    check(got == parts, f"{word} -> {got}")
+
+print("\n1b. Consonant clusters keep digraphs together")
+CLUSTERS = {
+    "birthday": ["birth", "day"],
+    "earthquake": ["earth", "quake"],
+    "nightmare": ["night", "mare"],
+    "lighthouse": ["light", "house"],
+    "grandmother": ["grand", "moth", "er"],
+    "pumpkin": ["pump", "kin"],
+}
+for word, parts in CLUSTERS.items():
+    got = split_syllables(word)
+    check(got == parts, f"{word} -> {got}")
+for word in ["spaceship", "something"]:
+    check(split_syllables(word) is None, f"{word} -> None (silent e, left to the LLM)")
+check("birt," not in (stuck_word_feedback("birthday") or ""), "birthday is never spoken as birt, hday")
+
+print("\n2. Unreliable splits are left to the LLM")
+for word in ["violin", "piano", "about", "elephant", "don't", "café", "antidisestablishment", ""]:
+    check(split_syllables(word) is None and stuck_word_feedback(word) is None, f"{word!r} -> None")
+
+print("\n3. Phrasing")
+text = stuck_word_feedback("butterfly")
+check(text is not None and "but, ter, fly, butterfly!" in text, f"syllables spoken with commas: {text}")
+check(text is not None and not any(c in text for c in "-/\""), "no dashes, slashes or quotes for TTS")
+check("cat" in (stuck_word_feedback("cat") or ""), "one-syllable words get a say-it-with-me phrase")
+start = time.perf_counter()
+for _ in range(1000):
+    stuck_word_feedback("caterpillar")
+per_call_ms = (time.perf_counter() - start)  # seconds for 1000 calls == ms per call
+check(per_call_ms < 1.0, f"{per_call_ms:.4f} ms per word")
+
+
+async def run_requests():
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+        with contextlib.redirect_stdout(io.StringIO()):
+            await client.post("/api/students", json={
+                "id": "syl-stu", "name": "Syl", "grade_level": 2,
+                "interests": ["bugs"], "learning_style": "visual"
+            })
+            results = {}
+            for word in ("butterfly", "violin"):
+                start = time.perf_counter()
+                response = await client.post("/api/reading/feedback", json={
+                    "student_id": "syl-stu", "expected_text": f"The {word} is here.", "spoken_text": "The",
+                    "current_word_index": 1, "struggle_indicators": {"stuck_word": True, "stuck_on": word},
+                })
+                elapsed = time.perf_counter() - start
+                pools = (await client.get("/api/system/http-pools")).json()["pools"]
+                results[word] = (response.json()["feedback"], elapsed, (pools["openai"] or {}).get("requests", 0))
+    return results
+
+
+results = asyncio.run(run_requests())
+
+print("\n4. Endpoint")
+local_text, local_elapsed, local_requests = results["butterfly"]
+check("but, ter, fly, butterfly!" in local_text, "stuck on butterfly: answered with local syllables")
+check(local_requests == 0, "no OpenAI request for butterfly")
+check(local_elapsed < 0.05, f"answered in {local_elapsed * 1000:.1f} ms")
+llm_text, _, llm_requests = results["violin"]
+check(llm_requests > 0 and llm_text.startswith("Keep reading!"),
+      "stuck on violin: went to the LLM (unreachable here, so the fallback)")
+
+total = passed + failed
+print()
+if failed == 0:
+    print(f"\033[32mAll {total} checks passed!\033[0m")
+else:
+    print(f"\033[31m{passed}/{total} checks passed, {failed} FAILED\033[0m")
+
+sys.exit(0 if failed == 0 else 1)
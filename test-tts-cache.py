@@ -0,0 +1,188 @@
+"""
+Tests for the content-addressed TTS cache (backend/audio_cache.py) and
+GET /api/tts/{hash}.
+
+Uses the offline upstream stub (backend/stub_upstream.py) for ElevenLabs
+and a temporary cache directory, and checks:
+1. Keys cover text, voice, model and voice settings, and are stable
+2. Size-based LRU eviction, and a restarted cache keeps the order
+3. Repeat POST /api/tts is served from disk without calling ElevenLabs
+4. GET /api/tts/{hash} is immutable and supports ETag and Range requests
+5. Unknown and malformed hashes are 404s; the metrics endpoint reports
+   hits and size
+
+Run with:  python test-tts-cache.py
+"""
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+sys.path.insert(0, BACKEND_DIR)
+from stub_upstream import run_in_thread, MP3_FRAME
+
+for name in ("ELEVENLABS_API_KEY", "POSTGRES_URL", "VERCEL", "UPSTREAM_STUB_URL"):
+    os.environ.pop(name, None)
+os.environ["STUB_LATENCY_MS"] = "50"
+os.environ["STUB_LATENCY_DIST"] = "fixed"
+stub_server, stub_url = run_in_thread()
+
+tmp_dir = tempfile.mkdtemp()
+os.environ["ELEVENLABS_API_KEY"] = "el-test-stub"
+os.environ["TTS_CACHE_DIR"] = os.path.join(tmp_dir, "tts")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'test.db')}"
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+import http_clients
+from audio_cache import AudioCache
+import httpx
+
+http_clients.UPSTREAMS["elevenlabs"] = (stub_url, 10.0)
+
+# ─── TESTS ─────────────────────────────────────────────────────────────
+
+passed = 0
+failed = 0
+
+
+def check(condition, label):
+    global passed, failed
+    if condition:
+        passed += 1
+        print(f"  \033[32m✓\033[0m {label}")
+    else:
+        failed += 1
+        print(f"  \033[31m✗\033[0m {label}")
+
+
+print("\n1. Keys")
+settings = {"stability": 0.6, "similarity_boost": 0.8}
+key = AudioCache.key("Hi there.", "voice", "model", settings)
+check(AudioCache.valid_key(key) and key == AudioCache.key("Hi there.", "voice", "model", dict(reversed(settings.items()))),
+      "64 hex chars, independent of dict order")
+check(len({key, AudioCache.key("Hi there!", "voice", "model", settings), AudioCache.key("Hi there.", "other", "model", settings),
+           AudioCache.key("Hi there.", "voice", "model2", settings),
+           AudioCache.key("Hi there.", "voice", "model", {**settings, "stability": 0.5})}) == 5,
+      "text, voice, model and settings all change the key")
+check(not AudioCache.valid_key("../../etc/passwd") and not AudioCache.valid_key(key.upper()), "only lowercase sha256 hex is a key")
+
+print("\n2. Eviction")
+cache_dir = os.path.join(tmp_dir, "unit")
+cache = AudioCache(cache_dir, max_bytes=3000)
+keys = [AudioCache.key(f"clip {i}", "v", "m", {}) for i in range(4)]
+for k in keys[:3]:
+    cache.put(k, b"x" * 1000)
+    time.sleep(0.01)  # distinct mtimes
+cache.get(keys[0])  # now most recently used
+cache.put(keys[3], b"y" * 1000)
+check(cache.get(keys[1]) is None and cache.get(keys[0]) == b"x" * 1000 and cache.get(keys[3]) == b"y" * 1000,
+      "the least recently used clip goes first")
+check(cache.stats()["bytes"] == 3000 and cache.stats()["evictions"] == 1
+      and not os.path.exists(os.path.join(cache_dir, keys[1][:2], f"{keys[1]}.mp3")),
+      "the total stays within max_bytes and the file is deleted")
+check(not cache.put(AudioCache.key("huge", "v", "m", {}), b"z" * 4000), "a clip bigger than the cache isn't stored")
+restarted = AudioCache(cache_dir, max_bytes=2000)
+check(restarted.get(keys[2]) is None and restarted.get(keys[3]) is not None and restarted.stats()["entries"] == 2,
+      "a restarted cache indexes the directory and evicts in mtime order")
+check(not [f for _, _, files in os.walk(cache_dir) for f in files if f.endswith(".tmp")], "no temporary files left behind")
+
+
+async def run_requests():
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+        async with httpx.AsyncClient(base_url=stub_url) as stub:
+            with contextlib.redirect_stdout(io.StringIO()):
+                async def upstream_calls():
+                    return (await stub.get("/stub/stats")).json()["requests"]["tts"]
+
+                text = "Great job! Let's sound it out together."
+                first = await client.post("/api/tts", json={"text": text})
+                results["first"] = first
+                results["calls_after_first"] = await upstream_calls()
+                start = time.perf_counter()
+                again = await asyncio.gather(*[client.post("/api/tts", json={"text": text}) for _ in range(10)])
+                results["again_elapsed"] = time.perf_counter() - start
+                results["again"] = again
+                results["calls_after_again"] = await upstream_calls()
+                await client.post("/api/tts", json={"text": text, "voice_id": "other-voice"})
+                results["calls_other_voice"] = await upstream_calls()
+
+                audio_hash = first.headers["x-tts-hash"]
+                results["get"] = await client.get(f"/api/tts/{audio_hash}")
+                results["head"] = await client.head(f"/api/tts/{audio_hash}")
+                results["not_modified"] = await client.get(f"/api/tts/{audio_hash}", headers={"If-None-Match": f'"{audio_hash}"'})
+                results["range"] = await client.get(f"/api/tts/{audio_hash}", headers={"Range": "bytes=100-499"})
+                results["open_range"] = await client.get(f"/api/tts/{audio_hash}", headers={"Range": "bytes=1000-"})
+                results["suffix"] = await client.get(f"/api/tts/{audio_hash}", headers={"Range": "bytes=-10"})
+                results["bad_range"] = await client.get(f"/api/tts/{audio_hash}", headers={"Range": "bytes=99999999-"})
+                results["if_range_stale"] = await client.get(f"/api/tts/{audio_hash}",
+                                                             headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+                results["missing"] = await client.get(f"/api/tts/{'0' * 64}")
+                results["invalid"] = await client.get("/api/tts/not-a-hash")
+
+                # Without an API key, cached clips still play
+                main.ELEVENLABS_API_KEY = None
+                results["no_key_cached"] = await client.post("/api/tts", json={"text": text})
+                results["no_key_new"] = await client.post("/api/tts", json={"text": "Brand new words."})
+                main.ELEVENLABS_API_KEY = "el-test-stub"
+
+                results["stats"] = (await client.get("/api/system/tts-cache")).json()
+    return results
+
+
+results = asyncio.run(run_requests())
+
+print("\n3. POST /api/tts")
+first = results["first"]
+check(first.status_code == 200 and first.content.startswith(MP3_FRAME[:4]) and first.headers["x-tts-cache"] == "miss"
+      and first.headers["content-location"] == f"/api/tts/{first.headers['x-tts-hash']}",
+      "first playback: synthesized, with the clip's hash and URL")
+check(results["calls_after_first"] == 1 and results["calls_after_again"] == 1,
+      f"10 repeat playbacks, {results['calls_after_again'] - results['calls_after_first']} ElevenLabs calls")
+check(all(r.status_code == 200 and r.content == first.content and r.headers["x-tts-cache"] == "hit" for r in results["again"]),
+      f"repeats are served from disk ({results['again_elapsed'] * 1000:.0f} ms for 10)")
+check(results["calls_other_voice"] == 2, "another voice is another clip")
+check(results["no_key_cached"].status_code == 200 and results["no_key_new"].status_code == 503,
+      "cached clips play without an API key; new text still needs one")
+
+print("\n4. GET /api/tts/{hash}")
+get, size = results["get"], len(first.content)
+check(get.status_code == 200 and get.content == first.content and get.headers["content-type"] == "audio/mpeg",
+      "serves the same audio")
+check(get.headers["cache-control"] == "public, max-age=31536000, immutable" and get.headers["etag"] == f'"{first.headers["x-tts-hash"]}"'
+      and get.headers["accept-ranges"] == "bytes", "immutable, with an ETag and Accept-Ranges")
+check(results["head"].status_code == 200 and results["head"].headers["content-length"] == str(size), "HEAD works")
+check(results["not_modified"].status_code == 304 and not results["not_modified"].content, "If-None-Match gets a 304")
+rng = results["range"]
+check(rng.status_code == 206 and rng.content == first.content[100:500] and rng.headers["content-range"] == f"bytes 100-499/{size}",
+      "bytes=100-499 gets 206 with Content-Range")
+check(results["open_range"].content == first.content[1000:] and results["suffix"].content == first.content[-10:],
+      "open-ended and suffix ranges")
+check(results["bad_range"].status_code == 416 and results["bad_range"].headers["content-range"] == f"bytes */{size}",
+      "an unsatisfiable range gets 416")
+check(results["if_range_stale"].status_code == 200 and len(results["if_range_stale"].content) == size,
+      "a stale If-Range gets the whole clip")
+
+print("\n5. Errors and metrics")
+check(results["missing"].status_code == 404 and results["invalid"].status_code == 404, "unknown and malformed hashes are 404s")
+stats = results["stats"]
+check(stats["entries"] == 2 and stats["hits"] >= 11 and stats["bytes"] > size,
+      f"metrics: {stats['entries']} clips, {stats['bytes']} bytes, hit rate {stats['hit_rate']}")
+
+stub_server.should_exit = True
+
+total = passed + failed
+print()
+if failed == 0:
+    print(f"\033[32mAll {total} checks passed!\033[0m")
+else:
+    print(f"\033[31m{passed}/{total} checks passed, {failed} FAILED\033[0m")
+
+sys.exit(0 if failed == 0 else 1)
@@ -0,0 +1,209 @@
+"""
+Tests for the bounded per-student tutor cache and precompiled prompts.
+
+Starts a stub OpenAI-compatible server that records each chat's system
+prompt, runs with TUTOR_CACHE_MAX_STUDENTS=3, and checks:
+1. Tutors are reused, bounded by LRU eviction and expire after the TTL
+2. Prompt templates are compiled once per (tutor type, grade) or
+   (grade, learning style) and tutors don't keep rendered prompts
+3. A profile posted to /api/students reaches the next chat
+4. Updating the users row refreshes the profile and drops the tutor
+5. Student profiles and progress are bounded too, and a profile changed
+   by another worker is reloaded from the users row after the TTL
+
+Run with:  python test-tutor-cache.py
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+# ─── Stub OpenAI server ───────────────────────────────────────────────
+
+system_prompts = []
+counter_lock = threading.Lock()
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with counter_lock:
+            system_prompts.append(body["messages"][0]["content"])
+        payload = json.dumps({
+            "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "Good question!"}}],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), StubOpenAIHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+tmp_dir = tempfile.mkdtemp()
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+os.environ["OPENAI_API_KEY"] = "sk-test-stub"
+os.environ["TUTOR_CACHE_MAX_STUDENTS"] = "3"
+os.environ["STUDENT_CACHE_MAX_STUDENTS"] = "3"
+os.environ["CONTEXT_SUMMARY_ENABLED"] = "0"
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'test.db')}"
+os.environ.pop("POSTGRES_URL", None)
+os.environ.pop("VERCEL", None)
+
+sys.path.insert(0, BACKEND_DIR)
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+from main import Student, SpecializedTutor, AITutor, get_tutor, tutor_cache
+from models.schema import User
+from sqlalchemy import update
+import httpx
+
+# ─── TESTS ─────────────────────────────────────────────────────────────
+
+passed = 0
+failed = 0
+
+
+def check(condition, label):
+    global passed, failed
+    if condition:
+        passed += 1
+        print(f"  \033[32m✓\033[0m {label}")
+    else:
+        failed += 1
+        print(f"  \033[31m✗\033[0m {label}")
+
+
+def student(sid, grade=3, interests=("cats",), style="visual", name=None):
+    return Student(id=sid, name=name or sid.title(), grade_level=grade, interests=list(interests), learning_style=style)
+
+
+print("\n1. Cache bounds")
+first = get_tutor(student("s1"))
+check(get_tutor(student("s1")) is first, "the same student gets the same tutor")
+for sid in ("s2", "s3", "s4", "s5"):
+    get_tutor(student(sid))
+stats = tutor_cache.stats()
+check(len(tutor_cache) == 3 and stats["evictions"] == 2, f"5 students, 3 kept ({stats['evictions']} evicted)")
+check(get_tutor(student("s1")) is not first, "an evicted student gets a new tutor")
+kept = get_tutor(student("s5"))
+tutor_cache.ttl_seconds = 0.05
+time.sleep(0.1)
+check(get_tutor(student("s5")) is not kept, "tutors expire after the TTL")
+tutor_cache.ttl_seconds = 3600
+check(get_tutor(student("s5", interests=("dogs",))) is not get_tutor(student("s5", interests=("cats",))),
+      "a changed profile gets a new tutor")
+
+print("\n2. Prompt templates")
+SpecializedTutor.prompt_template.cache_clear()
+AITutor.prompt_template.cache_clear()
+start = time.perf_counter()
+for i in range(200):
+    tutor = AITutor(student(f"t{i}", name=f"Kid{i}", interests=("space", f"hobby{i}")))
+    prompts = [t.system_prompt for t in tutor.specialized_tutors.values()] + [tutor.system_prompt]
+elapsed_ms = (time.perf_counter() - start) * 1000
+check(SpecializedTutor.prompt_template.cache_info().currsize == 4 and AITutor.prompt_template.cache_info().currsize == 1,
+      "200 grade-3 visual students share 5 compiled templates")
+check("system_prompt" not in vars(tutor) and all("system_prompt" not in vars(t) for t in tutor.specialized_tutors.values()),
+      "tutors don't store rendered prompts")
+check("Student: Kid199, Grade 3, Interests: space, hobby199" in prompts[0] and "tutor for Kid199, a 3th grade" in prompts[-1],
+      "only name and interests are filled in per student")
+check(elapsed_ms < 200, f"200 tutors with all 5 prompts rendered in {elapsed_ms:.1f} ms")
+check("Student: {x}" in SpecializedTutor("math", student("b", name="{x}")).system_prompt, "braces in a name are kept as-is")
+
+
+async def run_requests():
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+        with contextlib.redirect_stdout(io.StringIO()):
+            async def chat(sid):
+                await client.post("/api/chat", json={"student_id": sid, "content": "Why?", "tutor_type": "math"})
+                return system_prompts[-1]
+
+            await client.post("/api/students", json={
+                "id": "prof", "name": "Pia", "grade_level": 2, "interests": ["trains"], "learning_style": "visual"
+            })
+            results["before"] = await chat("prof")
+            await client.post("/api/students", json={
+                "id": "prof", "name": "Pia", "grade_level": 2, "interests": ["horses"], "learning_style": "visual"
+            })
+            results["after_post"] = await chat("prof")
+
+            async with main.async_session_scope() as db:
+                db.add(User(id="usr", email="u@example.com", name="Uma", hashed_password="x", grade_level=2))
+            results["user_before"] = await chat("usr")
+            tutor_before = tutor_cache.get("usr")
+            async with main.async_session_scope() as db:
+                user = await db.get(User, "usr")
+                user.grade_level = 4
+                user.name = "Uma Rose"
+            results["dropped"] = tutor_cache.get("usr") is None and tutor_before is not None
+            results["user_after"] = await chat("usr")
+            results["profile"] = (await client.get("/api/students/usr")).json()
+            results["stats"] = (await client.get("/api/system/tutor-cache")).json()
+
+            # A core UPDATE fires no ORM hook, like a change made on another worker
+            async with main.async_session_scope() as db:
+                await db.execute(update(User).where(User.id == "usr").values(name="Uma Lee"))
+            results["stale"] = (await client.get("/api/students/usr")).json()["name"]
+            main.students_db.ttl_seconds = 0.05
+            await asyncio.sleep(0.1)
+            results["reloaded"] = (await client.get("/api/students/usr")).json()["name"]
+            main.students_db.ttl_seconds = 3600
+
+            for i in range(4):
+                await client.post("/api/students", json={
+                    "id": f"many{i}", "name": f"Many{i}", "grade_level": 2, "interests": [], "learning_style": "visual"
+                })
+            results["bounded"] = (len(main.students_db), len(main.progress_db))
+    return results
+
+
+results = asyncio.run(run_requests())
+
+print("\n3. Profile changes")
+check("Interests: trains" in results["before"] and "Interests: horses" in results["after_post"],
+      "new interests reach the next chat")
+
+print("\n4. users row changes")
+check("Student: Uma, Grade 2" in results["user_before"], "tutor built from the users row")
+check(results["dropped"], "updating the row drops the cached tutor")
+check("Student: Uma Rose, Grade 4" in results["user_after"] and results["profile"]["grade_level"] == 4,
+      "the next chat and the profile use the new name and grade")
+stats = results["stats"]
+check(stats["entries"] <= 3 and stats["max_entries"] == 3, f"metrics: {stats['entries']} tutors, hit rate {stats['hit_rate']}")
+
+print("\n5. Student profile cache")
+check(results["bounded"] == (3, 3), f"profiles and progress kept for 3 students ({results['bounded']})")
+check(results["stale"] == "Uma Rose", "a change made elsewhere isn't seen before the TTL")
+check(results["reloaded"] == "Uma Lee", "an expired profile is reloaded from the users row")
+
+server.shutdown()
+
+total = passed + failed
+print()
+if failed == 0:
+    print(f"\033[32mAll {total} checks passed!\033[0m")
+else:
+    print(f"\033[31m{passed}/{total} checks passed, {failed} FAILED\033[0m")
+
+sys.exit(0 if failed == 0 else 1)
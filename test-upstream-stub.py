@@ -0,0 +1,186 @@
+"""
+Tests for the offline upstream stub (backend/stub_upstream.py) and the
+UPSTREAM_STUB_URL switch in main.py.
+
+Starts the stub with fixed latencies, imports the app in stub mode with
+no API keys set, and checks:
+1. Latency distributions (fixed, uniform, lognormal) and error rates
+2. Streaming replies arrive at STUB_TOKENS_PER_SECOND
+3. /api/chat, /api/chat/stream, /api/generate-chapter, /api/reading/feedback,
+   /api/reading/transcribe and /api/tts all work against the stub
+4. Injected errors reach the app's error handling
+5. The stub reports requests, errors and concurrency
+
+Run with:  python test-upstream-stub.py
+"""
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+LATENCY_MS = 100
+TOKENS_PER_SECOND = 100
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+sys.path.insert(0, BACKEND_DIR)
+from stub_upstream import StubState, run_in_thread, settings_from_env, MP3_FRAME, TRANSCRIPT
+
+for name in ("OPENAI_API_KEY", "OPENAI_BASE_URL", "ELEVENLABS_API_KEY", "ANTHROPIC_API_KEY", "POSTGRES_URL", "VERCEL"):
+    os.environ.pop(name, None)
+os.environ["STUB_LATENCY_MS"] = str(LATENCY_MS)
+os.environ["STUB_LATENCY_DIST"] = "fixed"
+os.environ["STUB_TOKENS_PER_SECOND"] = str(TOKENS_PER_SECOND)
+os.environ["STUB_REPLY_TOKENS"] = "30"
+stub_server, stub_url = run_in_thread(seed=1)
+
+tmp_dir = tempfile.mkdtemp()
+os.environ["UPSTREAM_STUB_URL"] = stub_url
+os.environ["CONTEXT_SUMMARY_ENABLED"] = "0"
+os.environ["TTS_CACHE_DIR"] = os.path.join(tmp_dir, "tts")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'test.db')}"
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+import httpx
+
+# ─── TESTS ─────────────────────────────────────────────────────────────
+
+passed = 0
+failed = 0
+
+
+def check(condition, label):
+    global passed, failed
+    if condition:
+        passed += 1
+        print(f"  \033[32m✓\033[0m {label}")
+    else:
+        failed += 1
+        print(f"  \033[31m✗\033[0m {label}")
+
+
+print("\n1. Distributions")
+settings = settings_from_env()
+check(settings["chat"]["latency_ms"] == LATENCY_MS and settings["tts"]["latency_dist"] == "fixed",
+      "settings come from STUB_* variables")
+os.environ["STUB_LATENCY_MS_TTS"] = "250"
+check(settings_from_env()["tts"]["latency_ms"] == 250 and settings_from_env()["chat"]["latency_ms"] == LATENCY_MS,
+      "a _TTS suffix sets one kind")
+del os.environ["STUB_LATENCY_MS_TTS"]
+state = StubState(settings, seed=7)
+check(state.latency("chat") == LATENCY_MS / 1000, "fixed latency")
+state.settings["chat"].update(latency_dist="uniform", latency_spread=0.5)
+samples = [state.latency("chat") for _ in range(2000)]
+check(min(samples) >= 0.05 and max(samples) <= 0.15, f"uniform stays within ±50% ({min(samples):.3f}-{max(samples):.3f} s)")
+state.settings["chat"].update(latency_dist="lognormal", latency_spread=0.5)
+samples = sorted(state.latency("chat") for _ in range(4000))
+median, p99 = statistics.median(samples), samples[int(len(samples) * 0.99)]
+check(0.09 < median < 0.11 and p99 > 2.5 * median, f"lognormal: median {median * 1000:.0f} ms, p99 {p99 * 1000:.0f} ms")
+state.settings["chat"]["error_rate"] = 0.25
+failures = sum(state.should_fail("chat") for _ in range(4000))
+check(900 < failures < 1100, f"error rate 0.25: {failures} of 4000 calls fail")
+
+
+async def run_requests():
+    results = {}
+    async with httpx.AsyncClient(base_url=stub_url, timeout=10) as stub:
+        # 2. streaming rate, straight from the stub
+        start = time.perf_counter()
+        arrivals = []
+        async with stub.stream("POST", "/v1/chat/completions", json={
+            "model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": "Hi"}], "stream": True, "max_tokens": 20
+        }) as response:
+            async for line in response.aiter_lines():
+                if line.startswith("data: {"):
+                    arrivals.append(time.perf_counter() - start)
+        results["arrivals"] = arrivals
+
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+            with contextlib.redirect_stdout(io.StringIO()):
+                await client.post("/api/students", json={
+                    "id": "stub-stu", "name": "Stubby", "grade_level": 2, "interests": ["foxes"], "learning_style": "visual"
+                })
+
+                # 3. every upstream-backed endpoint
+                results["chat"] = await client.post("/api/chat", json={
+                    "student_id": "stub-stu", "content": "What do foxes eat?", "tutor_type": "science"
+                })
+                results["chat_stream"] = await client.post("/api/chat/stream", json={
+                    "student_id": "stub-stu", "content": "And owls?", "tutor_type": "science"
+                })
+                results["chapter"] = await client.post("/api/generate-chapter", json={"student_id": "stub-stu", "topic": "Foxes"})
+                results["feedback"] = await client.post("/api/reading/feedback", json={
+                    "student_id": "stub-stu", "expected_text": "The fox ran.", "spoken_text": "The fax ran",
+                    "current_word_index": 3,
+                })
+                results["transcribe"] = await client.post("/api/reading/transcribe",
+                                                          files={"audio": ("a.webm", b"\x1a\x45\xdf\xa3 stub audio", "audio/webm")})
+                text = "The little fox ran to the big red barn."
+                start = time.perf_counter()
+                results["tts"] = await client.post("/api/tts", json={"text": text})
+                results["tts_elapsed"] = time.perf_counter() - start
+
+                # 4. injected errors
+                await stub.put("/stub/config", json={"tts": {"error_rate": 1}, "chat": {"error_rate": 1, "error_status": 400}})
+                results["tts_error"] = await client.post("/api/tts", json={"text": "Broken page."})
+                results["chat_error"] = await client.post("/api/chat", json={
+                    "student_id": "stub-stu", "content": "Are you there?", "tutor_type": "math"
+                })
+                await stub.put("/stub/config", json={"tts": {"error_rate": 0}, "chat": {"error_rate": 0}})
+
+        results["stats"] = (await stub.get("/stub/stats")).json()
+    return results
+
+
+results = asyncio.run(run_requests())
+
+print("\n2. Token streaming")
+arrivals = results["arrivals"]
+gaps = [b - a for a, b in zip(arrivals, arrivals[1:])]
+check(len(arrivals) == 21 and arrivals[0] >= LATENCY_MS / 1000, f"first token after {arrivals[0] * 1000:.0f} ms, then 19 more and a stop chunk")
+check(0.007 < statistics.median(gaps) < 0.02, f"tokens {statistics.median(gaps) * 1000:.1f} ms apart at {TOKENS_PER_SECOND}/s")
+
+print("\n3. App endpoints in stub mode")
+chat = results["chat"]
+check(chat.status_code == 200 and chat.json()["response"].startswith("Title: A Stub Story"),
+      "/api/chat gets the stub's reply")
+check(results["chat_stream"].status_code == 200 and "event: done" in results["chat_stream"].text
+      and "Stub Story" in results["chat_stream"].text, "/api/chat/stream streams it")
+chapter = results["chapter"].json()
+check(results["chapter"].status_code == 200 and chapter["title"] == "A Stub Story" and len(chapter["content"]) > 20,
+      f"/api/generate-chapter parses the stub chapter ({chapter.get('title')!r})")
+check(results["feedback"].status_code == 200 and results["feedback"].json()["feedback"], "/api/reading/feedback")
+check(results["transcribe"].status_code == 200 and results["transcribe"].json() == {"text": TRANSCRIPT},
+      "/api/reading/transcribe gets the Whisper-format transcript")
+audio = results["tts"].content
+check(results["tts"].status_code == 200 and audio.startswith(MP3_FRAME[:4]) and len(audio) % len(MP3_FRAME) == 0
+      and len(audio) > 20 * len(MP3_FRAME), f"/api/tts returns {len(audio)} bytes of MP3 frames")
+check(results["tts_elapsed"] >= LATENCY_MS / 1000, f"TTS took the configured latency ({results['tts_elapsed'] * 1000:.0f} ms)")
+
+print("\n4. Injected errors")
+check(results["tts_error"].status_code == 502, "a TTS error becomes the app's 502")
+check(results["chat_error"].status_code == 200 and "Stub" not in results["chat_error"].json()["response"],
+      "a chat error gets the fallback reply")
+
+print("\n5. Stub stats")
+stats = results["stats"]
+check(stats["requests"]["stt"] == 1 and stats["requests"]["tts"] == 2 and stats["requests"]["chat"] >= 5,
+      f"requests: {stats['requests']}")
+check(stats["errors_injected"]["tts"] == 1 and stats["errors_injected"]["chat"] == 1 and stats["in_flight"] == 0,
+      f"errors: {stats['errors_injected']}, peak in flight {stats['peak_in_flight']}")
+
+stub_server.should_exit = True
+
+total = passed + failed
+print()
+if failed == 0:
+    print(f"\033[32mAll {total} checks passed!\033[0m")
+else:
+    print(f"\033[31m{passed}/{total} checks passed, {failed} FAILED\033[0m")
+
+sys.exit(0 if failed == 0 else 1)